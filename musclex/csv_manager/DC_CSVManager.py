@@ -160,6 +160,15 @@ class DC_CSVManager():
         Add new data (DiffractionCentroids info) to encapsulated member, and rewrite summary
         :param info: DiffractionCentroids info (dict)
         """
+        self.addData(info)
+        self.rewriteSummary()
+
+    def addData(self, info):
+        """
+        Add new data (DiffractionCentroids info) to encapsulated member without rewriting summary.
+        Used to add many groups and rewrite summary once with rewriteSummary()
+        :param info: DiffractionCentroids info (dict)
+        """
         fileList = info["filelist"]
         k = "...".join([fileList[0], fileList[-1]])
         if "summary_m" in self.filename:
@@ -217,7 +226,6 @@ class DC_CSVManager():
         self.offmer_data[k] = off_mer_data
         l,r = info["int_area"]
         self.gen_data[k] = {"integration area width":abs(r-l)}
-        self.rewriteSummary()
 
     def getOffMerHeaders(self):
         """
@@ -34,6 +34,7 @@ from ..utils.file_manager import *
 from ..modules.ScanningDiffraction import *
 from ..csv_manager import DI_CSVManager
 from ..headless.DIImageWindowh import DIImageWindowh
+from ..utils.execution_resources import getWorkerCount, runWorker
 
 class HDFBrowser():
     """
@@ -221,8 +222,9 @@ class DIBatchWindowh():
         if self.filePath != "":
             imgList = os.listdir(self.filePath) if self.fileName is None else [self.fileName]
             imgList.sort()
-        from multiprocessing import Lock, Process, cpu_count
+        from multiprocessing import Lock, Process
         lock = Lock()
+        nWorkers = getWorkerCount()
         procs = []
         for image in imgList:
             file_name=os.path.join(self.filePath,image)
@@ -230,21 +232,21 @@ class DIBatchWindowh():
                 _, ext = os.path.splitext(str(file_name))
                 if ext in inpt_types:
                     # DIImageWindowh(image, dir_path,self.inputsetting,self.delcache,self.settingspath)
-                    proc = Process(target=DIImageWindowh, args=(image, self.filePath, self.inputsetting, self.delcache, self.settingspath, lock,))
+                    proc = Process(target=runWorker, args=(nWorkers, None, DIImageWindowh, image, self.filePath, self.inputsetting, self.delcache, self.settingspath, lock,))
                     procs.append(proc)
                     proc.start()
                 elif ext in ['.h5', '.hdf5']:
                     _, himgList, _, hfileList, _ = getImgFiles(str(file_name), headless=True)
                     for ind in range(len(himgList)):
                         print("filename is", himgList[ind])
-                        proc = Process(target=DIImageWindowh, args=(image, self.filePath, self.inputsetting, self.delcache, self.settingspath, lock, himgList, ind, hfileList, ext,))
+                        proc = Process(target=runWorker, args=(nWorkers, None, DIImageWindowh, image, self.filePath, self.inputsetting, self.delcache, self.settingspath, lock, himgList, ind, hfileList, ext,))
                         procs.append(proc)
                         proc.start()
-                        if len(procs) % cpu_count() == 0:
+                        if len(procs) % nWorkers == 0:
                             for proc in procs:
                                 proc.join()
                             procs = []
-            if len(procs) % cpu_count() == 0:
+            if len(procs) % nWorkers == 0:
                 for proc in procs:
                     proc.join()
                 procs = []
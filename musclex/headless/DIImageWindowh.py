@@ -40,10 +40,12 @@ try:
     from ..utils.file_manager import *
     from ..modules.ScanningDiffraction import *
     from ..csv_manager import DI_CSVManager
+    from ..utils.run_container import cacheExists, removeCacheFile
 except: # for coverage
     from utils.file_manager import *
     from modules.ScanningDiffraction import *
     from csv_manager import DI_CSVManager
+    from utils.run_container import cacheExists, removeCacheFile
 
 class DSpacingScale(mscale.ScaleBase):
     """
@@ -343,11 +345,11 @@ class DIImageWindowh():
         """
         file=self.fileName+'.info'
         cache_path = os.path.join(self.filePath, "di_cache",file)
-        cache_exist=os.path.isfile(cache_path)
+        cache_exist=cacheExists(cache_path)
         if self.delcache:
-            if os.path.isfile(cache_path):
+            if cache_exist:
                 self.statusPrint('cache is deleted')
-                os.remove(cache_path)
+                removeCacheFile(cache_path)
         fileName = self.imgList[self.currentFileNumber]
         self.statusPrint("current file is "+fileName)
         self.cirProj = ScanningDiffraction(self.filePath, fileName, self.fileList, self.ext, logger=self.logger, parent=self)
@@ -0,0 +1,178 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import json
+import pickle
+import traceback
+from multiprocessing import Pool
+from musclex import __version__
+try:
+    from ..utils.file_manager import fullPath, isImg
+    from ..modules.DiffractionCentroids import DiffractionCentroids
+    from ..csv_manager import DC_CSVManager
+    from ..utils.execution_resources import getWorkerCount, initWorker
+except: # for coverage
+    from utils.file_manager import fullPath, isImg
+    from modules.DiffractionCentroids import DiffractionCentroids
+    from csv_manager import DC_CSVManager
+    from utils.execution_resources import getWorkerCount, initWorker
+
+def groupImages(imgList, nFrames):
+    """
+    Group the images of a folder the way the Diffraction Centroids GUI does
+    :param imgList: sorted image names
+    :param nFrames: number of images in a group, all images are in one group if it is 0
+    :return: list of groups (list of lists of image names)
+    """
+    if nFrames <= 0:
+        return [imgList] if len(imgList) > 0 else []
+    return [imgList[i:i + nFrames] for i in range(0, len(imgList), nFrames)]
+
+def processGroup(dir_path, imgList, grp_number, settings, delcache=False):
+    """
+    Process a group of images (merge, peaks, baselines and centroids) in a worker process
+    :param dir_path: directory of the images
+    :param imgList: images of the group
+    :param grp_number: index of the group
+    :param settings: Diffraction Centroids settings
+    :param delcache: delete the cache of the group before processing it
+    :return: group index, DiffractionCentroids info or None if it failed, error message
+    """
+    try:
+        if delcache:
+            cache_path = fullPath(dir_path, 'dc_cache')
+            for ext in ('.info', '.avg'):
+                cache_file = fullPath(cache_path, imgList[0] + '_' + imgList[-1] + ext)
+                if os.path.isfile(cache_file):
+                    os.remove(cache_file)
+        difCent = DiffractionCentroids(dir_path, imgList, grp_number, settings['fix_ranges'], settings.get('off_meridian'))
+        flags = {
+            'orientation_model': settings.get('orientation_model'),
+            '90rotation': settings.get('90rotation', False)
+        }
+        difCent.process(flags)
+        return grp_number, difCent.info, None
+    except Exception:
+        return grp_number, None, traceback.format_exc()
+
+class DiffractionCentroidsh:
+    """
+    Headless Diffraction Centroids : process all groups of images of a folder in a pool of worker processes,
+    and write the summary once all groups are processed
+    """
+    def __init__(self, dir_path, inputsettings, delcache, settingspath='empty', nFrames=None, nWorkers=None):
+        """
+        :param dir_path: folder of the images
+        :param inputsettings: flag for input setting file
+        :param delcache: flag for deleting cache
+        :param settingspath: setting file (json). If it is not given, the settings saved by the GUI in the folder are used
+        :param nFrames: number of images in a group, overrides the 'group' setting
+        :param nWorkers: number of worker processes (default: MUSCLEX_WORKERS or number of cpus)
+        """
+        self.dir_path = dir_path
+        self.version = __version__
+        self.settings = self.getSettings(inputsettings, settingspath)
+        if self.settings is None:
+            return
+        if nFrames is not None:
+            self.settings['group'] = nFrames
+        self.settings.setdefault('group', 1)
+
+        imgList = sorted(f for f in os.listdir(dir_path) if isImg(fullPath(dir_path, f)))
+        self.groupList = groupImages(imgList, self.settings['group'])
+        if len(self.groupList) == 0:
+            print("There are no image in this folder")
+            return
+
+        self.csvManager = DC_CSVManager(dir_path, self.settings['group'], self.settings['fix_ranges'])
+        self.processGroups(delcache, getWorkerCount(nWorkers))
+
+    def getSettings(self, inputsettings, settingspath):
+        """
+        Get the settings from the json file, or from the GUI settings cache of the folder
+        :return: settings (dict), or None if there are no fixed meridian peak ranges
+        """
+        settings = {}
+        if inputsettings:
+            try:
+                with open(settingspath) as f:
+                    settings = json.load(f)
+            except Exception:
+                print("Can't load setting file")
+                return None
+        else:
+            cache_file = fullPath(fullPath(self.dir_path, 'dc_cache'), 'settings.cache')
+            if os.path.isfile(cache_file):
+                with open(cache_file, 'rb') as c:
+                    settings = pickle.load(c)
+                print("Using the settings saved by the GUI in " + cache_file)
+
+        # json gives lists, the module and the summary use (name, (start, end)) sorted by start
+        fix_ranges = [(str(name), (int(r[0]), int(r[1]))) for name, r in settings.get('fix_ranges', [])]
+        if len(fix_ranges) == 0:
+            print("Meridian peak ranges is empty, please specify at least 1 fixed range in the settings (\"fix_ranges\": [[name, [start, end]], ...])")
+            return None
+        settings['fix_ranges'] = sorted(fix_ranges, key=lambda nr: nr[1][0])
+        return settings
+
+    def processGroups(self, delcache, nWorkers):
+        """
+        Process all groups in worker processes. Results are collected as groups finish and the summary is written
+        once at the end (also if the run is interrupted)
+        :param delcache: delete the caches of the groups before processing them
+        :param nWorkers: number of worker processes
+        """
+        nGroups = len(self.groupList)
+        jobs = [(self.dir_path, grp, i, self.settings, delcache) for (i, grp) in enumerate(self.groupList)]
+        done = 0
+        failed = []
+        try:
+            nWorkers = max(1, min(nWorkers, nGroups))
+            with Pool(processes=nWorkers, initializer=initWorker, initargs=(nWorkers,)) as pool:
+                for grp_number, info, error in pool.imap_unordered(processGroupJob, jobs):
+                    done += 1
+                    grp = self.groupList[grp_number]
+                    if info is None:
+                        failed.append(grp_number)
+                        print("Group " + str(grp_number + 1) + " (" + grp[0] + " ... " + grp[-1] + ") failed :\n" + error)
+                    else:
+                        self.csvManager.addData(info)
+                        print("Group " + str(grp_number + 1) + " (" + grp[0] + " ... " + grp[-1] + ") has been processed (" + str(done) + "/" + str(nGroups) + ")")
+        finally:
+            if done > len(failed):
+                self.csvManager.rewriteSummary()
+                print("Summary has been written in " + self.csvManager.filename)
+        if len(failed) > 0:
+            print(str(len(failed)) + " group(s) failed : " + ", ".join(str(g + 1) for g in sorted(failed)))
+
+def processGroupJob(job):
+    """
+    Pool entry point unpacking the arguments of processGroup()
+    """
+    return processGroup(*job)
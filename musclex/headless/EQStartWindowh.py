@@ -32,9 +32,11 @@ from os.path import split
 try:
     from ..headless.EquatorWindowh import EquatorWindowh
     from ..utils.file_manager import getImgFiles
+    from ..utils.execution_resources import getWorkerCount, runWorker
 except: # for coverage
     from headless.EquatorWindowh import EquatorWindowh
     from utils.file_manager import getImgFiles
+    from utils.execution_resources import getWorkerCount, runWorker
 
 class EQStartWindowh:
     """
@@ -60,8 +62,9 @@ class EQStartWindowh:
         Popup an input folder dialog. Users can select a folder
         """
         input_types = ['.adsc', '.cbf', '.edf', '.fit2d', '.mar345', '.marccd', '.pilatus', '.tif', '.tiff', '.smv']
-        from multiprocessing import Lock, Process, cpu_count
+        from multiprocessing import Lock, Process
         lock = Lock()
+        nWorkers = getWorkerCount()
         procs = []
         if self.dir_path != "":
             imgList = os.listdir(self.dir_path) if not is_hdf5 else [self.dir_path]
@@ -72,9 +75,9 @@ class EQStartWindowh:
                 if ext in input_types:
                     print("filename is", file_name)
                     if self.settingspath == 'empty':
-                        proc = Process(target=EquatorWindowh, args=(file_name, self.inputFlag, self.delcache, lock,))
+                        proc = Process(target=runWorker, args=(nWorkers, None, EquatorWindowh, file_name, self.inputFlag, self.delcache, lock,))
                     else:
-                        proc = Process(target=EquatorWindowh, args=(file_name, self.inputFlag, self.delcache, lock, None, None, None, None, None, self.settingspath,))
+                        proc = Process(target=runWorker, args=(nWorkers, None, EquatorWindowh, file_name, self.inputFlag, self.delcache, lock, None, None, None, None, None, self.settingspath,))
                     procs.append(proc)
                     proc.start()
                 elif ext in ['.h5', '.hdf5', '.txt']:
@@ -82,16 +85,16 @@ class EQStartWindowh:
                     for ind in range(len(himgList)):
                         print("filename is", himgList[ind])
                         if self.settingspath == 'empty':
-                            proc = Process(target=EquatorWindowh, args=(file_name, self.inputFlag, self.delcache, lock, hdir_path, himgList, ind, hfileList, ext,))
+                            proc = Process(target=runWorker, args=(nWorkers, None, EquatorWindowh, file_name, self.inputFlag, self.delcache, lock, hdir_path, himgList, ind, hfileList, ext,))
                         else:
-                            proc = Process(target=EquatorWindowh, args=(file_name, self.inputFlag, self.delcache, lock, hdir_path, himgList, ind, hfileList, ext, self.settingspath,))
+                            proc = Process(target=runWorker, args=(nWorkers, None, EquatorWindowh, file_name, self.inputFlag, self.delcache, lock, hdir_path, himgList, ind, hfileList, ext, self.settingspath,))
                         procs.append(proc)
                         proc.start()
-                        if len(procs) % cpu_count() == 0:
+                        if len(procs) % nWorkers == 0:
                             for proc in procs:
                                 proc.join()
                             procs = []
-            if len(procs) % cpu_count() == 0:
+            if len(procs) % nWorkers == 0:
                 for proc in procs:
                     proc.join()
                 procs = []
@@ -36,11 +36,13 @@ try:
     from ..modules.EquatorImage import EquatorImage
     from ..utils.image_processor import *
     from ..csv_manager import EQ_CSVManager
+    from ..utils.run_container import cacheExists, removeCacheFile
 except: # for coverage
     from utils.file_manager import getImgFiles
     from modules.EquatorImage import EquatorImage
     from utils.image_processor import *
     from csv_manager import EQ_CSVManager
+    from utils.run_container import cacheExists, removeCacheFile
 
 class EquatorWindowh:
     """
@@ -95,10 +97,10 @@ class EquatorWindowh:
         fileName = self.imgList[self.currentImg]
         file=fileName+'.info'
         cache_path = os.path.join(self.dir_path, "eq_cache", file)
-        cache_exist = os.path.isfile(cache_path)
+        cache_exist = cacheExists(cache_path)
         if self.delcache:
-            if os.path.isfile(cache_path):
-                os.remove(cache_path)
+            if cache_exist:
+                removeCacheFile(cache_path)
 
         #prevInfo = self.bioImg.info if self.bioImg is not None else None
         self.bioImg = EquatorImage(self.dir_path, fileName, self, self.fileList, self.ext)
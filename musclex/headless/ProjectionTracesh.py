@@ -35,9 +35,11 @@ from os.path import exists, splitext
 import numpy as np
 from musclex import __version__
 from ..utils.file_manager import fullPath, getImgFiles, createFolder
-from ..utils.image_processor import getMaskThreshold, getCenter, processImageForIntCenter
+from ..utils.image_processor import getMaskThreshold
 from ..modules.ProjectionProcessor import ProjectionProcessor
+from ..utils.layerline_fitting import LayerLineSeriesFitter
 from ..csv_manager import PT_CSVManager
+from ..utils.run_container import cacheExists, removeCacheFile
 
 class BoxDetails:
     """
@@ -51,8 +53,10 @@ class ProjectionTracesh:
     """
     This class is for Projection Traces GUI Object
     """
-    def __init__(self, filename, inputsettings, delcache, settingspath=os.path.join('musclex', 'settings', 'ptsettings.json'), lock=None, dir_path=None, imgList=None, currentFileNumber=None, fileList=None, ext=None):
+    def __init__(self, filename, inputsettings, delcache, settingspath=os.path.join('musclex', 'settings', 'ptsettings.json'), lock=None, dir_path=None, imgList=None, currentFileNumber=None, fileList=None, ext=None, deferFit=False):
         self.lock = lock
+        self.deferFit = deferFit
+        self.processSettings = None
         self.current_file = 0
         self.calSettings = None
         self.projProc = None
@@ -88,10 +92,10 @@ class ProjectionTracesh:
         fileName = self.imgList[self.current_file]
         file=fileName+'.info'
         cache_path = os.path.join(self.dir_path, "qf_cache", file)
-        cache_exist=os.path.isfile(cache_path)
+        cache_exist=cacheExists(cache_path)
         if self.delcache:
             if cache_exist:
-                os.remove(cache_path)
+                removeCacheFile(cache_path)
 
         if self.inputsettings:
             self.getSettings()
@@ -154,7 +158,7 @@ class ProjectionTracesh:
         :return:
         """
         if self.center_func == 'automatic':
-            self.projProc.orig_img, center = processImageForIntCenter(self.projProc.orig_img, getCenter(self.projProc.orig_img))
+            center = self.projProc.findCenter()
             self.centerx, self.centery = center
         elif self.center_func == 'quadrant_fold': # default to quadrant folded
             self.centerx = self.projProc.orig_img.shape[1] / 2. - 0.5
@@ -178,6 +182,11 @@ class ProjectionTracesh:
             return
         settings = self.getSettings()
         try:
+            if self.deferFit:
+                # the boxes are fitted with the other images of the series, see ProjectionTracesSeriesh
+                self.projProc.processHistograms(settings)
+                self.processSettings = settings
+                return
             self.projProc.process(settings)
         except Exception:
             print('Unexpected error')
@@ -185,7 +194,19 @@ class ProjectionTracesh:
             msg += "Error : " + str(sys.exc_info()[0]) + '\n\n' + str(traceback.format_exc())
             print(msg)
             raise
+        self.writeResults()
 
+    def finishImage(self):
+        """
+        Finish the processing of an image whose boxes have been fitted by the series, then write data
+        """
+        self.projProc.processFitResults(self.processSettings)
+        self.writeResults()
+
+    def writeResults(self):
+        """
+        Write the cache, the csv summary and the histograms of the processed image
+        """
         # acquire the lock
         if self.lock is not None:
             self.lock.acquire()
@@ -352,3 +373,27 @@ class ProjectionTracesh:
             print(ptext)
         else:
             print(text)
+
+class ProjectionTracesSeriesh:
+    """
+    Headless Projection Traces of a series of images (e.g. time-resolved), in which each box is fitted on chunks of
+    consecutive images at once instead of one image per process
+    """
+    def __init__(self, frames, inputsettings, delcache, settingspath, chunkSize=16, warmStart=True):
+        """
+        :param frames: images of the series in order, as (filename, dict of the image arguments of ProjectionTracesh)
+        :param inputsettings: True if settingspath is used
+        :param delcache: delete the existing caches
+        :param settingspath: json setting file
+        :param chunkSize: number of images fitted together
+        :param warmStart: also start the fits of a chunk from the results of the last image of the previous chunk
+        """
+        self.fitter = LayerLineSeriesFitter(warmStart)
+        for i in range(0, len(frames), chunkSize):
+            chunk = []
+            for filename, kwargs in frames[i:i+chunkSize]:
+                chunk.append(ProjectionTracesh(filename, inputsettings, delcache, settingspath, deferFit=True, **kwargs))
+            chunk = [ptrace for ptrace in chunk if ptrace.projProc is not None and ptrace.processSettings is not None]
+            self.fitter.fitChunk([ptrace.projProc for ptrace in chunk])
+            for ptrace in chunk:
+                ptrace.finishImage()
@@ -38,13 +38,17 @@ from musclex import __version__
 try:
     from ..utils.file_manager import *
     from ..utils.image_processor import *
-    from ..modules.QuadrantFolder import QuadrantFolder
+    from ..modules.QuadrantFolder import QuadrantFolder, getDefaultFlags
     from ..csv_manager.QF_CSVManager import QF_CSVManager
+    from ..utils.result_writer import getResultWriter, getResultCodec
+    from ..utils.run_container import cacheExists, removeCacheFile, isRunContainerEnabled, writeContainerScalars
 except: # for coverage
     from utils.file_manager import *
     from utils.image_processor import *
-    from modules.QuadrantFolder import QuadrantFolder
+    from modules.QuadrantFolder import QuadrantFolder, getDefaultFlags
     from csv_manager.QF_CSVManager import QF_CSVManager
+    from utils.result_writer import getResultWriter, getResultCodec
+    from utils.run_container import cacheExists, removeCacheFile, isRunContainerEnabled, writeContainerScalars
 
 class QuadrantFoldingh:
     """
@@ -88,10 +92,10 @@ class QuadrantFoldingh:
         fileName = self.imgList[self.currentFileNumber]
         file=fileName+'.info'
         cache_path = os.path.join(self.dir_path, "qf_cache", file)
-        cache_exist=os.path.isfile(cache_path)
+        cache_exist=cacheExists(cache_path)
         if self.delcache:
             if cache_exist:
-                os.remove(cache_path)
+                removeCacheFile(cache_path)
         self.quadFold = QuadrantFolder(self.dir_path, fileName, self, self.fileList, self.ext)
 
         if self.inputsettings:
@@ -130,7 +134,7 @@ class QuadrantFoldingh:
         fileName = self.imgList[self.currentFileNumber]
         file=fileName+'.info'
         cache_path = os.path.join(self.dir_path, "qf_cache", file)
-        cache_exist=os.path.isfile(cache_path)
+        cache_exist=cacheExists(cache_path)
 
         if 'ignore_folds' in self.quadFold.info:
             self.ignoreFolds = self.quadFold.info['ignore_folds']
@@ -223,13 +227,13 @@ class QuadrantFoldingh:
                 img = self.quadFold.imgCache['resultImg']
 
                 img = img.astype("float32")
-                if 'compressed' in self.quadFold.info and not self.quadFold.info['compressed']:
+                codec = getResultCodec(self.quadFold.info)
+                if codec == 'none':
                     result_file += '_folded.tif'
-                    fabio.tifimage.tifimage(data=img).write(result_file)
                 else:
                     result_file += '_folded_compressed.tif'
-                    tif_img = Image.fromarray(img)
-                    tif_img.save(result_file, compression='tiff_lzw')
+                # written in the background, the processing of the next image does not wait for the disk
+                getResultWriter().submitImage(result_file, img, codec)
                 # metadata = json.dumps([True, self.quadFold.initImg.shape])
                 # imsave(result_file, img, description=metadata)
                 self.saveBackground()
@@ -255,23 +259,41 @@ class QuadrantFoldingh:
         createFolder(bg_path)
         resultImg = resultImg.astype("float32")
         # imsave(result_path, resultImg)
-        fabio.tifimage.tifimage(data=resultImg).write(result_path)
+        writer = getResultWriter()
+        writer.submitImage(result_path, resultImg, 'none')
+        writer.submit(self.writeBackgroundSum, filename, resultImg, join(bg_path, 'background_sum.csv'))
 
+    def writeBackgroundSum(self, filename, resultImg, csv_path):
+        """
+        Save the total intensity of the background in background_sum.csv (run by the result writer)
+        :param filename: name of the image
+        :param resultImg: background image
+        :param csv_path: path of the csv file
+        """
         total_inten = np.sum(resultImg)
-        csv_path = join(bg_path, 'background_sum.csv')
-        if self.csv_bg is None:
-            # create csv file to save total intensity for background
-            if exists(csv_path):
-                self.csv_bg = pd.read_csv(csv_path)
-            else:
-                self.csv_bg = pd.DataFrame(columns=['Name', 'Sum'])
-            self.csv_bg = self.csv_bg.set_index('Name')
+        if isRunContainerEnabled():
+            # kept with the frame in the run container, background_sum.csv is exported at the end of the run
+            writeContainerScalars(join(os.path.dirname(csv_path), filename), {'Sum': total_inten})
+            return
+        if self.lock is not None:
+            self.lock.acquire()
+        try:
+            if self.csv_bg is None:
+                # create csv file to save total intensity for background
+                if exists(csv_path):
+                    self.csv_bg = pd.read_csv(csv_path)
+                else:
+                    self.csv_bg = pd.DataFrame(columns=['Name', 'Sum'])
+                self.csv_bg = self.csv_bg.set_index('Name')
 
-        if filename in self.csv_bg.index:
-            self.csv_bg = self.csv_bg.drop(index=filename)
+            if filename in self.csv_bg.index:
+                self.csv_bg = self.csv_bg.drop(index=filename)
 
-        self.csv_bg.loc[filename] = pd.Series({'Sum':total_inten})
-        self.csv_bg.to_csv(csv_path)
+            self.csv_bg.loc[filename] = pd.Series({'Sum':total_inten})
+            self.csv_bg.to_csv(csv_path)
+        finally:
+            if self.lock is not None:
+                self.lock.release()
 
     def updateParams(self):
         """
@@ -295,28 +317,7 @@ class QuadrantFoldingh:
 
         flags['orientation_model'] = self.orientationModel
         flags['ignore_folds'] = self.ignoreFolds
-        # default values, same as QuadrantFoldingGUI.py default
-        flags['bgsub'] = 'None'
-        flags["cirmin"] = 0.0
-        flags["cirmax"] = 25.0
-        flags['win_size_x'] = 10
-        flags['win_size_y'] = 10
-        flags['win_sep_x'] = 10
-        flags['win_sep_y'] = 10
-        flags["bin_theta"] = 30
-        flags['radial_bin'] = 10
-        flags['smooth'] = 0.1
-        flags['tension'] = 1.0
-        flags["tophat1"] = 5
-        flags['tophat2'] = 20
-        flags['mask_thres'] = getMaskThreshold(self.quadFold.orig_img)
-        flags['sigmoid'] = 0.1
-        flags['fwhm'] = 10
-        flags['boxcar_x'] = 10
-        flags['boxcar_y'] = 10
-        flags['cycles'] = 5
-        flags['blank_mask'] = False
-        flags['rotate'] = False
+        flags.update(getDefaultFlags(self.quadFold.orig_img))
 
         if self.calSettings is not None:
             flags.update(self.calSettings)
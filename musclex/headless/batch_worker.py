@@ -0,0 +1,126 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import json
+try:
+    from ..utils.execution_resources import initWorker
+except: # for coverage
+    from utils.execution_resources import initWorker
+
+# Lock shared by all the workers of a batch, used by the headless classes around csv writing
+batch_lock = None
+
+def initBatchWorker(lock, nWorkers=1):
+    """
+    Initialize a batch worker process with the lock shared by the batch and its share of the threads
+    :param lock: multiprocessing lock
+    :param nWorkers: number of worker processes of the batch
+    :return: -
+    """
+    global batch_lock
+    batch_lock = lock
+    initWorker(nWorkers)
+
+def settingsToJson(obj):
+    """
+    Convert the values json can not serialize in the settings of the GUIs (numpy values, sets)
+    :param obj: value
+    :return: serializable value
+    """
+    if hasattr(obj, 'tolist'):
+        return obj.tolist()
+    if isinstance(obj, (set, tuple)):
+        return list(obj)
+    raise TypeError(str(type(obj)) + " is not JSON serializable")
+
+def writeBatchSettings(settings, path):
+    """
+    Write the settings of a GUI in a json file readable by the headless classes
+    :param settings: settings (dict)
+    :param path: path of the json file
+    :return: -
+    """
+    with open(path, 'w') as f:
+        json.dump(settings, f, default=settingsToJson)
+
+def getBatchJob(imgList, fileList, ext, index):
+    """
+    Give the arguments describing one image of a folder or H5 file, restricted to this image so
+    that only its own data (its frame for H5 files) is sent to the worker
+    :param imgList: image names of the folder
+    :param fileList: file list given by getImgFiles
+    :param ext: extension given by getImgFiles
+    :param index: index of the image in imgList
+    :return: image list, index and file list for the headless classes
+    """
+    name = imgList[index]
+    if ext in ('.hdf5', '.h5'):
+        ind = next((i for i, item in enumerate(fileList[0]) if item == name), 0)
+        return [name], 0, [[name], [fileList[1][ind]]]
+    return [name], 0, None
+
+def processBatchImage(program, dir_path, imgList, currentFileNumber, fileList, ext, settingspath=None, delcache=False):
+    """
+    Process one image with the headless class of the program, in a batch worker process
+    :param program: 'eq', 'qf', 'pt' or 'di'
+    :param dir_path: directory of the images
+    :param imgList, currentFileNumber, fileList, ext: image to process, as given by getBatchJob
+    :param settingspath: json settings file, or None to use the headless default settings
+    :param delcache: delete the cache of the image before processing it
+    :return: name of the processed image
+    """
+    inputsettings = settingspath is not None
+    filename = os.path.join(dir_path, imgList[currentFileNumber])
+    if program == 'eq':
+        try:
+            from .EquatorWindowh import EquatorWindowh
+        except: # for coverage
+            from headless.EquatorWindowh import EquatorWindowh
+        EquatorWindowh(filename, inputsettings, delcache, batch_lock, dir_path, imgList, currentFileNumber, fileList, ext, settingspath)
+    elif program == 'qf':
+        try:
+            from .QuadrantFoldingh import QuadrantFoldingh
+        except: # for coverage
+            from headless.QuadrantFoldingh import QuadrantFoldingh
+        QuadrantFoldingh(filename, inputsettings, delcache, settingspath, batch_lock, dir_path, imgList, currentFileNumber, fileList, ext)
+    elif program == 'pt':
+        try:
+            from .ProjectionTracesh import ProjectionTracesh
+        except: # for coverage
+            from headless.ProjectionTracesh import ProjectionTracesh
+        ProjectionTracesh(filename, inputsettings, delcache, settingspath, batch_lock, dir_path, imgList, currentFileNumber, fileList, ext)
+    elif program == 'di':
+        try:
+            from .DIImageWindowh import DIImageWindowh
+        except: # for coverage
+            from headless.DIImageWindowh import DIImageWindowh
+        DIImageWindowh(imgList[currentFileNumber], dir_path, inputsettings, delcache, settingspath, batch_lock, imgList, currentFileNumber, fileList, ext)
+    else:
+        raise ValueError("Unknown program " + str(program))
+    return imgList[currentFileNumber]
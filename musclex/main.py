@@ -30,11 +30,14 @@ authorization from Illinois Institute of Technology.
 
 import os
 import sys
+import json
 import unittest
 from musclex import __version__
 from musclex.ui.pyqt_utils import *
 from musclex.utils.file_manager import getImgFiles
 from musclex.utils.exception_handler import handlers
+from musclex.utils.execution_resources import setExecutionBudget, runWorker
+from musclex.utils.run_container import setRunContainer, exportRunCsvs
 from musclex.tests.module_test import MuscleXTest
 from musclex.tests.musclex_tester import MuscleXGlobalTester
 from musclex.tests.environment_tester import EnvironmentTester
@@ -42,6 +45,63 @@ from musclex.tests.environment_tester import EnvironmentTester
 if sys.platform in handlers:
     sys.excepthook = handlers[sys.platform]
 
+def runQuadrantFoldingSweep(filename, is_file, gridpath, settingspath, nWorkers, in_types):
+    """
+    Run a parameter sweep of the Quadrant Folding background subtraction on an image or the images of a folder
+    :param filename: image file (is_file) or folder
+    :param is_file: True if filename is an image file
+    :param gridpath: json file of the parameter grid
+    :param settingspath: json setting file used for all points, or None
+    :param nWorkers: number of threads evaluating the points
+    :param in_types: extensions of the images of a folder
+    :return: -
+    """
+    from musclex.modules.QuadrantFoldingSweep import QuadrantFoldingSweep
+    with open(gridpath, 'r') as f:
+        grid = json.load(f)
+    settings = None
+    if settingspath is not None:
+        with open(settingspath, 'r') as f:
+            settings = json.load(f)
+    if is_file:
+        dir_path, imgList = os.path.dirname(os.path.abspath(filename)), [os.path.basename(filename)]
+    else:
+        dir_path = filename
+        imgList = sorted(f for f in os.listdir(filename) if os.path.splitext(f)[1] in in_types and os.path.isfile(os.path.join(filename, f)))
+    QuadrantFoldingSweep(dir_path, imgList, grid, settings, nWorkers).run()
+
+def runProjectionTracesSeries(filename, is_file, inputsetting, delcache, settingspath, chunkSize, in_types, h5_types):
+    """
+    Run Projection Traces on the images of a folder or H5 file as one series, fitting each box on chunks of images
+    :param filename: H5 file (is_file) or folder
+    :param is_file: True if filename is a file
+    :param inputsetting: True if settingspath is used
+    :param delcache: delete the existing caches
+    :param settingspath: json setting file
+    :param chunkSize: number of images fitted together
+    :param in_types: extensions of the images of a folder
+    :param h5_types: extensions of the H5 files
+    :return: -
+    """
+    from musclex.headless.ProjectionTracesh import ProjectionTracesSeriesh
+    if is_file:
+        dir_path, fileNames = os.path.dirname(os.path.abspath(filename)), [os.path.basename(filename)]
+    else:
+        dir_path, fileNames = filename, sorted(os.listdir(filename))
+    imgList = [f for f in fileNames if os.path.splitext(f)[1] in in_types and os.path.isfile(os.path.join(dir_path, f))]
+    indexes = {f: ind for ind, f in enumerate(imgList)}
+    frames = []
+    for f in fileNames:
+        file_name = os.path.join(dir_path, f)
+        _, ext = os.path.splitext(f)
+        if f in indexes:
+            frames.append((file_name, {'dir_path': dir_path, 'imgList': imgList, 'currentFileNumber': indexes[f], 'fileList': None, 'ext': ext}))
+        elif ext in h5_types and os.path.isfile(file_name):
+            hdir_path, himgList, _, hfileList, hext = getImgFiles(str(file_name), headless=True)
+            for ind in range(len(himgList)):
+                frames.append((file_name, {'dir_path': hdir_path, 'imgList': himgList, 'currentFileNumber': ind, 'fileList': hfileList, 'ext': hext}))
+    ProjectionTracesSeriesh(frames, inputsetting, delcache, settingspath, chunkSize)
+
 def main(arguments=None):
     in_types = ['.adsc', '.cbf', '.edf', '.fit2d', '.mar345', '.marccd', '.pilatus', '.tif', '.tiff', '.smv']
     h5_types = ['.h5', '.hdf5']
@@ -157,6 +217,9 @@ def main(arguments=None):
         run=True
         i=3
         settingspath="empty"
+        nWorkers=None
+        nThreads=None
+        runContainer=False
         while i < len(arguments):
             if arguments[i]=='-s':
                 inputsetting=True
@@ -168,6 +231,14 @@ def main(arguments=None):
                     else:
                         print("Please provide the right settings file")
                         run=False
+            elif arguments[i]=='-w' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nWorkers=int(arguments[i])
+            elif arguments[i]=='-t' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nThreads=int(arguments[i])
+            elif arguments[i]=='-c':
+                runContainer=True
             elif arguments[i]=='-d':
                 delcache=True
             elif arguments[i]=='-i' or arguments[i]=='-f':
@@ -178,6 +249,9 @@ def main(arguments=None):
                 break
             i=i+1
         if run:
+            setExecutionBudget(nWorkers, nThreads)
+            if runContainer:
+                setRunContainer(True)
             from musclex.headless.EQStartWindowh import EQStartWindowh
             EQStartWindowh(filename, inputsetting, delcache, settingspath)
             sys.exit()
@@ -188,6 +262,9 @@ def main(arguments=None):
         run=True
         i=3
         settingspath='empty'
+        nWorkers=None
+        nThreads=None
+        runContainer=False
         processFolder=False
         while i < len(arguments):
             if arguments[i]=='-s':
@@ -200,6 +277,14 @@ def main(arguments=None):
                     else:
                         print("Please provide the right settings file")
                         run=False
+            elif arguments[i]=='-w' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nWorkers=int(arguments[i])
+            elif arguments[i]=='-t' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nThreads=int(arguments[i])
+            elif arguments[i]=='-c':
+                runContainer=True
             elif arguments[i]=='-d':
                 delcache=True
             elif arguments[i]=='-i' or arguments[i]=='-f':
@@ -217,6 +302,9 @@ def main(arguments=None):
                 break
             i=i+1
         if run:
+            setExecutionBudget(nWorkers, nThreads)
+            if runContainer:
+                setRunContainer(True)
             if not processFolder and not is_hdf5:
                 from musclex.headless.DIImageWindowh import DIImageWindowh
                 DIImageWindowh(str(fileName), str(filePath), inputsetting, delcache, settingspath)
@@ -232,6 +320,10 @@ def main(arguments=None):
         run=True
         i=3
         settingspath="empty"
+        nWorkers=None
+        nThreads=None
+        runContainer=False
+        sweeppath=None
         while i < len(arguments):
             if arguments[i]=='-s':
                 inputsetting=True
@@ -243,6 +335,20 @@ def main(arguments=None):
                     else:
                         print("Please provide the right settings file")
                         run=False
+            elif arguments[i]=='-w' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nWorkers=int(arguments[i])
+            elif arguments[i]=='-t' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nThreads=int(arguments[i])
+            elif arguments[i]=='-c':
+                runContainer=True
+            elif arguments[i]=='-p' and i+1<len(arguments):
+                i=i+1
+                sweeppath=arguments[i]
+                if not os.path.isfile(sweeppath):
+                    print("Please provide the right parameter grid file")
+                    run=False
             elif arguments[i]=='-d':
                 delcache=True
             elif arguments[i]=='-i' or arguments[i]=='-f':
@@ -254,11 +360,17 @@ def main(arguments=None):
                 break
             i=i+1
         if run:
+            nWorkers, nThreads = setExecutionBudget(nWorkers, nThreads)
+            if runContainer:
+                setRunContainer(True)
+            if sweeppath is not None:
+                runQuadrantFoldingSweep(filename, is_file, sweeppath, settingspath if inputsetting else None, nWorkers, in_types)
+                sys.exit()
             from musclex.headless.QuadrantFoldingh import QuadrantFoldingh
             if is_file and os.path.splitext(str(filename))[1] not in h5_types:
                 QuadrantFoldingh(filename, inputsetting, delcache, settingspath)
             else:
-                from multiprocessing import Lock, Process, cpu_count
+                from multiprocessing import Lock, Process
                 lock = Lock()
                 procs = []
                 imgList = os.listdir(filename) if not is_file else [filename]
@@ -270,33 +382,38 @@ def main(arguments=None):
                         if ext in in_types:
                             print("filename is", file_name)
                             # QuadrantFoldingh(file_name, inputsetting, delcache, settingspath)
-                            proc = Process(target=QuadrantFoldingh, args=(file_name, inputsetting, delcache, settingspath, lock,))
+                            proc = Process(target=runWorker, args=(nWorkers, nThreads, QuadrantFoldingh, file_name, inputsetting, delcache, settingspath, lock,))
                             procs.append(proc)
                             proc.start()
                         elif ext in h5_types:
                             hdir_path, himgList, _, hfileList, _ = getImgFiles(str(file_name), headless=True)
                             for ind in range(len(himgList)):
                                 print("filename is", himgList[ind])
-                                proc = Process(target=QuadrantFoldingh, args=(file_name, inputsetting, delcache, settingspath, lock, hdir_path, himgList, ind, hfileList, ext,))
+                                proc = Process(target=runWorker, args=(nWorkers, nThreads, QuadrantFoldingh, file_name, inputsetting, delcache, settingspath, lock, hdir_path, himgList, ind, hfileList, ext,))
                                 procs.append(proc)
                                 proc.start()
-                                if len(procs) % cpu_count() == 0:
+                                if len(procs) % nWorkers == 0:
                                     for proc in procs:
                                         proc.join()
                                     procs = []
-                    if len(procs) % cpu_count() == 0:
+                    if len(procs) % nWorkers == 0:
                         for proc in procs:
                             proc.join()
                         procs = []
                 for proc in procs:
                     proc.join()
-                    sys.exit()
+                exportRunCsvs(filename if not is_file else os.path.dirname(os.path.abspath(filename)))
+                sys.exit()
     elif len(arguments) >= 5 and arguments[1]=='pt' and arguments[2]=='-h':
         inputsetting=False
         delcache=False
         run=True
         i=3
         settingspath="empty"
+        nWorkers=None
+        nThreads=None
+        runContainer=False
+        chunkSize=None
         while i < len(arguments):
             if arguments[i]=='-s':
                 inputsetting=True
@@ -308,6 +425,17 @@ def main(arguments=None):
                     else:
                         print("Please provide the right settings file")
                         run=False
+            elif arguments[i]=='-w' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nWorkers=int(arguments[i])
+            elif arguments[i]=='-t' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nThreads=int(arguments[i])
+            elif arguments[i]=='-c':
+                runContainer=True
+            elif arguments[i]=='-b' and i+1<len(arguments) and arguments[i+1].isdigit() and int(arguments[i+1]) > 0:
+                i=i+1
+                chunkSize=int(arguments[i])
             elif arguments[i]=='-d':
                 delcache=True
             elif arguments[i]=='-i' or arguments[i]=='-f':
@@ -319,11 +447,17 @@ def main(arguments=None):
                 break
             i=i+1
         if run:
+            nWorkers, nThreads = setExecutionBudget(nWorkers, nThreads)
+            if runContainer:
+                setRunContainer(True)
+            if chunkSize is not None:
+                runProjectionTracesSeries(filename, is_file, inputsetting, delcache, settingspath, chunkSize, in_types, h5_types)
+                sys.exit()
             from musclex.headless.ProjectionTracesh import ProjectionTracesh
             if is_file and os.path.splitext(str(filename))[1] not in h5_types:
                 ProjectionTracesh(filename, inputsetting, delcache, settingspath)
             else:
-                from multiprocessing import Lock, Process, cpu_count
+                from multiprocessing import Lock, Process
                 lock = Lock()
                 procs = []
                 imgList = os.listdir(filename) if not is_file else [filename]
@@ -335,21 +469,21 @@ def main(arguments=None):
                         if ext in in_types:
                             print("filename is", file_name)
                             # QuadrantFoldingh(file_name, inputsetting, delcache, settingspath)
-                            proc = Process(target=ProjectionTracesh, args=(file_name, inputsetting, delcache, settingspath, lock,))
+                            proc = Process(target=runWorker, args=(nWorkers, nThreads, ProjectionTracesh, file_name, inputsetting, delcache, settingspath, lock,))
                             procs.append(proc)
                             proc.start()
                         elif ext in h5_types:
                             hdir_path, himgList, _, hfileList, _ = getImgFiles(str(file_name), headless=True)
                             for ind in range(len(himgList)):
                                 print("filename is", himgList[ind])
-                                proc = Process(target=ProjectionTracesh, args=(file_name, inputsetting, delcache, settingspath, lock, hdir_path, himgList, ind, hfileList, ext,))
+                                proc = Process(target=runWorker, args=(nWorkers, nThreads, ProjectionTracesh, file_name, inputsetting, delcache, settingspath, lock, hdir_path, himgList, ind, hfileList, ext,))
                                 procs.append(proc)
                                 proc.start()
-                                if len(procs) % cpu_count() == 0:
+                                if len(procs) % nWorkers == 0:
                                     for proc in procs:
                                         proc.join()
                                     procs = []
-                    if len(procs) % cpu_count() == 0:
+                    if len(procs) % nWorkers == 0:
                         for proc in procs:
                             proc.join()
                         procs = []
@@ -357,6 +491,52 @@ def main(arguments=None):
                     proc.join()
                     sys.exit()
 
+    elif len(arguments) >= 5 and arguments[1]=='dc' and arguments[2]=='-h':
+        inputsetting=False
+        delcache=False
+        run=True
+        i=3
+        settingspath="empty"
+        foldername=None
+        nFrames=None
+        nWorkers=None
+        nThreads=None
+        while i < len(arguments):
+            if arguments[i]=='-s':
+                inputsetting=True
+                if i+1<len(arguments) and len(arguments[i+1])>5:
+                    _, ext = os.path.splitext(str(arguments[i+1]))
+                    if ext==".json" and os.path.isfile(arguments[i+1]):
+                        i=i+1
+                        settingspath=arguments[i]
+                    else:
+                        print("Please provide the right settings file")
+                        run=False
+            elif arguments[i]=='-t' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nThreads=int(arguments[i])
+            elif arguments[i]=='-d':
+                delcache=True
+            elif arguments[i]=='-f' and i+1<len(arguments):
+                i=i+1
+                foldername=arguments[i]
+            elif arguments[i]=='-g' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nFrames=int(arguments[i])
+            elif arguments[i]=='-w' and i+1<len(arguments) and arguments[i+1].isdigit():
+                i=i+1
+                nWorkers=int(arguments[i])
+            else:
+                run=False
+                break
+            i=i+1
+        if run and foldername is not None and os.path.isdir(foldername):
+            setExecutionBudget(nWorkers, nThreads)
+            from musclex.headless.DiffractionCentroidsh import DiffractionCentroidsh
+            DiffractionCentroidsh(str(foldername), inputsetting, delcache, settingspath, nFrames, nWorkers)
+            sys.exit()
+        run = False
+
     else:
         run = False
 
@@ -374,7 +554,7 @@ def main(arguments=None):
         print("          ddf - DDF Processor")
         print("          aise - Add Intensities Single Experiment")
         print("          aime - Add Intensities Multiple Experiments")
-        print("          dc - Diffraction Centroids (DEPRECATED)")
+        print("          dc [<-h>] - Diffraction Centroids (DEPRECATED, -h for headless version)")
         print("")
         print("          gui - GUI Launcher")
         print("          test_global - Run Global Tests")
@@ -387,12 +567,35 @@ def main(arguments=None):
         print("\t$ musclex eq -h -i test.tif -s config.json")
         print("")
         print("** Musclex headless arguments (works for eq, di, qf and pt):")
-        print("    $ musclex eq|di|qf|pt -h -i|-f <file.tif|testfolder> [-s config.json] [-d] ")
+        print("    $ musclex eq|di|qf|pt -h -i|-f <file.tif|testfolder> [-s config.json] [-w <number of workers>] [-t <number of threads>] [-c] [-d] ")
         print("arguments:")
         print("-f <foldername> or -i <filename>")
         print("-d (optional) delete existing cache")
         print("-s (optional) <input setting file>")
+        print("-w (optional) number of worker processes (default: MUSCLEX_WORKERS or number of cpus)")
+        print("-t (optional) number of threads of each worker for OpenCV, numba, OpenMP and BLAS (default: MUSCLEX_THREADS or cpus shared between the workers)")
+        print("-c (optional) keep the caches of the run in one HDF5 file (musclex_run.h5) in the folder of the images, instead of one file")
+        print("   per image, the result images are still tif files (also enabled by MUSCLEX_RUN_CONTAINER=1, e.g. for the GUIs).")
+        print("   A process killed while it writes in this file may make the caches of the whole run unreadable")
+        print("-p (optional, qf only) <parameter grid file> sweep the background subtraction settings instead of processing the images,")
+        print("   e.g. {\"bgsub\": [\"White-top-hats\"], \"tophat1\": [3, 5, 7], \"sigmoid\": [0.05, 0.1]} or a list of such grids.")
+        print("   The center, rotation and folding of each image are done once, the comparison is saved in the folder qf_sweep")
+        print("-b (optional, pt only) <number of images> process the images as one series: each box is fitted on chunks of this number")
+        print("   of consecutive images in one solver call (one process). All images of a chunk also start from the result")
+        print("   of the last image of the previous chunk, the best fit is kept")
+        print("")
+        print("** Diffraction Centroids headless arguments:")
+        print("    $ musclex dc -h -f <testfolder> [-g <number of frames>] [-s config.json] [-w <number of workers>] [-t <number of threads>] [-d] ")
+        print("arguments:")
+        print("-f <foldername>")
+        print("-g (optional) number of images averaged in a group, 0 for one group of all images (default: saved settings or 1)")
+        print("-s (optional) <input setting file>, with \"fix_ranges\": [[name, [start, end]], ...] and optionally \"off_meridian\", \"orientation_model\" and \"90rotation\".")
+        print("   If it is not given, the settings saved by the GUI in the folder are used")
+        print("-w (optional) number of worker processes (default: MUSCLEX_WORKERS or number of cpus)")
+        print("-t (optional) number of threads of each worker (default: MUSCLEX_THREADS or cpus shared between the workers)")
+        print("-d (optional) delete existing cache")
         print("")
+        print("Note: The threads of a stage can be set with MUSCLEX_THREADS_<STAGE> (WARP, BGSUB, INTEGRATION), e.g. MUSCLEX_THREADS_BGSUB=8")
         print("Note: To generate the setting file, use the interactive muclex, set parameter in it, then select save the current settings. \nThis will create the necessary setting file. If a setting file is not provided, default settings will be used")
         print("Note: If a hdf file does not exist, the program will use the default file. You can generate a hdf step size file using the interactive version (set step size, click ok, the file will be automaticly saved)")
         print("")
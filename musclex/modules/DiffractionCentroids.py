@@ -30,20 +30,26 @@ from os import makedirs
 from os.path import isfile, exists
 import pickle
 import matplotlib.pyplot as plt
-from pyFAI.method_registry import IntegrationMethod
 from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
 from lmfit import Parameters
 from lmfit.models import VoigtModel
-import fabio
 from musclex import __version__
 try:
     from ..utils.file_manager import fullPath, ifHdfReadConvertless
     from ..utils.image_processor import *
     from ..utils.histogram_processor import *
+    from ..utils.image_prefetcher import readImageData, getFileStamp
+    from ..utils.group_averager import averageImages
+    from ..utils.integration_backend import getIntegrationMethod
+    from ..utils.execution_resources import stageThreads
 except: # for coverage
     from utils.file_manager import fullPath, ifHdfReadConvertless
     from utils.image_processor import *
     from utils.histogram_processor import *
+    from utils.image_prefetcher import readImageData, getFileStamp
+    from utils.group_averager import averageImages
+    from utils.integration_backend import getIntegrationMethod
+    from utils.execution_resources import stageThreads
 
 class DiffractionCentroids:
     """
@@ -72,21 +78,43 @@ class DiffractionCentroids:
         self.fixRanges = fixRanges
         self.init_off_mer = off_mer
         self.rotMat = None  # store the rotation matrix used so that any point specified in current co-ordinate system can be transformed to the base (original image) co-ordinate system
+        self.geometry_prep = None # preprocessing of the center search, reused by the rotation angle
+        self.rotated_img = None # rotated average image as [center, angle, rotated image, rotated center, rotation matrix]
 
     def mergeImages(self, dir_path, imgList):
         """
-        Merge all image in imgList
+        Merge all image in imgList. The average of a group is kept in "dc_cache" with the modification stamps of
+        its images, so the images are not read again while none of them changes
         :param dir_path: directory of images
         :param imgList: all merging images
         :return:
         """
-        imgList2 = []
-        for fname in imgList:
-            fullname = fullPath(dir_path, fname)
-            img = fabio.open(fullname).data
-            img = ifHdfReadConvertless(fname, img)
-            imgList2.append(img)
-        return np.mean(imgList2, axis=0)
+        paths = [fullPath(dir_path, fname) for fname in imgList]
+        members = [(fname, getFileStamp(path)) for fname, path in zip(imgList, paths)]
+        cache_path = fullPath(dir_path, 'dc_cache')
+        cachefile = fullPath(cache_path, imgList[0] + '_' + imgList[-1] + '.avg')
+
+        # a single image is as fast to read as its cache
+        if len(imgList) > 1 and isfile(cachefile):
+            try:
+                with open(cachefile, "rb") as c:
+                    cavg = pickle.load(c)
+                if cavg['members'] == members:
+                    return cavg['avg']
+            except Exception:
+                print("Average image cache could not be read, the images will be merged again")
+
+        avgImg = averageImages(paths, read=lambda path: ifHdfReadConvertless(path, readImageData(path)))
+
+        if len(imgList) > 1:
+            try:
+                if not exists(cache_path):
+                    makedirs(cache_path)
+                with open(cachefile, "wb") as c:
+                    pickle.dump({'members': members, 'avg': avgImg}, c, protocol=pickle.HIGHEST_PROTOCOL)
+            except OSError:
+                print("Average image cache could not be saved in " + cache_path)
+        return avgImg
 
     def loadCache(self, dir_path, imgList):
         """
@@ -177,7 +205,9 @@ class DiffractionCentroids:
                 self.info['center'] = (center[0], center[1])
                 self.info['orig_center'] = (center[0], center[1])
             return
-        self.avgImg, self.info['center'] = processImageForIntCenter(self.avgImg, getCenter(self.avgImg))
+        # The rotation angle is searched in the same image, translated to the integer center, the preprocessing is shared
+        self.geometry_prep = preprocessForGeometry(self.avgImg)
+        self.avgImg, self.info['center'] = processImageForIntCenter(self.avgImg, getCenterFromPreprocessed(self.geometry_prep))
         print("center = "+str(self.info['center']))
         self.removeInfo('rotationAngle')
 
@@ -189,7 +219,8 @@ class DiffractionCentroids:
         if 'rotationAngle' in self.info:
             return
         center = self.info['center']
-        self.info['rotationAngle'] = getRotationAngle(self.avgImg, center, self.info['orientation_model'])
+        self.info['rotationAngle'] = getRotationAngle(self.avgImg, center, self.info['orientation_model'], prep=self.geometry_prep)
+        self.geometry_prep = None
         print("rotation angle = " + str(self.info['rotationAngle']))
         self.removeInfo('rmin')
 
@@ -212,7 +243,7 @@ class DiffractionCentroids:
         npt_rad = int(round(max([distance(center, c) for c in corners])))
         ai = AzimuthalIntegrator(detector=det)
         ai.setFit2D(100, center[0], center[1])
-        integration_method = IntegrationMethod.select_one_available("csr", dim=1, default="csr", degradable=True)
+        integration_method = getIntegrationMethod(ai, img, 1, (npt_rad,), unit="r_mm")
         _, I = ai.integrate1d(img, npt_rad, unit="r_mm", method=integration_method)
         self.info['rmin'] = getFirstVallay(I)
         print("R-min = "+str(self.info['rmin']))
@@ -261,12 +292,12 @@ class DiffractionCentroids:
     def getRotatedImage(self, img = None, angle = None):
         """
         Get rotated image by angle. If the input params are not specified. image = original input image, angle = self.info["rotationAngle"]
+        The rotated average image is kept in self.rotated_img, so the meridian and all off-meridian strips share one rotation
         :param img: input image
         :param angle: rotation angle
         :return: rotated image
         """
-        if img is None:
-            img = copy.copy(self.avgImg)
+        useAvg = img is None
         if angle is None:
             angle = self.info['rotationAngle']
         if '90rotation' in self.info and self.info['90rotation'] is True:
@@ -278,7 +309,16 @@ class DiffractionCentroids:
         else:
             self.info["orig_center"] = center
 
-        rotImg, self.info["center"], self.rotMat = rotateImage(img, center, angle)
+        if useAvg and self.rotated_img is not None and self.rotated_img[0] == tuple(center) and self.rotated_img[1] == angle:
+            rotImg, self.info["center"], self.rotMat = self.rotated_img[2:]
+            return rotImg
+
+        if useAvg:
+            img = copy.copy(self.avgImg)
+        with stageThreads('warp'):
+            rotImg, self.info["center"], self.rotMat = rotateImage(img, center, angle)
+        if useAvg:
+            self.rotated_img = [tuple(center), angle, rotImg, self.info["center"], self.rotMat]
 
         return rotImg
 
@@ -314,10 +354,10 @@ class DiffractionCentroids:
             return
 
         int_area = self.info['int_area']
-        img = self.getRotatedImage(copy.copy(self.avgImg), self.info['rotationAngle'])
+        img = self.getRotatedImage()
         center_y = self.info['center'][1]
         img_area = img[:,int_area[0]: int_area[1]]
-        ignore = np.array([any(line <= self.mask_thres) for line in img_area])
+        ignore = np.any(img_area <= self.mask_thres, axis=1)
         hist = np.sum(img_area, axis=1)
 
         top_hist, top_ignore, bottom_hist, bottom_ignore = self.splitHist(center_y, hist, ignore)
@@ -426,7 +466,7 @@ class DiffractionCentroids:
                     break
                 left = min(p, new_peak)
                 right = max(p, new_peak)
-                if all(smooth_hist[left+1:right] > p):
+                if np.all(smooth_hist[left+1:right] > p):
                     break
                 dist = dist/2
             peakList.append(new_peak)
@@ -438,17 +478,13 @@ class DiffractionCentroids:
         Baselines will be kept in self..info["[side]_baselines"].
         This calulation might affact other infos : centroids width and intensity
         """
-        if 'top_baselines' not in self.info:
-            hist = self.info['top_hull']
-            peaks = self.info['top_peaks']
-            self.info['top_baselines'] = [hist[p] / 2. for p in peaks]
-            self.removeInfo('top_centroids')
+        for side in ['top', 'bottom']:
+            if side + '_baselines' not in self.info:
+                hist = self.info[side + '_hull']
+                peaks = np.array(self.info[side + '_peaks'], dtype=int)
+                self.info[side + '_baselines'] = (hist[peaks] / 2.).tolist()
+                self.removeInfo(side + '_centroids')
         print("Top baselines = "+str(self.info['top_baselines']))
-        if 'bottom_baselines' not in self.info:
-            hist = self.info['bottom_hull']
-            peaks = self.info['bottom_peaks']
-            self.info['bottom_baselines'] = [hist[p]/2. for p in peaks]
-            self.removeInfo('bottom_centroids')
         print("Bottom baselines = "+str(self.info['bottom_baselines']))
 
     def calculateCentroids(self):
@@ -456,23 +492,16 @@ class DiffractionCentroids:
         Calculate all other peaks infomation including centroid, width, and intensity(area)
         This results will be kept in self.info
         """
-        if 'top_centroids' not in self.info:
-            hist = self.info['top_hull']
-            peaks = self.info['top_peaks']
-            baselines = self.info["top_baselines"]
-            results = getPeakInformations(hist, peaks, baselines)
-            self.info['top_centroids'] = results['centroids']
-            self.info['top_widths'] = results['widths']
-            self.info['top_areas'] = results['areas']
+        sides = [side for side in ['top', 'bottom'] if side + '_centroids' not in self.info]
+        if len(sides) > 0:
+            allResults = getPeakInformationsBatch([self.info[side + '_hull'] for side in sides],
+                                                  [self.info[side + '_peaks'] for side in sides],
+                                                  [self.info[side + '_baselines'] for side in sides])
+            for side, results in zip(sides, allResults):
+                self.info[side + '_centroids'] = results['centroids']
+                self.info[side + '_widths'] = results['widths']
+                self.info[side + '_areas'] = results['areas']
         print("Top centroids = "+ str(self.info['top_centroids']))
-        if 'bottom_centroids' not in self.info:
-            hist = self.info['bottom_hull']
-            peaks = self.info['bottom_peaks']
-            baselines = self.info["bottom_baselines"]
-            results = getPeakInformations(hist, peaks, baselines)
-            self.info['bottom_centroids'] = results['centroids']
-            self.info['bottom_widths'] = results['widths']
-            self.info['bottom_areas'] = results['areas']
         print("Bottom centroids = " + str(self.info['bottom_centroids']))
 
     def fitModel(self, hist, peaks, baselines):
@@ -626,8 +655,8 @@ class DiffractionCentroids:
             # left_ignore = np.array([any(line < 0) for line in left_area])
             # right_ignore = np.array([any(line < 0) for line in right_area])
 
-            left_ignore = np.array([sum(np.array(line) < 0) > 0.1*len(line) for line in left_area])
-            right_ignore = np.array([sum(np.array(line) < 0) > 0.1*len(line) for line in right_area])
+            left_ignore = np.count_nonzero(left_area < 0, axis=1) > 0.1*left_area.shape[1]
+            right_ignore = np.count_nonzero(right_area < 0, axis=1) > 0.1*right_area.shape[1]
             left_hist = np.sum(left_area, axis=1)
             right_hist = np.sum(right_area, axis=1)
             top_left_hist, top_left_ignore, bottom_left_hist, bottom_left_ignore = self.splitHist(center_y, left_hist,
@@ -683,7 +712,7 @@ class DiffractionCentroids:
             peaks = self.info["off_mer_peaks"]
             hulls = self.info["off_mer_hists"]["hulls"]
             for k in peaks.keys():
-                baselines[k] = [hulls[k][p]*.5 for p in peaks[k]]
+                baselines[k] = (hulls[k][np.array(peaks[k], dtype=int)]*.5).tolist()
             self.info["off_mer_baselines"] = baselines
             self.removeInfo("off_mer_peak_info")
 
@@ -693,19 +722,15 @@ class DiffractionCentroids:
         These info will be kept in self.info["off_mer_peak_info"]
         """
         if "off_mer_peak_info" not in self.info:
-            all_info = {}
             peaks = self.info["off_mer_peaks"]
             hulls = self.info["off_mer_hists"]["hulls"]
             baselines = self.info["off_mer_baselines"]
 
-            for k in peaks.keys():
-                peak_list = peaks[k]
-                hull = hulls[k]
-                baseline_list = baselines[k]
-                results = getPeakInformations(hull, peak_list, baseline_list)
-                all_info[k] = copy.copy(results)
-
-            self.info["off_mer_peak_info"] = all_info
+            # All quadrants and all of their peaks are processed in one pass
+            quadrants = list(peaks.keys())
+            allResults = getPeakInformationsBatch([hulls[k] for k in quadrants], [peaks[k] for k in quadrants],
+                                                  [baselines[k] for k in quadrants])
+            self.info["off_mer_peak_info"] = dict(zip(quadrants, allResults))
 
     def initOffMeridianPeakRange(self):
         """
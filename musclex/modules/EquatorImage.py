@@ -36,7 +36,6 @@ import tifffile
 from lmfit import Model, Parameters
 from lmfit.models import VoigtModel, GaussianModel
 from sklearn.metrics import r2_score, mean_squared_error
-from pyFAI.method_registry import IntegrationMethod
 from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
 import fabio
 from musclex import __version__
@@ -44,10 +43,18 @@ try:
     from ..utils.file_manager import fullPath, getBlankImageAndMask, getMaskOnly, ifHdfReadConvertless
     from ..utils.histogram_processor import *
     from ..utils.image_processor import *
+    from ..utils.image_prefetcher import readImageData, readCacheFile
+    from ..utils.run_container import cacheExists, writeCacheFile, removeCacheFile
+    from ..utils.integration_backend import getIntegrationMethod
+    from ..utils.execution_resources import stageThreads
 except: # for coverage
     from utils.file_manager import fullPath, getBlankImageAndMask, getMaskOnly, ifHdfReadConvertless
     from utils.histogram_processor import *
     from utils.image_processor import *
+    from utils.image_prefetcher import readImageData, readCacheFile
+    from utils.run_container import cacheExists, writeCacheFile, removeCacheFile
+    from utils.integration_backend import getIntegrationMethod
+    from utils.execution_resources import stageThreads
 
 class EquatorImage:
     """
@@ -66,10 +73,11 @@ class EquatorImage:
             index = next((i for i, item in enumerate(file_list[0]) if item == filename), 0)
             self.orig_img = file_list[1][index]
         else:
-            self.orig_img = fabio.open(fullPath(dir_path, filename)).data
+            self.orig_img = readImageData(fullPath(dir_path, filename))
         self.orig_img = ifHdfReadConvertless(self.filename, self.orig_img)
         self.orig_img = self.orig_img.astype("float32")
         self.image = None
+        self.geometry_prep = None # preprocessing of the center search, reused by the rotation angle
         self.skeletalVarsNotSet = False
         self.extraPeakVarsNotSet = False
 
@@ -197,7 +205,11 @@ class EquatorImage:
                 print("Using Calibration Center")
                 self.info['center'] = self.info['calib_center']
                 return
-            self.orig_img, self.info['center'] = processImageForIntCenter(self.orig_img, getCenter(self.orig_img))
+            prep = preprocessForGeometry(self.orig_img)
+            self.orig_img, self.info['center'] = processImageForIntCenter(self.orig_img, getCenterFromPreprocessed(prep))
+            if 'blank_mask' in self.info and not self.info['blank_mask']:
+                # The rotation angle is searched in the same image (see applyBlankAndMask), the preprocessing is shared
+                self.geometry_prep = prep
             self.removeInfo('rotationAngle') # Remove rotationAngle from info dict to make it be re-calculated
         else:
             if self.rotMat is not None:
@@ -228,9 +240,10 @@ class EquatorImage:
             center = self.info['center']
             img = copy.copy(self.image)
             if 'detector' in self.info:
-                self.info['rotationAngle'] = getRotationAngle(img, center, self.info['orientation_model'], man_det=self.info['detector'])
+                self.info['rotationAngle'] = getRotationAngle(img, center, self.info['orientation_model'], man_det=self.info['detector'], prep=self.geometry_prep)
             else:
-                self.info['rotationAngle'] = getRotationAngle(img, center, self.info['orientation_model'])
+                self.info['rotationAngle'] = getRotationAngle(img, center, self.info['orientation_model'], prep=self.geometry_prep)
+            self.geometry_prep = None
             self.removeInfo('rmin')  # Remove R-min from info dict to make it be re-calculated
 
         if "mode_angle" in self.info:
@@ -264,7 +277,7 @@ class EquatorImage:
             npt_rad = int(round(max([distance(center, c) for c in corners])))
             ai = AzimuthalIntegrator(detector=det)
             ai.setFit2D(100, center[0], center[1])
-            integration_method = IntegrationMethod.select_one_available("csr", dim=1, default="csr", degradable=True)
+            integration_method = getIntegrationMethod(ai, img, 1, (npt_rad,), unit="r_mm")
             _, I = ai.integrate1d(img, npt_rad, unit="r_mm", method=integration_method) # Get 1D Azimuthal integrated histogram
             self.info['rmin'] = getFirstVallay(I) # R-min is value before the first valley
             self.removeInfo('int_area')  # Remove integrated area from info dict to make it be re-calculated
@@ -297,7 +310,8 @@ class EquatorImage:
             else:
                 self.info["orig_center"] = center
 
-            rotImg, self.info["center"], self.rotMat = rotateImage(img, center, angle)
+            with stageThreads('warp'):
+                rotImg, self.info["center"], self.rotMat = rotateImage(img, center, angle)
             self.rotated_img = [self.info["center"], angle, img, rotImg]
 
         return self.rotated_img[3]
@@ -447,8 +461,7 @@ class EquatorImage:
         self.parent.statusPrint("Finding Peaks...")
         print("Finding Peaks...")
         if 'tmp_peaks' not in self.info:
-            left_peaks = getPeaksFromHist(self.info['hulls']['left'])
-            right_peaks = getPeaksFromHist(self.info['hulls']['right'])
+            left_peaks, right_peaks = getPeaksFromHistBatch([self.info['hulls']['left'], self.info['hulls']['right']])
             self.info['tmp_peaks'] = {'left': left_peaks, 'right': right_peaks}
             self.removeInfo('peaks')  # Remove real peaks from info dict to make it be re-calculated
 
@@ -975,8 +988,8 @@ class EquatorImage:
         cache_path = fullPath(self.dir_path, "eq_cache")
         cache_file = fullPath(cache_path, self.filename + '.info')
 
-        if exists(cache_path) and isfile(cache_file):
-            cinfo = pickle.load(open(cache_file, "rb"))
+        if cacheExists(cache_file):
+            cinfo = readCacheFile(cache_file)
             if cinfo is not None:
                 if cinfo['program_version'] == self.version:
                     return cinfo
@@ -997,7 +1010,7 @@ class EquatorImage:
             makedirs(cache_path)
 
         self.info['program_version'] = self.version
-        pickle.dump(self.info, open(cache_file, "wb"))
+        writeCacheFile(cache_file, self.info)
 
     def delCache(self):
         """
@@ -1006,8 +1019,7 @@ class EquatorImage:
         """
         cache_path = fullPath(self.dir_path, "eq_cache")
         cache_file = fullPath(cache_path, self.filename + '.info')
-        if exists(cache_path) and isfile(cache_file):
-            os.remove(cache_file)
+        removeCacheFile(cache_file)
 
     def statusPrint(self, text):
         """
@@ -39,10 +39,16 @@ try:
     from ..utils.file_manager import fullPath, createFolder, ifHdfReadConvertless, getBlankImageAndMask, getMaskOnly
     from ..utils.histogram_processor import movePeaks, getPeakInformations, convexHull
     from ..utils.image_processor import *
+    from ..utils.image_prefetcher import readImageData, readCacheFile
+    from ..utils.run_container import cacheExists, writeCacheFile, removeCacheFile
+    from ..utils.execution_resources import stageThreads
 except: # for coverage
     from utils.file_manager import fullPath, createFolder, ifHdfReadConvertless, getBlankImageAndMask, getMaskOnly
     from utils.histogram_processor import movePeaks, getPeakInformations, convexHull
     from utils.image_processor import *
+    from utils.image_prefetcher import readImageData, readCacheFile
+    from utils.run_container import cacheExists, writeCacheFile, removeCacheFile
+    from utils.execution_resources import stageThreads
 
 class ProjectionProcessor:
     """
@@ -55,7 +61,7 @@ class ProjectionProcessor:
             index = next((i for i, item in enumerate(file_list[0]) if item == file_name), 0)
             img = file_list[1][index]
         else:
-            img = fabio.open(fullPath(dir_path, file_name)).data
+            img = readImageData(fullPath(dir_path, file_name))
         # if img.shape[1] > img.shape[0]: # image is longer than it is wide
         #     img = cv2.copyMakeBorder(img, top=int((img.shape[1]-img.shape[0])/2), bottom=int((img.shape[1]-img.shape[0])/2), left=0, right=0, borderType=cv2.BORDER_CONSTANT)
         # else:
@@ -69,6 +75,7 @@ class ProjectionProcessor:
         self.version = __version__
         self.masked = False
         self.fixed_sigma = {}
+        self.geometry_prep = None # preprocessing of the center search, reused by the rotation angle
         cache = self.loadCache()
         self.rotMat = None  # store the rotation matrix used so that any point specified in current co-ordinate system can be transformed to the base (original image) co-ordinate system
         if cache is None:
@@ -154,17 +161,41 @@ class ProjectionProcessor:
         """
         All processing steps - all settings are provided by Projection Traces app as a dictionary
         """
+        self.processHistograms(settings)
+        self.fitModel()
+        self.processFitResults(settings)
+
+    def processHistograms(self, settings={}):
+        """
+        Processing steps before fitting the boxes. Used with processFitResults() when the boxes of several images are
+        fitted together (see LayerLineSeriesFitter)
+        """
         self.updateSettings(settings)
         self.applyBlankImageAndMask()
         self.getHistograms()
         self.applyConvexhull()
         self.updateRotationAngle()
-        self.fitModel()
+
+    def processFitResults(self, settings={}):
+        """
+        Processing steps after fitting the boxes
+        """
         self.getBackgroundSubtractedHistograms()
         self.getPeakInfos()
         if 'no_cache' not in settings:
             self.cacheInfo()
 
+    def findCenter(self):
+        """
+        Find the center of the diffraction and translate orig_img to the nearest integer center.
+        The preprocessing of the search is kept for the rotation angle (see updateRotationAngle)
+        :return: integer center
+        """
+        prep = preprocessForGeometry(self.orig_img)
+        self.orig_img, center = processImageForIntCenter(self.orig_img, getCenterFromPreprocessed(prep))
+        self.geometry_prep = prep
+        return center
+
     def applyBlankImageAndMask(self):
         """
         Apply the blank image and mask threshold on the orig_img
@@ -185,6 +216,7 @@ class ProjectionProcessor:
             self.info['hists'] = {}
             self.orig_img = img
             self.masked = True
+            self.geometry_prep = None
 
     def updateSettings(self, settings):
         """
@@ -275,7 +307,8 @@ class ProjectionProcessor:
                         # the box center
                         cx, cy = b[6]
                         rot_angle = b[5]
-                        img = rotateImageAboutPoint(img, (cx, cy), rot_angle)
+                        with stageThreads('warp'):
+                            img = rotateImageAboutPoint(img, (cx, cy), rot_angle)
 
                     # y is shape[0], x is shape[1]?
                     x1 = np.max((int(b[0][0]), 0))
@@ -362,14 +395,15 @@ class ProjectionProcessor:
             center = (self.info['centerx'], self.info['centery'])
             img = copy.copy(self.orig_img)
             if 'detector' in self.info:
-                self.info['rotationAngle'] = getRotationAngle(img, center, man_det=self.info['detector'])
+                self.info['rotationAngle'] = getRotationAngle(img, center, man_det=self.info['detector'], prep=self.geometry_prep)
             else:
-                self.info['rotationAngle'] = getRotationAngle(img, center)
+                self.info['rotationAngle'] = getRotationAngle(img, center, prep=self.geometry_prep)
+            self.geometry_prep = None
 
-    def fitModel(self):
+    def getFitSetups(self):
         """
-        Fit model to histogram
-        Fit results will be kept in self.info["fit_results"].
+        Give the initial parameters of the layer line model of the boxes which have to be fitted
+        :return: dict of box name -> (histogram, parameters as (name, value, min, max, vary), fixed values)
         """
         box_names = self.info['box_names']
         all_hists = self.info['hists2']
@@ -377,6 +411,7 @@ class ProjectionProcessor:
         all_peaks = self.info['peaks']
         all_boxes = self.info['boxes']
         fit_results = self.info['fit_results']
+        setups = {}
 
         for name in box_names:
             hist = np.array(all_hists[name])
@@ -389,14 +424,10 @@ class ProjectionProcessor:
             start_x = box[0][0]
             start_y = box[1][0]
 
-            x = np.arange(0, len(hist))
-
-            int_vars = {
-                'x' : x
-            }
+            int_vars = {}
 
             # Initial Parameters
-            params = Parameters()
+            params = []
 
             # Init Center X
             if self.info['types'][name] == 'h':
@@ -409,7 +440,7 @@ class ProjectionProcessor:
                 init_center = self.info['centery'] - start_y
 
             init_center = int(round(init_center))
-            params.add('centerX', init_center, min=init_center - 1., max=init_center + 1.)
+            params.append(('centerX', init_center, init_center - 1., init_center + 1., True))
 
             if bgsubs[name] == 1:
                 # Convex hull has been applied, so we don't need to fit 3 gaussian anymore
@@ -422,49 +453,73 @@ class ProjectionProcessor:
                 int_vars['center_amplitude2'] = 0
             else:
                 # Init linear background
-                # params.add('bg_line', 0, min=0)
+                # params.append(('bg_line', 0, 0, np.inf, True))
                 int_vars['bg_line'] = 0
 
                 # Init background params
-                params.add('bg_sigma', len(hist)/3., min=1, max=len(hist)*2+1.)
-                params.add('bg_amplitude', 0, min=-1, max=sum(hist)+1.)
+                params.append(('bg_sigma', len(hist)/3., 1, len(hist)*2+1., True))
+                params.append(('bg_amplitude', 0, -1, sum(hist)+1., True))
 
                 if self.info['merid_bg'][name]:
                     # Init Meridian params1
-                    params.add('center_sigma1', 15, min=1, max=len(hist)+1.)
-                    params.add('center_amplitude1', sum(hist) / 20., min=-1, max=sum(hist) + 1.)
+                    params.append(('center_sigma1', 15, 1, len(hist)+1., True))
+                    params.append(('center_amplitude1', sum(hist) / 20., -1, sum(hist) + 1., True))
                 else:
                     int_vars['center_sigma1'] = 1
                     int_vars['center_amplitude1'] = 0
 
                 # Init Meridian params2
-                params.add('center_sigma2',5 , min=1, max=len(hist)+1.)
-                params.add('center_amplitude2', sum(hist) / 20., min=-1, max=sum(hist)+1.)
+                params.append(('center_sigma2', 5, 1, len(hist)+1., True))
+                params.append(('center_amplitude2', sum(hist) / 20., -1, sum(hist)+1., True))
 
             # Init peaks params
             for j,p in enumerate(peaks):
-                params.add('p_' + str(j), p, min=p - 10., max=p + 10.)
+                params.append(('p_' + str(j), p, p - 10., p + 10., True))
                 if j in self.fixed_sigma:
-                    params.add('sigma' + str(j), self.fixed_sigma[j], vary=False)
+                    params.append(('sigma' + str(j), self.fixed_sigma[j], -np.inf, np.inf, False))
                 else:
-                    params.add('sigma' + str(j), 10, min=1, max=50.)
-                params.add('amplitude' + str(j), sum(hist)/10., min=-1)
-                # params.add('gamma' + str(j), 0. , min=0., max=30)
+                    params.append(('sigma' + str(j), 10, 1, 50., True))
+                params.append(('amplitude' + str(j), sum(hist)/10., -1, np.inf, True))
+                # params.append(('gamma' + str(j), 0., 0., 30, True))
+
+            setups[name] = (hist, params, int_vars)
+        return setups
+
+    def fitModel(self):
+        """
+        Fit model to histogram
+        Fit results will be kept in self.info["fit_results"].
+        """
+        for name, (hist, init_params, int_vars) in self.getFitSetups().items():
+            x = np.arange(0, len(hist))
+            params = Parameters()
+            for pname, value, vmin, vmax, vary in init_params:
+                params.add(pname, value, min=vmin, max=vmax, vary=vary)
 
             # Fit model
-            model = Model(layerlineModel, nan_policy='propagate', independent_vars=int_vars.keys())
-            result = model.fit(hist, verbose=False, params=params, **int_vars)
+            model = Model(layerlineModel, nan_policy='propagate', independent_vars=['x'] + list(int_vars.keys()))
+            result = model.fit(hist, verbose=False, params=params, x=x, **int_vars)
             if result is not None:
                 result_dict = result.values
-                int_vars.pop('x')
                 result_dict.update(int_vars)
-                result_dict['error'] = 1. - r2_score(hist, layerlineModel(x, **result_dict))
-                self.info['fit_results'][name] = result_dict
-                self.removeInfo(name, 'subtracted_hists')
-                print("Box : "+ str(name))
-                print("Fitting Result : " + str(self.info['fit_results'][name]))
-                print("Fitting Error : " + str(self.info['fit_results'][name]['error']))
-                print("---")
+                self.setFitResult(name, result_dict)
+
+    def setFitResult(self, name, result_dict):
+        """
+        Keep the fit result of a box in self.info["fit_results"] with its error and clear the results depending on it
+        :param name: box name
+        :param result_dict: values of all the parameters of layerlineModel
+        :return: -
+        """
+        hist = np.array(self.info['hists2'][name])
+        x = np.arange(0, len(hist))
+        result_dict['error'] = 1. - r2_score(hist, layerlineModel(x, **result_dict))
+        self.info['fit_results'][name] = result_dict
+        self.removeInfo(name, 'subtracted_hists')
+        print("Box : "+ str(name))
+        print("Fitting Result : " + str(self.info['fit_results'][name]))
+        print("Fitting Error : " + str(self.info['fit_results'][name]['error']))
+        print("---")
 
 
     def getBackgroundSubtractedHistograms(self):
@@ -609,7 +664,8 @@ class ProjectionProcessor:
             else:
                 self.info["orig_center"] = center
 
-            rotImg, (self.info["centerx"], self.info["centery"]), self.rotMat = rotateImage(img, center, angle)
+            with stageThreads('warp'):
+                rotImg, (self.info["centerx"], self.info["centery"]), self.rotMat = rotateImage(img, center, angle)
             self.rotated_img = [(self.info["centerx"], self.info["centery"]), angle, img, rotImg]
 
         return self.rotated_img[3]
@@ -642,8 +698,8 @@ class ProjectionProcessor:
         """
         cache_path = fullPath(self.dir_path, "pt_cache")
         cache_file = fullPath(cache_path, self.filename + '.info')
-        if exists(cache_path) and isfile(cache_file):
-            cinfo = pickle.load(open(cache_file, "rb"))
+        if cacheExists(cache_file):
+            cinfo = readCacheFile(cache_file)
             if cinfo is not None:
                 if cinfo['program_version'] == self.version:
                     return cinfo
@@ -661,7 +717,7 @@ class ProjectionProcessor:
         cache_file = fullPath(cache_path, self.filename + '.info')
 
         self.info["program_version"] = self.version
-        pickle.dump(self.info, open(cache_file, "wb"))
+        writeCacheFile(cache_file, self.info)
 
 
 def layerlineModel(x, centerX, bg_line, bg_sigma, bg_amplitude, center_sigma1, center_amplitude1,
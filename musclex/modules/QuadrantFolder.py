@@ -34,7 +34,6 @@ from scipy.interpolate import UnivariateSpline
 from skimage.morphology import white_tophat, disk
 #import ccp13
 from ..converted_fortran.converted_fortran import *
-from pyFAI.method_registry import IntegrationMethod
 from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
 from musclex import __version__
 try:
@@ -42,11 +41,91 @@ try:
     from ..utils.file_manager import fullPath, createFolder, getBlankImageAndMask, getMaskOnly, ifHdfReadConvertless
     from ..utils.histogram_processor import *
     from ..utils.image_processor import *
+    from ..utils.scratch_arena import getScratchArena
+    from ..utils.execution_resources import stageThreads
+    from ..utils.image_prefetcher import readImageData, readCacheFile
+    from ..utils.run_container import cacheExists, writeCacheFile, removeCacheFile
+    from ..utils.integration_backend import getIntegrationMethod
+    from ..utils.stage_graph import Stage, StageGraph
 except: # for coverage
     from modules import QF_utilities as qfu
     from utils.file_manager import fullPath, createFolder, getBlankImageAndMask, getMaskOnly, ifHdfReadConvertless
     from utils.histogram_processor import *
     from utils.image_processor import *
+    from utils.scratch_arena import getScratchArena
+    from utils.execution_resources import stageThreads
+    from utils.image_prefetcher import readImageData, readCacheFile
+    from utils.run_container import cacheExists, writeCacheFile, removeCacheFile
+    from utils.integration_backend import getIntegrationMethod
+    from utils.stage_graph import Stage, StageGraph
+
+# Parameters used by each background subtraction method to produce bgimg1
+BGSUB_PARAMS = {
+    'Circularly-symmetric': ['cirmin', 'cirmax', 'radial_bin', 'smooth', 'tension'],
+    'White-top-hats': ['tophat1'],
+    'Roving Window': ['cirmin', 'cirmax', 'smooth', 'tension', 'win_size_x', 'win_size_y', 'win_sep_x', 'win_sep_y', 'roi_rad'],
+    'Smoothed-Gaussian': ['fwhm', 'cycles', 'tension', 'roi_rad'],
+    'Smoothed-BoxCar': ['boxcar_x', 'boxcar_y', 'cycles', 'tension', 'roi_rad']
+}
+
+def getBgimg1Params(info):
+    """
+    Give the parameters of bgimg1 for the selected background subtraction method
+    """
+    return ['bgsub'] + BGSUB_PARAMS.get(info.get('bgsub'), [])
+
+def getBgimg2Params(info):
+    """
+    Give the parameters of bgimg2, the selected method only matters if it is 'None' (bgimg2 is then the average fold)
+    """
+    return ['bgsub'] if info.get('bgsub') == 'None' else ['tophat2']
+
+def getQuadrantFoldingStages():
+    """
+    Give the stage graph of Quadrant Folding : each stage is run by process() only if its results are missing
+    or its parameters changed, and running it removes the results of the stages after it
+    """
+    return StageGraph([
+        Stage('center', ['center']),
+        Stage('rotation', ['rotationAngle'], params=['orientation_model', 'mode_angle']),
+        Stage('avg_fold', ['avg_fold'], inputs=['center', 'rotation'], params=['fold_image', 'ignore_folds', 'mask_thres']),
+        Stage('rminmax', ['rmin', 'rmax'], inputs=['avg_fold'], params=['fixed_rmin', 'fixed_rmax']),
+        Stage('bgimg1', ['bgimg1'], inputs=['avg_fold', 'rminmax'], params=getBgimg1Params),
+        Stage('bgimg2', ['bgimg2'], inputs=['avg_fold'], params=getBgimg2Params),
+        Stage('BgSubFold', ['BgSubFold'], inputs=['bgimg1', 'bgimg2', 'rminmax'], params=['sigmoid'], store='imgCache'),
+        Stage('resultImg', ['resultImg'], inputs=['BgSubFold'], params=['rotate', 'roi_rad'], store='imgCache')
+    ])
+
+def getDefaultFlags(img):
+    """
+    Give the default flags of process() when they are not set by the user (headless mode, parameter sweep),
+    same as QuadrantFoldingGUI.py default
+    :param img: original image, for the mask threshold
+    :return: flags (dict)
+    """
+    return {
+        'bgsub': 'None',
+        'cirmin': 0.0,
+        'cirmax': 25.0,
+        'win_size_x': 10,
+        'win_size_y': 10,
+        'win_sep_x': 10,
+        'win_sep_y': 10,
+        'bin_theta': 30,
+        'radial_bin': 10,
+        'smooth': 0.1,
+        'tension': 1.0,
+        'tophat1': 5,
+        'tophat2': 20,
+        'mask_thres': getMaskThreshold(img),
+        'sigmoid': 0.1,
+        'fwhm': 10,
+        'boxcar_x': 10,
+        'boxcar_y': 10,
+        'cycles': 5,
+        'blank_mask': False,
+        'rotate': False
+    }
 
 # Make sure the cython part is compiled
 # from subprocess import call
@@ -66,7 +145,7 @@ class QuadrantFolder:
             index = next((i for i, item in enumerate(file_list[0]) if item == img_name), 0)
             self.orig_img = file_list[1][index]
         else:
-            self.orig_img = fabio.open(fullPath(img_path, img_name)).data
+            self.orig_img = readImageData(fullPath(img_path, img_name))
         self.orig_img = ifHdfReadConvertless(img_name, self.orig_img)
         self.orig_img = self.orig_img.astype("float32")
         self.orig_image_center = None
@@ -75,11 +154,13 @@ class QuadrantFolder:
         self.img_path = img_path
         self.img_name = img_name
         self.imgCache = {} # displayed images will be saved in this param
+        self.stages = getQuadrantFoldingStages()
         self.ignoreFolds = set()
         self.version = __version__
         cache = self.loadCache() # load from cache if it's available
         self.initImg = None
         self.centImgTransMat = None # Centerize image transformation matrix
+        self.centImgDim = None # Dimension of the centerized image
         self.center_before_rotation = None # we need the center before rotation is applied each time we rotate the image
         self.rotMat = None # store the rotation matrix used so that any point specified in current co-ordinate system can be transformed to the base (original image) co-ordinate system
         self.centerChanged = False
@@ -90,6 +171,8 @@ class QuadrantFolder:
             self.parent = self
         self.newImgDimension = None
         self.masked = False
+        self.pyramids = {} # downsampled images used for the estimations when 'pyramid_level' > 0
+        self.geometry_prep = None # preprocessing of the center search, reused by the rotation angle of the same image
 
         # info dictionary will save all results
         if cache is not None:
@@ -105,8 +188,7 @@ class QuadrantFolder:
         cache_file = fullPath(fullPath(self.img_path, "qf_cache"), self.img_name + ".info")
         createFolder(fullPath(self.img_path, "qf_cache"))
         self.info['program_version'] = self.version
-        with open(cache_file, "wb") as c:
-            pickle.dump(self.info, c)
+        writeCacheFile(cache_file, self.info)
 
     def loadCache(self):
         """
@@ -114,9 +196,8 @@ class QuadrantFolder:
         :return: cached info (dict)
         """
         cache_file = fullPath(fullPath(self.img_path, "qf_cache"), self.img_name+".info")
-        if os.path.isfile(cache_file):
-            with open(cache_file, "rb") as c:
-                info = pickle.load(c)
+        if cacheExists(cache_file):
+            info = readCacheFile(cache_file)
             if info is not None:
                 if info['program_version'] == self.version:
                     return info
@@ -131,8 +212,7 @@ class QuadrantFolder:
         """
         cache_path = fullPath(self.img_path, "qf_cache")
         cache_file = fullPath(cache_path, self.img_name + '.info')
-        if os.path.exists(cache_path) and os.path.isfile(cache_file):
-            os.remove(cache_file)
+        removeCacheFile(cache_file)
 
     def deleteFromDict(self, dicto, delStr):
         """
@@ -144,6 +224,12 @@ class QuadrantFolder:
         if delStr in dicto:
             del dicto[delStr]
 
+    def getStageStores(self):
+        """
+        Give the dicts keeping the results of the stages
+        """
+        return {'info': self.info, 'imgCache': self.imgCache}
+
     def process(self, flags):
         """
         All processing steps - all flags are provided by Quadrant Folding app as a dictionary
@@ -155,33 +241,33 @@ class QuadrantFolder:
         other backgound subtraction params - cirmin, cirmax, nbins, tophat1, tophat2
         """
         print(str(self.img_name) + " is being processed...")
-        self.updateInfo(flags)
-        self.initParams()
-        self.applyBlankImageAndMask()
-        self.findCenter()
-        self.centerizeImage()
-        self.rotateImg()
-        self.calculateAvgFold()
-        if flags['fold_image'] == False:
-            self.info['avg_fold'] = self.orig_img
-            self.info['folded'] = False
-            
-            #self.initImg = self.orig_img
-            
-            # if self.initImg is not None:
-            #     self.info['avg_fold'] = self.initImg
-            # else:
-            #     self.info['avg_fold'] = self.orig_img
-        self.getRminmax()
+        self.stages.resetReport()
+        self.processFold(flags)
         self.applyBackgroundSubtraction()
         self.mergeImages()
         self.generateResultImage()
+        print(self.stages.getReport())
 
         if "no_cache" not in flags:
             self.cacheInfo()
 
         self.parent.statusPrint("")
 
+    def processFold(self, flags):
+        """
+        Processing steps before the background subtraction : center, rotation angle, average fold, R-min and R-max.
+        Their results are shared by all background subtraction settings (see QuadrantFoldingSweep)
+        :param flags: flags, as in process()
+        """
+        self.updateInfo(flags)
+        self.initParams()
+        self.applyBlankImageAndMask()
+        self.findCenter()
+        self.centerizeImage()
+        self.rotateImg()
+        self.calculateAvgFold()
+        self.getRminmax()
+
     def updateInfo(self, flags):
         """
         Update info dict using flags
@@ -242,6 +328,8 @@ class QuadrantFolder:
             self.centerChanged = False
             return
         self.centerChanged = True
+        self.geometry_prep = None
+        self.stages.invalidate(self.getStageStores(), 'center', dependentsOnly=True)
         if 'calib_center' in self.info:
             self.info['center'] = self.info['calib_center']
             return
@@ -253,36 +341,74 @@ class QuadrantFolder:
             self.info['center'] = self.info['manual_center']
             return
         print("Center is being calculated ... ")
-        self.orig_image_center = getCenter(self.orig_img)
+        if self.initImg is not None:
+            # the center is found in the centerized image, it will be converted back by centerizeImage()
+            self.orig_img = self.getCenterizedImage()
+        img, scale = self.getPyramidImage('orig', self.orig_img)
+        prep = preprocessForGeometry(img)
+        self.orig_image_center = pyramidToNative(getCenterFromPreprocessed(prep), scale)
+        if self.initImg is None:
+            # The rotation angle is searched in the same image, translated to the integer center
+            self.geometry_prep = prep
         self.orig_img, self.info['center'] = processImageForIntCenter(self.orig_img, self.orig_image_center)
+        if 'orig' in self.pyramids:
+            # The translation to the integer center is sub-pixel, the downsampled levels are kept for the rotation angle
+            self.pyramids['init'] = [self.orig_img] + self.pyramids.pop('orig')[1:]
         print("Done. Center = "+str(self.info['center']))
 
 
     def rotateImg(self):
         """
         Find rotation angle of the diffraction. Turn the diffraction equator to be horizontal. The angle will be kept in self.info["rotationAngle"]
-        Once the rotation angle is calculated, the average fold will be re-calculated, so self.info["avg_fold"] is deleted
+        Once the rotation angle is calculated, the average fold will be re-calculated (see getQuadrantFoldingStages())
         """
         self.parent.statusPrint("Finding Rotation Angle...")
+        if 'manual_rotationAngle' in self.info:
+            self.stages.invalidate(self.getStageStores(), 'rotation')
+        self.stages.run(self.getStageStores(), 'rotation', self.calculateRotationAngle)
+        print("Done. Rotation Angle is " + str(self.info['rotationAngle']) +" degree")
+
+    def calculateRotationAngle(self):
+        """
+        Set self.info["rotationAngle"] from the manual angle, the mode angle of the folder, or the angle found in the image
+        """
         if 'manual_rotationAngle' in self.info:
             self.info['rotationAngle'] = self.info['manual_rotationAngle']
             del self.info['manual_rotationAngle']
-            self.deleteFromDict(self.info, 'avg_fold')
         elif "mode_angle" in self.info:
             print(f'Using mode orientation {self.info["mode_angle"]}')
             self.info['rotationAngle'] = self.info["mode_angle"]
-            self.deleteFromDict(self.info, 'avg_fold')
-        elif not self.empty and 'rotationAngle' not in self.info.keys():
+        elif not self.empty:
             print("Rotation Angle is being calculated ... ")
             # Selecting disk (base) image and corresponding center for determining rotation as for larger images (formed from centerize image) rotation angle is wrongly computed
             _, center = self.parent.getExtentAndCenter()
-            img = copy.copy(self.initImg) if self.initImg is not None else copy.copy(self.orig_img)
-            if 'detector' in self.info:
-                self.info['rotationAngle'] = getRotationAngle(img, center, self.info['orientation_model'], man_det=self.info['detector'])
+            img = self.initImg if self.initImg is not None else self.orig_img
+            man_det = self.info['detector'] if 'detector' in self.info else None
+            coarse, scale = self.getPyramidImage('init', img)
+            if scale > 1:
+                det = resolveBinnedDetector(img.shape, scale, man_det=man_det)
+                self.info['rotationAngle'] = getRotationAngle(copy.copy(coarse), nativeToPyramid(center, scale), self.info['orientation_model'], detector=det, prep=self.geometry_prep)
             else:
-                self.info['rotationAngle'] = getRotationAngle(img, center, self.info['orientation_model'])
-            self.deleteFromDict(self.info, 'avg_fold')
-        print("Done. Rotation Angle is " + str(self.info['rotationAngle']) +" degree")
+                self.info['rotationAngle'] = getRotationAngle(copy.copy(img), center, self.info['orientation_model'], man_det=man_det, prep=self.geometry_prep)
+            self.geometry_prep = None
+
+    def getPyramidImage(self, key, img):
+        """
+        Give the image to use for an estimation step (center, rotation angle, R-min) at the pyramid level
+        set by self.info['pyramid_level'] (0 = native resolution, 1 = 2x downsampled, 2 = 4x downsampled).
+        The pyramid of each image is built once and kept in self.pyramids.
+        :param key: name of the image in self.pyramids
+        :param img: image at native resolution
+        :return: image at the pyramid level, downsampling factor
+        """
+        level = int(self.info['pyramid_level']) if 'pyramid_level' in self.info else 0
+        if level <= 0:
+            return img, 1
+        if key not in self.pyramids or self.pyramids[key][0] is not img:
+            self.pyramids[key] = buildImagePyramid(img, 2)
+        pyramid = self.pyramids[key]
+        level = min(level, len(pyramid) - 1)
+        return pyramid[level], 2 ** level
 
     def getExtentAndCenter(self):
         """
@@ -307,7 +433,11 @@ class QuadrantFolder:
 
     def centerizeImage(self):
         """
-        Create an enlarged image such that image center is at the center of new image
+        Find the enlarged image such that image center is at the center of new image. The enlarged image is not created,
+        only its dimension and translation are kept in self.centImgDim and self.centImgTransMat. getRotatedImage() applies
+        them with the rotation in one warp, getCenterizedImage() gives the enlarged image if it's needed.
+        self.orig_img stays the initial image, so self.info['center'] stays in its coordinate system. The center in the
+        enlarged image is kept in self.center_before_rotation
         """
         self.parent.statusPrint("Centererizing image...")
         if not self.centerChanged:
@@ -342,59 +472,54 @@ class QuadrantFolder:
             self.parent.newImgDimension = dim
         else:
             dim = self.parent.newImgDimension
-        new_img = np.zeros((dim,dim)).astype("float32")
-        try:
-            new_img[0:b,0:l] = img
-        except:
+        if b > dim or l > dim:
             print("Centerize Image : Dimension mismatched. Please report error and the steps leading up to it.")
-        
 
         #Translate image to appropriate position
         transx = int(((dim/2) - center[0]))
         transy = int(((dim/2) - center[1]))
         M = np.float32([[1,0,transx],[0,1,transy]])
         self.centImgTransMat = M
-        rows, cols = new_img.shape
-        # mask_thres = self.info["mask_thres"]
-
-        # if self.img_type == "PILATUS":
-        #     if mask_thres == -999:
-        #         mask_thres = getMaskThreshold(img, self.img_type)
-        #     mask = np.zeros((new_img.shape[0], new_img.shape[1]), dtype=np.uint8)
-        #     mask[new_img <= mask_thres] = 255
-        #     cv2.setNumThreads(1) # Added to prevent segmentation fault due to cv2.warpAffine
-        #     translated_Img = cv2.warpAffine(new_img, M, (cols, rows))
-        #     translated_mask = cv2.warpAffine(mask, M, (cols, rows))
-        #     translated_mask[translated_mask > 0.] = 255
-        #     translated_Img[translated_mask > 0] = mask_thres
-        # else:
-        cv2.setNumThreads(1) # Added to prevent segmentation fault due to cv2.warpAffine
-        translated_Img = cv2.warpAffine(new_img,M,(cols,rows))
+        self.centImgDim = dim
 
-        self.orig_img = translated_Img
-        self.info['center'] = (int(dim / 2), int(dim / 2))
+        self.orig_img = img
+        self.info['center'] = center
         self.center_before_rotation = (int(dim / 2), int(dim / 2))
-        print("Dimension of image after centerize ", self.orig_img.shape)
+        print("Dimension of image after centerize ", (dim, dim))
+
+    def getCenterizedImage(self):
+        """
+        Get the enlarged image from centerizeImage() where image center is at the center of new image
+        :return: centerized image (the image itself if it's not centerized)
+        """
+        if self.centImgTransMat is None:
+            return self.orig_img
+        dim = self.centImgDim
+        img, _, _, _ = rotateTranslatedImage(self.initImg, self.centImgTransMat[:, 2], (dim, dim), self.center_before_rotation, 0)
+        return img
 
     def getRotatedImage(self):
         """
         Get rotated image by angle while image = original input image, and angle = self.info["rotationAngle"]
+        The translation of centerizeImage() and the rotation are done in one warp of the initial image, directly to the
+        size of the folds
         """
-        img = np.array(self.orig_img, dtype="float32")
         center = self.info["center"]
         if self.center_before_rotation is not None:
             center = self.center_before_rotation
         else:
             self.center_before_rotation = center
 
-        b, l = img.shape
-        rotImg, newCenter, self.rotMat = rotateImage(img, center, self.info["rotationAngle"])
+        if self.centImgTransMat is None:
+            img = np.asarray(self.orig_img, dtype=np.float32)
+            translation, shape = (0, 0), img.shape
+        else:
+            img = self.initImg
+            translation, shape = self.centImgTransMat[:, 2], (self.centImgDim, self.centImgDim)
 
-        # Cropping off the surrounding part since we had already expanded the image to maximum possible extent in centerize image
-        bnew, lnew = rotImg.shape
-        db, dl = (bnew - b)//2, (lnew-l)//2
-        final_rotImg = rotImg[db:bnew-db, dl:lnew-dl]
-        self.info["center"] = (newCenter[0]-dl, newCenter[1]-db)
+        # The surrounding part is cropped off since we had already expanded the image to maximum possible extent in centerize image
+        with stageThreads('warp'):
+            final_rotImg, self.info["center"], self.rotMat, (dl, db) = rotateTranslatedImage(img, translation, shape, center, self.info["rotationAngle"])
         self.dl, self.db = dl, db # storing the cropped off section to recalculate coordinates when manual center is given
 
         return final_rotImg
@@ -445,14 +570,15 @@ class QuadrantFolder:
         nBins = 90/theta_size
 
         I2D = []
-        integration_method = IntegrationMethod.select_one_available("csr", dim=1, default="csr", degradable=True)
+        integration_method = getIntegrationMethod(ai, copy_img, 1, (npt_rad,), mask=mask, unit="r_mm", azimuth_range=(180, 181))
         for deg in range(180, 271):
             _, I = ai.integrate1d(copy_img, npt_rad, mask=mask, unit="r_mm", method=integration_method, azimuth_range=(deg, deg+1))
             I2D.append(I)
 
         I2D = np.array(I2D)
 
-        sub_tr = []
+        hulls_x = []
+        hulls_y = []
         for i in range(nBins):
             # loop in each theta range
             subr = []
@@ -482,15 +608,14 @@ class QuadrantFolder:
             subr_hist = subr[rmin:rmax + 1]
             hist_x = list(range(0, len(subr_hist)))
 
-            # Get pchip line from subtraction histogram
+            # Get hull from subtraction histogram
             hull_x, hull_y = getHull(hist_x, subr_hist)
-            y_pchip = np.array(pchip(hull_x, hull_y, hist_x))
-
-            subr_hist = np.concatenate((np.zeros(rmin), y_pchip))
-            subr_hist = np.concatenate((subr_hist, np.zeros(len(subr) - rmax)))
-
-            sub_tr.append(subr_hist)
+            hulls_x.append(hull_x)
+            hulls_y.append(hull_y)
 
+        # Get pchip lines of all bins at once, they share the same radius values
+        pchiplines = pchipBatch(hulls_x, hulls_y, hist_x)
+        sub_tr = np.concatenate((np.zeros((len(pchiplines), rmin)), pchiplines, np.zeros((len(pchiplines), len(subr) - rmax))), axis=1)
 
         # Create Angular background from subtraction lines (pchipline in each bin)
         bg_img = qfu.createAngularBG(copy_img.shape[1], copy_img.shape[0], np.array(sub_tr, dtype=np.float32), nBins)
@@ -568,10 +693,9 @@ class QuadrantFolder:
 
         # self.info['bgimg1'] = result
 
-        fold = copy.copy(self.info["avg_fold"])
+        fold = self.info["avg_fold"]
 
-        img = self.makeFullImage(fold)
-        img = img.astype("float32")
+        img = self.makeFullImage(fold, out=self.getFullImageBuffer(fold))
         width = img.shape[1]
         height = img.shape[0]
 
@@ -599,11 +723,9 @@ class QuadrantFolder:
             pc2=pc2
         )
 
-        background = copy.copy(background)
         background[np.isnan(background)] = 0.
-        background = np.array(background, 'float32')
         background = background.reshape((height, width))
-        background = background[:fold.shape[0], :fold.shape[1]]
+        background = background[:fold.shape[0], :fold.shape[1]].astype(np.float32)
         result = np.array(fold - background, dtype=np.float32)
         result = qfu.replaceRmin(result, int(rmin), 0.)
         self.info['bgimg1'] = result
@@ -695,18 +817,17 @@ class QuadrantFolder:
 
         #--------------------------------NEW ROVING WINDOW BG SUB--------------------------------
 
-        fold = np.copy(self.info["avg_fold"])
+        fold = self.info["avg_fold"]
         
-        img = self.makeFullImage(fold)
+        img = self.makeFullImage(fold, out=self.getFullImageBuffer(fold))
         center = self.info["center"]
 
         if "roi_rad" in self.info: # if roi_rad is specified, use it
             roi_rad = int(self.info["roi_rad"])
             center_x = int(center[0])
             center_y = int(center[1])
-            img = img[center_y - roi_rad:center_y + roi_rad, center_x - roi_rad:center_x + roi_rad]
+            img = np.ascontiguousarray(img[center_y - roi_rad:center_y + roi_rad, center_x - roi_rad:center_x + roi_rad])
 
-        img = img.astype("float32")
         width = img.shape[1]
         height = img.shape[0]
        
@@ -742,9 +863,9 @@ class QuadrantFolder:
             edge_background=edge_background,
         )
 
-        background = copy.copy(result)
+        # the smoothing is done in place, so result is the (float32) full image buffer
+        background = result
         background[np.isnan(background)] = 0.0
-        background = np.array(background, "float32")
         background = background.reshape((height, width))
         # replacing values that fall outside the roi_rad with the original values fromthe image
         print("background shape before padding", background.shape)
@@ -828,10 +949,10 @@ class QuadrantFolder:
 
         #---------------------NEW VERSION OF ROVING WINDOW BACKGROUND SUBTRACTION---------------------#
 
-        fold = copy.copy(self.info["avg_fold"])
+        fold = self.info["avg_fold"]
         # center = [fold.shape[1] + .5, fold.shape[0] + .5]
 
-        img = self.makeFullImage(fold)
+        img = self.makeFullImage(fold, out=self.getFullImageBuffer(fold))
         center = self.info["center"]
 
         if "roi_rad" in self.info: # if roi_rad is specified, use it
@@ -843,8 +964,7 @@ class QuadrantFolder:
 
         width = img.shape[1]
         height = img.shape[0]
-        img = np.ravel(img)
-        buf = np.array(img, "f")
+        buf = np.ravel(img)
         iwid = self.info["win_size_x"]
         jwid = self.info["win_size_y"]
         isep = self.info["win_sep_x"]
@@ -857,17 +977,11 @@ class QuadrantFolder:
         maxdim = width * height
         maxwin = (iwid * 2 + 1) * (jwid * 2 + 1)
 
-        # Prepare additional parameters for replicate_bgwsrt2
-        xb = np.zeros(maxdim, dtype='f')
-        yb = np.zeros(maxdim, dtype='f')
-        ys = np.zeros(maxdim, dtype='f')  # Check if needed
-        ysp = np.zeros(maxdim, dtype='f') # Check if needed
-        wrk = np.zeros(9 * maxdim, dtype='f')  # Workspace array
-        bw = np.zeros(maxwin, dtype='f')  # Background window array
-        index_bn = np.zeros(maxwin, dtype='int')  # Check if needed
-        b = np.zeros(maxdim, dtype='f')  # Background array
+        # Background array (fully overwritten by replicate_bgwsrt2)
+        # The work arrays xb, yb, ys, ysp, wrk, bw and index of the fortran version are not used by replicate_bgwsrt2
+        b = getScratchArena().get('qf_roving_bg', (maxdim,), np.float32)
         # Call the replicate_bgwsrt2 function
-        b = replicate_bgwsrt2(buf, b, iwid, jwid, isep, jsep, smoo, tension, pc1, pc2, width, height, maxdim, maxwin, xb, yb, ys, ysp, wrk, bw, index_bn, 0, 6)
+        b = replicate_bgwsrt2(buf, b, iwid, jwid, isep, jsep, smoo, tension, pc1, pc2, width, height, maxdim, maxwin, None, None, None, None, None, None, None, 0, 6)
         b= b.reshape((height, width))
       
         if "roi_rad" in self.info:
@@ -929,15 +1043,16 @@ class QuadrantFolder:
         # Subtract original average fold by background
         self.info['bgimg1'] = result
 
-    def getFirstPeak(self, hist):
+    def getFirstPeak(self, hist, scale=1):
         """
         Find the first peak using the histogram.
         Start from index 5 and go to the right until slope is less than -10
         :param hist: histogram
+        :param scale: downsampling factor of the histogram (pyramid level), the peak is given in native pixels
         """
-        for i in range(5, int(len(hist)/2)):
-            if hist[i] - hist[i-1] < -10:
-                return i
+        for i in range(max(1, int(round(5 / scale))), int(len(hist)/2)):
+            if hist[i] - hist[i-1] < -10 * scale:
+                return i * scale
         return 20
 
     def getRminmax(self):
@@ -946,37 +1061,37 @@ class QuadrantFolder:
         """
         self.parent.statusPrint("Finding Rmin and Rmax...")
         print("R-min and R-max is being calculated...")
+        self.stages.run(self.getStageStores(), 'rminmax', self.calculateRminmax)
+        print("Done. R-min is "+str(self.info['rmin']) + " and R-max is " + str(self.info['rmax']))
 
+    def calculateRminmax(self):
+        """
+        Set R-min and R-max from the fixed values, or from the first peak of the azimuthal integration of the average fold
+        """
         if 'fixed_rmin' in self.info and 'fixed_rmax' in self.info:
-            if 'rmin' in self.info and 'rmax' in self.info:
-                if self.info['rmin'] == self.info['fixed_rmin'] and self.info['rmax'] == self.info['fixed_rmax']:
-                    return
             self.info['rmin'] = self.info['fixed_rmin']
             self.info['rmax'] = self.info['fixed_rmax']
-        elif 'rmin' in self.info and 'rmax' in self.info:
-            return
         else:
-            copy_img = copy.copy(self.info['avg_fold'])
+            avg_fold = self.info['avg_fold']
+            copy_img, scale = self.getPyramidImage('avg_fold', avg_fold)
+            copy_img = copy.copy(copy_img)
             center = [copy_img.shape[1] - 1, copy_img.shape[0] - 1]
             npt_rad = int(distance(center, (0, 0)))
 
             # Get 1D azimuthal integration histogram
-            if 'detector' in self.info:
-                det = find_detector(copy_img, man_det=self.info['detector'])
+            man_det = self.info['detector'] if 'detector' in self.info else None
+            if scale > 1:
+                det = resolveBinnedDetector(avg_fold.shape, scale, man_det=man_det)
             else:
-                det = find_detector(copy_img)
+                det = find_detector(copy_img, man_det=man_det)
 
             ai = AzimuthalIntegrator(detector=det)
             ai.setFit2D(100, center[0], center[1])
-            integration_method = IntegrationMethod.select_one_available("csr", dim=1, default="csr", degradable=True)
+            integration_method = getIntegrationMethod(ai, copy_img, 1, (npt_rad,), unit="r_mm", azimuth_range=(180, 270))
             _, totalI = ai.integrate1d(copy_img, npt_rad, unit="r_mm", method=integration_method, azimuth_range=(180, 270))
 
-            self.info['rmin'] = int(round(self.getFirstPeak(totalI) * 1.5))
-            self.info['rmax'] = int(round((min(copy_img.shape[0], copy_img.shape[1]) - 1) * .8))
-
-        self.deleteFromDict(self.info, 'bgimg1') # remove "bgimg1" from info to make it reprocess
-        self.deleteFromDict(self.info, 'bgimg2') # remove "bgimg2" from info to make it reprocess
-        print("Done. R-min is "+str(self.info['rmin']) + " and R-max is " + str(self.info['rmax']))
+            self.info['rmin'] = int(round(self.getFirstPeak(totalI, scale) * 1.5))
+            self.info['rmax'] = int(round((min(avg_fold.shape[0], avg_fold.shape[1]) - 1) * .8))
 
     def apply2DConvexhull(self): # Deprecated, removed from MuscleX
         """
@@ -989,14 +1104,15 @@ class QuadrantFolder:
         center = [copy_img.shape[1] - 1, copy_img.shape[0] - 1]
 
         hist_x = list(np.arange(rmin, rmax + 1))
-        pchiplines = []
+        hulls_x = []
+        hulls_y = []
 
         det = "agilent_titan"
         npt_rad = int(distance(center, (0, 0)))
         ai = AzimuthalIntegrator(detector=det)
         ai.setFit2D(100, center[0], center[1])
 
-        integration_method = IntegrationMethod.select_one_available("csr", dim=1, default="csr", degradable=True)
+        integration_method = getIntegrationMethod(ai, copy_img, 1, (npt_rad,), unit="r_mm", azimuth_range=(180, 180.5))
         for deg in np.arange(180, 271, 1):
             if deg == 180 :
                 _, I = ai.integrate1d(copy_img, npt_rad, unit="r_mm", method=integration_method, azimuth_range=(180, 180.5))
@@ -1010,8 +1126,11 @@ class QuadrantFolder:
             #hist_y = list(I[hist_x])
 
             hull_x, hull_y = getHull(hist_x, hist_y)
-            y_pchip = pchip(hull_x, hull_y, hist_x)
-            pchiplines.append(y_pchip)
+            hulls_x.append(hull_x)
+            hulls_y.append(hull_y)
+
+        # Get pchip lines of all angles at once, they share the same radius values
+        pchiplines = pchipBatch(hulls_x, hulls_y, hist_x)
 
         # Smooth each histogram by radius
         pchiplines = np.array(pchiplines, dtype="float32")
@@ -1036,11 +1155,19 @@ class QuadrantFolder:
         Calculate an average fold for 1-4 quadrants. Quadrants are splitted by center and rotation
         """
         self.parent.statusPrint("Calculating Avg Fold...")
-        if 'avg_fold' not in self.info.keys():
-            self.deleteFromDict(self.info, 'rmin')
-            self.deleteFromDict(self.info, 'rmax')
-            # self.imgResultForDisplay = None
-            rotate_img = copy.copy(self.getRotatedImage())
+        self.stages.run(self.getStageStores(), 'avg_fold', self.foldImage)
+
+    def foldImage(self):
+        """
+        Average the quadrants in self.info['avg_fold'], or keep the centerized image if the image is not folded
+        """
+        if self.info.get('fold_image', True) == False:
+            self.info['avg_fold'] = self.getCenterizedImage()
+            if self.centImgTransMat is not None:
+                self.info['center'] = self.center_before_rotation
+            self.info['folded'] = False
+        else:
+            rotate_img = self.getRotatedImage()
             center = self.info['center']
             center_x = int(center[0])
             center_y = int(center[1])
@@ -1051,29 +1178,26 @@ class QuadrantFolder:
             fold_width = max(int(center[0]), img_width-int(center[0])) # max(max(int(center[0]), img_width-int(center[0])), max(int(center[1]), img_height-int(center[1])))
             fold_height = max(int(center[1]), img_height-int(center[1])) # fold_width
 
-            # Get each fold, and flip them to the same direction
+            # Get each fold as a view of the rotated image, flipped to the same direction (no copy)
             top_left = rotate_img[max(center_y-fold_height,0):center_y, max(center_x-fold_width,0):center_x]
-            top_right = rotate_img[max(center_y-fold_height,0):center_y, center_x:center_x+fold_width]
-            top_right = cv2.flip(top_right,1)
-            buttom_left = rotate_img[center_y:center_y+fold_height, max(center_x-fold_width,0):center_x]
-            buttom_left = cv2.flip(buttom_left,0)
-            buttom_right = rotate_img[center_y:center_y+fold_height, center_x:center_x+fold_width]
-            buttom_right = cv2.flip(buttom_right,1)
-            buttom_right = cv2.flip(buttom_right,0)
-
-            # Add all folds which are not ignored
-            quadrants = np.ones((4, fold_height, fold_width), rotate_img.dtype) * (self.info['mask_thres'] - 1.)
-            for i, quad in enumerate([top_left, top_right, buttom_left, buttom_right]):
-                quadrants[i][-quad.shape[0]:, -quad.shape[1]:] = quad
-            remained = np.ones(4, dtype=bool)
-            remained[list(self.info["ignore_folds"])] = False
-            quadrants = quadrants[remained]
+            top_right = rotate_img[max(center_y-fold_height,0):center_y, center_x:center_x+fold_width][:, ::-1]
+            buttom_left = rotate_img[center_y:center_y+fold_height, max(center_x-fold_width,0):center_x][::-1, :]
+            buttom_right = rotate_img[center_y:center_y+fold_height, center_x:center_x+fold_width][::-1, ::-1]
+
+            # Write all folds which are not ignored in one float32 stack, reused from one image to the next
+            remained = [i for i in range(4) if i not in self.info["ignore_folds"]]
+            quadrants = getScratchArena().get('qf_quadrants', (len(remained), fold_height, fold_width), np.float32)
+            folds = [top_left, top_right, buttom_left, buttom_right]
+            for n, i in enumerate(remained):
+                quad = folds[i]
+                if quad.shape != (fold_height, fold_width):
+                    # the part of the fold outside of the image is ignored while averaging
+                    quadrants[n].fill(self.info['mask_thres'] - 1.)
+                if quad.size > 0:
+                    quadrants[n][-quad.shape[0]:, -quad.shape[1]:] = quad
 
             # Get average fold from all folds
             self.get_avg_fold(quadrants,fold_height,fold_width)
-            if 'resultImg' in self.imgCache:
-                del self.imgCache['resultImg']
-            
 
             print("Done.")
 
@@ -1090,7 +1214,7 @@ class QuadrantFolder:
         if len(self.info["ignore_folds"]) < 4:
             # if self.info['pixel_folding']:
             # average fold by pixel to pixel by cython
-            result = qfu.get_avg_fold_float32(np.array(quadrants, dtype="float32"), len(quadrants), fold_height, fold_width,
+            result = qfu.get_avg_fold_float32(np.ascontiguousarray(quadrants, dtype=np.float32), len(quadrants), fold_height, fold_width,
                                                 self.info['mask_thres'])
             # else:
             #     result = np.mean( np.array(quadrants), axis=0 )
@@ -1106,11 +1230,22 @@ class QuadrantFolder:
         """
         self.parent.statusPrint("Applying Background Subtraction...")
         print("Background Subtraction is being processed...")
-        method = self.info["bgsub"]
 
         # Produce bgimg1
-        if "bgimg1" not in self.info:
-            avg_fold = np.array(self.info['avg_fold'], dtype="float32")
+        self.stages.run(self.getStageStores(), 'bgimg1', self.produceBgimg1)
+
+        # Produce bgimg2
+        self.stages.run(self.getStageStores(), 'bgimg2', self.produceBgimg2)
+
+        print("Done.")
+
+    def produceBgimg1(self):
+        """
+        Apply the selected background subtraction method to the average fold, the result is kept in self.info['bgimg1']
+        """
+        method = self.info["bgsub"]
+        avg_fold = self.info['avg_fold'].astype(np.float32)
+        with stageThreads('bgsub'):
             if method == 'None':
                 self.info["bgimg1"] = avg_fold # if method is None, original average fold will be used
             elif method == '2D Convexhull': # option has been commented out in the gui
@@ -1128,18 +1263,16 @@ class QuadrantFolder:
                 self.applySmoothedBGSub('boxcar')
             else:
                 self.info["bgimg1"] = avg_fold
-            self.deleteFromDict(self.imgCache, "BgSubFold")
-
-        # Produce bgimg2
-        if "bgimg2" not in self.info:
-            avg_fold = np.array(self.info['avg_fold'], dtype="float32")
-            if method == 'None':
-                self.info["bgimg2"] = avg_fold # if method is 'None', original average fold will be used
-            else:
-                self.info["bgimg2"] = white_tophat(avg_fold, disk(self.info["tophat2"]))
-            self.deleteFromDict(self.imgCache, "BgSubFold")
 
-        print("Done.")
+    def produceBgimg2(self):
+        """
+        Apply white top hat to the average fold for the part outside of the merge radius, the result is kept in self.info['bgimg2']
+        """
+        avg_fold = self.info['avg_fold'].astype(np.float32)
+        if self.info["bgsub"] == 'None':
+            self.info["bgimg2"] = avg_fold # if method is 'None', original average fold will be used
+        else:
+            self.info["bgimg2"] = white_tophat(avg_fold, disk(self.info["tophat2"]))
 
     def mergeImages(self):
         """
@@ -1150,18 +1283,21 @@ class QuadrantFolder:
         self.parent.statusPrint("Merging Images...")
         print("Merging images...")
 
-        if "BgSubFold" not in self.imgCache:
-            img1 = np.array(self.info["bgimg1"], dtype="float32")
-            img2 = np.array(self.info["bgimg2"], dtype="float32")
-            sigmoid = self.info["sigmoid"]
-            center = [img1.shape[1]-1, img1.shape[0]-1]
-            rad = self.info["rmax"] - 10
+        self.stages.run(self.getStageStores(), 'BgSubFold', self.mergeBgimgs)
+        print("Done.")
 
-            # Merge 2 images at merge radius using sigmoid as merge gradient
-            self.imgCache['BgSubFold'] = qfu.combine_bgsub_float32(img1, img2, center[0], center[1], sigmoid, rad)
-            self.deleteFromDict(self.imgCache, "resultImg")
+    def mergeBgimgs(self):
+        """
+        Merge bgimg1 and bgimg2 in self.imgCache['BgSubFold']
+        """
+        img1 = np.asarray(self.info["bgimg1"], dtype=np.float32)
+        img2 = np.asarray(self.info["bgimg2"], dtype=np.float32)
+        sigmoid = self.info["sigmoid"]
+        center = [img1.shape[1]-1, img1.shape[0]-1]
+        rad = self.info["rmax"] - 10
 
-        print("Done.")
+        # Merge 2 images at merge radius using sigmoid as merge gradient
+        self.imgCache['BgSubFold'] = qfu.combine_bgsub_float32(img1, img2, center[0], center[1], sigmoid, rad)
 
     def generateResultImage(self):
         """
@@ -1170,7 +1306,14 @@ class QuadrantFolder:
         """
         self.parent.statusPrint("Generating Resultant Image...")
         print("Generating result image from average fold...")
-        result = self.makeFullImage(copy.copy(self.imgCache['BgSubFold']))
+        self.stages.run(self.getStageStores(), 'resultImg', self.makeResultImage)
+        print("Done.")
+
+    def makeResultImage(self):
+        """
+        Put 4 self.info["BgSubFold"] together in self.imgCache['resultImg'], rotated and cropped to the region of interest
+        """
+        result = self.makeFullImage(self.imgCache['BgSubFold'])
         if 'rotate' in self.info and self.info['rotate']:
             result = np.rot90(result)
         result[np.isnan(result)] = 0.
@@ -1179,24 +1322,25 @@ class QuadrantFolder:
             rad = self.info['roi_rad']
             result = result[max(int(center[1]-rad), 0):min(int(center[1]+rad), result.shape[1]), max(int(center[0]-rad), 0):min(int(center[0]+rad), result.shape[0])]
         self.imgCache['resultImg'] = result
-        print("Done.")
 
-    def makeFullImage(self, fold):
+    def makeFullImage(self, fold, out=None):
         """
         Flip + rotate 4 folds and combine them to 1 image
         :param fold:
+        :param out: buffer of shape (2*fold height, 2*fold width) to write the image to (optional, a new float64 image by default)
         :return: result image
         """
         fold_height = fold.shape[0]
         fold_width = fold.shape[1]
 
+        # flipped folds are views of the fold (negative strides), written directly in the result image
         top_left = fold
-        top_right = cv2.flip(fold, 1)
+        top_right = fold[:, ::-1]
 
-        buttom_left = cv2.flip(fold, 0)
-        buttom_right = cv2.flip(buttom_left, 1)
+        buttom_left = fold[::-1, :]
+        buttom_right = fold[::-1, ::-1]
 
-        resultImg = np.zeros((fold_height * 2, fold_width * 2))
+        resultImg = np.zeros((fold_height * 2, fold_width * 2)) if out is None else out
         resultImg[0:fold_height, 0:fold_width] = top_left
         resultImg[0:fold_height, fold_width:fold_width * 2] = top_right
         resultImg[fold_height:fold_height * 2, 0:fold_width] = buttom_left
@@ -1204,6 +1348,15 @@ class QuadrantFolder:
 
         return resultImg
 
+    def getFullImageBuffer(self, fold):
+        """
+        Get the float32 scratch buffer of the full image built from the fold by the background subtraction methods.
+        The buffer is reused for every image processed by the same worker, so it should never be stored in self.info
+        :param fold: fold
+        :return: scratch buffer (content is undefined)
+        """
+        return getScratchArena().get('qf_full_image', (fold.shape[0] * 2, fold.shape[1] * 2), np.float32)
+
     def statusPrint(self, text):
         """
         Print the text in the window or in the terminal depending on if we are using GUI or headless.
@@ -0,0 +1,287 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import copy
+import html
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import cv2
+from PIL import Image
+from scipy.ndimage import laplace
+try:
+    from .QuadrantFolder import QuadrantFolder, getDefaultFlags, getQuadrantFoldingStages, getBgimg1Params, getBgimg2Params
+    from ..utils.file_manager import fullPath, createFolder
+    from ..utils.execution_resources import getWorkerCount, workerThreads, initWorkerThread
+except: # for coverage
+    from modules.QuadrantFolder import QuadrantFolder, getDefaultFlags, getQuadrantFoldingStages, getBgimg1Params, getBgimg2Params
+    from utils.file_manager import fullPath, createFolder
+    from utils.execution_resources import getWorkerCount, workerThreads, initWorkerThread
+
+# Settings which can be swept, they only change the stages after R-min and R-max
+SWEEP_PARAMS = ['bgsub', 'cirmin', 'cirmax', 'bin_theta', 'radial_bin', 'smooth', 'tension', 'tophat1', 'tophat2',
+                'win_size_x', 'win_size_y', 'win_sep_x', 'win_sep_y', 'fwhm', 'boxcar_x', 'boxcar_y', 'cycles', 'sigmoid']
+THUMBNAIL_SIZE = 256
+
+def expandGrid(grid):
+    """
+    Give the points of a parameter grid
+    :param grid: dict setting name -> list of values (all combinations are used), or list of such dicts
+    (e.g. one grid per background subtraction method)
+    :return: list of dict setting name -> value
+    """
+    grids = grid if isinstance(grid, list) else [grid]
+    points = []
+    for g in grids:
+        for key in g:
+            if key not in SWEEP_PARAMS:
+                raise ValueError("Setting " + str(key) + " can not be swept, the settings of the background subtraction are " + ", ".join(SWEEP_PARAMS))
+        keys = list(g.keys())
+        values = [v if isinstance(v, list) else [v] for v in g.values()]
+        for combination in itertools.product(*values):
+            points.append(dict(zip(keys, combination)))
+    return points
+
+def getEffectiveParams(info):
+    """
+    Give the settings which change the result of the background subtraction for an info dict
+    (the settings of the other methods are not used)
+    :param info: info dict with the settings of a grid point
+    :return: dict setting name -> value
+    """
+    keys = getBgimg1Params(info) + getBgimg2Params(info) + ['sigmoid']
+    return {k: info[k] for k in SWEEP_PARAMS if k in keys and k in info}
+
+def getResidualMetrics(avg_fold, result, rmin, rmax, mask_thres):
+    """
+    Measure the background subtraction of a fold between R-min and R-max
+    - negative_fraction : fraction of the pixels below 0 after the subtraction (over-subtraction)
+    - background_fraction : part of the intensity removed as background
+    - background_roughness : mean absolute laplacian of the background relative to its mean, high if the background follows the peaks
+    :param avg_fold: average fold
+    :param result: background subtracted fold
+    :param rmin, rmax: R-min and R-max
+    :param mask_thres: mask threshold, the pixels below it are not used
+    :return: dict metric name -> value
+    """
+    avg_fold = np.asarray(avg_fold, dtype=np.float64)
+    result = np.asarray(result, dtype=np.float64)
+    h, w = avg_fold.shape
+    y, x = np.ogrid[:h, :w]
+    r = np.sqrt((x - (w - 1)) ** 2 + (y - (h - 1)) ** 2)
+    region = (r >= rmin) & (r <= rmax) & (avg_fold >= mask_thres) & np.isfinite(result)
+    if not np.any(region):
+        return {'negative_fraction': np.nan, 'background_fraction': np.nan, 'background_roughness': np.nan}
+    background = avg_fold - result
+    total = np.sum(avg_fold[region])
+    meanBackground = np.mean(np.abs(background[region]))
+    roughness = np.abs(laplace(np.where(region, background, 0.)))
+    return {
+        'negative_fraction': float(np.mean(result[region] < 0)),
+        'background_fraction': float(np.sum(background[region]) / total) if total != 0 else np.nan,
+        'background_roughness': float(np.mean(roughness[region]) / meanBackground) if meanBackground > 0 else np.nan
+    }
+
+def writeThumbnail(path, img, size=THUMBNAIL_SIZE):
+    """
+    Save a small log-scaled png of an image
+    :param path: path of the png file
+    :param img: image
+    :param size: maximum width and height
+    :return: -
+    """
+    img = np.log1p(np.clip(np.nan_to_num(np.asarray(img, dtype=np.float32)), 0, None))
+    scale = size / max(img.shape)
+    if scale < 1:
+        img = cv2.resize(img, (max(1, int(img.shape[1] * scale)), max(1, int(img.shape[0] * scale))), interpolation=cv2.INTER_AREA)
+    top = np.percentile(img, 99.9) if img.size > 0 else 0
+    img = np.clip(img / top * 255, 0, 255) if top > 0 else np.zeros_like(img)
+    Image.fromarray(img.astype(np.uint8)).save(path)
+
+class QuadrantFoldingSweep:
+    """
+    Parameter sweep of the background subtraction of Quadrant Folding. For each image, the stages before the background
+    subtraction (center, rotation angle, average fold, R-min and R-max) are run once, then the background subtraction
+    of all the points of the grid is done in parallel threads from the same average fold, which share the threads of the
+    process. The points giving the same bgimg1 share it, and the settings not used by a method are ignored (the points
+    differing only by them are merged).
+    The comparison is saved in the folder qf_sweep : sweep_report.csv (metrics of each image and point),
+    sweep_summary.csv (mean metrics of each point), report.html and the thumbnails of the results.
+    """
+    def __init__(self, dir_path, imgList, grid, settings=None, nWorkers=None):
+        """
+        :param dir_path: directory of the images
+        :param imgList: names of the images
+        :param grid: parameter grid (see expandGrid)
+        :param settings: settings used for all points (as in the headless setting file), None for the default settings
+        :param nWorkers: number of threads evaluating the points
+        """
+        self.dir_path = dir_path
+        self.imgList = imgList
+        self.settings = settings if settings is not None else {}
+        self.points = expandGrid(grid)
+        self.nWorkers = getWorkerCount(nWorkers)
+        self.sweep_path = fullPath(dir_path, 'qf_sweep')
+        self.rows = []
+
+    def getFlags(self, quadFold):
+        """
+        Give the flags of the stages shared by the points
+        """
+        flags = {'orientation_model': 0, 'ignore_folds': set(), 'fold_image': True}
+        flags.update(getDefaultFlags(quadFold.orig_img))
+        flags.update(self.settings)
+        flags.pop('center', None)
+        flags['no_cache'] = True
+        return flags
+
+    def prepareImage(self, filename):
+        """
+        Run the stages shared by all points for an image
+        :param filename: name of the image
+        :return: QuadrantFolder object
+        """
+        quadFold = QuadrantFolder(self.dir_path, filename, None)
+        quadFold.info = {}
+        if 'center' in self.settings:
+            quadFold.info['calib_center'] = self.settings['center']
+        quadFold.processFold(self.getFlags(quadFold))
+        return quadFold
+
+    def getVariant(self, quadFold, params):
+        """
+        Give a copy of a QuadrantFolder object sharing its results (they are not modified), with other settings
+        :param quadFold: QuadrantFolder object
+        :param params: settings of the copy
+        :return: QuadrantFolder object
+        """
+        variant = copy.copy(quadFold)
+        variant.info = dict(quadFold.info)
+        variant.info['stage_params'] = copy.deepcopy(quadFold.info.get('stage_params', {}))
+        variant.info.update(params)
+        variant.imgCache = {}
+        variant.stages = getQuadrantFoldingStages()
+        return variant
+
+    def runBackground(self, variant):
+        """
+        Run the background subtraction stages of a variant
+        :return: variant
+        """
+        variant.applyBackgroundSubtraction()
+        variant.mergeImages()
+        variant.generateResultImage()
+        return variant
+
+    def sweepImage(self, filename):
+        """
+        Evaluate all the points of the grid on an image
+        :param filename: name of the image
+        :return: -
+        """
+        print("Sweeping the background subtraction of " + filename + "...")
+        quadFold = self.prepareImage(filename)
+        points, bgimg1Groups = {}, {}
+        for point in self.points:
+            info = dict(quadFold.info)
+            info.update(point)
+            params = getEffectiveParams(info)
+            key = repr(sorted(params.items()))
+            if key not in points:
+                points[key] = params
+                bgimg1Key = repr([(k, info.get(k)) for k in getBgimg1Params(info)])
+                bgimg1Groups.setdefault(bgimg1Key, []).append(key)
+
+        with workerThreads(self.nWorkers), ThreadPoolExecutor(max_workers=self.nWorkers, initializer=initWorkerThread) as executor:
+            # bgimg1 once for each group of points sharing it, then the other stages of each point from its group
+            groups = {g: executor.submit(self.runBackground, self.getVariant(quadFold, points[keys[0]])) for g, keys in bgimg1Groups.items()}
+            futures = {}
+            for g, keys in bgimg1Groups.items():
+                base = groups[g].result()
+                futures[keys[0]] = groups[g]
+                for key in keys[1:]:
+                    futures[key] = executor.submit(self.runBackground, self.getVariant(base, points[key]))
+            variants = {key: f.result() for key, f in futures.items()}
+
+        name = os.path.splitext(filename)[0]
+        createFolder(fullPath(self.sweep_path, 'thumbnails'))
+        for n, key in enumerate(points):
+            variant = variants[key]
+            metrics = getResidualMetrics(variant.info['avg_fold'], variant.imgCache['BgSubFold'], variant.info['rmin'],
+                                         variant.info['rmax'], variant.info['mask_thres'])
+            thumbnail = os.path.join('thumbnails', name + '_' + str(n) + '.png')
+            writeThumbnail(fullPath(self.sweep_path, thumbnail), variant.imgCache['resultImg'])
+            row = {'Image': filename, 'Point': n, 'Settings': ', '.join(k + '=' + str(v) for k, v in points[key].items())}
+            row.update(metrics)
+            row['Thumbnail'] = thumbnail
+            self.rows.append(row)
+        print("Done. " + str(len(points)) + " settings evaluated (" + str(len(bgimg1Groups)) + " background images)")
+
+    def run(self):
+        """
+        Sweep all the images and write the report
+        :return: report (DataFrame)
+        """
+        createFolder(self.sweep_path)
+        for filename in self.imgList:
+            self.sweepImage(filename)
+        return self.writeReport()
+
+    def writeReport(self):
+        """
+        Write sweep_report.csv, sweep_summary.csv and report.html in the folder qf_sweep
+        :return: report (DataFrame)
+        """
+        report = pd.DataFrame(self.rows)
+        if len(report) == 0:
+            return report
+        report.to_csv(fullPath(self.sweep_path, 'sweep_report.csv'), index=False)
+        metrics = ['negative_fraction', 'background_fraction', 'background_roughness']
+        summary = report.groupby('Settings', sort=False)[metrics].mean().sort_values('negative_fraction')
+        summary.to_csv(fullPath(self.sweep_path, 'sweep_summary.csv'))
+
+        lines = ['<html><head><meta charset="utf-8"><title>Quadrant Folding background subtraction sweep</title>',
+                 '<style>table{border-collapse:collapse}td,th{border:1px solid #999;padding:4px;font:12px sans-serif}</style>',
+                 '</head><body><h3>Mean metrics of the settings (' + str(len(self.imgList)) + ' images)</h3><table><tr><th>Settings</th>']
+        lines += ['<th>' + m + '</th>' for m in metrics] + ['</tr>']
+        for settings, values in summary.iterrows():
+            lines.append('<tr><td>' + html.escape(settings) + '</td>' + ''.join('<td>%.4g</td>' % values[m] for m in metrics) + '</tr>')
+        lines.append('</table>')
+        for filename, rows in report.groupby('Image', sort=False):
+            lines.append('<h3>' + html.escape(filename) + '</h3><table><tr>')
+            for _, row in rows.iterrows():
+                lines.append('<td><img src="' + html.escape(row['Thumbnail']) + '"><br>' + html.escape(row['Settings']) + '<br>' +
+                             ', '.join(m + ' %.3g' % row[m] for m in metrics) + '</td>')
+            lines.append('</tr></table>')
+        lines.append('</body></html>')
+        with open(fullPath(self.sweep_path, 'report.html'), 'w') as f:
+            f.write('\n'.join(lines))
+        print("Sweep report saved in " + self.sweep_path)
+        return report
@@ -31,9 +31,11 @@ import numpy as np
 try:
     from ..utils.file_manager import fullPath, ifHdfReadConvertless
     from ..utils.image_processor import *
+    from ..utils.image_prefetcher import readImageData
 except: # for coverage
     from utils.file_manager import fullPath, ifHdfReadConvertless
     from utils.image_processor import *
+    from utils.image_prefetcher import readImageData
 
 class XRayViewer:
     """
@@ -50,7 +52,7 @@ class XRayViewer:
             index = next((i for i, item in enumerate(file_list[0]) if item == img_name), 0)
             self.orig_img = file_list[1][index]
         else:
-            self.orig_img = fabio.open(fullPath(img_path, img_name)).data
+            self.orig_img = readImageData(fullPath(img_path, img_name))
         self.orig_img = ifHdfReadConvertless(img_name, self.orig_img)
         self.orig_img = self.orig_img.astype("float32")
         self.orig_image_center = None
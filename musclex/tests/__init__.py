@@ -25,3 +25,14 @@ of Technology shall not be used in advertising or otherwise to promote
 the sale, use or other dealings in this Software without prior written
 authorization from Illinois Institute of Technology.
 """
+
+import os
+import atexit
+import shutil
+import tempfile
+
+# the integration profile of the tests is not kept in the cache folder of the user
+if 'MUSCLEX_INTEGRATION_PROFILE' not in os.environ:
+    _profileDir = tempfile.mkdtemp(prefix='musclex_test_')
+    os.environ['MUSCLEX_INTEGRATION_PROFILE'] = os.path.join(_profileDir, 'integration_profile.json')
+    atexit.register(shutil.rmtree, _profileDir, True)
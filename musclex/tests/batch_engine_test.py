@@ -0,0 +1,95 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+import fabio
+from ..ui.batch_engine import BatchEngine
+from ..headless.batch_worker import writeBatchSettings, processBatchImage
+from ..utils.result_writer import getResultWriter
+
+class BatchEngineTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        cls.imgList = ['P40_1_3_00000.tif', 'P40_1_3_00001.tif', 'P40_1_3_00002.tif']
+        cls.settings = {'bgsub' : 'White-top-hats', 'tophat1' : 5, 'tophat2' : 20, 'sigmoid' : 0.0,
+                        'orientation_model' : 0, 'mask_thres' : -1.0}
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def makeFolder(self, name):
+        folder = os.path.join(self.tmpdir, name)
+        os.makedirs(folder)
+        for img in self.imgList:
+            shutil.copy(os.path.join(self.inpath, img), folder)
+        return folder
+
+    def testSameResultsAsHeadless(self):
+        # processed one image after the other in this process, as `musclex qf -h`
+        serial = self.makeFolder('serial')
+        settingspath = os.path.join(self.tmpdir, 'settings.json')
+        writeBatchSettings(self.settings, settingspath)
+        for i in range(len(self.imgList)):
+            processBatchImage('qf', serial, self.imgList, i, None, '.tif', settingspath, True)
+        getResultWriter().flush()
+
+        batch = self.makeFolder('batch')
+        engine = BatchEngine('qf', batch, self.imgList, None, '.tif', settings=self.settings, delcache=True, nProcesses=2, refreshEvery=2)
+        progress, refreshed, finished = [], [], []
+        engine.progress.connect(lambda done, total: progress.append((done, total)))
+        engine.refreshRequested.connect(refreshed.append)
+        engine.batchFinished.connect(finished.append)
+        engine.run()
+
+        self.assertEqual(progress[-1], (3, 3))
+        self.assertEqual(len(refreshed), 1)
+        self.assertEqual(finished, [True])
+        results = sorted(f for f in os.listdir(os.path.join(serial, 'qf_results')) if f.endswith('.tif'))
+        self.assertEqual(len(results), 3)
+        self.assertEqual(sorted(f for f in os.listdir(os.path.join(batch, 'qf_results')) if f.endswith('.tif')), results)
+        for name in results:
+            np.testing.assert_array_equal(fabio.open(os.path.join(batch, 'qf_results', name)).data,
+                                          fabio.open(os.path.join(serial, 'qf_results', name)).data)
+        # the csv files written by all the workers keep the rows of every image
+        for csv, key in ((os.path.join('qf_results', 'summary.csv'), 'Filename'), (os.path.join('qf_results', 'bg', 'background_sum.csv'), 'Name')):
+            expected = pd.read_csv(os.path.join(serial, csv)).set_index(key).sort_index()
+            result = pd.read_csv(os.path.join(batch, csv)).set_index(key).sort_index()
+            self.assertEqual(sorted(result.index), sorted(self.imgList))
+            pd.testing.assert_frame_equal(result, expected)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
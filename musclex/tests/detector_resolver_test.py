@@ -0,0 +1,71 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import unittest
+from pyFAI.detectors import Detector
+from ..utils.detector_resolver import DetectorResolver, DEFAULT_DETECTOR
+
+def scanRegistry(shape, man_det=None):
+    """
+    Detector name found by the registry scan find_detector used before the resolver
+    """
+    if man_det is None:
+        for name in Detector.registry:
+            if hasattr(Detector.registry[name], 'MAX_SHAPE') and Detector.registry[name].MAX_SHAPE == shape:
+                return name
+    elif man_det in Detector.registry and hasattr(Detector.registry[man_det], 'MAX_SHAPE') and Detector.registry[man_det].MAX_SHAPE == shape:
+        return man_det
+    return DEFAULT_DETECTOR
+
+class DetectorResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.resolver = DetectorResolver()
+        self.shapes = [(1043, 981), (1, 1)]
+        for det_class in Detector.registry.values():
+            shape = getattr(det_class, 'MAX_SHAPE', None)
+            if shape is not None and tuple(shape) not in self.shapes:
+                self.shapes.append(tuple(shape))
+
+    def testSameNameAsRegistryScan(self):
+        for shape in self.shapes:
+            self.assertEqual(self.resolver.getDetectorName(shape), scanRegistry(shape), str(shape))
+
+    def testManualDetector(self):
+        self.assertEqual(self.resolver.getDetectorName((1043, 981), 'pilatus1m'), scanRegistry((1043, 981), 'pilatus1m'))
+        self.assertEqual(self.resolver.getDetectorName((1, 1), 'pilatus1m'), DEFAULT_DETECTOR)
+
+    def testDetectorCreatedOnce(self):
+        detector = self.resolver.getDetector((1043, 981))
+        self.assertIs(self.resolver.getDetector((1043, 981)), detector)
+        binned = self.resolver.getBinnedDetector((1043, 981), 2)
+        self.assertEqual(binned.max_shape, (521, 490))
+        self.assertAlmostEqual(binned.pixel1, detector.pixel1 * 2)
+        self.assertIs(self.resolver.getBinnedDetector((1043, 981), 2), binned)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
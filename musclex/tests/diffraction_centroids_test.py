@@ -0,0 +1,146 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import copy
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from ..modules.DiffractionCentroids import DiffractionCentroids
+from ..headless.DiffractionCentroidsh import DiffractionCentroidsh, groupImages
+from ..csv_manager import DC_CSVManager
+from ..utils.image_processor import rotateImage
+
+class UnsharedDiffractionCentroids(DiffractionCentroids):
+    """
+    Diffraction Centroids rotating the average image each time it is used, as it was done before the rotated image was kept
+    """
+    def getRotatedImage(self, img = None, angle = None):
+        if img is None:
+            img = copy.copy(self.avgImg)
+        if angle is None:
+            angle = self.info['rotationAngle']
+        if '90rotation' in self.info and self.info['90rotation'] is True:
+            angle = angle - 90 if angle > 90 else angle + 90
+
+        center = self.info["center"]
+        if "orig_center" in self.info:
+            center = self.info["orig_center"]
+        else:
+            self.info["orig_center"] = center
+
+        rotImg, self.info["center"], self.rotMat = rotateImage(img, center, angle)
+        return rotImg
+
+class DiffractionCentroidsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        self.imgList = sorted(f for f in os.listdir(inpath) if f.endswith('.tif'))
+        for name in self.imgList:
+            shutil.copy(os.path.join(inpath, name), self.tmpdir)
+        self.fixRanges = [('peak1', (100, 900))]
+        self.offMer = {'x1': 10, 'x2': 40, 'x3': 10, 'x4': 40, 's59': 150, 'e59': 200, 's51': 210, 'e51': 260}
+        self.flags = {'orientation_model': 0, '90rotation': False, 'no_cache': True}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRotatedImageCache(self):
+        imgList = self.imgList[:1]
+        dc = DiffractionCentroids(self.tmpdir, imgList, 0, self.fixRanges, self.offMer)
+        dc.process(dict(self.flags))
+        unshared = UnsharedDiffractionCentroids(self.tmpdir, imgList, 0, self.fixRanges, self.offMer)
+        unshared.process(dict(self.flags))
+        np.testing.assert_equal(dc.info, unshared.info)
+        np.testing.assert_equal(dc.rotMat, unshared.rotMat)
+
+        # the meridian and the off-meridian strips share one rotation of the average image
+        rotImg = dc.getRotatedImage()
+        self.assertIs(dc.getRotatedImage(), rotImg)
+        np.testing.assert_array_equal(rotImg, unshared.getRotatedImage())
+        self.assertEqual(dc.info['center'], unshared.info['center'])
+
+        # it is rotated again when the angle or the center changes
+        angle = dc.info['rotationAngle'] + 1
+        np.testing.assert_array_equal(dc.getRotatedImage(angle=angle), unshared.getRotatedImage(angle=angle))
+        self.assertEqual(dc.info['center'], unshared.info['center'])
+        for d in (dc, unshared):
+            d.info['orig_center'] = (d.info['orig_center'][0] + 3, d.info['orig_center'][1] - 2)
+        np.testing.assert_array_equal(dc.getRotatedImage(), unshared.getRotatedImage())
+        self.assertEqual(dc.info['center'], unshared.info['center'])
+        np.testing.assert_equal(dc.rotMat, unshared.rotMat)
+
+        # other images are not kept
+        img = dc.avgImg * 2
+        np.testing.assert_array_equal(dc.getRotatedImage(img), unshared.getRotatedImage(img))
+        np.testing.assert_array_equal(dc.getRotatedImage(), unshared.getRotatedImage())
+
+    def testHeadless(self):
+        imgList = self.imgList[:4]
+        for name in self.imgList[4:]:
+            os.remove(os.path.join(self.tmpdir, name))
+        guiDir = os.path.join(self.tmpdir, 'gui')
+        os.makedirs(guiDir)
+        for name in imgList:
+            shutil.copy(os.path.join(self.tmpdir, name), guiDir)
+        # a group which can not be read does not stop the others
+        with open(os.path.join(self.tmpdir, 'zz_broken.tif'), 'wb') as f:
+            f.write(b'not an image')
+        settingsPath = os.path.join(self.tmpdir, 'settings.json')
+        with open(settingsPath, 'w') as f:
+            json.dump({'fix_ranges': [['peak1', [100, 900]]], 'off_meridian': self.offMer,
+                       'orientation_model': 0, '90rotation': False}, f)
+
+        dch = DiffractionCentroidsh(self.tmpdir, True, False, settingsPath, nFrames=2, nWorkers=2)
+        self.assertEqual(dch.groupList, [imgList[:2], imgList[2:], ['zz_broken.tif']])
+
+        # groups processed one by one and written after each group, as the GUI does
+        csvManager = DC_CSVManager(guiDir, 2, self.fixRanges)
+        for i, grp in enumerate(groupImages(imgList, 2)):
+            dc = DiffractionCentroids(guiDir, grp, i, self.fixRanges, self.offMer)
+            dc.process({'orientation_model': 0, '90rotation': False})
+            csvManager.writeNewData(dc.info)
+
+        with open(dch.csvManager.filename) as f:
+            summary = f.read()
+        with open(csvManager.filename) as f:
+            self.assertEqual(summary, f.read())
+        lines = summary.splitlines()
+        self.assertEqual([line.split(',')[:2] for line in lines[1:]], [['1', imgList[0]], ['', imgList[1]], ['2', imgList[2]], ['', imgList[3]]])
+        self.assertEqual(os.path.basename(dch.csvManager.filename), 'summary_2f_peak1.csv')
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmpdir, 'dc_cache'))),
+                         sorted(os.listdir(os.path.join(guiDir, 'dc_cache'))))
+
+        self.assertEqual(groupImages(imgList, 0), [imgList])
+        self.assertEqual(groupImages([], 2), [])
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
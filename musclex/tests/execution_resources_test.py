@@ -0,0 +1,152 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import unittest
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from threadpoolctl import threadpool_info
+from ..utils import execution_resources as er
+
+class ExecutionResourcesTest(unittest.TestCase):
+    def setUp(self):
+        self.environ = {name: os.environ.get(name) for name in ('MUSCLEX_WORKERS', 'MUSCLEX_THREADS', 'MUSCLEX_THREADS_WARP')}
+        for name in self.environ:
+            os.environ.pop(name, None)
+        self.resources = dict(er._resources, stages=dict(er._resources['stages']))
+
+    def tearDown(self):
+        for name, value in self.environ.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        er.configureThreads(self.resources['threads'] if self.resources['threads'] is not None else er.getCpuCount())
+        er._resources.update(self.resources)
+
+    def getLimits(self):
+        """
+        Threads of OpenCV and of the OpenMP and BLAS libraries
+        """
+        return cv2.getNumThreads(), [lib['num_threads'] for lib in threadpool_info()]
+
+    def runStage(self, stage):
+        """
+        Give the threads of a stage run in the current thread
+        """
+        with er.stageThreads(stage) as n:
+            return n
+
+    def testWorkerCount(self):
+        self.assertEqual(er.getWorkerCount(3), 3)
+        self.assertEqual(er.getWorkerCount(), er.getCpuCount())
+        os.environ['MUSCLEX_WORKERS'] = '5'
+        self.assertEqual(er.getWorkerCount(), 5)
+        self.assertEqual(er.getWorkerCount(2), 2)
+        for value in ('0', '-2', 'all'):
+            os.environ['MUSCLEX_WORKERS'] = value
+            self.assertEqual(er.getWorkerCount(), er.getCpuCount())
+        self.assertEqual(er.getWorkerCount(0), er.getCpuCount())
+
+    def testThreadBudget(self):
+        with mock.patch.object(er, 'getCpuCount', return_value=16):
+            self.assertEqual(er.getThreadBudget(), 16)
+            self.assertEqual(er.getThreadBudget(4), 4)
+            self.assertEqual(er.getThreadBudget(5), 3)
+            self.assertEqual(er.getThreadBudget(32), 1)
+            self.assertEqual(er.getThreadBudget(4, 6), 6)
+            os.environ['MUSCLEX_THREADS'] = '2'
+            self.assertEqual(er.getThreadBudget(4), 2)
+            self.assertEqual(er.getThreadBudget(4, 6), 6)
+
+    def testExecutionBudget(self):
+        with mock.patch.object(er, 'getCpuCount', return_value=16):
+            self.assertEqual(er.setExecutionBudget(4), (4, 4))
+            self.assertEqual((os.environ['MUSCLEX_WORKERS'], os.environ['MUSCLEX_THREADS']), ('4', '4'))
+            # the workers started from now on use the budget
+            self.assertEqual((er.getWorkerCount(), er.getThreadBudget(er.getWorkerCount())), (4, 4))
+            self.assertEqual(er.setExecutionBudget(3, 2), (3, 2))
+            self.assertEqual(er.getThreadBudget(3), 2)
+
+    def testStageThreads(self):
+        er.initWorker(1, 3)
+        limits = self.getLimits()
+        self.assertEqual(limits[0], 3)
+        with er.stageThreads('warp') as n:
+            self.assertEqual(n, 1)
+            self.assertEqual(cv2.getNumThreads(), 1)
+            self.assertTrue(all(threads == 1 for threads in self.getLimits()[1]))
+        self.assertEqual(self.getLimits(), limits)
+        # the limits are set back when the stage fails
+        os.environ['MUSCLEX_THREADS_WARP'] = '2'
+        with self.assertRaises(RuntimeError):
+            with er.stageThreads('warp') as n:
+                self.assertEqual((n, cv2.getNumThreads()), (2, 2))
+                raise RuntimeError()
+        self.assertEqual(self.getLimits(), limits)
+        er.setStageThreads('bgsub', 2)
+        self.assertEqual(er.getStageThreads('bgsub'), 2)
+        er.setStageThreads('bgsub', None)
+        self.assertEqual(er.getStageThreads('bgsub'), 3)
+
+    def testStageThreadsUnchanged(self):
+        er.initWorker(1, 3)
+        with mock.patch.object(er.cv2, 'setNumThreads', wraps=cv2.setNumThreads) as setNumThreads:
+            # the stage uses the threads of the worker, nothing is set
+            with er.stageThreads('bgsub') as n:
+                self.assertEqual(n, 3)
+            self.assertEqual(setNumThreads.call_count, 0)
+            with er.stageThreads('warp'):
+                self.assertEqual(setNumThreads.call_count, 1)
+            self.assertEqual(setNumThreads.call_count, 2)
+            # the libraries already using the threads are not set again
+            er.applyThreads(3)
+            self.assertEqual(setNumThreads.call_count, 2)
+
+    def testWorkerThreads(self):
+        er.initWorker(1, 8)
+        limits = self.getLimits()
+        with mock.patch.object(er, 'getCpuCount', return_value=8):
+            with er.workerThreads(4) as n:
+                self.assertEqual(n, 2)
+                self.assertEqual(cv2.getNumThreads(), 2)
+                resources = dict(er._resources)
+                with mock.patch.object(er.cv2, 'setNumThreads', wraps=cv2.setNumThreads) as setNumThreads:
+                    with ThreadPoolExecutor(4, initializer=er.initWorkerThread) as executor:
+                        # the stages of the threads of the pool do not change the threads shared by the process
+                        stages = list(executor.map(self.runStage, ['warp', 'bgsub'] * 8))
+                    self.assertEqual(setNumThreads.call_count, 0)
+                self.assertEqual(stages, [2] * 16)
+                self.assertEqual(er._resources, resources)
+        self.assertEqual(self.getLimits(), limits)
+        self.assertEqual(er._resources['threads'], 8)
+        self.assertFalse(er._resources['pool'])
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,124 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import fabio
+import tifffile
+from PIL import Image
+from fabio.edfimage import EdfImage
+from ..utils.frame_source import readFrame, mapFrame, readTiffLayout, readEdfLayout, isMappingEnabled
+
+class FrameSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_env = os.environ.get('MUSCLEX_MMAP_FRAMES')
+        self.inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        rng = np.random.default_rng(0)
+        self.images = {'int32': rng.integers(-1000, 100000, (97, 131)).astype(np.int32),
+                       'uint16': rng.integers(0, 65535, (97, 131)).astype(np.uint16),
+                       'float32': rng.random((97, 131)).astype(np.float32)}
+
+    def tearDown(self):
+        if self.old_env is None:
+            os.environ.pop('MUSCLEX_MMAP_FRAMES', None)
+        else:
+            os.environ['MUSCLEX_MMAP_FRAMES'] = self.old_env
+        shutil.rmtree(self.tmpdir)
+
+    def assertSameFrame(self, path, mapped):
+        """
+        Check that the frame read is the frame decoded by fabio, and mapped or not
+        """
+        expected = fabio.open(path).data
+        img = readFrame(path)
+        self.assertEqual(img.dtype, expected.dtype)
+        np.testing.assert_array_equal(img, expected)
+        self.assertEqual(mapFrame(path) is not None, mapped)
+
+    def testTestImages(self):
+        for name in sorted(os.listdir(self.inpath)):
+            if name.endswith('.tif'):
+                path = os.path.join(self.inpath, name)
+                self.assertSameFrame(path, True)
+                self.assertFalse(readFrame(path).flags.writeable)
+
+    def testTiff(self):
+        for name, data in self.images.items():
+            path = os.path.join(self.tmpdir, name + '.tif')
+            fabio.tifimage.tifimage(data=data).write(path)
+            dtype, shape, _ = readTiffLayout(path)
+            self.assertEqual((dtype, shape), (data.dtype, data.shape))
+            self.assertSameFrame(path, True)
+            # several strips
+            path = os.path.join(self.tmpdir, name + '_strips.tif')
+            tifffile.imwrite(path, data, rowsperstrip=10)
+            self.assertSameFrame(path, True)
+            # compressed, tiled and big-endian files are decoded by fabio
+            path = os.path.join(self.tmpdir, name + '_lzw.tif')
+            Image.fromarray(data).save(path, format='TIFF', compression='tiff_lzw')
+            self.assertIsNone(readTiffLayout(path))
+            self.assertSameFrame(path, False)
+            for suffix, kwargs in (('_tiled', {'tile': (32, 32)}), ('_be', {'byteorder': '>'})):
+                path = os.path.join(self.tmpdir, name + suffix + '.tif')
+                tifffile.imwrite(path, data, **kwargs)
+                self.assertIsNone(readTiffLayout(path))
+                self.assertSameFrame(path, False)
+
+    def testEdf(self):
+        for name, data in self.images.items():
+            path = os.path.join(self.tmpdir, name + '.edf')
+            EdfImage(data=data, header={'Title': 'test'}).write(path)
+            dtype, shape, _ = readEdfLayout(path)
+            self.assertEqual((dtype, shape), (data.dtype, data.shape))
+            self.assertSameFrame(path, True)
+        # truncated file
+        path = os.path.join(self.tmpdir, 'truncated.edf')
+        with open(os.path.join(self.tmpdir, 'int32.edf'), 'rb') as f:
+            content = f.read()
+        with open(path, 'wb') as f:
+            f.write(content[:-100])
+        self.assertIsNone(readEdfLayout(path))
+        self.assertIsNone(mapFrame(path))
+
+    def testMappingDisabled(self):
+        path = os.path.join(self.tmpdir, 'frame.tif')
+        fabio.tifimage.tifimage(data=self.images['float32']).write(path)
+        self.assertTrue(isMappingEnabled())
+        self.assertFalse(readFrame(path).flags.writeable)
+        os.environ['MUSCLEX_MMAP_FRAMES'] = '0'
+        self.assertFalse(isMappingEnabled())
+        img = readFrame(path)
+        self.assertTrue(img.flags.writeable)
+        np.testing.assert_array_equal(img, self.images['float32'])
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,132 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import copy
+import unittest
+import numpy as np
+import cv2
+import fabio
+from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+from pyFAI.method_registry import IntegrationMethod
+from ..utils.image_processor import get8bitImage, bkImg, getContours, find_detector, distance, get_ring_model, HoF, \
+    getRadOfMaxHoF, preprocessForGeometry, getCenter, getRotationAngle, getCenterAndRotationAngle
+
+def getEllipseUnshared(img):
+    """
+    Ellipse of the biggest contour as it was computed by getCenter() and getRotationAngle() before the preprocessing was shared
+    """
+    cimg = get8bitImage(copy.copy(img))
+    cimg = cv2.GaussianBlur(cimg, (5, 5), 0)
+    cimg = bkImg(copy.copy(cimg), 0.005, 50)
+    cnt = max(getContours(cimg), key=len)
+    return cv2.fitEllipse(cnt) if len(cnt) > 5 else None
+
+def getRotationAngleUnshared(img, center, method=0):
+    """
+    Rotation angle as it was computed before the preprocessing and the cake were shared : the 1 degree histogram
+    and the 0.1 degree refinement come from separate integrations
+    """
+    init_angle = None
+    ellipse = getEllipseUnshared(img)
+    if ellipse is not None:
+        init_angle = (ellipse[2]+90.) % 180
+        init_angle = init_angle if init_angle <= 90. else 180. - init_angle
+    corners = [(0, 0), (0, img.shape[1]), (img.shape[0], 0), (img.shape[0], img.shape[1])]
+    npt_rad = int(round(min([distance(center, c) for c in corners])))
+    mask = np.zeros(img.shape)
+    mask[img<0] = 1
+    ai = AzimuthalIntegrator(detector=find_detector(img))
+    ai.setFit2D(200, center[0], center[1])
+    integration_method = IntegrationMethod.select_one_available("csr", dim=2, default="csr", degradable=True)
+    I2D, tth, _ = ai.integrate2d(img, npt_rad, 360, unit="r_mm", method=integration_method, mask=mask)
+    hist = np.sum(I2D[:, :int(len(tth)/3.)], axis=1)
+    if method == 1:
+        x = np.arange(0, 2 * np.pi, 2 * np.pi / 360)
+        max_degree = int(get_ring_model([x, hist])['u'] / np.pi * 180) % 180
+    elif 2 <= method <= 3:
+        mode = 'f' if method == 2 else 'h'
+        max_degree = int(getRadOfMaxHoF(HoF(hist, mode), mode) / np.pi * 180) % 180
+    else:
+        max_degree = max(np.arange(180), key=lambda d: hist[d] + hist[d + 180])
+        hist = 0
+        for degree in (max_degree, max_degree-180 if max_degree > 0 else max_degree+180):
+            if -175 <= degree < 175:
+                I2D, tth, _ = ai.integrate2d(img, npt_rad, 100, azimuth_range=(degree-5, degree+5), unit="r_mm", method=integration_method, mask=mask)
+                hist += np.sum(I2D[:, :int(len(tth)/3.)], axis=1)
+        delta_degree = max(np.arange(100), key=lambda d: hist[d])
+        max_degree += (delta_degree-50)/10
+    if init_angle is not None and abs(max_degree-init_angle) > 20. and abs(180 - max_degree - init_angle)>20:
+        return int(round(init_angle))
+    if max_degree > 90:
+        return -1*(180-max_degree)
+    if max_degree < -90:
+        return 180 + max_degree
+    return max_degree
+
+class GeometryTest(unittest.TestCase):
+    def setUp(self):
+        # the reference integration method of the unshared path
+        self.method = os.environ.get('MUSCLEX_INTEGRATION_METHOD')
+        os.environ['MUSCLEX_INTEGRATION_METHOD'] = 'csr'
+        inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        self.imgs = [fabio.open(os.path.join(inpath, 'P40_1_3_%05d.tif' % i)).data for i in range(6)]
+
+    def tearDown(self):
+        if self.method is None:
+            del os.environ['MUSCLEX_INTEGRATION_METHOD']
+        else:
+            os.environ['MUSCLEX_INTEGRATION_METHOD'] = self.method
+
+    def testSharedPreprocessing(self):
+        for img in self.imgs:
+            self.assertEqual(preprocessForGeometry(img)['ellipse'], getEllipseUnshared(img))
+
+    def testRotationAngle(self):
+        """
+        The angles from the shared cake are the angles of the separate integrations
+        """
+        for img in self.imgs:
+            center = getCenter(img)
+            for method in range(4):
+                self.assertEqual(getRotationAngle(img, center, method), getRotationAngleUnshared(img, center, method))
+            self.assertEqual(getCenterAndRotationAngle(img, decimate=1), (center, getRotationAngleUnshared(img, center)))
+
+    def testRotatedImage(self):
+        """
+        The refinement reads the fine bins of the angle wherever it is in the chi range
+        """
+        img = self.imgs[0].astype(np.float32)
+        center = getCenter(img)
+        for angle in (-60, 35, 85):
+            M = cv2.getRotationMatrix2D(tuple(center), angle, 1)
+            rotated = cv2.warpAffine(img, M, (img.shape[1], img.shape[0]), borderValue=-1)
+            self.assertEqual(getRotationAngle(rotated, center), getRotationAngleUnshared(rotated, center))
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
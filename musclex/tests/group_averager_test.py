@@ -0,0 +1,99 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import pickle
+import tempfile
+import unittest
+import numpy as np
+import fabio
+from ..utils.group_averager import GroupAverager, averageImages
+from ..modules.DiffractionCentroids import DiffractionCentroids
+
+class GroupAveragerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        cls.imgList = sorted(f for f in os.listdir(cls.inpath) if f.endswith('.tif'))
+        cls.images = [fabio.open(os.path.join(cls.inpath, f)).data for f in cls.imgList]
+
+    def testSameAsMean(self):
+        for images in (self.images, [img.astype(np.int32) for img in self.images], [img.astype(np.float32) for img in self.images]):
+            averager = GroupAverager()
+            for img in images:
+                averager.add(img)
+            expected = np.mean(images, axis=0)
+            result = averager.mean()
+            self.assertEqual(result.dtype, expected.dtype)
+            if np.issubdtype(images[0].dtype, np.integer):
+                np.testing.assert_array_equal(result, expected)
+            else:
+                np.testing.assert_allclose(result, expected, rtol=1e-6)
+        self.assertIsNone(GroupAverager().mean())
+
+    def testStreamedInOrder(self):
+        paths = [os.path.join(self.inpath, f) for f in self.imgList]
+        expected = np.mean(self.images, axis=0)
+        for nWorkers in (1, 2, 4):
+            np.testing.assert_array_equal(averageImages(paths, nWorkers=nWorkers), expected)
+        self.assertIsNone(averageImages([]))
+
+    def testGroupCache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            imgList = self.imgList[:3]
+            for f in imgList:
+                shutil.copy(os.path.join(self.inpath, f), tmpdir)
+            dc = DiffractionCentroids(tmpdir, imgList, 0, [('peak1', (100, 900))], None)
+            np.testing.assert_array_equal(dc.avgImg, np.mean(self.images[:3], axis=0))
+            cachefile = os.path.join(tmpdir, 'dc_cache', imgList[0] + '_' + imgList[-1] + '.avg')
+            self.assertTrue(os.path.isfile(cachefile))
+
+            # the group is read from the cache while its images do not change
+            with open(cachefile, 'rb') as c:
+                cavg = pickle.load(c)
+            cavg['avg'] = cavg['avg'] + 1
+            with open(cachefile, 'wb') as c:
+                pickle.dump(cavg, c)
+            np.testing.assert_array_equal(dc.mergeImages(tmpdir, imgList), np.mean(self.images[:3], axis=0) + 1)
+
+            # and merged again when one of them changes
+            changed = self.images[3]
+            fabio.tifimage.tifimage(data=changed).write(os.path.join(tmpdir, imgList[1]))
+            os.utime(os.path.join(tmpdir, imgList[1]), ns=(1, 1))
+            np.testing.assert_array_equal(dc.mergeImages(tmpdir, imgList), np.mean([self.images[0], changed, self.images[2]], axis=0))
+
+            # single images are not cached
+            dc.mergeImages(tmpdir, imgList[:1])
+            self.assertEqual(os.listdir(os.path.join(tmpdir, 'dc_cache')), [os.path.basename(cachefile)])
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,220 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import unittest
+import warnings
+import numpy as np
+from scipy.interpolate import PchipInterpolator
+from ..utils.histogram_processor import convexHull, convexHullBatch, getHull, getHullScan, getSubtractedHistArray, \
+    getCentroid, getWidth, getPeakInformationsBatch, pchip, pchipBatch, pchipslopes, pchipend
+
+def scanConvexHull(hist, start_p, end_p):
+    """
+    convexHull() with the hull of getHullScan()
+    """
+    hist = np.array(hist)
+    end_p = min(end_p, len(hist))
+    hist_x = list(range(start_p, end_p))
+    hist_y = np.array(hist[hist_x], dtype=np.float32)
+    hull_x, hull_y = getHullScan(hist_x, hist_y)
+    ret = np.zeros(len(hist))
+    ret[start_p:end_p] = getSubtractedHistArray(hist_x, hist_y, hull_x, hull_y)
+    return list(ret)
+
+def loopPeakInformations(hist, peaks, baselines):
+    """
+    Peak informations computed peak by peak with getWidth() and getCentroid(), as getPeakInformations() did
+    """
+    centroids, widths, intersections, areas = [], [], [], []
+    for p, baseline in zip(peaks, baselines):
+        width, inters = getWidth(hist, p, baseline)
+        centroids.append(getCentroid(hist, p, inters))
+        widths.append(width)
+        intersections.append(inters)
+        areas.append(hist[p] * width / (2.35 * 0.3989))
+    return {"centroids": centroids, "widths": widths, "intersections": intersections, "areas": areas}
+
+def scalarPchip(x, y, u):
+    """
+    pchip() as it was computed point by point, with the slopes in lists and u.index() lookups
+    """
+    h = []
+    h0 = x[0]
+    for h1 in x[1:]:
+        h.append(h1 - h0)
+        h0 = h1
+
+    delta = []
+    for (j, f) in enumerate(h):
+        delta.append((y[j + 1] - y[j]) / f)
+
+    d = []
+    d.append(pchipend(h[0], h[1], delta[0], delta[1]))
+    for k in range(1, len(x) - 1):
+        d.append(pchipslopes(h[k - 1], h[k], delta[k - 1], delta[k]))
+    d.append(pchipend(h[-1], h[-2], delta[-1], delta[-2]))
+
+    pchipy = []
+    segmentlx = x[0]
+    segmently = y[0]
+    for (i, e) in enumerate(delta):
+        segmentrx = x[i + 1]
+        segmentry = y[i + 1]
+        leftindex = u.index(segmentlx)
+        rightindex = u.index(segmentrx)
+        c = (3 * e - 2 * d[i] - d[i + 1]) / h[i]
+        b = (d[i] - 2 * e + d[i + 1]) / (h[i] ** 2)
+        dfloat = d[i]
+        for j in u[leftindex:rightindex]:
+            j = j - u[leftindex]
+            pchipy.append(segmently + j * (dfloat + j * (c + j * b)))
+        segmentlx = segmentrx
+        segmently = segmentry
+    pchipy.append(y[-1])
+    return pchipy
+
+class HistogramProcessorTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+
+    def makeHistogram(self, kind, n):
+        """
+        Random histograms : noise, ramps with nearly collinear points, plateaus, python floats, nan and inf values
+        """
+        if kind == 0:
+            return (self.rng.random(n) * 1000).astype(np.float32)
+        if kind == 1:
+            return (np.arange(n) * self.rng.uniform(-3, 3) + self.rng.normal(0, 1e-3, n)).astype(np.float32)
+        if kind == 2:
+            return np.round(self.rng.random(n) * 5).astype(np.float32)
+        if kind == 3:
+            return list(self.rng.random(n) * 100)
+        if kind == 4:
+            hist = (self.rng.random(n) * 100).astype(np.float32)
+            hist[self.rng.integers(0, n, 3)] = self.rng.choice([np.nan, np.inf, -np.inf], 3)
+            return hist
+        # decaying background with peaks, as the histograms of the modules
+        x = np.arange(n)
+        hist = 1000. * np.exp(-x / (n / 4.)) + 50. * np.exp(-(x - n / 2.) ** 2 / 20.)
+        return (hist + self.rng.normal(0, 1, n)).astype(np.float32)
+
+    def assertSameHull(self, hull, expected):
+        self.assertEqual(hull[0], expected[0])
+        np.testing.assert_array_equal(hull[1], expected[1]) # nan values are equal
+
+    def testHull(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            for t in range(3000):
+                n = int(self.rng.integers(1, 300))
+                y = self.makeHistogram(t % 6, n)
+                x = list(range(5, 5 + n))
+                self.assertSameHull(getHull(x, y), getHullScan(x, y))
+        # points on a line
+        x = list(range(6))
+        y = np.array([0., 1., 2., 3., 4., 5.], dtype=np.float32)
+        self.assertEqual(getHull(x, y), getHullScan(x, y))
+        self.assertEqual(getHull([], []), ([], []))
+        # integer histograms are handled by the scan itself
+        y = np.array([5, 3, 4, 1, 2], dtype=np.int32)
+        self.assertEqual(getHull(list(range(5)), y), getHullScan(list(range(5)), y))
+
+    def testConvexHull(self):
+        for t in range(500):
+            n = int(self.rng.integers(10, 400))
+            hist = np.array(self.makeHistogram([0, 1, 2, 5][t % 4], n))
+            start_p = int(self.rng.integers(0, n // 3))
+            end_p = int(self.rng.integers(start_p + 6, n + 20))
+            self.assertEqual(convexHull(hist, start_p, end_p), scanConvexHull(hist, start_p, end_p))
+
+    def testConvexHullBatch(self):
+        hists = np.array([self.makeHistogram(5, 200) for _ in range(8)])
+        ignore = np.zeros(200, dtype=bool)
+        ignore[[50, 51, 120]] = True
+        for start_p, end_p, mask in ((0, 99999999, None), (10, 180, None), (10, 180, ignore), (10, 12, None)):
+            batch = convexHullBatch(hists, start_p, end_p, mask)
+            for i, hist in enumerate(hists):
+                np.testing.assert_array_equal(batch[i], convexHull(hist, start_p, end_p, mask))
+
+    def makeHull(self, u, nKnots, dtype):
+        """
+        Random hull on u keeping its first and last values
+        """
+        x = [u[0]] + sorted(int(k) for k in self.rng.choice(u[1:-1], nKnots - 2, replace=False)) + [u[-1]]
+        y = self.rng.random(nKnots) * 1000 if dtype is None else (self.rng.random(nKnots) * 1000).astype(dtype)
+        if self.rng.random() < 0.3:
+            y[self.rng.integers(1, nKnots - 1)] = y[0] # flat and turning segments
+        return (np.array(x) if self.rng.random() < 0.5 else x), y
+
+    def testPchipBatch(self):
+        for t in range(300):
+            start = int(self.rng.integers(0, 50))
+            u = list(range(start, start + int(self.rng.integers(5, 400))))
+            dtype = [np.float32, np.float64, np.int32, None][t % 4]
+            hulls = [self.makeHull(u, int(self.rng.integers(3, min(len(u), 40) + 1)), dtype)
+                     for _ in range(int(self.rng.integers(1, 8)))]
+            batch = pchipBatch([x for x, _ in hulls], [y for _, y in hulls], u)
+            self.assertEqual(batch.shape, (len(hulls), len(u)))
+            for line, (x, y) in zip(batch, hulls):
+                # bit-identical to the point by point evaluation
+                expected = scalarPchip(x, y, u)
+                np.testing.assert_array_equal(line, np.array(expected, dtype=np.float64))
+                self.assertEqual(pchip(x, y, u), list(line))
+                # and the same curve as scipy, up to rounding (float32 differences are rounded to float32)
+                reference = PchipInterpolator(x, np.asarray(y, dtype=np.float64))(u)
+                tol = 1e-6 if dtype is np.float32 else 1e-9
+                np.testing.assert_allclose(line, reference, rtol=tol, atol=tol * np.abs(reference).max())
+        with self.assertRaises(ValueError):
+            pchipBatch([[0, 2, 4], [1, 2, 4]], [[1., 2., 3.], [1., 2., 3.]], list(range(5)))
+
+    def testPeakInformationsBatch(self):
+        for t in range(300):
+            hists, peaksList, baselinesList = [], [], []
+            # histograms of different lengths, some without peaks
+            for _ in range(int(self.rng.integers(1, 6))):
+                n = int(self.rng.integers(5, 300))
+                hist = np.array(self.makeHistogram([0, 1, 2, 5][t % 4], n), dtype=np.float64)
+                nPeaks = int(self.rng.integers(0, 6))
+                peaks = sorted(int(p) for p in self.rng.integers(1, n - 1, nPeaks))
+                baselines = [float(self.rng.uniform(hist.min(), hist[p])) for p in peaks]
+                hists.append(hist if t % 2 else list(hist))
+                peaksList.append(peaks)
+                baselinesList.append(baselines)
+            batch = getPeakInformationsBatch(hists, peaksList, baselinesList)
+            self.assertEqual(len(batch), len(hists))
+            for result, hist, peaks, baselines in zip(batch, hists, peaksList, baselinesList):
+                expected = loopPeakInformations(np.array(hist), peaks, baselines)
+                self.assertEqual(result["intersections"], expected["intersections"])
+                self.assertEqual(result["widths"], expected["widths"])
+                np.testing.assert_allclose(result["areas"], expected["areas"], rtol=1e-12)
+                np.testing.assert_allclose(result["centroids"], expected["centroids"], rtol=1e-10)
+        self.assertEqual(getPeakInformationsBatch([[1., 2., 1.], [3., 4.]], [[], []], [[], []]),
+                         [{"centroids": [], "widths": [], "intersections": [], "areas": []}] * 2)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
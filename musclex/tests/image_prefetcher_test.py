@@ -0,0 +1,152 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+import fabio
+from ..utils.image_prefetcher import ImagePrefetcher, readImageData, readCacheFile
+
+class ImagePrefetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.imgList = ['img_%02d.tif' % i for i in range(10)]
+        self.images = {}
+        for name in self.imgList:
+            img = rng.integers(0, 65535, (37, 53)).astype(np.uint16)
+            fabio.tifimage.tifimage(data=img).write(self.path(name))
+            self.images[name] = img
+        os.makedirs(os.path.join(self.tmpdir, 'qf_cache'))
+        for name in self.imgList[:4]:
+            with open(os.path.join(self.tmpdir, 'qf_cache', name + '.info'), 'wb') as c:
+                pickle.dump({'name': name}, c)
+        self.prefetchers = []
+
+    def tearDown(self):
+        for prefetcher in self.prefetchers:
+            prefetcher.shutdown()
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def makePrefetcher(self, **kwargs):
+        prefetcher = ImagePrefetcher(**kwargs)
+        self.prefetchers.append(prefetcher)
+        return prefetcher
+
+    def submitted(self, prefetcher, index):
+        """
+        Names of the images read in advance for the current image index, in their order
+        """
+        with mock.patch.object(prefetcher, 'submit') as submit:
+            prefetcher.prefetch(self.tmpdir, self.imgList, index)
+        return [os.path.basename(call.args[0]) for call in submit.call_args_list]
+
+    def testPrefetchOrder(self):
+        prefetcher = self.makePrefetcher(readAhead=3)
+        self.assertEqual(self.submitted(prefetcher, 0), ['img_01.tif', 'img_02.tif', 'img_03.tif'])
+        self.assertEqual(self.submitted(prefetcher, 1), ['img_02.tif', 'img_03.tif', 'img_04.tif'])
+        # going back reads the previous images, around the end of the list
+        self.assertEqual(self.submitted(prefetcher, 0), ['img_09.tif', 'img_08.tif', 'img_07.tif'])
+        self.assertEqual(self.submitted(prefetcher, 9), ['img_08.tif', 'img_07.tif', 'img_06.tif'])
+        # a jump keeps the direction
+        self.assertEqual(self.submitted(prefetcher, 5), ['img_04.tif', 'img_03.tif', 'img_02.tif'])
+        self.assertEqual(self.submitted(prefetcher, 6), ['img_07.tif', 'img_08.tif', 'img_09.tif'])
+        prefetcher.invalidate()
+        self.assertEqual(self.submitted(prefetcher, 9), ['img_00.tif', 'img_01.tif', 'img_02.tif'])
+        # h5 frames are not read
+        with mock.patch.object(prefetcher, 'submit') as submit:
+            prefetcher.prefetch(self.tmpdir, self.imgList, 1, ext='.h5')
+        submit.assert_not_called()
+
+    def testSameImages(self):
+        prefetcher = self.makePrefetcher()
+        prefetcher.prefetch(self.tmpdir, self.imgList, 0, cache_dir='qf_cache')
+        for name in self.imgList[1:3]:
+            img = prefetcher.getImage(self.path(name))
+            self.assertIsNotNone(img)
+            self.assertFalse(img.flags.writeable)
+            np.testing.assert_array_equal(img, fabio.open(self.path(name)).data)
+            self.assertIs(readImageData(self.path(name)), img)
+        self.assertIsNone(prefetcher.getImage(self.path(self.imgList[3])))
+        np.testing.assert_array_equal(readImageData(self.path(self.imgList[3])), self.images[self.imgList[3]])
+
+        # caches are given once, then read from the disk
+        cache = os.path.join(self.tmpdir, 'qf_cache', self.imgList[1] + '.info')
+        prefetcher.waitFor(cache)
+        self.assertIn(cache, prefetcher.caches)
+        self.assertEqual(readCacheFile(cache), {'name': self.imgList[1]})
+        self.assertNotIn(cache, prefetcher.caches)
+        self.assertIsNone(prefetcher.getCache(cache))
+        self.assertEqual(readCacheFile(cache), {'name': self.imgList[1]})
+
+    def testModifiedImage(self):
+        prefetcher = self.makePrefetcher()
+        prefetcher.prefetch(self.tmpdir, self.imgList, 0)
+        path = self.path(self.imgList[1])
+        self.assertIsNotNone(prefetcher.getImage(path))
+        changed = self.images[self.imgList[1]] + 1
+        fabio.tifimage.tifimage(data=changed).write(path)
+        os.utime(path, ns=(1, 1))
+        self.assertIsNone(prefetcher.getImage(path))
+        np.testing.assert_array_equal(readImageData(path), changed)
+
+    def testEviction(self):
+        prefetcher = self.makePrefetcher(maxSize=4, readAhead=2, nWorkers=1)
+        paths = [self.path(name) for name in self.imgList]
+        prefetcher.prefetchFiles(paths[:4])
+        prefetcher.waitFor(paths[3])
+        self.assertEqual(list(prefetcher.images), paths[:4])
+        prefetcher.prefetchFiles(paths[4:6])
+        prefetcher.waitFor(paths[5])
+        # the least recently used images are forgotten first
+        self.assertEqual(list(prefetcher.images), paths[2:6])
+        self.assertIsNotNone(prefetcher.getImage(paths[2]))
+        prefetcher.prefetchFiles(paths[6:7])
+        prefetcher.waitFor(paths[6])
+        self.assertEqual(list(prefetcher.images), [paths[4], paths[5], paths[2], paths[6]])
+        self.assertIsNone(prefetcher.getImage(paths[3]))
+        # images in memory are not read again
+        with mock.patch.object(prefetcher.executor, 'submit') as submit:
+            prefetcher.prefetchFiles(paths[4:7])
+        submit.assert_not_called()
+        # no more than maxSize images are read for a list
+        prefetcher.invalidate()
+        prefetcher.prefetchFiles(paths)
+        prefetcher.waitFor(paths[3])
+        self.assertEqual(list(prefetcher.images), paths[:4])
+        self.assertEqual(prefetcher.pending, {})
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
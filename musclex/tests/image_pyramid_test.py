@@ -0,0 +1,71 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import unittest
+import numpy as np
+import fabio
+from ..utils.image_processor import buildImagePyramid, pyramidToNative, nativeToPyramid, getCenter, getRotationAngle
+from ..utils.detector_resolver import resolveBinnedDetector
+
+class ImagePyramidTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        cls.images = [fabio.open(os.path.join(cls.inpath, f)).data.astype('float32')
+                      for f in sorted(os.listdir(cls.inpath)) if f.endswith('.tif')]
+
+    def testLevelsAreBlockAverages(self):
+        img = np.random.RandomState(0).rand(64, 48).astype('float32') * 100
+        img[10, 10] = -1
+        pyramid = buildImagePyramid(img, 2)
+        self.assertEqual([p.shape for p in pyramid], [(64, 48), (32, 24), (16, 12)])
+        blocks = img.reshape(32, 2, 24, 2).mean(axis=(1, 3))
+        blocks[5, 5] = -1 # a level pixel is masked if one of its pixels is
+        np.testing.assert_allclose(pyramid[1], blocks, rtol=1e-5)
+        self.assertEqual(pyramid[2][2, 2], -1)
+
+    def testCoordinatesRoundTrip(self):
+        for scale in (1, 2, 4):
+            point = nativeToPyramid(pyramidToNative((12.25, 7.5), scale), scale)
+            self.assertAlmostEqual(point[0], 12.25)
+            self.assertAlmostEqual(point[1], 7.5)
+        self.assertEqual(pyramidToNative((0, 0), 2), (0.5, 0.5))
+
+    def testEstimationsOnFirstLevel(self):
+        for img in self.images:
+            center = getCenter(img)
+            pyramid = buildImagePyramid(img, 1)
+            coarse_center = pyramidToNative(getCenter(pyramid[1]), 2)
+            self.assertLess(np.hypot(center[0] - coarse_center[0], center[1] - coarse_center[1]), 3)
+            angle = getRotationAngle(img, center)
+            coarse_angle = getRotationAngle(pyramid[1], nativeToPyramid(center, 2), detector=resolveBinnedDetector(img.shape, 2))
+            self.assertLess(abs(angle - coarse_angle), 1)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,115 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import unittest
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from ..ui.image_view import PyramidImageView
+
+class PyramidImageViewTest(unittest.TestCase):
+    def setUp(self):
+        self.img = (np.random.default_rng(0).random((1500, 1300)) * 100).astype(np.float32)
+
+    def render(self, usePyramid, xlim=None, ylim=None, minLevelSize=256):
+        """
+        Display the image in a 400x400 pixels figure, through a PyramidImageView or with imshow() as the GUIs did before
+        :return: rendered pixels, view (None with imshow), axes
+        """
+        fig = Figure(figsize=(4, 4), dpi=100)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(111)
+        view = None
+        if usePyramid:
+            view = PyramidImageView(ax, minLevelSize)
+            view.show(self.img, 0, 100)
+        else:
+            ax.imshow(self.img, cmap='gray', vmin=0, vmax=100)
+        if xlim is not None:
+            ax.set_xlim(xlim)
+            ax.set_ylim(ylim)
+        fig.canvas.draw()
+        return np.asarray(fig.canvas.buffer_rgba()).copy(), view, ax
+
+    def testSameAsImshow(self):
+        # before any zoom the full image is given to matplotlib
+        expected, _, _ = self.render(False)
+        rendered, view, ax = self.render(True)
+        np.testing.assert_array_equal(rendered, expected)
+        np.testing.assert_array_equal(view.image.get_array(), self.img)
+
+        # zoomed in, the visible part of the full resolution image is displayed at the same place
+        for xlim, ylim in (((100, 300), (400, 200)), ((0.3, 50.7), (80.2, 20.1)), ((1250, 1310), (1510, 1440))):
+            expected, _, _ = self.render(False, xlim, ylim)
+            rendered, view, ax = self.render(True, xlim, ylim)
+            self.assertEqual(ax.get_xlim(), xlim)
+            self.assertEqual(ax.get_ylim(), ylim)
+            left, right, bottom, top = view.image.get_extent()
+            c0, r0 = int(left + 0.5), int(top + 0.5)
+            self.assertEqual((right - left, bottom - top), view.image.get_array().shape[::-1])
+            np.testing.assert_array_equal(view.image.get_array(), self.img[r0:int(bottom + 0.5), c0:int(right + 0.5)])
+            # resampling of the crop may round a pixel differently
+            self.assertLess(np.mean((rendered != expected).any(axis=2)), 1e-4)
+
+    def testLevelSelection(self):
+        # 1300 columns in a 310 pixels wide axes : the quarter resolution level is displayed
+        _, view, ax = self.render(True, (-0.5, 1299.5), (1499.5, -0.5))
+        self.assertEqual(len(view.levels), 3)
+        data = view.image.get_array()
+        self.assertEqual(data.shape, (375, 325))
+        np.testing.assert_allclose(data, self.img.reshape(375, 4, 325, 4).mean(axis=(1, 3)), rtol=1e-5)
+        self.assertEqual(view.image.get_extent(), (-0.5, 1299.5, 1499.5, -0.5))
+
+        # levels smaller than minLevelSize are not built
+        _, view, ax = self.render(True, (-0.5, 1299.5), (1499.5, -0.5), minLevelSize=400)
+        self.assertEqual(len(view.levels), 2)
+        self.assertEqual(view.image.get_array().shape, (750, 650))
+        self.assertIsNone(view.getLevel(2))
+
+        # a zoom selects a finer level and only its visible part
+        _, view, ax = self.render(True, (100, 1100), (1300, 300))
+        data = view.image.get_array()
+        left, right, bottom, top = view.image.get_extent()
+        self.assertLess(data.shape[1], 650)
+        self.assertEqual((right - left) / data.shape[1], 2)
+        self.assertEqual((bottom - top) / data.shape[0], 2)
+        c0, r0 = int(left + 0.5) // 2, int(top + 0.5) // 2
+        np.testing.assert_array_equal(data, view.levels[1][r0:r0 + data.shape[0], c0:c0 + data.shape[1]])
+        self.assertLessEqual(left, 100)
+        self.assertGreaterEqual(right, 1100)
+
+        # the levels are kept while the same image is shown, and rebuilt for a new one
+        levels = view.levels
+        view.show(self.img, 0, 50)
+        self.assertIs(view.levels[1], levels[1])
+        view.show(self.img * 2, 0, 50)
+        self.assertEqual(len(view.levels), 2)
+        np.testing.assert_allclose(view.levels[1], levels[1] * 2, rtol=1e-6)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
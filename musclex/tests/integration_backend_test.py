@@ -0,0 +1,124 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+import unittest
+import numpy as np
+from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+from ..utils import integration_backend as ib
+from ..utils.image_processor import find_detector
+
+class IntegrationBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.old_path = os.environ.get('MUSCLEX_INTEGRATION_PROFILE')
+        os.environ['MUSCLEX_INTEGRATION_PROFILE'] = os.path.join(self.tmpdir, 'profile.json')
+        ib._profile['path'], ib._profile['methods'] = None, None
+        rng = np.random.default_rng(0)
+        self.img = rng.random((300, 400)).astype(np.float32) * 100
+
+    def tearDown(self):
+        if self.old_path is None:
+            del os.environ['MUSCLEX_INTEGRATION_PROFILE']
+        else:
+            os.environ['MUSCLEX_INTEGRATION_PROFILE'] = self.old_path
+        ib._profile['path'], ib._profile['methods'] = None, None
+        shutil.rmtree(self.tmpdir)
+
+    def makeIntegrator(self, center):
+        ai = AzimuthalIntegrator(detector=find_detector(self.img))
+        ai.setFit2D(100, center[0], center[1])
+        return ai
+
+    def testGeometryKey(self):
+        ai = self.makeIntegrator((200, 150))
+        kwargs = {'unit': 'r_mm', 'azimuth_range': (180, 270)}
+        key = ib.getGeometryKey(ai, self.img, 1, (250,), 1, kwargs)
+        self.assertEqual(key, ib.getGeometryKey(self.makeIntegrator((210, 140)), self.img, 1, (250,), 1, kwargs))
+        # the numbers of points of close centers share a bucket
+        self.assertEqual(key, ib.getGeometryKey(ai, self.img, 1, (240,), 1, kwargs))
+        self.assertNotEqual(key, ib.getGeometryKey(ai, self.img, 1, (500,), 1, kwargs))
+        self.assertNotEqual(key, ib.getGeometryKey(ai, self.img, 1, (250,), 1, dict(kwargs, unit='2th_deg')))
+        self.assertNotEqual(key, ib.getGeometryKey(ai, self.img, 1, (250,), 1, {'unit': 'r_mm'}))
+        self.assertNotEqual(key, ib.getGeometryKey(ai, self.img, 1, (250,), 10, kwargs))
+
+    def testNptBucket(self):
+        self.assertEqual([ib.getNptBucket(n) for n in (0, 1, 2, 3, 129, 256, 257, 1000.7)], [1, 1, 2, 4, 256, 256, 512, 1024])
+
+    def testProfile(self):
+        ai = self.makeIntegrator((200, 150))
+        method = ib.getIntegrationMethod(ai, self.img, 1, (250,), unit="r_mm", azimuth_range=(180, 270))
+        key = ib.getGeometryKey(ai, self.img, 1, (250,), 1, {'unit': 'r_mm', 'azimuth_range': (180, 270)})
+        with open(ib.getProfilePath()) as f:
+            entry = json.load(f)[key]
+        self.assertEqual(entry['method'], ib.methodToList(method))
+        self.assertIsNotNone(entry['timings']['_'.join(ib.methodToList(method)[:3])])
+        # the selected method gives the result of the reference method
+        reference = ib.methodFromList(1, list(ib.REFERENCE_METHOD) + [None])
+        expected = ib.runIntegration(self.makeIntegrator((200, 150)), self.img, 1, (250,), reference, {'unit': 'r_mm', 'azimuth_range': (180, 270)})
+        result = ib.runIntegration(self.makeIntegrator((200, 150)), self.img, 1, (250,), method, {'unit': 'r_mm', 'azimuth_range': (180, 270)})
+        np.testing.assert_allclose(result, expected, rtol=ib.RESULT_TOLERANCE, atol=ib.RESULT_TOLERANCE * np.abs(expected).max())
+        # another process (empty cache) uses the saved method without benchmarking again
+        ib._profile['path'], ib._profile['methods'] = None, None
+        ib.saveProfileEntry(key, {'method': ib.methodToList(reference), 'timings': {}})
+        ib._profile['path'], ib._profile['methods'] = None, None
+        self.assertEqual(ib.methodToList(ib.getIntegrationMethod(ai, self.img, 1, (250,), unit="r_mm", azimuth_range=(180, 270))),
+                         ib.methodToList(reference))
+
+    def testBenchmarkLock(self):
+        ai = self.makeIntegrator((200, 150))
+        key = ib.getGeometryKey(ai, self.img, 1, (250,), 1, {'unit': 'r_mm', 'azimuth_range': (180, 270)})
+        reference = list(ib.REFERENCE_METHOD) + [None]
+        # a process benchmarking the geometry holds the lock, then saves its method
+        script = ("import sys, time\n"
+                  "from musclex.utils import integration_backend as ib\n"
+                  "with ib.profileLock():\n"
+                  "    print('locked', flush=True)\n"
+                  "    time.sleep(1)\n"
+                  "    ib.saveProfileEntry(sys.argv[1], {'method': " + repr(reference) + ", 'timings': {}})\n")
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env = dict(os.environ, PYTHONPATH=root)
+        proc = subprocess.Popen([sys.executable, '-c', script, key], stdout=subprocess.PIPE, env=env, universal_newlines=True)
+        try:
+            self.assertEqual(proc.stdout.readline().strip(), 'locked')
+            # waits for the other process and uses its method instead of benchmarking again
+            method = ib.getIntegrationMethod(ai, self.img, 1, (250,), unit="r_mm", azimuth_range=(180, 270))
+            self.assertEqual(ib.methodToList(method), reference)
+            with open(ib.getProfilePath()) as f:
+                self.assertEqual(json.load(f)[key]['timings'], {})
+        finally:
+            proc.wait()
+            proc.stdout.close()
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
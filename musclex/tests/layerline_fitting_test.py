@@ -0,0 +1,211 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import io
+import copy
+import shutil
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+import numpy as np
+from lmfit import Model, Parameters
+from ..modules.ProjectionProcessor import ProjectionProcessor, layerlineModel
+from ..utils.layerline_fitting import LayerLineModel, LayerLineSeriesFitter, toInternal, fromInternal
+
+# Background removed by the convex hull (fixed values of ProjectionProcessor.getFitSetups)
+HULL_FIXED = {'bg_line': 0, 'bg_sigma': 1, 'bg_amplitude': 0, 'center_sigma1': 1, 'center_amplitude1': 0,
+              'center_sigma2': 1, 'center_amplitude2': 0}
+
+def getSetup(peaks, total, center=100):
+    """
+    Parameters of a box as in ProjectionProcessor.getFitSetups, with the background removed
+    """
+    params = [('centerX', center, center - 1., center + 1., True)]
+    for j, p in enumerate(peaks):
+        params += [('p_' + str(j), p, p - 10., p + 10., True), ('sigma' + str(j), 10, 1, 50., True),
+                   ('amplitude' + str(j), total / 10., -1, np.inf, True)]
+    return params, dict(HULL_FIXED)
+
+def fitLmfit(hist, params, fixed):
+    """
+    Fit of ProjectionProcessor.fitModel
+    :return: fitted values (dict)
+    """
+    parameters = Parameters()
+    for pname, value, vmin, vmax, vary in params:
+        parameters.add(pname, value, min=vmin, max=vmax, vary=vary)
+    model = Model(layerlineModel, nan_policy='propagate', independent_vars=['x'] + list(fixed.keys()))
+    values = model.fit(hist, verbose=False, params=parameters, x=np.arange(len(hist)), **fixed).values
+    values.update(fixed)
+    return values
+
+class LayerLineFittingTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.x = np.arange(201, dtype=float)
+
+    def makeHistograms(self, nframes, peaks=(20, 45, -20, -45)):
+        """
+        Synthetic layer line histograms : gaussian peaks around the center with noise
+        :return: histograms (frames, len(x)) and the parameters of their box
+        """
+        model = LayerLineModel(*getSetup(peaks, 1.))
+        values = np.array([[100.3] + sum(([p + self.rng.normal(0, 2), self.rng.uniform(4, 12), self.rng.uniform(500, 2000)]
+                                          for p in peaks), []) + list(HULL_FIXED.values()) for _ in range(nframes)])
+        hists = model.evaluate(self.x, values)
+        hists += self.rng.normal(0, 0.02 * hists.max(), hists.shape)
+        return hists, getSetup(peaks, hists[0].sum())
+
+    def testModel(self):
+        params, _ = getSetup((20, -45), 1000.)
+        fixed = {'bg_line': 3., 'bg_sigma': 40., 'bg_amplitude': 900., 'center_sigma1': 12., 'center_amplitude1': 300.,
+                 'center_sigma2': 4., 'center_amplitude2': 150.}
+        model = LayerLineModel(params, fixed)
+        values = np.array([[100.4, 21., 8., 700., -44., 5., 400.] + list(fixed.values())])
+        kwargs = dict(zip(model.names, values[0]))
+        np.testing.assert_allclose(model.evaluate(self.x, values)[0], layerlineModel(self.x, **kwargs), rtol=1e-10, atol=1e-10)
+        # analytic derivatives
+        _, jac = model.evaluate(self.x, values, jacobian=True)
+        for k, i in enumerate(model.free):
+            step = np.zeros_like(values)
+            step[0, i] = 1e-6 * max(1., abs(values[0, i]))
+            numeric = (model.evaluate(self.x, values + step) - model.evaluate(self.x, values - step))[0] / (2 * step[0, i])
+            np.testing.assert_allclose(jac[0, :, k], numeric, rtol=1e-5, atol=1e-6)
+
+    def testBounds(self):
+        lower = np.array([0., -np.inf, 1., -np.inf])
+        upper = np.array([10., 5., np.inf, np.inf])
+        values = np.array([2.5, -3., 7., 42.])
+        internal = toInternal(values, lower, upper)
+        back, derivatives = fromInternal(internal, lower, upper)
+        np.testing.assert_allclose(back, values)
+        numeric = (fromInternal(internal + 1e-6, lower, upper)[0] - fromInternal(internal - 1e-6, lower, upper)[0]) / 2e-6
+        np.testing.assert_allclose(derivatives, numeric, rtol=1e-6)
+
+    def testFit(self):
+        """
+        The batched fit reaches the sum of squares of lmfit on each frame, and a frame gives the same result alone
+        """
+        hists, (params, fixed) = self.makeHistograms(6)
+        model = LayerLineModel(params, fixed)
+        values = np.tile([p[1] for p in params] + list(fixed.values()), (len(hists), 1)).astype(float)
+        lower = np.tile([p[2] for p in params if p[4]], (len(hists), 1))
+        upper = np.tile([p[3] for p in params if p[4]], (len(hists), 1))
+        fitted, cost, nfev = model.fit(self.x, hists, values, lower, upper)
+        self.assertEqual(fitted.shape, values.shape)
+        self.assertTrue(np.all(nfev > 1))
+        np.testing.assert_allclose(cost, ((model.evaluate(self.x, fitted) - hists) ** 2).sum(axis=1))
+        self.assertTrue(np.all(fitted[:, model.free] >= lower) and np.all(fitted[:, model.free] <= upper))
+        for i, hist in enumerate(hists):
+            result = fitLmfit(hist, params, fixed)
+            lmfitCost = ((layerlineModel(self.x, **result) - hist) ** 2).sum()
+            self.assertLessEqual(cost[i], lmfitCost * (1 + 1e-6))
+            single, _, _ = model.fit(self.x, hists[i:i + 1], values[i:i + 1], lower[i:i + 1], upper[i:i + 1])
+            np.testing.assert_allclose(single[0], fitted[i], rtol=1e-8, atol=1e-8)
+
+    def testWarmStart(self):
+        """
+        The frames of a chunk start from the default values, and from the last frame of the previous chunk if there is one
+        """
+        class Frame:
+            def __init__(self, hist, params, fixed):
+                self.setup = (hist, params, fixed)
+                self.results = {}
+            def getFitSetups(self):
+                return {'b': self.setup}
+            def setFitResult(self, name, result_dict):
+                self.results[name] = result_dict
+
+        hists, (params, fixed) = self.makeHistograms(6)
+        defaults = [p[1] for p in params] + list(fixed.values())
+        starts = []
+        fit = LayerLineModel.fit
+        def recordingFit(model, x, hists, values, lower, upper, **kwargs):
+            starts.append(np.array(values))
+            return fit(model, x, hists, values, lower, upper, **kwargs)
+
+        with mock.patch.object(LayerLineModel, 'fit', recordingFit):
+            fitter = LayerLineSeriesFitter()
+            first = [Frame(hist, params, fixed) for hist in hists[:3]]
+            fitter.fitChunk(first)
+            second = [Frame(hist, params, fixed) for hist in hists[3:]]
+            fitter.fitChunk(second)
+            LayerLineSeriesFitter(warm_start=False).fitChunk([Frame(hist, params, fixed) for hist in hists[3:]])
+
+        np.testing.assert_array_equal(starts[0], np.tile(defaults, (3, 1)))
+        last = np.array([first[-1].results['b'][n] for n in fitter.getModel(params, fixed).names])
+        lower = np.array([p[2] for p in params])
+        upper = np.array([p[3] for p in params])
+        free = slice(0, len(params))
+        warm = np.where((last[free] > lower) & (last[free] < upper), last[free], defaults[:len(params)])
+        self.assertFalse(np.array_equal(warm, defaults[:len(params)]))
+        # every frame of the second chunk starts from the last frame of the first chunk, not from the previous frame
+        np.testing.assert_array_equal(starts[1][:3, free], np.tile(warm, (3, 1)))
+        np.testing.assert_array_equal(starts[1][3:], np.tile(defaults, (3, 1)))
+        np.testing.assert_array_equal(starts[2], np.tile(defaults, (3, 1)))
+
+    def testSeries(self):
+        """
+        Fit errors of the boxes of a series fitted in one chunk are equal to or lower than the errors of lmfit
+        """
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inpath = os.path.join(os.path.dirname(__file__), "test_images")
+            imgList = ['P40_1_3_0000' + str(i) + '.tif' for i in range(3)]
+            for name in imgList:
+                shutil.copy(os.path.join(inpath, name), tmpdir)
+            settings = {'boxes': {'b': ((250, 570), (480, 520))}, 'bgsubs': {'b': 1}, 'types': {'b': 'h'},
+                        'peaks': {'b': [14, 36, -14, -36]}, 'merid_bg': {'b': False}, 'hull_ranges': {'b': (5, 120)},
+                        'no_cache': True}
+            def getProcessors():
+                processors = []
+                for name in imgList:
+                    proc = ProjectionProcessor(tmpdir, name)
+                    proc.info['centerx'] = 410.0
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        proc.processHistograms(copy.deepcopy(settings))
+                    processors.append(proc)
+                return processors
+            reference = getProcessors()
+            with contextlib.redirect_stdout(io.StringIO()):
+                for proc in reference:
+                    proc.fitModel()
+            expected = [proc.info['fit_results']['b']['error'] for proc in reference]
+            for warmStart in (True, False):
+                processors = getProcessors()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    LayerLineSeriesFitter(warmStart).fitChunk(processors)
+                for proc, error in zip(processors, expected):
+                    self.assertLessEqual(proc.info['fit_results']['b']['error'], error + 1e-6)
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
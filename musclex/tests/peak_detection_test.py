@@ -0,0 +1,127 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import unittest
+import numpy as np
+from ..utils.histogram_processor import smooth, getPeaksFromHist, getPeaksFromHistBatch
+
+def loopPeaksFromHist(orig_hist, width_thres=0, height_thres=0):
+    """
+    Peaks found with the loops used before the peak detection was vectorized
+    """
+    if len(orig_hist) < 10:
+        return []
+    if width_thres == 0:
+        width_thres = 5
+    if height_thres == 0:
+        height_thres = np.mean(orig_hist)
+
+    hist = smooth(np.array(orig_hist), 20)
+    hist[hist < height_thres] = height_thres
+    hist = hist - min(hist)
+
+    peak_hist1 = np.zeros((len(hist), 1))
+    peak_list = []
+    for i in range(4, len(hist) - 4):
+        peak_hist1[i] = hist[i + 1] - hist[i - 1]
+    for i in range(width_thres, len(peak_hist1) - width_thres):
+        if all(peak_hist1[i - width_thres:i] > 0) and all(peak_hist1[i + 1:i + width_thres] < 0):
+            peak_list.append(i)
+
+    if len(peak_list) != 0:
+        new_list = []
+        derivate = np.zeros((len(peak_list), 1))
+        for i in range(1, len(peak_list)):
+            derivate[i] = peak_list[i] - peak_list[i - 1]
+        i = 0
+        while i < len(derivate) - 1:
+            s = peak_list[i]
+            c = 0
+            if derivate[i + 1] == 1 and not i + 1 == len(derivate) - 1:
+                j = i + 1
+                while j <= len(derivate):
+                    if derivate[j] == 1 and not j + 1 == len(derivate):
+                        s += peak_list[j]
+                        c += 1
+                        j += 1
+                    else:
+                        s /= (c + 1)
+                        i = j
+                        break
+            else:
+                i += 1
+            new_list.append(s)
+        if i != len(derivate) - 1:
+            new_list.append(peak_list[i])
+        peak_list = new_list
+
+    peak_list.sort()
+    return peak_list
+
+def makeHistogram(rng, n):
+    """
+    Synthetic histogram : decreasing background, a few gaussian peaks and noise
+    """
+    x = np.arange(n)
+    hist = 200. * np.exp(-x / (n / 3.))
+    for _ in range(rng.randint(1, 8)):
+        hist += rng.uniform(20, 300) * np.exp(-(x - rng.uniform(0, n)) ** 2 / (2 * rng.uniform(1, 15) ** 2))
+    return hist + rng.normal(0, 3, n)
+
+class PeakDetectionTest(unittest.TestCase):
+    def assertSamePeaks(self, result, expected):
+        self.assertEqual(result, expected)
+        self.assertEqual([type(p) for p in result], [type(p) for p in expected])
+
+    def testSameAsLoops(self):
+        rng = np.random.RandomState(0)
+        for k in range(400):
+            hist = makeHistogram(rng, rng.randint(5, 600))
+            if k % 4 == 1:
+                hist = hist.astype(np.float32)
+            elif k % 4 == 2:
+                hist = np.round(hist)
+            elif k % 4 == 3:
+                hist = list(hist)
+            width = rng.randint(0, 11)
+            height = 0 if k % 3 else float(np.percentile(hist, 60))
+            self.assertSamePeaks(getPeaksFromHist(hist, width, height), loopPeaksFromHist(hist, width, height))
+
+    def testBatchSameAsSingle(self):
+        rng = np.random.RandomState(1)
+        hists = [makeHistogram(rng, n) for n in (300, 300, 8, 450, 300)]
+        for width in (0, 3, 7):
+            batch = getPeaksFromHistBatch(hists, width)
+            self.assertEqual(len(batch), len(hists))
+            for hist, peaks in zip(hists, batch):
+                self.assertSamePeaks(peaks, loopPeaksFromHist(hist, width))
+        stack = np.array(hists[:2])
+        self.assertEqual(getPeaksFromHistBatch(stack), [loopPeaksFromHist(h) for h in stack])
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
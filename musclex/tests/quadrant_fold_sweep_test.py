@@ -0,0 +1,104 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from ..modules.QuadrantFolder import QuadrantFolder
+from ..modules.QuadrantFoldingSweep import QuadrantFoldingSweep, expandGrid, getEffectiveParams, getResidualMetrics
+
+METRICS = ['negative_fraction', 'background_fraction', 'background_roughness']
+
+class QuadrantFoldingSweepTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        self.imgList = ['P40_1_3_00000.tif', 'P40_1_3_00001.tif']
+        for name in self.imgList:
+            shutil.copy(os.path.join(inpath, name), self.tmpdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testGrid(self):
+        points = expandGrid([{'bgsub': 'White-top-hats', 'tophat1': [3, 5], 'sigmoid': [0.1, 0.2]}, {'bgsub': 'None'}])
+        self.assertEqual(len(points), 5)
+        self.assertEqual(points[0], {'bgsub': 'White-top-hats', 'tophat1': 3, 'sigmoid': 0.1})
+        self.assertEqual(points[-1], {'bgsub': 'None'})
+        with self.assertRaises(ValueError):
+            expandGrid({'center': [(10, 10)]})
+        # the settings of the other methods are ignored
+        info = {'bgsub': 'White-top-hats', 'tophat1': 3, 'tophat2': 20, 'fwhm': 10, 'sigmoid': 0.1, 'cirmin': 0}
+        self.assertEqual(getEffectiveParams(info), {'bgsub': 'White-top-hats', 'tophat1': 3, 'tophat2': 20, 'sigmoid': 0.1})
+        info['bgsub'] = 'None'
+        self.assertEqual(getEffectiveParams(info), {'bgsub': 'None', 'sigmoid': 0.1})
+
+    def testMetrics(self):
+        fold = np.full((50, 60), 10.)
+        metrics = getResidualMetrics(fold, fold - 2., 5, 40, 0)
+        self.assertEqual(metrics['negative_fraction'], 0.)
+        self.assertAlmostEqual(metrics['background_fraction'], 0.2)
+        noisy = fold - 2. + np.random.default_rng(0).normal(0, 1, fold.shape)
+        self.assertGreater(getResidualMetrics(fold, noisy, 5, 40, 0)['background_roughness'], 10 * metrics['background_roughness'])
+        self.assertEqual(getResidualMetrics(fold, fold - 11., 5, 40, 0)['negative_fraction'], 1.)
+        self.assertTrue(np.isnan(getResidualMetrics(fold, fold, 100, 200, 0)['negative_fraction']))
+
+    def testSweep(self):
+        """
+        Each point of the sweep gives the result of process() with its settings
+        """
+        grid = [{'bgsub': 'White-top-hats', 'tophat1': [3, 8], 'tophat2': 10, 'sigmoid': [0.05, 0.2]},
+                {'bgsub': 'None', 'tophat1': [3, 8], 'sigmoid': 0.1}] # tophat1 is not used by 'None'
+        sweep = QuadrantFoldingSweep(self.tmpdir, self.imgList, grid, nWorkers=3)
+        report = sweep.run()
+        for name in ('sweep_report.csv', 'sweep_summary.csv', 'report.html'):
+            self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'qf_sweep', name)))
+        self.assertEqual(len(report), len(self.imgList) * 5)
+        for row in sweep.rows:
+            self.assertTrue(os.path.isfile(os.path.join(self.tmpdir, 'qf_sweep', row['Thumbnail'])))
+        points = {}
+        for point in expandGrid(grid):
+            info = dict(sweep.getFlags(QuadrantFolder(self.tmpdir, self.imgList[0], None)), **point)
+            points.setdefault(', '.join(k + '=' + str(v) for k, v in getEffectiveParams(info).items()), point)
+        self.assertEqual(len(points), 5)
+        for filename in self.imgList:
+            rows = {row['Settings']: row for row in sweep.rows if row['Image'] == filename}
+            self.assertEqual(set(rows), set(points))
+            for settings, point in points.items():
+                quadFold = QuadrantFolder(self.tmpdir, filename, None)
+                quadFold.info = {}
+                quadFold.process(dict(sweep.getFlags(quadFold), **point))
+                metrics = getResidualMetrics(quadFold.info['avg_fold'], quadFold.imgCache['BgSubFold'], quadFold.info['rmin'],
+                                             quadFold.info['rmax'], quadFold.info['mask_thres'])
+                for m in METRICS:
+                    np.testing.assert_equal(rows[settings][m], metrics[m])
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,137 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import cv2
+from ..modules.QuadrantFolder import QuadrantFolder
+
+def copyFold(rotate_img, center, ignore_folds, mask_thres, qf):
+    """
+    Average fold computed as before the folds became views of the rotated image (copies, cv2 flips and a float64 stack)
+    """
+    rotate_img = rotate_img.copy()
+    center_x = int(center[0])
+    center_y = int(center[1])
+    img_width = rotate_img.shape[1]
+    img_height = rotate_img.shape[0]
+    fold_width = max(int(center[0]), img_width-int(center[0]))
+    fold_height = max(int(center[1]), img_height-int(center[1]))
+    top_left = rotate_img[max(center_y-fold_height,0):center_y, max(center_x-fold_width,0):center_x]
+    top_right = cv2.flip(rotate_img[max(center_y-fold_height,0):center_y, center_x:center_x+fold_width], 1)
+    buttom_left = cv2.flip(rotate_img[center_y:center_y+fold_height, max(center_x-fold_width,0):center_x], 0)
+    buttom_right = cv2.flip(cv2.flip(rotate_img[center_y:center_y+fold_height, center_x:center_x+fold_width], 1), 0)
+    quadrants = np.ones((4, fold_height, fold_width), rotate_img.dtype) * (mask_thres - 1.)
+    for i, quad in enumerate([top_left, top_right, buttom_left, buttom_right]):
+        quadrants[i][-quad.shape[0]:, -quad.shape[1]:] = quad
+    remained = np.ones(4, dtype=bool)
+    remained[list(ignore_folds)] = False
+    qf.get_avg_fold(np.array(quadrants[remained], dtype="float32"), fold_height, fold_width)
+    return qf.info['avg_fold']
+
+def copyFullImage(fold):
+    """
+    Full image computed as before the flipped folds became views
+    """
+    h, w = fold.shape
+    result = np.zeros((h * 2, w * 2))
+    result[0:h, 0:w] = fold
+    result[0:h, w:] = cv2.flip(fold, 1)
+    result[h:, 0:w] = cv2.flip(fold, 0)
+    result[h:, w:] = cv2.flip(cv2.flip(fold, 0), 1)
+    return result
+
+class QuadrantFoldTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        cls.filename = 'P40_1_3_00000.tif'
+        shutil.copy(os.path.join(inpath, cls.filename), cls.tmpdir)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def getFolder(self):
+        qf = QuadrantFolder(self.tmpdir, self.filename, None)
+        qf.process({'bgsub' : 'None', 'sigmoid' : 0.0, 'no_cache' : True, 'orientation_model' : 0})
+        return qf
+
+    def testFoldAsCopies(self):
+        qf = self.getFolder()
+        avg_fold = qf.info['avg_fold']
+        for ignore_folds in (set(), {1}, {0, 3}):
+            qf.info['ignore_folds'] = ignore_folds
+            qf.foldImage()
+            expected = copyFold(qf.getRotatedImage(), qf.info['center'], ignore_folds, qf.info['mask_thres'], qf)
+            qf.foldImage()
+            np.testing.assert_array_equal(qf.info['avg_fold'], expected)
+        # the fold of an image is not changed by the next fold, which reuses the quadrant stack
+        self.assertTrue(np.array_equal(avg_fold, copyFold(qf.getRotatedImage(), qf.info['center'], set(), qf.info['mask_thres'], qf)))
+
+    def testFoldOutsideOfImage(self):
+        qf = self.getFolder()
+        img = np.random.RandomState(1).rand(120, 90).astype(np.float32) * 50
+        qf.getRotatedImage = lambda: img
+        for center in ((30, 70), (61.5, 20.2), (45, 60)):
+            qf.info['center'] = center
+            qf.info['ignore_folds'] = set()
+            qf.foldImage()
+            result = qf.info['avg_fold']
+            np.testing.assert_array_equal(result, copyFold(img, center, set(), qf.info['mask_thres'], qf))
+
+    def testCenterizedFrames(self):
+        qf = QuadrantFolder(self.tmpdir, self.filename, None)
+        qf.updateInfo({'bgsub' : 'None', 'sigmoid' : 0.0, 'no_cache' : True, 'orientation_model' : 0})
+        qf.initParams()
+        qf.applyBlankImageAndMask()
+        qf.findCenter()
+        center = qf.info['center']
+        qf.centerizeImage()
+        # the initial image and the center stay in the same coordinate system
+        self.assertIs(qf.orig_img, qf.initImg)
+        self.assertEqual(qf.info['center'], center)
+        enlarged = qf.getCenterizedImage()
+        cx, cy = qf.center_before_rotation
+        np.testing.assert_array_equal(enlarged[cy-50:cy+50, cx-50:cx+50], qf.orig_img[center[1]-50:center[1]+50, center[0]-50:center[0]+50])
+
+    def testFullImage(self):
+        qf = self.getFolder()
+        fold = qf.imgCache['BgSubFold']
+        expected = copyFullImage(fold)
+        np.testing.assert_array_equal(qf.makeFullImage(fold), expected)
+        out = qf.getFullImageBuffer(fold)
+        np.testing.assert_array_equal(qf.makeFullImage(fold, out), expected.astype(np.float32))
+        np.testing.assert_array_equal(qf.imgCache['resultImg'], np.rot90(expected) if qf.info.get('rotate') else expected)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
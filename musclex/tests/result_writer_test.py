@@ -0,0 +1,92 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import numpy as np
+import fabio
+from ..utils.result_writer import ResultWriter, writeImage, getAvailableCodecs, getResultCodec
+
+class ResultWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.img = (np.random.RandomState(0).rand(300, 257) * 1000).astype(np.float32)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testCodecsRoundTrip(self):
+        for codec in getAvailableCodecs():
+            path = os.path.join(self.tmpdir, codec + '.tif')
+            writeImage(path, self.img, codec, nThreads=2)
+            np.testing.assert_array_equal(fabio.open(path).data, self.img)
+        # uncompressed images are the file fabio writes
+        path = os.path.join(self.tmpdir, 'fabio.tif')
+        fabio.tifimage.tifimage(data=self.img).write(path)
+        with open(path, 'rb') as f1, open(os.path.join(self.tmpdir, 'none.tif'), 'rb') as f2:
+            self.assertEqual(f1.read(), f2.read())
+        # no temporary file is left
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), sorted([c + '.tif' for c in getAvailableCodecs()] + ['fabio.tif']))
+        self.assertRaises(ValueError, writeImage, os.path.join(self.tmpdir, 'x.tif'), self.img, 'jpeg')
+        self.assertFalse(os.path.exists(os.path.join(self.tmpdir, 'x.tif')))
+
+    def testResultCodec(self):
+        self.assertEqual(getResultCodec({}), 'lzw')
+        self.assertEqual(getResultCodec({'compressed': True}), 'lzw')
+        self.assertEqual(getResultCodec({'compressed': False}), 'none')
+        self.assertEqual(getResultCodec({'compressed': False, 'codec': 'deflate'}), 'deflate')
+        self.assertEqual(getResultCodec({'codec': 'unknown'}), 'lzw')
+
+    def testJobsInOrder(self):
+        writer = ResultWriter(maxQueue=2)
+        done = []
+        threads = set()
+        def job(i):
+            threads.add(threading.get_ident())
+            done.append(i)
+        def failing():
+            raise IOError('disk full')
+        for i in range(10):
+            writer.submit(job, i)
+        writer.submit(failing)
+        writer.submitImage(os.path.join(self.tmpdir, 'img.tif'), self.img)
+        errors = writer.flush()
+        self.assertEqual(done, list(range(10)))
+        self.assertEqual(threads, {writer.thread.ident})
+        self.assertEqual(len(errors), 1)
+        self.assertIn('disk full', errors[0])
+        self.assertEqual(writer.flush(), [])
+        np.testing.assert_array_equal(fabio.open(os.path.join(self.tmpdir, 'img.tif')).data, self.img)
+        writer.close()
+        self.assertIsNone(writer.thread)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
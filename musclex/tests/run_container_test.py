@@ -0,0 +1,169 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import sys
+import time
+import shutil
+import subprocess
+import tempfile
+import unittest
+import numpy as np
+from ..utils.run_container import RUN_CONTAINER_FILE, isRunContainerEnabled, setRunContainer, splitRunPath, openContainer, \
+    isFileLockedError, cacheExists, writeCacheFile, readContainerCache, removeCacheFile, writeContainerScalars, \
+    readContainerScalars, exportRunCsvs
+from ..utils.image_prefetcher import readCacheFile
+
+class RunContainerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.enabled = isRunContainerEnabled()
+        setRunContainer(True)
+
+    def tearDown(self):
+        setRunContainer(self.enabled)
+        shutil.rmtree(self.tmpdir)
+
+    def runInProcess(self, code, **env):
+        """
+        Run python code in another process using the container of the test folder
+        """
+        env = dict(os.environ, **env, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        return subprocess.Popen([sys.executable, '-c', code], env=env, stdout=subprocess.PIPE)
+
+    def testSplitPath(self):
+        container, group, name = splitRunPath(os.path.join(self.tmpdir, 'qf_results', 'bg', 'img.tif.bg.tif'))
+        self.assertEqual(container, os.path.join(self.tmpdir, RUN_CONTAINER_FILE))
+        self.assertEqual(group, 'qf_results/bg')
+        self.assertEqual(name, 'img.tif.bg.tif')
+        self.assertIsNone(splitRunPath(os.path.join(self.tmpdir, 'img.tif')))
+
+    def testRoundTrip(self):
+        cache = os.path.join(self.tmpdir, 'qf_cache')
+        results = os.path.join(self.tmpdir, 'qf_results', 'bg')
+        rng = np.random.RandomState(0)
+        infos = {}
+        for i in range(20):
+            name = 'img_%02d.tif' % i
+            infos[name] = {'center': (i, 2 * i), 'avg_fold': rng.rand(8, 6).astype(np.float32), 'program_version': '1'}
+            writeCacheFile(os.path.join(cache, name + '.info'), infos[name])
+            writeContainerScalars(os.path.join(results, name), {'Sum': float(i)})
+        # written again : the frame keeps its index
+        infos['img_03.tif']['center'] = (-1, -1)
+        writeCacheFile(os.path.join(cache, 'img_03.tif.info'), infos['img_03.tif'])
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), [RUN_CONTAINER_FILE, RUN_CONTAINER_FILE + '.lock'])
+
+        for name in infos:
+            path = os.path.join(cache, name + '.info')
+            self.assertTrue(cacheExists(path))
+            info = readCacheFile(path)
+            self.assertEqual(info['center'], infos[name]['center'])
+            np.testing.assert_array_equal(info['avg_fold'], infos[name]['avg_fold'])
+        self.assertFalse(cacheExists(os.path.join(cache, 'other.tif.info')))
+
+        removeCacheFile(os.path.join(cache, 'img_05.tif.info'))
+        self.assertFalse(cacheExists(os.path.join(cache, 'img_05.tif.info')))
+        self.assertEqual(readContainerCache(os.path.join(cache, 'img_06.tif.info'))['center'], (6, 12))
+
+        scalars = readContainerScalars(results)
+        self.assertEqual(list(scalars.index), ['img_%02d.tif' % i for i in range(20)])
+        np.testing.assert_array_equal(scalars['Sum'].values, np.arange(20))
+        os.makedirs(results)
+        exportRunCsvs(self.tmpdir)
+        with open(os.path.join(results, 'background_sum.csv')) as f:
+            lines = f.read().split()
+        self.assertEqual(lines[0], 'Name,Sum')
+        self.assertEqual(lines[4], 'img_03.tif,3.0')
+
+    def testFramesAddedByOtherProcesses(self):
+        cache = os.path.join(self.tmpdir, 'qf_cache')
+        writeCacheFile(os.path.join(cache, 'a.tif.info'), {'n': 1})
+        self.assertEqual(readCacheFile(os.path.join(cache, 'a.tif.info')), {'n': 1})
+        code = "from musclex.utils.run_container import setRunContainer, writeCacheFile\n" \
+               "setRunContainer(True)\n" \
+               "writeCacheFile({}, {{'n': 2}})\n" \
+               "writeCacheFile({}, {{'n': 3}})\n".format(repr(os.path.join(cache, 'b.tif.info')), repr(os.path.join(cache, 'a.tif.info')))
+        proc = self.runInProcess(code)
+        self.assertEqual(proc.wait(), 0)
+        proc.stdout.close()
+        self.assertEqual(readCacheFile(os.path.join(cache, 'a.tif.info')), {'n': 3})
+        self.assertEqual(readCacheFile(os.path.join(cache, 'b.tif.info')), {'n': 2})
+        writeCacheFile(os.path.join(cache, 'c.tif.info'), {'n': 4})
+        self.assertEqual(readCacheFile(os.path.join(cache, 'b.tif.info')), {'n': 2})
+        self.assertEqual(readCacheFile(os.path.join(cache, 'c.tif.info')), {'n': 4})
+
+    def testOpening(self):
+        container = os.path.join(self.tmpdir, RUN_CONTAINER_FILE)
+        writeCacheFile(os.path.join(self.tmpdir, 'qf_cache', 'a.tif.info'), {'n': 1})
+        # waits until the container is closed by the other process
+        proc = self.runInProcess("import h5py, time\nf = h5py.File({}, 'a')\nprint('open', flush=True)\ntime.sleep(1)\nf.close()\n".format(repr(container)))
+        self.assertEqual(proc.stdout.readline().strip(), b'open')
+        start = time.time()
+        with openContainer(container, 'a') as f:
+            self.assertIn('qf_cache', f)
+        self.assertGreater(time.time() - start, 0.5)
+        proc.wait()
+        proc.stdout.close()
+        # other errors are raised at once
+        with self.assertRaises(OSError):
+            with openContainer(os.path.join(self.tmpdir, 'missing.h5'), 'r', 10):
+                pass
+        with open(container, 'wb') as f:
+            f.write(b'not an hdf5 file')
+        start = time.time()
+        with self.assertRaises(OSError):
+            with openContainer(container, 'a', 10):
+                pass
+        self.assertLess(time.time() - start, 5)
+
+    def testLockedError(self):
+        self.assertTrue(isFileLockedError(BlockingIOError(11, "Unable to open file (unable to lock file, errno = 11, error message = 'Resource temporarily unavailable')")))
+        self.assertTrue(isFileLockedError(OSError("Unable to open file (unable to lock file, errno = 11, error message = 'Resource temporarily unavailable')")))
+        # file systems without locks, waiting does not help
+        self.assertFalse(isFileLockedError(OSError(38, "Unable to open file (unable to lock file, errno = 38, error message = 'Function not implemented')")))
+        self.assertFalse(isFileLockedError(OSError("Unable to open file (unable to lock file, errno = 38, error message = 'Function not implemented')")))
+        self.assertFalse(isFileLockedError(FileNotFoundError(2, "Unable to open file (unable to open file: name = 'missing.h5', errno = 2)")))
+
+    def testConcurrentWritesWithoutHdf5Locking(self):
+        cache = os.path.join(self.tmpdir, 'qf_cache')
+        code = "import os\n" \
+               "from musclex.utils.run_container import setRunContainer, writeCacheFile\n" \
+               "setRunContainer(True)\n" \
+               "for i in range(30):\n" \
+               "    writeCacheFile(os.path.join({}, 'p{}_%02d.tif.info' % i), {{'n': i}})\n"
+        procs = [self.runInProcess(code.format(repr(cache), p), HDF5_USE_FILE_LOCKING='FALSE') for p in range(4)]
+        for proc in procs:
+            self.assertEqual(proc.wait(), 0)
+            proc.stdout.close()
+        # the writes of the processes are serialised by the lock file, no frame is lost
+        for p in range(4):
+            for i in range(30):
+                self.assertEqual(readContainerCache(os.path.join(cache, 'p%d_%02d.tif.info' % (p, i))), {'n': i})
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
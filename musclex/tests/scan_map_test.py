@@ -0,0 +1,126 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import io
+import unittest
+import numpy as np
+import pandas as pd
+from ..utils.scan_map import ScanMapAssembler
+
+def loopSelectRings(df_sum, df_rings, best, dist, col, max_dif, angle_sigma):
+    """
+    Maps of a scanning diffraction batch computed with the per-frame loop used before the rings were grouped
+    """
+    df_sum = df_sum.sort_values(['filename'], ascending=True)
+    maps = {k: {} for k in ('intensity', 'total intensity', 'peak intensity', 'angle', 'angle sigma', 'd-spacing')}
+    for _, row in df_sum.iterrows():
+        filename = str(row['filename'])
+        index = int(filename[filename.rfind('_') + 1:filename.rfind('.')])
+        maps['intensity'][index] = row['total intensity (hull)'] \
+                if 'total intensity (hull)' in row and not np.isnan(row['total intensity (hull)']) else \
+                row['total intensity']
+        maps['total intensity'][index] = row['total intensity']
+        all_rings = df_rings[(df_rings['filename'] == filename)]
+        peak_inten, d_spacing, angle, sigma = -1, 0, 0, 0
+        if len(all_rings) > 0:
+            distance_ok = True
+            if best:
+                all_rings = all_rings.sort_values(['angle fitting error'], ascending=True)
+                best_ring = all_rings.iloc[0]
+            else:
+                try:
+                    min_ind = min(np.arange(len(all_rings)), key=lambda ind: abs(float(all_rings.iloc[ind][col])-dist))
+                    if abs(float(all_rings.iloc[min_ind][col])-dist) > max_dif:
+                        distance_ok = False
+                except Exception:
+                    min_ind = 0
+                    distance_ok = False
+                best_ring = all_rings.iloc[min_ind]
+            if float(best_ring['angle fitting error']) < 1. and best_ring['angle sigma'] < angle_sigma and distance_ok:
+                peak_inten = float(best_ring['peak intensity']) if pd.notnull(best_ring['peak intensity']) else 0
+                angle = best_ring['angle'] if pd.notnull(best_ring['angle']) else 0
+                sigma = float(best_ring['angle sigma']) if pd.notnull(best_ring['angle sigma']) else 0
+                if pd.notnull(best_ring['d']) and best_ring['d'] != '-':
+                    d_spacing = float(best_ring['d'])
+                elif pd.notnull(best_ring['S']):
+                    d_spacing = float(best_ring['S'])
+        maps['peak intensity'][index] = peak_inten
+        maps['angle'][index] = angle
+        maps['angle sigma'][index] = sigma
+        maps['d-spacing'][index] = d_spacing
+    return maps
+
+def makeBatch(rng, nFrames, invalidDistance=False):
+    """
+    summary.csv and rings.csv of a synthetic batch, read back by pandas as the csv manager does
+    """
+    frames = ['scan_%05d.tif' % i for i in rng.permutation(nFrames) + 3]
+    sums = io.StringIO()
+    sums.write('filename,total intensity,total intensity (hull)\n')
+    for f in frames[:-5]: # the last positions have no frame
+        hull = '' if rng.rand() < .2 else '%.3f' % rng.uniform(0, 500)
+        sums.write('%s,%.3f,%s\n' % (f, rng.uniform(0, 1000), hull))
+    rings = io.StringIO()
+    rings.write('filename,S,d,peak intensity,angle,angle sigma,angle fitting error\n')
+    for f in frames:
+        for _ in range(rng.randint(0, 5)):
+            S = '%.2f' % rng.uniform(50, 150)
+            if invalidDistance and rng.rand() < .05:
+                S = '-'
+            elif rng.rand() < .05:
+                S = ''
+            d = '-' if rng.rand() < .3 else ('' if rng.rand() < .1 else '%.4f' % rng.uniform(1, 5))
+            error = '' if rng.rand() < .1 else '%.6f' % rng.uniform(0, 1.5)
+            peak = '' if rng.rand() < .1 else '%.2f' % rng.uniform(0, 100)
+            rings.write('%s,%s,%s,%s,%.3f,%.4f,%s\n' % (f, S, d, peak, rng.uniform(-90, 90), rng.uniform(0, 1.5), error))
+    sums.seek(0)
+    rings.seek(0)
+    return pd.read_csv(sums), pd.read_csv(rings)
+
+class ScanMapTest(unittest.TestCase):
+    def assertSameMaps(self, assembler, rings, expected, nPositions):
+        result = {'intensity': assembler.intensity, 'total intensity': assembler.total_intensity}
+        result.update(rings)
+        for key, values in expected.items():
+            self.assertEqual(assembler.toDict(result[key]), values, key)
+            grid = [float(values[i]) if i in values else -1 for i in range(3, nPositions + 3)]
+            np.testing.assert_array_equal(assembler.toGrid(result[key], nPositions, 3), grid)
+
+    def testSameAsLoop(self):
+        rng = np.random.RandomState(0)
+        for invalidDistance in (False, True):
+            df_sum, df_rings = makeBatch(rng, 200, invalidDistance)
+            assembler = ScanMapAssembler(df_sum, df_rings)
+            for best, dist, col, bandwidth, angle_sigma in ((True, 0., 'S', 0., 1.), (False, 100., 'S', 10., 1.),
+                                                            (False, 3., 'd', 0.5, 1.2), (True, 0., 'S', 0., 0.5)):
+                rings = assembler.selectRings(best=best, distance=dist, col=col, bandwidth=bandwidth, angle_sigma=angle_sigma)
+                expected = loopSelectRings(df_sum, df_rings, best, dist, col, bandwidth, angle_sigma)
+                self.assertSameMaps(assembler, rings, expected, 200)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,228 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import collections
+import numpy as np
+import fabio
+from pyFAI.azimuthalIntegrator import AzimuthalIntegrator
+from pyFAI.method_registry import IntegrationMethod
+from ..modules.ScanningDiffraction import ScanningDiffraction
+from ..utils.image_processor import getCenter, find_detector, distance
+
+def getSectorHistograms(sd, ranges):
+    """
+    Histograms of the sectors integrated one by one, as get_partial_integrations did before the sector bank
+    """
+    img = sd.original_image
+    center = sd.info['center']
+    corners = [(0, 0), (img.shape[1], 0), (0, img.shape[0]), (img.shape[1], img.shape[0])]
+    npt_rad = int(round(max([distance(center, c) for c in corners])))
+    ai = AzimuthalIntegrator(detector=find_detector(img))
+    ai.setFit2D(100, center[0], center[1])
+    integration_method = IntegrationMethod.select_one_available("csr", dim=1, default="csr", degradable=True)
+    return [ai.integrate1d(img, npt_rad, unit="r_mm", method=integration_method, azimuth_range=a_range)[1] for a_range in ranges]
+
+class LoopRunsScanningDiffraction(ScanningDiffraction):
+    """
+    Scanning Diffraction finding the runs and the rings of the central difference method row by row and
+    column by column, as it was done before the run detection was vectorized
+    """
+    def get_central_difference(self, I2D, h):
+        central = I2D * 2
+        right_shift = -1 * np.roll(I2D, -h, axis=1)
+        left_shift = -1 * np.roll(I2D, h, axis=1)
+        result_r = np.add(central, right_shift)
+        return np.add(result_r, left_shift)
+
+    def get_runs_from_image(self, central_difference):
+        runs = collections.defaultdict(list)
+        lenght_threshold = 60
+        value_threshold = np.median(central_difference, axis=0)
+        step = 10
+        for i in range(step, len(value_threshold) - step):
+            value_threshold[i] = np.mean(value_threshold[i - step:i + step])
+        value_threshold = [1 if v < 1 else v for v in value_threshold]
+        distance_threshold = 8
+
+        for c in range(central_difference.shape[1]):
+            run = []
+            last_pos = 0
+            for r in range(central_difference.shape[0]):
+                if central_difference[r][c] > value_threshold[c]:
+                    if r - last_pos > distance_threshold:
+                        if len(run) > lenght_threshold:
+                            line = [run[0], run[len(run) - 1]]
+                            runs[c].append(line)
+                        run = []
+
+                    last_pos = r
+                    run.append((r, c))
+            if len(run) > lenght_threshold:
+                line = [run[0], run[len(run) - 1]]
+                runs[c].append(line)
+        return runs
+
+    def group_runs_by_ring(self, runs):
+        result_rings = {}
+        distance_threshold = 1
+        i = 0
+        while i < self.original_image.shape[1]:
+            if i in runs:
+                dist = 0
+                start = i
+                end = i
+                for c in range(1, self.original_image.shape[1] - i):
+
+                    if i + c in runs:
+                        end = i + c
+                        dist = 0
+                    else:
+                        dist += 1
+
+                    if dist > distance_threshold:
+                        result_rings[(end + start) / 2] = (start, end)
+                        i += c
+                        break
+            i += 1
+
+        return result_rings
+
+class ScanningDiffractionTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.method = os.environ.get('MUSCLEX_INTEGRATION_METHOD')
+        os.environ['MUSCLEX_INTEGRATION_METHOD'] = 'csr'
+        inpath = os.path.join(os.path.dirname(__file__), "test_images", "di_test_data")
+        self.imgList = ['Mn23-1_30umThick_20umStep_1s_diffScan_0167.tif', 'Mn23-1_30umThick_20umStep_1s_diffScan_0312.tif']
+        for name in self.imgList:
+            shutil.copy(os.path.join(inpath, name), self.tmpdir)
+
+    def tearDown(self):
+        if self.method is None:
+            del os.environ['MUSCLEX_INTEGRATION_METHOD']
+        else:
+            os.environ['MUSCLEX_INTEGRATION_METHOD'] = self.method
+        shutil.rmtree(self.tmpdir)
+
+    def getObject(self, name):
+        sd = ScanningDiffraction(self.tmpdir, name)
+        sd.info['center'] = getCenter(sd.original_image)
+        return sd
+
+    def testPartialIntegrations(self):
+        """
+        The histograms of the sector bank are within the documented tolerance of the sectors integrated one by one
+        """
+        for name in self.imgList:
+            sd = self.getObject(name)
+            for angle, median, percentile in ((90, 0.002, 0.01), (10, 0.002, 0.03)):
+                ranges, histograms = sd.get_partial_integrations(angle)
+                # integrate1d truncates the ranges crossing 180 degrees
+                kept = [i for i, r in enumerate(ranges) if r[1] <= 180 or r[0] >= 180]
+                sectors = getSectorHistograms(sd, [ranges[i] if ranges[i][1] <= 180 else (ranges[i][0] - 360, ranges[i][1] - 360) for i in kept])
+                errors = []
+                for i, hist in zip(kept, sectors):
+                    self.assertEqual(histograms[i].shape, hist.shape)
+                    nonzero = hist[70:] != 0
+                    errors.append(np.abs(histograms[i][70:] - hist[70:])[nonzero] / np.abs(hist[70:])[nonzero])
+                errors = np.concatenate(errors)
+                self.assertLess(np.median(errors), median)
+                self.assertLess(np.percentile(errors, 99), percentile)
+
+    def assertSameRuns(self, info, expected):
+        """
+        Central difference method results are identical, including the order of the keys and the types
+        """
+        for key in ('m2_central_difference', 'central_log'):
+            self.assertEqual(info[key].dtype, expected[key].dtype)
+            np.testing.assert_array_equal(info[key], expected[key])
+        for key in ('m2_runs_dict', 'm2_rings'):
+            self.assertEqual(list(info[key].items()), list(expected[key].items()))
+            self.assertEqual([type(k) for k in info[key]], [type(k) for k in expected[key]])
+
+    def testCentralDifferenceRuns(self):
+        for name in self.imgList:
+            sd = self.getObject(name)
+            sd.get2DIntegrations()
+            loop = LoopRunsScanningDiffraction(self.tmpdir, name)
+            loop.info = {'tophat_2dintegration': sd.info['tophat_2dintegration']}
+            sd.processCentralDiffMethod()
+            loop.processCentralDiffMethod()
+            self.assertGreater(len(sd.info['m2_runs_dict']), 0)
+            self.assertSameRuns(sd.info, loop.info)
+
+        # synthetic ring maps : noisy columns with gaps, rings of different widths, up to the image border
+        rng = np.random.default_rng(0)
+        rings = 0
+        for t in range(20):
+            I2D = rng.random((360, 300)) * 10
+            for _ in range(int(rng.integers(1, 8))):
+                c = int(rng.integers(0, 300))
+                w = int(rng.integers(1, 12))
+                rows = rng.random(360) < rng.uniform(0.6, 1)
+                I2D[rows, c:c + w] += rng.uniform(50, 5000)
+            if t % 2:
+                I2D = I2D.astype(np.float32)
+            sd.info = {'tophat_2dintegration': [I2D]}
+            loop.info = {'tophat_2dintegration': [I2D]}
+            loop.original_image = sd.original_image = np.zeros((10, 300))
+            sd.processCentralDiffMethod()
+            loop.processCentralDiffMethod()
+            self.assertSameRuns(sd.info, loop.info)
+            rings += len(sd.info['m2_rings'])
+        self.assertGreater(rings, 20)
+
+    def testSectorBankKey(self):
+        sd = self.getObject(self.imgList[0])
+        bank = sd.getSectorBank()
+        self.assertIs(sd.getSectorBank(), bank)
+        # a new partial angle uses the same bank
+        sd.get_partial_integrations(30)
+        self.assertIs(sd.getSectorBank(), bank)
+        center = sd.info['center']
+        sd.info['center'] = (center[0] + 3, center[1])
+        moved = sd.getSectorBank()
+        self.assertIsNot(moved, bank)
+        self.assertIs(sd.getSectorBank(), moved)
+        # the shape of the image, the detector and the mask of the folder are part of the key
+        sd.original_image = sd.original_image[:-10]
+        cropped = sd.getSectorBank()
+        self.assertIsNot(cropped, moved)
+        sd.info['detector'] = 'pilatus1m'
+        self.assertIsNot(sd.getSectorBank(), cropped)
+        bank = sd.getSectorBank()
+        os.makedirs(os.path.join(self.tmpdir, 'settings'))
+        fabio.tifimage.tifimage(data=np.zeros(sd.original_image.shape, dtype=np.int32)).write(os.path.join(self.tmpdir, 'settings', 'mask.tif'))
+        self.assertIsNot(sd.getSectorBank(), bank)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -0,0 +1,145 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from ..utils.stage_graph import Stage, StageGraph
+from ..modules.QuadrantFolder import QuadrantFolder, getDefaultFlags
+
+class StageGraphTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.inpath = os.path.join(os.path.dirname(__file__), "test_images")
+        self.graph = StageGraph([
+            Stage('a', ['a'], params=['p']),
+            Stage('b', ['b'], inputs=['a'], params=lambda info: ['q'] if info.get('p') == 1 else ['r']),
+            Stage('c', ['c'], inputs=['b'], store='imgCache'),
+            Stage('d', ['d'], inputs=['a'])
+        ])
+        self.info = {'p': 1, 'q': 2, 'r': 3}
+        self.stores = {'info': self.info, 'imgCache': {}}
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def runAll(self):
+        """
+        Run all the stages, each result counts the runs of its stage
+        :return: names of the stages run
+        """
+        self.graph.resetReport()
+        for name in self.graph.order:
+            store = self.stores[self.graph.stages[name].store]
+            self.graph.run(self.stores, name, lambda: store.update({name: store.get(name, 0) + 1}))
+        return self.graph.ran
+
+    def testGraph(self):
+        with self.assertRaises(ValueError):
+            StageGraph([Stage('b', ['b'], inputs=['a'])])
+        self.assertEqual(self.graph.getDependents('a'), ['b', 'c', 'd'])
+        self.assertEqual(self.graph.getDependents('b'), ['c'])
+        self.assertEqual(self.runAll(), ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.runAll(), [])
+        self.assertEqual(self.graph.getReport(), "Stages run : none, skipped : a, b, c, d")
+        # a parameter used by the stage
+        self.info['q'] = 5
+        self.assertEqual(self.runAll(), ['b', 'c'])
+        # a parameter not used with the current value of p
+        self.info['r'] = 5
+        self.assertEqual(self.runAll(), [])
+        self.info['p'] = 2
+        self.assertEqual(self.runAll(), ['a', 'b', 'c', 'd'])
+        self.assertEqual(self.info['a'], 2)
+        self.assertEqual(self.stores['imgCache']['c'], 1)
+        self.graph.invalidate(self.stores, 'b', dependentsOnly=True)
+        self.assertIn('b', self.info)
+        self.assertNotIn('c', self.stores['imgCache'])
+        self.assertEqual(self.runAll(), ['c'])
+        self.graph.invalidate(self.stores, 'a')
+        self.assertNotIn('a', self.info['stage_params'])
+        self.assertEqual(self.runAll(), ['a', 'b', 'c', 'd'])
+
+    def testSeed(self):
+        self.runAll()
+        # results without recorded parameters are produced again
+        del self.info['stage_params']['b']
+        self.assertEqual(self.runAll(), ['b', 'c'])
+        # results set by the caller are kept once seeded, the stages after them are produced again
+        self.info['b'] = 10
+        self.graph.seed(self.stores, 'b')
+        self.assertNotIn('c', self.stores['imgCache'])
+        self.assertEqual(self.runAll(), ['c'])
+        self.assertEqual(self.info['b'], 10)
+        self.graph.invalidate(self.stores, 'c')
+        with self.assertRaises(ValueError):
+            self.graph.seed(self.stores, 'c')
+        self.info['q'] = 7
+        self.assertEqual(self.runAll(), ['b', 'c'])
+        self.assertEqual(self.info['b'], 11)
+
+    def assertSameResults(self, qf, fresh):
+        for key in ('center', 'rotationAngle', 'rmin', 'rmax'):
+            self.assertEqual(qf.info[key], fresh.info[key])
+        for key in ('avg_fold', 'bgimg1', 'bgimg2'):
+            np.testing.assert_array_equal(qf.info[key], fresh.info[key])
+        np.testing.assert_array_equal(qf.imgCache['resultImg'], fresh.imgCache['resultImg'])
+
+    def testQuadrantFolder(self):
+        """
+        Results kept by the graph after a change of settings (in the same object as in the GUI, or loaded
+        from the cache) are the results of a new processing
+        """
+        shutil.copy(os.path.join(self.inpath, 'P40_1_3_00000.tif'), self.tmpdir)
+        qf = QuadrantFolder(self.tmpdir, 'P40_1_3_00000.tif', None)
+        flags = getDefaultFlags(qf.orig_img)
+        flags.update({'orientation_model': 0, 'ignore_folds': set(), 'fold_image': True, 'bgsub': 'White-top-hats'})
+        qf.process(dict(flags))
+        changes = [({'sigmoid': 0.2}, ['BgSubFold', 'resultImg']),
+                   ({'fwhm': 5}, []), # parameter of an unused method
+                   ({'tophat1': 8}, ['bgimg1', 'BgSubFold', 'resultImg']),
+                   ({'bgsub': 'None'}, ['bgimg1', 'bgimg2', 'BgSubFold', 'resultImg']),
+                   ({'ignore_folds': {1}}, ['avg_fold', 'rminmax', 'bgimg1', 'bgimg2', 'BgSubFold', 'resultImg'])]
+        for change, ran in changes:
+            flags.update(change)
+            qf.process(dict(flags))
+            self.assertEqual(qf.stages.ran, ran)
+            fresh = QuadrantFolder(self.tmpdir, 'P40_1_3_00000.tif', None)
+            fresh.info = {}
+            fresh.process(dict(flags, no_cache=True))
+            self.assertSameResults(qf, fresh)
+            # a new object on the same image, loading the cache (BgSubFold and resultImg are not in it)
+            cached = QuadrantFolder(self.tmpdir, 'P40_1_3_00000.tif', None)
+            cached.process(dict(flags))
+            self.assertEqual(cached.stages.ran, ['BgSubFold', 'resultImg'])
+            self.assertSameResults(cached, fresh)
+
+if __name__=="__main__":
+    unittest.main(verbosity=2)
@@ -41,6 +41,8 @@ from .pyqt_utils import *
 from ..utils.file_manager import fullPath, ifHdfReadConvertless, createFolder, isImg
 from ..utils.image_processor import calcSlope, getIntersectionOfTwoLines, getPerpendicularLineHomogenous, processImageForIntCenter, getRotationAngle, getCenter, getNewZoom, rotateImage, averageImages
 from ..CalibrationSettings import CalibrationSettings
+from ..utils.image_prefetcher import ImagePrefetcher, readImageData
+from ..utils.result_writer import getResultWriter
 
 class AddIntensitiesMultExp(QMainWindow):
     """
@@ -68,6 +70,7 @@ class AddIntensitiesMultExp(QMainWindow):
         self.default_img_zoom = None # default zoom calculated after processing image
         self.dir_path = ""
         self.stop_process = False
+        self.prefetcher = ImagePrefetcher(maxSize=32) # reads the next images in background
         self.nbOfExposures = 0
         self.function = None
         self.resultAxes = None
@@ -1834,8 +1837,11 @@ class AddIntensitiesMultExp(QMainWindow):
                 self.orig_imgs.append(image.astype(np.float32))
                 self.orig_img_names.append(self.numberToFilesMap[self.currentFileNumber][i])
             else:
-                self.orig_imgs.append(fabio.open(self.numberToFilesMap[self.currentFileNumber][i]).data.astype(np.float32))
+                self.orig_imgs.append(readImageData(self.numberToFilesMap[self.currentFileNumber][i]).astype(np.float32))
                 self.orig_img_names.append(os.path.split(self.numberToFilesMap[self.currentFileNumber][i])[1])
+        if not self.isHdf5:
+            nextFiles = self.numberToFilesMap.get((self.currentFileNumber + 1) % len(self.numberToFilesMap), [])
+            self.prefetcher.prefetchFiles(nextFiles[:self.nbOfExposures])
         self.init_imgs = copy.copy(self.orig_imgs)
         self.imgDetailOnStatusBar.setText(
             str(self.orig_imgs[0].shape[0]) + 'x' + str(self.orig_imgs[0].shape[1]) + ' : ' + str(self.orig_imgs[0].dtype))
@@ -2178,7 +2184,7 @@ class AddIntensitiesMultExp(QMainWindow):
                 filename += '_'
         filename += 'res_' + str(key).zfill(5) + '.tif'
         result_file = os.path.join(dir_path, 'aime_results', filename)
-        fabio.tifimage.tifimage(data=sum_img).write(result_file)
+        getResultWriter().submitImage(result_file, sum_img, 'none')
         print('Saved ', result_file)
         print('Resulting image shape ', sum_img.shape)
         return sum_img
@@ -2200,7 +2206,7 @@ def addIntensities(numberToFilesMap, dir_path):
                 img = resizeImage(img, sum_img.shape)
             sum_img += img
         result_file = os.path.join(dir_path, 'aime_results', 'res_' + str(key).zfill(5) + '.tif')
-        fabio.tifimage.tifimage(data=sum_img).write(result_file)
+        getResultWriter().submitImage(result_file, sum_img, 'none')
         print('Saved ', result_file)
         print('Resulting image shape ', sum_img.shape)
 
@@ -41,6 +41,8 @@ from .pyqt_utils import *
 from ..utils.file_manager import ifHdfReadConvertless, createFolder, getFilesAndHdf
 from ..utils.image_processor import calcSlope, getIntersectionOfTwoLines, getPerpendicularLineHomogenous, processImageForIntCenter, getRotationAngle, getCenter, getNewZoom, rotateImage, averageImages
 from ..CalibrationSettings import CalibrationSettings
+from ..utils.image_prefetcher import ImagePrefetcher, readImageData
+from ..utils.result_writer import getResultWriter, getResultCodec
 
 class AddIntensitiesSingleExp(QMainWindow):
     """
@@ -66,6 +68,7 @@ class AddIntensitiesSingleExp(QMainWindow):
         self.default_img_zoom = None # default zoom calculated after processing image
         self.dir_path = ""
         self.stop_process = False
+        self.prefetcher = ImagePrefetcher(maxSize=32) # reads the next group in background
         self.nbOfFrames = 3
         self.nbOfGroups = 1
         self.function = None
@@ -707,11 +710,8 @@ class AddIntensitiesSingleExp(QMainWindow):
                     self.avg_img = sum_img
                 print('Saving merged image...')
                 self.statusPrint('Saving merged image...')
-                if self.compressChkBx.isChecked():
-                    tif_img = Image.fromarray(self.avg_img)
-                    tif_img.save(os.path.join(output, filename), compression='tiff_lzw')
-                else:
-                    fabio.tifimage.tifimage(data=self.avg_img).write(os.path.join(output, filename))
+                codec = getResultCodec({'compressed': self.compressChkBx.isChecked()})
+                getResultWriter().submitImage(os.path.join(output, filename), self.avg_img, codec)
 
             self.refreshAllTab()
             print("Done. Result image have been saved to "+output)
@@ -1918,7 +1918,11 @@ class AddIntensitiesSingleExp(QMainWindow):
                     frame = series.get_frame(i).data
                 self.orig_imgs.append(ifHdfReadConvertless(self.img_list[i], frame).astype(np.float32))
             else:
-                self.orig_imgs.append(fabio.open(os.path.join(self.dir_path, self.img_list[i])).data.astype(np.float32))
+                self.orig_imgs.append(readImageData(os.path.join(self.dir_path, self.img_list[i])).astype(np.float32))
+        if not self.isHdf5:
+            start = self.nbOfFrames*((self.currentGroupNumber + 1) % self.nbOfGroups)
+            end = min(len(self.img_list), start + self.nbOfFrames)
+            self.prefetcher.prefetchFiles([os.path.join(self.dir_path, self.img_list[i]) for i in range(start, end)])
         self.init_imgs = copy.copy(self.orig_imgs)
         self.imgDetailOnStatusBar.setText(
             str(self.orig_imgs[0].shape[0]) + 'x' + str(self.orig_imgs[0].shape[1]) + ' : ' + str(self.orig_imgs[0].dtype))
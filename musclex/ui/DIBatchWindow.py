@@ -41,6 +41,8 @@ from .pyqt_utils import *
 from ..utils.file_manager import *
 from ..modules.ScanningDiffraction import *
 from ..csv_manager import DI_CSVManager
+from ..utils.scan_map import ScanMapAssembler
+from ..utils.image_prefetcher import getFileStamp
 from .DIImageWindow import DIImageWindow
 
 matplotlib.rcParams.update({'font.size': 5})
@@ -257,6 +259,9 @@ class DIBatchWindow(QMainWindow):
         self.coord_dict = {}
         self.hdf_filename = ""
         self.hdf_data = np.array([])
+        self.hdf_stamp = None
+        self.mapAssembler = None # rings of the batch grouped by frame, kept until the csv files are modified
+        self.mapAssembler_stamp = None
         self.xyIntensity = []
         self.xylim = []
         self.max_int = None
@@ -1233,113 +1238,60 @@ class DIBatchWindow(QMainWindow):
 
     def processBatchmodeResults(self):
         """
-        Process the batch results
+        Process the batch results. The csv files and the scan coordinates are only read again if they have been
+        modified, changing the options of the maps only selects the rings again from the cached results.
         """
         QApplication.setOverrideCursor(Qt.WaitCursor)
         dir_path = self.filePath
-        self.csvManager.load_all()
         hdf_filename = self.hdf_filename
         csv_filename = self.csvManager.sum_file
         self.updateStatusBar(text='Dir : ' + dir_path + '\nHDF : ' + hdf_filename + '\nCSV : ' + csv_filename)
-        df_sum = self.csvManager.df_sum.copy()
-        df_sum = df_sum.sort_values(['filename'], ascending=True)
-        df_rings = self.csvManager.df_rings
+        csv_stamp = (csv_filename, getFileStamp(csv_filename), getFileStamp(self.csvManager.rings_file))
+        if self.mapAssembler is None or self.mapAssembler_stamp != csv_stamp:
+            self.csvManager.load_all()
+            self.mapAssembler = ScanMapAssembler(self.csvManager.df_sum, self.csvManager.df_rings)
+            self.mapAssembler_stamp = csv_stamp
+        assembler = self.mapAssembler
         self.angle_sigma=1
 
         self.angle_sigma=self.aSigmaSpnBx.value()
 
-        # Read intensity from csv to organize the info given
-        self.name_dict = {}
-        self.intensity_dict = {}
-        self.sim_inten_dict = {}
-        self.peak_intensity_dict = {}
-        self.distance_dict = {}
-        self.angrange_dict = {}
-        self.orientation_dict = {}
+        # Select the ring of each frame : best fitted ring, or ring closest to the distance
+        # Add ring model if its error < 1. and sigma < 1. (prevent uniform ring)
+        col = 'S' if str(self.unitChoice.currentText()) == 'pixel' else 'd'
+        rings = assembler.selectRings(best=self.bestRadio.isChecked(), distance=self.distanceSpnBx.value(), col=col,
+                                      bandwidth=self.bandwidthSpnBx.value(), angle_sigma=self.angle_sigma)
+
+        self.name_dict = dict(zip(assembler.indexes.tolist(), assembler.filenames.tolist()))
+        self.intensity_dict = assembler.toDict(assembler.intensity)
+        self.sim_inten_dict = assembler.toDict(assembler.total_intensity)
+        self.peak_intensity_dict = assembler.toDict(rings['peak intensity'])
+        self.distance_dict = assembler.toDict(rings['d-spacing'])
+        self.angrange_dict = assembler.toDict(rings['angle sigma'])
+        self.orientation_dict = assembler.toDict(rings['angle'])
         self.fit_dict = {}
         self.fitcd_dict = {}
 
-        for i, row in df_sum.iterrows():
-            filename = str(row['filename'])
-            start_ind = filename.rfind('_')
-            end_ind = filename.rfind('.')
-            index = int(row['filename'][start_ind + 1:end_ind])
-            self.name_dict[index] = row['filename']
-            self.intensity_dict[index] = row['total intensity (hull)'] \
-                    if 'total intensity (hull)' in row and not np.isnan(row['total intensity (hull)']) else \
-                    row['total intensity']
-            self.sim_inten_dict[index] = row['total intensity']
-
-            # Add ring model if its error < 1. and sigma < 1. (prevent uniform ring)
-            all_rings = df_rings[(df_rings['filename'] == filename) ]
-
-            if len(all_rings) > 0:
-                distance_ok = True
-                if self.bestRadio.isChecked():
-                    all_rings = all_rings.sort_values(['angle fitting error'], ascending=True)
-                    best_ring = all_rings.iloc[0]
-                else:
-                    dist = self.distanceSpnBx.value()
-                    unit = str(self.unitChoice.currentText())
-                    if unit == 'pixel':
-                        col = 'S'
-                    else:
-                        col = 'd'
-                    try:
-                        min_ind = min(np.arange(len(all_rings)), key=lambda ind: abs(float(all_rings.iloc[ind][col])-dist)) # Find closest ring to distance
-                        max_dif = self.bandwidthSpnBx.value()
-                        if abs(float(all_rings.iloc[min_ind][col])-dist) > max_dif:
-                            distance_ok = False
-                    except Exception:
-                        print(f"WARNING : Unable to find the closest ring to the specified d-spacing for image {row['filename']}")
-                        min_ind = 0
-                        distance_ok = False
-                    best_ring = all_rings.iloc[min_ind]
-
-                good_model = float(best_ring['angle fitting error']) < 1. and best_ring['angle sigma'] <self.angle_sigma and distance_ok
-                peak_inten = -1
-                d_spacing = 0
-                angle = 0
-                angle_sigma = 0
-
-                if good_model:
-                    peak_inten = float(best_ring['peak intensity']) if pd.notnull(best_ring['peak intensity']) else 0
-                    angle = best_ring['angle'] if pd.notnull(best_ring['angle']) else 0
-                    angle_sigma = float(best_ring['angle sigma']) if pd.notnull(best_ring['angle sigma']) else 0
-                    if pd.notnull(best_ring['d']) and best_ring['d'] != '-':
-                        d_spacing = float(best_ring['d'])
-                    elif pd.notnull(best_ring['S']):
-                        d_spacing = float(best_ring['S'])
-
-                self.peak_intensity_dict[index] = peak_inten
-                self.orientation_dict[index] = angle
-                self.angrange_dict[index] = angle_sigma
-                self.distance_dict[index] = d_spacing
-            else:
-                self.peak_intensity_dict[index] = -1
-                self.orientation_dict[index] = 0
-                self.angrange_dict[index] = 0
-                self.distance_dict[index] = 0
-
         self.init_number = min(self.name_dict.keys())
 
         # Read hdf5 file to get the coordinates and image shape
-        self.hdf_data = self.get_scan_data(hdf_filename)
-        self.coord_dict = {}
-
-        for i in range(self.init_number, len(self.hdf_data) + self.init_number):
-            self.coord_dict[i] = (self.hdf_data[i - self.init_number][0], self.hdf_data[i - self.init_number][1])
-        nCols = len(self.hdf_data) # 1D Scan
-        for i in range(self.init_number + 1, len(self.hdf_data) + self.init_number):
-            if abs(self.coord_dict[i][1] - self.coord_dict[i - 1][1]) != 0:
-                nCols = i - self.init_number
-                break
+        hdf_stamp = (hdf_filename, getFileStamp(hdf_filename))
+        if self.hdf_stamp != hdf_stamp:
+            self.hdf_data = self.get_scan_data(hdf_filename)
+            self.hdf_stamp = hdf_stamp
+        nPositions = len(self.hdf_data)
+        coords = np.asarray(self.hdf_data, dtype=np.float64).reshape(nPositions, -1)
+        self.coord_dict = dict(zip(range(self.init_number, nPositions + self.init_number), map(tuple, coords[:, :2].tolist())))
+        nCols = nPositions # 1D Scan
+        newRows = np.flatnonzero(np.diff(coords[:, 1]) != 0) if nPositions > 1 else []
+        if len(newRows) > 0:
+            nCols = int(newRows[0]) + 1
         if nCols != 0:
-            nRows = int(len(self.hdf_data) / nCols)
+            nRows = int(nPositions / nCols)
         else :
             nRows = 0
-        all_xs = np.reshape(np.array([v[0] for k, v in self.coord_dict.items()]), (nRows, nCols))
-        all_ys = np.reshape(np.array([v[1] for k, v in self.coord_dict.items()]), (nRows, nCols))
+        all_xs = np.reshape(coords[:, 0], (nRows, nCols))
+        all_ys = np.reshape(coords[:, 1], (nRows, nCols))
         x = np.mean(all_xs, axis=0)
         y = np.mean(all_ys, axis=1)
 
@@ -1352,18 +1304,11 @@ class DIBatchWindow(QMainWindow):
         else:
             y_grad = 0
 
-        # Plot heatmap for intensity
-        z = [float(self.intensity_dict[i]) if i in self.intensity_dict else -1 for i in
-             range(self.init_number, len(self.hdf_data) + self.init_number)]
-        simp_z = [float(self.sim_inten_dict[i]) if i in self.sim_inten_dict else -1 for i in
-             range(self.init_number, len(self.hdf_data) + self.init_number)]
-        dist_z = [float(self.distance_dict[i]) if i in self.distance_dict else -1 for i in
-             range(self.init_number, len(self.hdf_data) + self.init_number)]
-        # z = np.array([z[i:i + x_max] for i in range(0, , x_max)])
-        # z = cv2.blur(z, (4,4))
-        # intensity = np.array(z)
-        ring_z = [float(self.peak_intensity_dict[i]) if i in self.peak_intensity_dict else -1 for i in
-             range(self.init_number, len(self.hdf_data) + self.init_number)]
+        # Plot heatmap for intensity, the frames are placed at their scan position
+        z = assembler.toGrid(assembler.intensity, nPositions, self.init_number)
+        simp_z = assembler.toGrid(assembler.total_intensity, nPositions, self.init_number)
+        dist_z = assembler.toGrid(rings['d-spacing'], nPositions, self.init_number)
+        ring_z = assembler.toGrid(rings['peak intensity'], nPositions, self.init_number)
         intensity = np.reshape(z, (len(y), len(x)))
         simp_intensity = np.reshape(simp_z, (len(y), len(x)))
         ring_intensity = np.reshape(ring_z, (len(y), len(x)))
@@ -45,6 +45,9 @@ from ..modules.ScanningDiffraction import *
 from ..CalibrationSettings import CalibrationSettings
 from ..csv_manager import DI_CSVManager
 from .BlankImageSettings import BlankImageSettings
+from .batch_engine import BatchEngine
+from .image_view import PyramidImageView
+from ..utils.image_prefetcher import ImagePrefetcher
 
 class DSpacingScale(mscale.ScaleBase):
     """
@@ -209,6 +212,8 @@ class DIImageWindow(QMainWindow):
         self.pixelDataFile = None
         self.flags = {}
         self.stop_process = False
+        self.batchEngine = None
+        self.prefetcher = ImagePrefetcher() # reads the next images in background
         self.intensityRange = []
         self.updatingUI = False
         self.m1_selected_range = 0
@@ -271,6 +276,7 @@ class DIImageWindow(QMainWindow):
         self.displayImgFigure = plt.figure()
         self.displayImgAxes = self.displayImgFigure.add_subplot(111)
         self.displayImgCanvas = FigureCanvas(self.displayImgFigure)
+        self.displayImgView = PyramidImageView(self.displayImgAxes)
         self.imageOptionsFrame = QFrame()
         self.imageOptionsFrame.setFixedWidth(400)
         self.imageOptionsLayout = QVBoxLayout()
@@ -967,6 +973,8 @@ class DIImageWindow(QMainWindow):
                 self.processFolder()
         else:
             self.stop_process = True
+            if self.batchEngine is not None:
+                self.batchEngine.stop()
 
     def processFolder(self):
         """
@@ -1034,17 +1042,55 @@ class DIImageWindow(QMainWindow):
             self.logger.addHandler(handler)
             self.logger.addFilter(logging.Filter(name='di'))
 
-            ## Process all images and update progress bar
+            ## Process all images in worker processes and update progress bar
             self.in_batch_process = True
             self.stop_process = False
-            for i in range(nImg):
-                if self.stop_process:
-                    break
-                self.nextImage()
-                self.progressBar.setValue(i)
-                QApplication.processEvents()
+            self.batchEngine = BatchEngine('di', self.filePath, self.imgList, self.fileList, self.ext,
+                                           settings=flags, parent=self)
+            self.batchEngine.progress.connect(self.batchProgress)
+            self.batchEngine.refreshRequested.connect(self.batchRefresh)
+            self.batchEngine.imageFailed.connect(self.batchImageFailed)
+            self.batchEngine.batchFinished.connect(self.batchFinished)
+            self.batchEngine.start()
+            return
+
+        self.batchFinished(False)
+
+    def batchProgress(self, done, total):
+        """
+        Triggered when an image of the folder has been processed by the batch engine
+        :param done: number of images processed
+        :param total: number of images in the folder
+        """
+        self.progressBar.setValue(done)
+
+    def batchRefresh(self, index):
+        """
+        Display an image processed by the batch engine (not every image is displayed during the batch)
+        :param index: index of the image in the folder
+        """
+        if self.batchEngine is not None:
+            self.currentFileNumber = index
+            # the worker has written the results, the window only displays them
+            self.onImageChanged(readOnly=True)
+
+    def batchImageFailed(self, index, name, msg):
+        """
+        Triggered when an image of the folder could not be processed by the batch engine
+        """
+        print("Error while processing " + name + " :\n" + msg)
+
+    def batchFinished(self, completed):
+        """
+        Triggered when the processing of the folder is done or stopped, display the results of the current image
+        :param completed: True if all the images have been processed
+        """
+        if self.batchEngine is not None:
+            self.batchEngine.wait()
+            self.batchEngine = None
             self.in_batch_process = False
-            self.folder_processed = True
+            self.folder_processed = completed
+            self.onImageChanged()
         else:
             self.folder_processed = False
 
@@ -1069,6 +1115,11 @@ class DIImageWindow(QMainWindow):
         """
         Close event
         """
+        if self.batchEngine is not None:
+            self.batchEngine.stop()
+            self.batchEngine.wait()
+            self.batchEngine = None
+        self.prefetcher.shutdown()
         if self.mainWin is not None:
             self.mainWin.removeWidget(self)
 
@@ -1137,6 +1188,7 @@ class DIImageWindow(QMainWindow):
         if imgList is not None:
             self.imgList = imgList
         else:
+            self.prefetcher.invalidate()
             self.filePath, self.imgList, self.currentFileNumber, self.fileList, self.ext = getImgFiles(self.fullPath)
             # self.imgList, _ = getFilesAndHdf(self.filePath)
 
@@ -1148,21 +1200,27 @@ class DIImageWindow(QMainWindow):
         # else:
         #     self.currentFileNumber = 0
 
-    def onImageChanged(self):
+    def onImageChanged(self, readOnly=False):
         """
         When the image is changed, process the scanning diffraction again
+        :param readOnly: only display the image from its cache, nothing is written (cache and csv files)
         """
         fileName = self.imgList[self.currentFileNumber]
         self.filenameLineEdit.setText(fileName)
         fileFullPath = fullPath(self.filePath, fileName)
         self.updateStatusBar(fileFullPath+' ('+str(self.currentFileNumber+1)+'/'+str(self.numberOfFiles)+') is processing ...')
         self.cirProj = ScanningDiffraction(self.filePath, fileName, self.fileList, self.ext, logger=self.logger)
+        if self.batchEngine is None:
+            self.prefetcher.prefetch(self.filePath, self.imgList, self.currentFileNumber, 'di_cache', self.ext)
 
         self.setMinMaxIntensity(self.cirProj.original_image, self.minInt, self.maxInt, self.minIntLabel, self.maxIntLabel)
         # Calculating grid lines to exclude in pixel data computation
         grid_lines = np.where(self.cirProj.original_image < 0)
         if self.rotation90ChkBx.isEnabled():
             self.rotation90ChkBx.setChecked('90rotation' in self.cirProj.info and self.cirProj.info['90rotation'])
+        if readOnly:
+            self.displayCachedImage()
+            return
         self.processImage(True)
         self.updateStatusBar(fileFullPath + ' (' + str(self.currentFileNumber + 1) + '/' + str(
             self.numberOfFiles) + ') is processed.')
@@ -1182,6 +1240,19 @@ class DIImageWindow(QMainWindow):
             self.refreshAllTabs()
             self.updateUI()
 
+    def displayCachedImage(self):
+        """
+        Display the results of the current image from its cache without writing anything (cache and csv files),
+        the results are the ones written by the worker which processed the image
+        """
+        if self.cirProj is not None:
+            self.flags = self.getFlags(True)
+            self.flags['no_cache'] = True
+            self.cirProj.process(self.flags)
+            self.updateParams()
+            self.refreshAllTabs()
+            self.updateUI()
+
     def create_circular_mask(self, h, w, center, radius):
         """
         Create a circular mask
@@ -1460,11 +1531,11 @@ class DIImageWindow(QMainWindow):
 
         #img = getBGR(get8bitImage(img, min=self.minInt.value(), max=self.maxInt.value()))
         ax = self.displayImgAxes
-        ax.cla()
+        self.displayImgView.clearOverlays()
         if self.logScaleIntChkBx.isChecked():
-            ax.imshow(img, cmap='gray', norm=LogNorm(vmin=max(1, self.minInt.value()), vmax=self.maxInt.value()))
+            self.displayImgView.show(img, max(1, self.minInt.value()), self.maxInt.value(), logScale=True)
         else:
-            ax.imshow(img, cmap='gray', norm=Normalize(vmin=self.minInt.value(), vmax=self.maxInt.value()))
+            self.displayImgView.show(img, self.minInt.value(), self.maxInt.value())
         ax.set_facecolor('black')
 
         if self.rotation90ChkBx.isEnabled():
@@ -49,6 +49,9 @@ from ..modules.EquatorImage import EquatorImage, getCardiacGraph
 from ..csv_manager import EQ_CSVManager
 from ..ui.EQ_FittingTab import EQ_FittingTab
 from .BlankImageSettings import BlankImageSettings
+from .batch_engine import BatchEngine
+from .image_view import PyramidImageView
+from ..utils.image_prefetcher import ImagePrefetcher
 
 class EquatorWindow(QMainWindow):
     """
@@ -85,6 +88,8 @@ class EquatorWindow(QMainWindow):
         self.newImgDimension = None
         self.plot_min = None
         self.stop_process = False
+        self.batchEngine = None # BatchEngine processing the current folder in background
+        self.prefetcher = ImagePrefetcher() # reads the next images in background
         self.doubleZoomPt = None
         self.chordpoints = []
         self.chordLines = []
@@ -172,6 +177,7 @@ class EquatorWindow(QMainWindow):
         self.displayImgAxes = self.displayImgFigure.add_subplot(111)
         self.imageVLayout = QVBoxLayout()
         self.displayImgCanvas = FigureCanvas(self.displayImgFigure)
+        self.displayImgView = PyramidImageView(self.displayImgAxes)
         self.imageVLayout.addWidget(self.displayImgCanvas)
 
         self.imgDispOptionGrp = QGroupBox('Display Options')
@@ -1468,6 +1474,8 @@ class EquatorWindow(QMainWindow):
                 self.processFolder()
         else:
             self.stop_process = True
+            if self.batchEngine is not None:
+                self.batchEngine.stop()
 
     def h5batchProcBtnToggled(self):
         """
@@ -1562,18 +1570,56 @@ class EquatorWindow(QMainWindow):
             # Display progress bar
             self.progressBar.setMaximum(nImg)
             self.progressBar.setMinimum(0)
+            self.progressBar.setValue(0)
             self.progressBar.setVisible(True)
 
-            ## Process all images and update progress bar
+            ## Process all images in background processes (same as headless), the progress bar is updated by the signals
             self.in_batch_process = True
             self.stop_process = False
-            for i in range(nImg):
-                if self.stop_process:
-                    break
-                self.progressBar.setValue(i)
-                QApplication.processEvents()
-                self.nextImageFitting(True)
+            self.batchEngine = BatchEngine('eq', self.dir_path, self.imgList, self.fileList, self.ext, settings=settings, delcache=True, parent=self)
+            self.batchEngine.progress.connect(self.batchProgress)
+            self.batchEngine.refreshRequested.connect(self.batchRefresh)
+            self.batchEngine.imageFailed.connect(self.batchImageFailed)
+            self.batchEngine.batchFinished.connect(self.batchFinished)
+            self.batchEngine.start()
+            return
+
+        self.batchFinished(False)
+
+    def batchProgress(self, done, total):
+        """
+        Triggered when an image of the folder has been processed by the batch engine
+        :param done: number of images processed
+        :param total: number of images in the folder
+        """
+        self.progressBar.setValue(done)
+
+    def batchRefresh(self, index):
+        """
+        Display an image processed by the batch engine (not every image is displayed during the batch)
+        :param index: index of the image in the folder
+        """
+        if self.batchEngine is not None:
+            self.currentImg = index
+            # the worker has written the results, the window only displays them
+            self.onImageChanged(readOnly=True)
+
+    def batchImageFailed(self, index, name, msg):
+        """
+        Triggered when an image of the folder could not be processed by the batch engine
+        """
+        print("Error while processing " + name + " :\n" + msg)
+
+    def batchFinished(self, completed):
+        """
+        Triggered when the processing of the folder is done or stopped, display the results of the current image
+        :param completed: True if all the images have been processed
+        """
+        if self.batchEngine is not None:
+            self.batchEngine.wait()
+            self.batchEngine = None
             self.in_batch_process = False
+            self.onImageChanged()
 
         self.progressBar.setVisible(False)
         self.processFolderButton.setChecked(False)
@@ -3051,6 +3097,11 @@ class EquatorWindow(QMainWindow):
         """
         Trigger when window is closed
         """
+        if self.batchEngine is not None:
+            self.batchEngine.stop()
+            self.batchEngine.wait()
+            self.batchEngine = None
+        self.prefetcher.shutdown()
         # delete window object from main window
         if self.logger is not None:
             self.logger.popup()
@@ -3130,13 +3181,14 @@ class EquatorWindow(QMainWindow):
 
         self.syncUI = False
 
-    def onImageChanged(self):
+    def onImageChanged(self, readOnly=False):
         """
         Need to be called when image is change i.e. to the next image.
         This will create a new EquatorImage object for the new image and syncUI if cache is available
         Process the new image if there's no cache.
+        :param readOnly: only display the image from its cache, nothing is written (cache and csv files)
         """
-        if self.fixedFittingParamChanged(self.getSettings()):
+        if not readOnly and self.fixedFittingParamChanged(self.getSettings()):
             print("Refitting current image first")
             self.refitting()
 
@@ -3145,6 +3197,8 @@ class EquatorWindow(QMainWindow):
         self.filenameLineEdit2.setText(fileName)
         # prevInfo = self.bioImg.info if self.bioImg is not None else None
         self.bioImg = EquatorImage(self.dir_path, fileName, self, self.fileList, self.ext)
+        if self.batchEngine is None:
+            self.prefetcher.prefetch(self.dir_path, self.imgList, self.currentImg, 'eq_cache', self.ext)
         self.bioImg.skeletalVarsNotSet = not ('isSkeletal' in self.bioImg.info and self.bioImg.info['isSkeletal'])
         self.bioImg.extraPeakVarsNotSet = not ('isExtraPeak' in self.bioImg.info and self.bioImg.info['isExtraPeak'])
         settings = None
@@ -3164,7 +3218,9 @@ class EquatorWindow(QMainWindow):
         #     print("Refitting next image")
         #     self.refreshAllFittingParams()
 
-        if self.use_previous_fit_chkbx.isChecked():
+        if readOnly:
+            self.displayCachedImage()
+        elif self.use_previous_fit_chkbx.isChecked():
             print("Using previous fit")
             ret = self.updateFittingParamsInParamInfo()
             if ret == -1:
@@ -3404,6 +3460,21 @@ class EquatorWindow(QMainWindow):
         self.quadrantFoldCheckbx.setChecked(self.bioImg.quadrant_folded)
         QApplication.restoreOverrideCursor()
 
+    def displayCachedImage(self):
+        """
+        Display the results of the current image from its cache without writing anything (cache and csv files),
+        the results are the ones written by the worker which processed the image
+        """
+        if self.bioImg is None:
+            return
+        settings = self.getSettings()
+        settings['no_cache'] = True
+        self.bioImg.process(settings)
+        self.updateParams()
+        self.resetUI()
+        self.refreshStatusbar()
+        self.quadrantFoldCheckbx.setChecked(self.bioImg.quadrant_folded)
+
     def setLeftStatus(self, s):
         """
         Set text on status bar on the left
@@ -3636,12 +3707,12 @@ class EquatorWindow(QMainWindow):
         int_area = info['int_area']
 
         ax = self.displayImgAxes
-        ax.cla()
+        self.displayImgView.clearOverlays()
         #ax.imshow(disp_img)  # Display selected image
         if self.logScaleIntChkBx.isChecked():
-            ax.imshow(img, cmap='gray', norm=LogNorm(vmin=max(1, self.minIntSpnBx.value()), vmax=self.maxIntSpnBx.value()))
+            self.displayImgView.show(img, max(1, self.minIntSpnBx.value()), self.maxIntSpnBx.value(), logScale=True)
         else:
-            ax.imshow(img, cmap='gray', norm=Normalize(vmin=self.minIntSpnBx.value(), vmax=self.maxIntSpnBx.value()))
+            self.displayImgView.show(img, self.minIntSpnBx.value(), self.maxIntSpnBx.value())
         ax.set_facecolor('black')
 
 
@@ -40,12 +40,15 @@ import numpy as np
 import cv2
 from musclex import __version__
 from ..utils.file_manager import fullPath, getImgFiles, createFolder
-from ..utils.image_processor import getPerpendicularLineHomogenous, calcSlope, getIntersectionOfTwoLines, getBGR, get8bitImage, getNewZoom, getCenter, rotateImageAboutPoint, rotatePoint, processImageForIntCenter, getMaskThreshold
+from ..utils.image_processor import getPerpendicularLineHomogenous, calcSlope, getIntersectionOfTwoLines, getBGR, get8bitImage, getNewZoom, rotateImageAboutPoint, rotatePoint, getMaskThreshold
 from ..modules.ProjectionProcessor import ProjectionProcessor
 from ..ui.ProjectionBoxTab import ProjectionBoxTab
 from ..CalibrationSettings import CalibrationSettings
 from ..csv_manager import PT_CSVManager
 from .BlankImageSettings import BlankImageSettings
+from .batch_engine import BatchEngine
+from .image_view import PyramidImageView
+from ..utils.image_prefetcher import ImagePrefetcher
 from .pyqt_utils import *
 
 class BoxDetails(QDialog):
@@ -137,6 +140,8 @@ class ProjectionTracesGUI(QMainWindow):
         self.h5List = [] # if the file selected is an H5 file, regroups all the other h5 files names
         self.h5index = 0
         self.stop_process = False
+        self.batchEngine = None # BatchEngine processing the current folder in background
+        self.prefetcher = ImagePrefetcher() # reads the next images in background
         self.projProc = None
         self.syncUI = False
         self.csvManager = None
@@ -190,6 +195,7 @@ class ProjectionTracesGUI(QMainWindow):
         self.displayImgAxes = self.displayImgFigure.add_subplot(111)
         self.imageVLayout = QVBoxLayout()
         self.displayImgCanvas = FigureCanvas(self.displayImgFigure)
+        self.displayImgView = PyramidImageView(self.displayImgAxes)
         self.imageVLayout.addWidget(self.displayImgCanvas)
 
         self.imageLeftFrame = QFrame()
@@ -869,6 +875,8 @@ class ProjectionTracesGUI(QMainWindow):
                 self.processFolder()
         else:
             self.stop_process = True
+            if self.batchEngine is not None:
+                self.batchEngine.stop()
     
     def h5batchProcBtnToggled(self):
         """
@@ -923,16 +931,57 @@ class ProjectionTracesGUI(QMainWindow):
 
         # If "yes" is pressed
         if ret == QMessageBox.Yes:
+            self.progressBar.setValue(0)
             self.progressBar.setVisible(True)
             self.stop_process = False
-            for i in range(self.numberOfFiles):
-                if self.stop_process:
-                    break
-                self.progressBar.setValue(int(100. / self.numberOfFiles * i))
-                QApplication.processEvents()
-                self.nextClicked()
-            self.progressBar.setVisible(False)
-        
+            # Process all images in background processes (same as headless), they use the boxes and peaks saved in the cache
+            if self.projProc is not None:
+                self.cacheBoxesAndPeaks()
+            self.batchEngine = BatchEngine('pt', self.dir_path, self.imgList, self.fileList, self.ext, parent=self)
+            self.batchEngine.progress.connect(self.batchProgress)
+            self.batchEngine.refreshRequested.connect(self.batchRefresh)
+            self.batchEngine.imageFailed.connect(self.batchImageFailed)
+            self.batchEngine.batchFinished.connect(self.batchFinished)
+            self.batchEngine.start()
+            return
+
+        self.batchFinished(False)
+
+    def batchProgress(self, done, total):
+        """
+        Triggered when an image of the folder has been processed by the batch engine
+        :param done: number of images processed
+        :param total: number of images in the folder
+        """
+        self.progressBar.setValue(int(100. / total * done))
+
+    def batchRefresh(self, index):
+        """
+        Display an image processed by the batch engine (not every image is displayed during the batch)
+        :param index: index of the image in the folder
+        """
+        if self.batchEngine is not None:
+            self.current_file = index
+            # the worker has written the results, the window only displays them
+            self.onImageChanged(readOnly=True)
+
+    def batchImageFailed(self, index, name, msg):
+        """
+        Triggered when an image of the folder could not be processed by the batch engine
+        """
+        print("Error while processing " + name + " :\n" + msg)
+
+    def batchFinished(self, completed):
+        """
+        Triggered when the processing of the folder is done or stopped, display the results of the current image
+        :param completed: True if all the images have been processed
+        """
+        if self.batchEngine is not None:
+            self.batchEngine.wait()
+            self.batchEngine = None
+            self.onImageChanged()
+
+        self.progressBar.setVisible(False)
         self.processFolderButton.setChecked(False)
         if self.ext in ['.h5', '.hdf5']:
             self.processFolderButton.setText("Process Current H5 File")
@@ -2019,6 +2068,7 @@ class ProjectionTracesGUI(QMainWindow):
         :param fullfilename: path for the image selected
         :return:
         """
+        self.prefetcher.invalidate()
         self.dir_path, self.imgList, self.current_file, self.fileList, self.ext = getImgFiles(fullfilename)
         self.propGrp.setEnabled(True)
         self.boxGrp.setEnabled(True)
@@ -2045,13 +2095,16 @@ class ProjectionTracesGUI(QMainWindow):
         self.setH5Mode(fullfilename)
         self.onImageChanged()
 
-    def onImageChanged(self):
+    def onImageChanged(self, readOnly=False):
         """
         Need to be called when image is change i.e. to the next image.
         This will create a new ProjectionProcessor object for the new image and syncUI if cache is available
         Process the new image if there's no cache.
+        :param readOnly: only display the image from its cache, nothing is written (cache, csv and histograms)
         """
         self.projProc = ProjectionProcessor(self.dir_path, self.imgList[self.current_file], self.fileList, self.ext)
+        if self.batchEngine is None:
+            self.prefetcher.prefetch(self.dir_path, self.imgList, self.current_file, 'pt_cache', self.ext)
         # self.initSpinBoxes(self.projProc.info)
         self.initMinMaxIntensities(self.projProc)
         self.img_zoom = None
@@ -2059,8 +2112,11 @@ class ProjectionTracesGUI(QMainWindow):
         if self.center_func is None:
             self.center_func = 'init'
         self.updateCenter() # do not update fit results
-        # Process new image
-        self.processImage()
+        if readOnly:
+            self.displayCachedImage()
+        else:
+            # Process new image
+            self.processImage()
 
     def initMinMaxIntensities(self, projProc):
         """
@@ -2107,7 +2163,7 @@ class ProjectionTracesGUI(QMainWindow):
         :return:
         """
         if self.center_func == 'automatic':
-            self.projProc.orig_img, center = processImageForIntCenter(self.projProc.orig_img, getCenter(self.projProc.orig_img))
+            center = self.projProc.findCenter()
             self.centerx, self.centery = center
             if self.qfChkBx.isChecked():
                 self.qfChkBx.disconnect() # Avoid second runs at launch
@@ -2168,6 +2224,29 @@ class ProjectionTracesGUI(QMainWindow):
         self.exportHistograms()
         QApplication.restoreOverrideCursor()
 
+    def displayCachedImage(self):
+        """
+        Display the results of the current image from its cache without writing anything (cache, csv and histograms),
+        the results are the ones written by the worker which processed the image
+        """
+        if self.projProc is None:
+            return
+        settings = self.getSettings()
+        settings['no_cache'] = True
+        self.projProc.process(settings)
+        self.resetUI()
+        self.refreshStatusbar()
+
+    def closeEvent(self, ev):
+        """
+        Trigger when window is closed
+        """
+        if self.batchEngine is not None:
+            self.batchEngine.stop()
+            self.batchEngine.wait()
+            self.batchEngine = None
+        self.prefetcher.shutdown()
+
     def exportHistograms(self):
         """
         Export both original histograms and background subtracted histograms if Export All Projections is checked
@@ -2353,11 +2432,11 @@ class ProjectionTracesGUI(QMainWindow):
             img = self.projProc.orig_img
         img = get8bitImage(copy.copy(img), min=self.minIntSpnBx.value(), max=self.maxIntSpnBx.value())
         ax = self.displayImgAxes
-        ax.cla()
+        self.displayImgView.clearOverlays()
         if self.logScaleIntChkBx.isChecked():
-            ax.imshow(img, cmap='gray', norm=LogNorm(vmin=max(1, self.minIntSpnBx.value()), vmax=self.maxIntSpnBx.value()))
+            self.displayImgView.show(img, max(1, self.minIntSpnBx.value()), self.maxIntSpnBx.value(), logScale=True)
         else:
-            ax.imshow(getBGR(img))
+            self.displayImgView.show(getBGR(img))
         
         if len(self.allboxes.keys()) > 0:
             self.selectPeaksGrp.setEnabled(True)
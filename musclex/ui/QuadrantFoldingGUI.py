@@ -44,6 +44,11 @@ from ..csv_manager.QF_CSVManager import QF_CSVManager
 from .pyqt_utils import *
 from .BlankImageSettings import BlankImageSettings
 from ..CalibrationSettings import CalibrationSettings
+from .batch_engine import BatchEngine
+from .image_view import PyramidImageView
+from ..utils.image_prefetcher import ImagePrefetcher
+from ..utils.result_writer import getResultWriter, getResultCodec
+from ..utils.run_container import isRunContainerEnabled, writeContainerScalars, exportRunCsvs
 
 class QuadrantFoldingGUI(QMainWindow):
     """
@@ -76,10 +81,11 @@ class QuadrantFoldingGUI(QMainWindow):
         self.BGImages = []
         self.calSettings = None
         self.ignoreFolds = set()
-        self.csv_bg = None
         self.orientationModel = None
         self.modeOrientation = None
         self.stop_process = False
+        self.batchEngine = None # BatchEngine processing the current folder in background
+        self.prefetcher = ImagePrefetcher() # reads the next images in background
         self.chordLines = []
         self.chordpoints = []
         self.masked = False
@@ -136,6 +142,7 @@ class QuadrantFoldingGUI(QMainWindow):
         self.imageFigure = plt.figure()
         self.imageAxes = self.imageFigure.add_subplot(111)
         self.imageCanvas = FigureCanvas(self.imageFigure)
+        self.imageView = PyramidImageView(self.imageAxes)
 
         self.imageCanvas.setHidden(True)
         self.imageTabLayout.addLayout(self.verImgLayout)
@@ -559,6 +566,7 @@ class QuadrantFoldingGUI(QMainWindow):
         self.resultAxes = self.resultFigure.add_subplot(111)
         self.resultVLayout = QVBoxLayout()
         self.resultCanvas = FigureCanvas(self.resultFigure)
+        self.resultView = PyramidImageView(self.resultAxes)
         self.resultTabLayout.addWidget(self.resultCanvas)
 
         self.rightLayout = QVBoxLayout()
@@ -700,9 +708,9 @@ class QuadrantFoldingGUI(QMainWindow):
 
         ##### Image Tab #####
         self.selectFolder.clicked.connect(self.browseFolder)
-        self.spminInt.valueChanged.connect(self.refreshImageTab)
-        self.spmaxInt.valueChanged.connect(self.refreshImageTab)
-        self.logScaleIntChkBx.stateChanged.connect(self.refreshImageTab)
+        self.spminInt.valueChanged.connect(self.imageIntensityChanged)
+        self.spmaxInt.valueChanged.connect(self.imageIntensityChanged)
+        self.logScaleIntChkBx.stateChanged.connect(self.imageIntensityChanged)
         self.showSeparator.stateChanged.connect(self.refreshAllTabs)
         self.orientationCmbBx.currentIndexChanged.connect(self.orientationModelChanged)
         self.processFolderButton.toggled.connect(self.batchProcBtnToggled)
@@ -719,9 +727,9 @@ class QuadrantFoldingGUI(QMainWindow):
         self.nextFileButton2.clicked.connect(self.nextFileClicked)
         self.prevFileButton2.clicked.connect(self.prevFileClicked)
         self.filenameLineEdit2.editingFinished.connect(self.fileNameChanged)
-        self.spResultmaxInt.valueChanged.connect(self.refreshResultTab)
-        self.spResultminInt.valueChanged.connect(self.refreshResultTab)
-        self.resLogScaleIntChkBx.stateChanged.connect(self.refreshResultTab)
+        self.spResultmaxInt.valueChanged.connect(self.resultIntensityChanged)
+        self.spResultminInt.valueChanged.connect(self.resultIntensityChanged)
+        self.resLogScaleIntChkBx.stateChanged.connect(self.resultIntensityChanged)
         self.modeAngleChkBx.clicked.connect(self.modeAngleChecked)
         self.doubleZoom.stateChanged.connect(self.doubleZoomChecked)
         self.toggleFoldImage.stateChanged.connect(self.onFoldChkBoxToggled)
@@ -943,7 +951,6 @@ class QuadrantFoldingGUI(QMainWindow):
             if 'center' in self.quadFold.info:
                 del self.quadFold.info['center']
             print("New center after extent ", self.quadFold.info['manual_center'])
-            self.deleteInfo(['avg_fold'])
             self.newImgDimension = None
             self.setCentByPerp.setChecked(False)
             self.processImage()
@@ -998,7 +1005,6 @@ class QuadrantFoldingGUI(QMainWindow):
             if 'center' in self.quadFold.info:
                 del self.quadFold.info['center']
             print("New center after extent ", self.quadFold.info['manual_center'])
-            self.deleteInfo(['avg_fold'])
             self.newImgDimension = None
             self.setCentByChords.setChecked(False)
             self.processImage()
@@ -1052,7 +1058,6 @@ class QuadrantFoldingGUI(QMainWindow):
         sucess = self.setCalibrationImage(force=True)
         if sucess:
             self.deleteInfo(['rotationAngle'])
-            self.deleteImgCache(['BgSubFold'])
             self.processImage()
 
     def setCalibrationImage(self, force=False):
@@ -1314,7 +1319,6 @@ class QuadrantFoldingGUI(QMainWindow):
                     if 'center' in self.quadFold.info:
                         del self.quadFold.info['center']
                     self.quadFold.info['manual_rotationAngle'] = self.quadFold.info['rotationAngle'] + new_angle
-                    self.deleteInfo(['avg_fold'])
                     self.newImgDimension = None
                     self.setCenterRotationButton.setChecked(False)
                     self.processImage()
@@ -1339,7 +1343,6 @@ class QuadrantFoldingGUI(QMainWindow):
                     new_angle = -180. * np.arctan((y1 - y2) / abs(x1 - x2)) / np.pi
 
                 self.quadFold.info['manual_rotationAngle'] = self.quadFold.info['rotationAngle'] + new_angle
-                self.deleteInfo(['avg_fold'])
                 self.setRotationButton.setChecked(False)
                 self.processImage()
 
@@ -1413,9 +1416,9 @@ class QuadrantFoldingGUI(QMainWindow):
             h = abs(start_pt[1] - y)
             x = min(start_pt[0], x)
             y = min(start_pt[1], y)
-            ax.add_patch(patches.Rectangle((x, y), w, h,
-                                           linewidth=1, edgecolor='r', facecolor='none', linestyle='dotted'))
-            self.imageCanvas.draw_idle()
+            rect = ax.add_patch(patches.Rectangle((x, y), w, h,
+                                                  linewidth=1, edgecolor='r', facecolor='none', linestyle='dotted'))
+            self.imageView.blit([rect])
         elif func[0] == "im_move":
             # change zoom-in location (x,y ranges) to move around image
             if self.img_zoom is not None:
@@ -1607,7 +1610,7 @@ class QuadrantFoldingGUI(QMainWindow):
         direction = event.button
         x = event.xdata
         y = event.ydata
-        img_size = self.quadFold.orig_img.shape
+        img_size = self.img.shape if self.img is not None else self.quadFold.orig_img.shape
 
         if self.img_zoom is None:
             self.img_zoom = [(0, img_size[1]), (0, img_size[0])]
@@ -1680,7 +1683,7 @@ class QuadrantFoldingGUI(QMainWindow):
         self.rmaxSpnBx.setValue(rmax)
         self.uiUpdating = False
 
-        self.deleteInfo(['bgimg1'])  # delete bgimg1 to make QuadrantFolder recalculate
+        self.quadFold.stages.seed(self.quadFold.getStageStores(), 'rminmax') # R-min and R-max are set here, the next stages are recalculated
         self.processImage()
 
     def resultClicked(self, event):
@@ -1810,9 +1813,9 @@ class QuadrantFoldingGUI(QMainWindow):
             h = abs(start_pt[1] - y)
             x = min(start_pt[0], x)
             y = min(start_pt[1], y)
-            ax.add_patch(patches.Rectangle((x, y), w, h,
-                                           linewidth=1, edgecolor='r', facecolor='none', linestyle='dotted'))
-            self.resultCanvas.draw_idle()
+            rect = ax.add_patch(patches.Rectangle((x, y), w, h,
+                                                  linewidth=1, edgecolor='r', facecolor='none', linestyle='dotted'))
+            self.resultView.blit([rect])
         elif func[0] == "rminmax":
             # draw circles
             img = self.quadFold.info['avg_fold']
@@ -1933,7 +1936,6 @@ class QuadrantFoldingGUI(QMainWindow):
         """
         if self.quadFold is None or self.uiUpdating:
             return
-        self.deleteInfo(['avg_fold'])
         self.processImage()
 
     def pixRangeChanged(self):
@@ -1997,7 +1999,6 @@ class QuadrantFoldingGUI(QMainWindow):
         Trigger when sigmoid param (merge gradient) is changed
         """
         if self.ableToProcess():
-            self.deleteImgCache(['BgSubFold'])
             self.processImage()
 
     def updateImportedBG(self):
@@ -2017,10 +2018,7 @@ class QuadrantFoldingGUI(QMainWindow):
         """
         QApplication.processEvents()
         if self.ableToProcess():
-            self.deleteInfo(['bgimg1']) # delete bgimg1 to make QuadrantFolder reproduce background subrtacted image
-            self.deleteInfo(['bgimg2']) # delete bgimg2 to make QuadrantFolder reproduce background subrtacted image
-            self.deleteImgCache(['BgSubFold'])
-            self.processImage()
+            self.processImage() # the background subtracted images are reproduced if their parameters changed
 
     def minIntChanged(self):
         """
@@ -2053,7 +2051,6 @@ class QuadrantFoldingGUI(QMainWindow):
         self.orientationModel = self.orientationCmbBx.currentIndex()
         if self.quadFold is None:
             return
-        self.deleteInfo(['rotationAngle'])
         self.processImage()
 
     def doubleZoomChecked(self):
@@ -2153,7 +2150,6 @@ class QuadrantFoldingGUI(QMainWindow):
         fold_number = self.quadFold.getFoldNumber(self.function[1][0], self.function[1][1])
         self.function = None
         self.ignoreFolds.add(fold_number)
-        self.deleteInfo(['avg_fold'])
         self.processImage()
 
     def removeIgnoreQuadrant(self):
@@ -2163,7 +2159,6 @@ class QuadrantFoldingGUI(QMainWindow):
         fold_number = self.quadFold.getFoldNumber(self.function[1][0], self.function[1][1])
         self.function = None
         self.ignoreFolds.remove(fold_number)
-        self.deleteInfo(['avg_fold'])
         self.processImage()
 
     def deleteInfo(self, delList):
@@ -2176,16 +2171,6 @@ class QuadrantFoldingGUI(QMainWindow):
                 if inf in self.quadFold.info.keys():
                     del self.quadFold.info[inf]
 
-    def deleteImgCache(self, delList):
-        """
-        Remove input keys from imgCache dict of current QuadrantFolder object
-        :param delList: list of keys
-        """
-        if self.ableToProcess():
-            for inf in delList:
-                if inf in self.quadFold.imgCache:
-                    del self.quadFold.imgCache[inf]
-
     def initialWidgets(self, img, previnfo):
         """
         Initial some widgets values which depends on current image
@@ -2267,19 +2252,23 @@ class QuadrantFoldingGUI(QMainWindow):
 
         self.uiUpdating = False
 
-    def onImageChanged(self, reprocess=False):
+    def onImageChanged(self, reprocess=False, readOnly=False):
         """
         Need to be called when image is change i.e. to the next image.
         This will create a new QuadrantFolder object for the new image and syncUI if cache is available
         Process the new image if there's no cache.
+        :param reprocess: ignore the cache of the image
+        :param readOnly: only display the image from its cache, nothing is written (cache, csv and result files)
         """
         previnfo = None if self.quadFold is None else self.quadFold.info
         fileName = self.imgList[self.currentFileNumber]
         self.filenameLineEdit.setText(fileName)
         self.filenameLineEdit2.setText(fileName)
-        if self.quadFold is not None and 'saveCroppedImage' in self.quadFold.info and self.quadFold.info['saveCroppedImage'] != self.cropFoldedImageChkBx.isChecked():
+        if not readOnly and self.quadFold is not None and 'saveCroppedImage' in self.quadFold.info and self.quadFold.info['saveCroppedImage'] != self.cropFoldedImageChkBx.isChecked():
             self.quadFold.delCache()
         self.quadFold = QuadrantFolder(self.filePath, fileName, self, self.fileList, self.ext)
+        if self.batchEngine is None:
+            self.prefetcher.prefetch(self.filePath, self.imgList, self.currentFileNumber, 'qf_cache', self.ext)
         if reprocess:
             self.quadFold.info = {}
         if 'saveCroppedImage' not in self.quadFold.info:
@@ -2291,27 +2280,35 @@ class QuadrantFoldingGUI(QMainWindow):
         self.initialWidgets(original_image, previnfo)
         if 'ignore_folds' in self.quadFold.info:
             self.ignoreFolds = self.quadFold.info['ignore_folds']
-        if 'folded' in self.quadFold.info:
-            print(self.quadFold.info['folded'])
-            if self.quadFold.info['folded'] != self.toggleFoldImage.isChecked():
-                self.quadFold.deleteFromDict(self.quadFold.info, 'avg_fold')
-                self.quadFold.deleteFromDict(self.quadFold.imgCache, 'BgSubFold')
-        self.processImage()
+        if readOnly:
+            self.displayCachedImage()
+        else:
+            self.processImage()
 
     def onFoldChkBoxToggled(self):
         if self.quadFold is not None:
-            self.quadFold.deleteFromDict(self.quadFold.info, 'avg_fold')
-            # self.quadFold.info['avg_fold'] = self.quadFold.orig_img
-            # self.quadFold.deleteFromDict(self.quadFold.imgCache, 'resultImg')
-            self.quadFold.deleteFromDict(self.quadFold.imgCache, 'BgSubFold')
-            self.processImage()
+            self.processImage() # the average fold is reproduced since 'fold_image' changed
 
     def closeEvent(self, ev):
         """
         Close the event
         """
+        if self.batchEngine is not None:
+            self.batchEngine.stop()
+            self.batchEngine.wait()
+            self.batchEngine = None
+        self.exportResults()
+        self.prefetcher.shutdown()
         self.close()
 
+    def exportResults(self):
+        """
+        Wait until the results of the window are written, then export the csv files of the run container of the folder
+        """
+        getResultWriter().flush()
+        if self.filePath != "":
+            exportRunCsvs(self.filePath)
+
     def markFixedInfo(self, currentInfo, prevInfo):
         """
         Deleting the center for appropriate recalculation
@@ -2354,6 +2351,34 @@ class QuadrantFoldingGUI(QMainWindow):
         self.updated['result'] = False
         self.updateUI()
 
+    def imageIntensityChanged(self):
+        """
+        Triggered when the intensity range or scale of the image tab is changed.
+        Only the norm of the displayed image is updated, the image tab is not redrawn
+        """
+        if not self.updated['img'] or self.imageView.image is None:
+            self.refreshImageTab()
+            return
+        if self.logScaleIntChkBx.isChecked():
+            self.imageView.setIntensity(max(1, self.spminInt.value()), self.spmaxInt.value(), logScale=True)
+        else:
+            self.imageView.setIntensity(self.spminInt.value(), self.spmaxInt.value())
+        self.imageCanvas.draw_idle()
+
+    def resultIntensityChanged(self):
+        """
+        Triggered when the intensity range or scale of the result tab is changed.
+        Only the norm of the displayed image is updated, the result tab is not redrawn
+        """
+        if not self.updated['result'] or self.resultView.image is None:
+            self.refreshResultTab()
+            return
+        if self.resLogScaleIntChkBx.isChecked():
+            self.resultView.setIntensity(max(1, self.spResultminInt.value()), self.spResultmaxInt.value(), logScale=True)
+        else:
+            self.resultView.setIntensity(self.spResultminInt.value(), self.spResultmaxInt.value())
+        self.resultCanvas.draw_idle()
+
     def updateUI(self):
         """
         Update current all widget in current tab , spinboxes, and refresh status bar
@@ -2375,16 +2400,16 @@ class QuadrantFoldingGUI(QMainWindow):
             self.uiUpdating = True
 
             ax = self.imageAxes
-            ax.cla()
+            self.imageView.clearOverlays()
             img = self.quadFold.getRotatedImage()
             extent, center = self.getExtentAndCenter()
             self.img = img
             self.extent = extent
             # img = getBGR(get8bitImage(img, min=self.spminInt.value(), max=self.spmaxInt.value()))
             if self.logScaleIntChkBx.isChecked():
-                ax.imshow(img, cmap='gray', norm=LogNorm(vmin=max(1, self.spminInt.value()), vmax=self.spmaxInt.value()), extent=[0-extent[0], img.shape[1] - extent[0], img.shape[0] - extent[1], 0-extent[1]])
+                self.imageView.show(img, max(1, self.spminInt.value()), self.spmaxInt.value(), logScale=True, origin=(0-extent[0], 0-extent[1]))
             else:
-                ax.imshow(img, cmap='gray', norm=Normalize(vmin=self.spminInt.value(), vmax=self.spmaxInt.value()), extent=[0-extent[0], img.shape[1] - extent[0], img.shape[0] - extent[1], 0-extent[1]])
+                self.imageView.show(img, self.spminInt.value(), self.spmaxInt.value(), origin=(0-extent[0], 0-extent[1]))
             ax.set_facecolor('black')
 
             self.orientationCmbBx.setCurrentIndex(0 if self.orientationModel is None else self.orientationModel)
@@ -2474,11 +2499,11 @@ class QuadrantFoldingGUI(QMainWindow):
             # convert image for displaying
             # img = getBGR(get8bitImage(img, max=self.spResultmaxInt.value(), min=self.spResultminInt.value()))
             ax = self.resultAxes
-            ax.cla()
+            self.resultView.clearOverlays()
             if self.resLogScaleIntChkBx.isChecked():
-                ax.imshow(img, cmap='gray', norm=LogNorm(vmin=max(1, self.spResultminInt.value()), vmax=self.spResultmaxInt.value()))
+                self.resultView.show(img, max(1, self.spResultminInt.value()), self.spResultmaxInt.value(), logScale=True)
             else:
-                ax.imshow(img, cmap='gray', norm=Normalize(vmin=self.spResultminInt.value(), vmax=self.spResultmaxInt.value()))
+                self.resultView.show(img, self.spResultminInt.value(), self.spResultmaxInt.value())
             ax.set_facecolor('black')
 
             # Set Zoom in location
@@ -2532,6 +2557,19 @@ class QuadrantFoldingGUI(QMainWindow):
             self.saveResults()
             QApplication.restoreOverrideCursor()
 
+    def displayCachedImage(self):
+        """
+        Display the results of the current image from its cache without writing anything. Only the steps
+        which are not cached (merging and result image) are run, the results are the ones written by the worker
+        which processed the image
+        """
+        if self.ableToProcess():
+            flags = self.getFlags()
+            flags['no_cache'] = True
+            self.quadFold.process(flags)
+            self.updateParams()
+            self.refreshAllTabs()
+
     def saveResults(self):
         """
         Save result to folder qf_results
@@ -2560,19 +2598,16 @@ class QuadrantFoldingGUI(QMainWindow):
                 result_file += '_folded_cropped.tif'
                 if self.compressFoldedImageChkBx.isChecked():
                     result_file += '_folded_cropped_compressed.tif'
-                    tif_img = Image.fromarray(img)
-                    tif_img.save(result_file, compression='tiff_lzw')
                 else:
                     result_file += '_folded_cropped.tif'
-                    fabio.tifimage.tifimage(data=img).write(result_file)
             else:
                 if self.compressFoldedImageChkBx.isChecked():
                     result_file += '_folded_compressed.tif'
-                    tif_img = Image.fromarray(img)
-                    tif_img.save(result_file, compression='tiff_lzw')
                 else:
                     result_file += '_folded.tif'
-                    fabio.tifimage.tifimage(data=img).write(result_file)
+            # written in the background, the GUI does not wait for the disk
+            codec = getResultCodec({'compressed': self.compressFoldedImageChkBx.isChecked()})
+            getResultWriter().submitImage(result_file, img, codec)
             # plt.imsave(fullPath(result_path, self.imgList[self.currentFileNumber])+".result2.tif", img)
 
             self.saveBackground()
@@ -2607,23 +2642,44 @@ class QuadrantFoldingGUI(QMainWindow):
             # create bg folder
             createFolder(bg_path)
             resultImg = resultImg.astype("float32")
-            fabio.tifimage.tifimage(data=resultImg).write(result_path)
-
-            total_inten = np.sum(resultImg)
-            csv_path = join(bg_path, 'background_sum.csv')
-            if self.csv_bg is None:
+            writer = getResultWriter()
+            writer.submitImage(result_path, resultImg, 'none')
+            writer.submit(self.writeBackgroundSum, filename, resultImg, join(bg_path, 'background_sum.csv'))
+
+    def writeBackgroundSum(self, filename, resultImg, csv_path):
+        """
+        Save the total intensity of the background in background_sum.csv (run by the result writer)
+        :param filename: name of the image
+        :param resultImg: background image
+        :param csv_path: path of the csv file
+        """
+        total_inten = np.sum(resultImg)
+        # the workers of a batch write the same file, it is read again under their lock before each change
+        batchEngine = self.batchEngine
+        lock = batchEngine.lock if batchEngine is not None else None
+        if lock is not None:
+            lock.acquire()
+        try:
+            if isRunContainerEnabled():
+                # kept with the frame in the run container, background_sum.csv is exported from it by exportResults()
+                # and at the end of a batch
+                writeContainerScalars(join(os.path.dirname(csv_path), filename), {'Sum': total_inten})
+                return
+            if exists(csv_path):
+                csv_bg = pd.read_csv(csv_path)
+            else:
                 # create csv file to save total intensity for background
-                if exists(csv_path):
-                    self.csv_bg = pd.read_csv(csv_path)
-                else:
-                    self.csv_bg = pd.DataFrame(columns=['Name', 'Sum'])
-                self.csv_bg = self.csv_bg.set_index('Name')
+                csv_bg = pd.DataFrame(columns=['Name', 'Sum'])
+            csv_bg = csv_bg.set_index('Name')
 
-            if filename in self.csv_bg.index:
-                self.csv_bg = self.csv_bg.drop(index=filename)
+            if filename in csv_bg.index:
+                csv_bg = csv_bg.drop(index=filename)
 
-            self.csv_bg.loc[filename] = pd.Series({'Sum':total_inten})
-            self.csv_bg.to_csv(csv_path)
+            csv_bg.loc[filename] = pd.Series({'Sum':total_inten})
+            csv_bg.to_csv(csv_path)
+        finally:
+            if lock is not None:
+                lock.release()
 
     def updateParams(self):
         """
@@ -2709,6 +2765,8 @@ class QuadrantFoldingGUI(QMainWindow):
         :param newFile: full name of selected file
         """
         QApplication.setOverrideCursor(Qt.WaitCursor)
+        self.prefetcher.invalidate()
+        self.exportResults()
         self.filePath, self.imgList, self.currentFileNumber, self.fileList, self.ext = getImgFiles(str(newFile))
         self.csvManager = QF_CSVManager(self.filePath)
         self.numberOfFiles = len(self.imgList)
@@ -2770,6 +2828,7 @@ class QuadrantFoldingGUI(QMainWindow):
         # popup folder selection dialog
         dir_path = getAFolder()
         if dir_path != "":
+            self.exportResults()
             self.filePath = str(dir_path)
             self.selectImageButton.setHidden(True)
             self.selectFolder.setHidden(True)
@@ -2793,6 +2852,8 @@ class QuadrantFoldingGUI(QMainWindow):
                 self.processFolder()
         else:
             self.stop_process = True
+            if self.batchEngine is not None:
+                self.batchEngine.stop()
     
     def h5batchProcBtnToggled(self):
         """
@@ -2868,16 +2929,58 @@ class QuadrantFoldingGUI(QMainWindow):
 
         # If "yes" is pressed
         if ret == QMessageBox.Yes:
+            self.progressBar.setValue(0)
             self.progressBar.setVisible(True)
             self.stop_process = False
-            for i in range(self.numberOfFiles):
-                if self.stop_process:
-                    break
-                self.progressBar.setValue(int(100. / self.numberOfFiles * i))
-                QApplication.processEvents()
-                self.nextClicked(reprocess=True)
-            self.progressBar.setVisible(False)
+            # Process all images in background processes (same as headless) with the calibration settings and the current flags
+            settings = dict(self.calSettings) if self.calSettings is not None else {}
+            settings.update(flags)
+            settings['compressed'] = self.compressFoldedImageChkBx.isChecked()
+            self.batchEngine = BatchEngine('qf', self.filePath, self.imgList, self.fileList, self.ext, settings=settings, delcache=True, parent=self)
+            self.batchEngine.progress.connect(self.batchProgress)
+            self.batchEngine.refreshRequested.connect(self.batchRefresh)
+            self.batchEngine.imageFailed.connect(self.batchImageFailed)
+            self.batchEngine.batchFinished.connect(self.batchFinished)
+            self.batchEngine.start()
+            return
 
+        self.batchFinished(False)
+
+    def batchProgress(self, done, total):
+        """
+        Triggered when an image of the folder has been processed by the batch engine
+        :param done: number of images processed
+        :param total: number of images in the folder
+        """
+        self.progressBar.setValue(int(100. / total * done))
+
+    def batchRefresh(self, index):
+        """
+        Display an image processed by the batch engine (not every image is displayed during the batch)
+        :param index: index of the image in the folder
+        """
+        if self.batchEngine is not None:
+            self.currentFileNumber = index
+            # the worker has written the results, the window only displays them
+            self.onImageChanged(readOnly=True)
+
+    def batchImageFailed(self, index, name, msg):
+        """
+        Triggered when an image of the folder could not be processed by the batch engine
+        """
+        print("Error while processing " + name + " :\n" + msg)
+
+    def batchFinished(self, completed):
+        """
+        Triggered when the processing of the folder is done or stopped, display the results of the current image
+        :param completed: True if all the images have been processed
+        """
+        if self.batchEngine is not None:
+            self.batchEngine.wait()
+            self.batchEngine = None
+            self.onImageChanged()
+
+        self.progressBar.setVisible(False)
         self.processFolderButton.setChecked(False)
         self.processFolderButton2.setChecked(False)
         if self.ext in ['.h5', '.hdf5']:
@@ -38,6 +38,8 @@ from ..modules.XRayViewer import XRayViewer
 from ..csv_manager.XV_CSVManager import XV_CSVManager
 from .pyqt_utils import *
 from .LogTraceViewer import LogTraceViewer
+from ..utils.image_prefetcher import ImagePrefetcher
+from .image_view import PyramidImageView
 
 class XRayViewerGUI(QMainWindow):
     """
@@ -70,6 +72,7 @@ class XRayViewerGUI(QMainWindow):
         self.first_box = False
         self.saved_slice = None
         self.stop_process = False
+        self.prefetcher = ImagePrefetcher() # reads the next images in background
 
         self.initUI() # initial all GUI
         self.setConnections() # set triggered function for widgets
@@ -110,6 +113,7 @@ class XRayViewerGUI(QMainWindow):
         self.imageFigure = plt.figure()
         self.imageAxes = self.imageFigure.add_subplot(111)
         self.imageCanvas = FigureCanvas(self.imageFigure)
+        self.imageView = PyramidImageView(self.imageAxes)
 
         self.imageCanvas.setHidden(True)
         self.imageTabLayout.addLayout(self.verImgLayout)
@@ -298,10 +302,10 @@ class XRayViewerGUI(QMainWindow):
         self.tabWidget.currentChanged.connect(self.updateUI)
 
         ##### Image Tab #####
-        self.spminInt.valueChanged.connect(self.refreshImageTab)
-        self.spmaxInt.valueChanged.connect(self.refreshImageTab)
-        self.colorMapChoice.currentIndexChanged.connect(self.refreshImageTab)
-        self.logScaleIntChkBx.stateChanged.connect(self.refreshImageTab)
+        self.spminInt.valueChanged.connect(self.imageIntensityChanged)
+        self.spmaxInt.valueChanged.connect(self.imageIntensityChanged)
+        self.colorMapChoice.currentIndexChanged.connect(self.imageIntensityChanged)
+        self.logScaleIntChkBx.stateChanged.connect(self.imageIntensityChanged)
         self.processFolderButton.toggled.connect(self.batchProcBtnToggled)
         self.nextButton.clicked.connect(self.nextClicked)
         self.prevButton.clicked.connect(self.prevClicked)
@@ -825,9 +829,9 @@ class XRayViewerGUI(QMainWindow):
             h = abs(start_pt[1] - y)
             x = min(start_pt[0], x)
             y = min(start_pt[1], y)
-            ax.add_patch(patches.Rectangle((x, y), w, h,
-                                           linewidth=1, edgecolor='r', facecolor='none', linestyle='dotted'))
-            self.imageCanvas.draw_idle()
+            rect = ax.add_patch(patches.Rectangle((x, y), w, h,
+                                                  linewidth=1, edgecolor='r', facecolor='none', linestyle='dotted'))
+            self.imageView.blit([rect])
         elif func[0] == "im_move":
             # change zoom-in location (x,y ranges) to move around image
             if self.img_zoom is not None:
@@ -1053,6 +1057,7 @@ class XRayViewerGUI(QMainWindow):
         self.filenameLineEdit2.setText(fileName)
 
         self.xrayViewer = XRayViewer(self.filePath, fileName, self.fileList, self.ext)
+        self.prefetcher.prefetch(self.filePath, self.imgList, self.currentFileNumber, ext=self.ext)
 
         if self.inpaintChkBx.isChecked():
             self.statusPrint("Inpainting...")
@@ -1078,6 +1083,7 @@ class XRayViewerGUI(QMainWindow):
         """
         Close the event
         """
+        self.prefetcher.shutdown()
         self.close()
 
     def refreshAllTabs(self):
@@ -1096,6 +1102,21 @@ class XRayViewerGUI(QMainWindow):
         self.updated['img'] = False
         self.updateUI()
 
+    def imageIntensityChanged(self):
+        """
+        Triggered when the intensity range, scale or color map of the image tab is changed.
+        Only the norm and color map of the displayed image are updated, the image tab is not redrawn
+        """
+        if not self.updated['img'] or self.imageView.image is None:
+            self.refreshImageTab()
+            return
+        if self.logScaleIntChkBx.isChecked():
+            self.imageView.setIntensity(max(1, self.spminInt.value()), self.spmaxInt.value(), logScale=True)
+        else:
+            self.imageView.setIntensity(self.spminInt.value(), self.spmaxInt.value())
+        self.imageView.image.set_cmap(self.colorMapChoice.currentText())
+        self.imageCanvas.draw_idle()
+
     def updateUI(self):
         """
         Update current all widget in current tab , spinboxes, and refresh status bar
@@ -1112,12 +1133,12 @@ class XRayViewerGUI(QMainWindow):
             self.uiUpdating = True
 
             ax = self.imageAxes
-            ax.cla()
+            self.imageView.clearOverlays()
             img = self.xrayViewer.orig_img
             if self.logScaleIntChkBx.isChecked():
-                ax.imshow(img, cmap=self.colorMapChoice.currentText(), norm=LogNorm(vmin=max(1, self.spminInt.value()), vmax=self.spmaxInt.value()))
+                self.imageView.show(img, max(1, self.spminInt.value()), self.spmaxInt.value(), logScale=True, cmap=self.colorMapChoice.currentText())
             else:
-                ax.imshow(img, cmap=self.colorMapChoice.currentText(), norm=Normalize(vmin=self.spminInt.value(), vmax=self.spmaxInt.value()))
+                self.imageView.show(img, self.spminInt.value(), self.spmaxInt.value(), cmap=self.colorMapChoice.currentText())
             ax.set_facecolor('black')
 
             # Set Zoom in location
@@ -1175,6 +1196,7 @@ class XRayViewerGUI(QMainWindow):
         :param newFile: full name of selected file
         """
         QApplication.setOverrideCursor(Qt.WaitCursor)
+        self.prefetcher.invalidate()
         self.filePath, self.imgList, self.currentFileNumber, self.fileList, self.ext = getImgFiles(str(newFile))
         self.numberOfFiles = len(self.imgList)
         fileName = self.imgList[self.currentFileNumber]
@@ -0,0 +1,129 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import tempfile
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PyQt5.QtCore import QThread, pyqtSignal
+try:
+    from ..headless.batch_worker import initBatchWorker, writeBatchSettings, getBatchJob, processBatchImage
+    from ..utils.run_container import exportRunCsvs
+except: # for coverage
+    from headless.batch_worker import initBatchWorker, writeBatchSettings, getBatchJob, processBatchImage
+    from utils.run_container import exportRunCsvs
+
+class BatchEngine(QThread):
+    """
+    Process a folder (or H5 file) in a pool of worker processes with the headless classes, out of the UI thread.
+    Progress and results are sent back to the window through Qt signals, so that the window only has to
+    refresh its canvas from time to time (every refreshEvery images) instead of drawing every image.
+    """
+    progress = pyqtSignal(int, int) # number of images done, total number of images
+    imageProcessed = pyqtSignal(int, str) # index and name of the image processed
+    imageFailed = pyqtSignal(int, str, str) # index and name of the image, error message
+    refreshRequested = pyqtSignal(int) # index of the last image processed, emitted every refreshEvery images
+    batchFinished = pyqtSignal(bool) # True if all the images were processed, False if stopped
+
+    def __init__(self, program, dir_path, imgList, fileList, ext, settings=None, delcache=False, nProcesses=None, refreshEvery=25, parent=None):
+        """
+        :param program: 'eq', 'qf', 'pt' or 'di'
+        :param dir_path, imgList, fileList, ext: folder to process, as given by getImgFiles
+        :param settings: settings of the window passed to the headless classes (dict), None to use the headless defaults
+        :param delcache: delete the cache of each image before processing it (reprocess)
+        :param nProcesses: number of worker processes (default: number of cpus - 1, keeping one for the UI)
+        :param refreshEvery: number of images processed between 2 canvas refresh requests
+        """
+        super().__init__(parent)
+        self.program = program
+        self.dir_path = dir_path
+        self.imgList = list(imgList)
+        self.fileList = fileList
+        self.ext = ext
+        self.settings = settings
+        self.delcache = delcache
+        self.nProcesses = nProcesses if nProcesses is not None else max(1, multiprocessing.cpu_count() - 1)
+        self.refreshEvery = max(1, refreshEvery)
+        # spawn the workers : forking a process running Qt threads is not safe
+        self.context = multiprocessing.get_context('spawn')
+        self.lock = self.context.Lock() # shared with the workers, to be held by the window when it writes the same files
+        self.stopped = False
+
+    def stop(self):
+        """
+        Stop submitting images. The images being processed are completed
+        """
+        self.stopped = True
+
+    def run(self):
+        """
+        Submit the images to the process pool (keeping only a few of them queued so that stop is fast) and report the results
+        """
+        nImg = len(self.imgList)
+        settingspath = None
+        if self.settings is not None:
+            fd, settingspath = tempfile.mkstemp(prefix='musclex_batch_', suffix='.json')
+            os.close(fd)
+            writeBatchSettings(self.settings, settingspath)
+        done = 0
+        try:
+            with ProcessPoolExecutor(max_workers=self.nProcesses, mp_context=self.context,
+                                     initializer=initBatchWorker, initargs=(self.lock, self.nProcesses)) as executor:
+                pending = {}
+                nextImg = 0
+                while True:
+                    while not self.stopped and nextImg < nImg and len(pending) < 2 * self.nProcesses:
+                        imgList, current, fileList = getBatchJob(self.imgList, self.fileList, self.ext, nextImg)
+                        future = executor.submit(processBatchImage, self.program, self.dir_path, imgList, current,
+                                                 fileList, self.ext, settingspath, self.delcache)
+                        pending[future] = nextImg
+                        nextImg += 1
+                    if len(pending) == 0:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        i = pending.pop(future)
+                        done += 1
+                        try:
+                            future.result()
+                            self.imageProcessed.emit(i, self.imgList[i])
+                        except Exception:
+                            self.imageFailed.emit(i, self.imgList[i], traceback.format_exc())
+                        self.progress.emit(done, nImg)
+                        if done % self.refreshEvery == 0:
+                            self.refreshRequested.emit(i)
+        except Exception:
+            # the pool is broken (e.g. a worker was killed), stop the batch
+            traceback.print_exc()
+            self.stopped = True
+        finally:
+            if settingspath is not None and os.path.exists(settingspath):
+                os.remove(settingspath)
+        exportRunCsvs(self.dir_path)
+        self.batchFinished.emit(not self.stopped and done == nImg)
@@ -0,0 +1,230 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import numpy as np
+from matplotlib.colors import LogNorm, Normalize
+
+class PyramidImageView:
+    """
+    Image displayed in a matplotlib axes without being redrawn from scratch at every update.
+    The AxesImage is created once and its data, extent and norm are updated in place.
+    A multi-resolution pyramid (each level halves the previous one) is built lazily,
+    and only the visible part of the level matching the screen resolution is given to matplotlib,
+    so zooming, panning and changing the intensities do not resample the full image.
+    The axes limits stay in full-resolution image coordinates, so the overlays are not affected.
+    The displayed image must not be modified in place after being shown (the pyramid would be outdated).
+    Temporary overlays (e.g. the rectangle of a zoom selection) can be drawn with blit().
+    """
+    def __init__(self, ax, minLevelSize=256):
+        """
+        :param ax: matplotlib axes displaying the image
+        :param minLevelSize: smallest size (in pixels) of the lowest resolution level
+        """
+        self.ax = ax
+        self.minLevelSize = minLevelSize
+        self.source = None
+        self.levels = []
+        self.origin = (-0.5, -0.5)
+        self.image = None
+        self.callbacks = None
+        self.background = None
+        self.cropping = False
+        ax.figure.canvas.mpl_connect('draw_event', self.onDraw)
+        ax.figure.canvas.mpl_connect('resize_event', lambda event: self.updateView())
+
+    def show(self, img, vmin=None, vmax=None, logScale=False, cmap='gray', origin=(-0.5, -0.5)):
+        """
+        Display an image, or update the displayed image in place
+        :param img: image (2D array, or RGB(A) image)
+        :param vmin, vmax: intensity range
+        :param logScale: display the intensities in log scale
+        :param cmap: color map
+        :param origin: data coordinates of the top left corner of the image (as imshow, pixel centers are
+        at integer coordinates by default)
+        :return: AxesImage
+        """
+        ax = self.ax
+        if self.image is not None and (self.image.axes is not ax or self.image not in ax.images):
+            # the axes has been cleared
+            self.image = None
+        if img is not self.source:
+            self.source = img
+            self.levels = [img]
+        self.origin = origin
+        if self.image is None:
+            self.image = ax.imshow(img, cmap=cmap, norm=self.getNorm(vmin, vmax, logScale), extent=self.getExtent())
+        else:
+            self.image.set_cmap(cmap)
+            self.setIntensity(vmin, vmax, logScale)
+            if ax.get_autoscalex_on() or ax.get_autoscaley_on():
+                # no zoom yet, the visible part is not known
+                self.cropping = True
+                try:
+                    self.image.set_data(img)
+                    self.image.set_extent(self.getExtent())
+                finally:
+                    self.cropping = False
+        if self.callbacks is not ax.callbacks:
+            self.callbacks = ax.callbacks
+            ax.callbacks.connect('xlim_changed', self.updateView)
+            ax.callbacks.connect('ylim_changed', self.updateView)
+        self.updateView()
+        return self.image
+
+    def getNorm(self, vmin, vmax, logScale):
+        """
+        Give the norm of the intensities
+        """
+        if logScale:
+            return LogNorm(vmin=vmin, vmax=vmax)
+        return Normalize(vmin=vmin, vmax=vmax)
+
+    def setIntensity(self, vmin, vmax, logScale=False):
+        """
+        Change the displayed intensity range without recreating the image (call canvas.draw_idle() to display it)
+        :param vmin, vmax: intensity range
+        :param logScale: display the intensities in log scale
+        :return: -
+        """
+        if self.image is None:
+            return
+        if logScale != isinstance(self.image.norm, LogNorm):
+            self.image.set_norm(self.getNorm(vmin, vmax, logScale))
+        else:
+            self.image.set_clim(vmin, vmax)
+
+    def getExtent(self, r0=0, r1=None, c0=0, c1=None, scale=1):
+        """
+        Give the extent (left, right, bottom, top) of a part of the image
+        :param r0, r1, c0, c1: rows and columns of the part in the level
+        :param scale: scale of the level
+        """
+        h, w = self.source.shape[:2]
+        r1 = h if r1 is None else r1
+        c1 = w if c1 is None else c1
+        x0, y0 = self.origin
+        return (x0 + c0 * scale, x0 + c1 * scale, y0 + r1 * scale, y0 + r0 * scale)
+
+    def getLevel(self, level):
+        """
+        Give a level of the pyramid, build it if needed
+        :param level: level (0 is the full resolution image)
+        :return: image at 1/2**level resolution, or None if the level would be too small
+        """
+        while len(self.levels) <= level:
+            prev = self.levels[-1]
+            h, w = prev.shape[0] // 2, prev.shape[1] // 2
+            if min(h, w) < self.minLevelSize:
+                return None
+            if prev.ndim == 2:
+                prev = prev[:2 * h, :2 * w].astype(np.float32)
+                nxt = prev[0::2, 0::2] + prev[1::2, 0::2]
+                nxt += prev[0::2, 1::2]
+                nxt += prev[1::2, 1::2]
+                nxt *= 0.25
+            else:
+                # RGB(A) image, keep the data type
+                nxt = prev[0:2 * h:2, 0:2 * w:2]
+            self.levels.append(nxt)
+        return self.levels[level]
+
+    def updateView(self, ax=None):
+        """
+        Give to the AxesImage the visible part of the level matching the resolution of the axes
+        (called when the axes limits change)
+        """
+        ax = self.ax
+        if self.cropping or self.image is None or self.image.axes is not ax:
+            return
+        if ax.get_autoscalex_on() or ax.get_autoscaley_on():
+            return
+        xlim = sorted(ax.get_xlim())
+        ylim = sorted(ax.get_ylim())
+        # size of the axes before the aspect ratio is applied, the data are fitted in it
+        pos = ax.get_position(original=True)
+        width, height = pos.width * ax.figure.bbox.width, pos.height * ax.figure.bbox.height
+        ratio = max((xlim[1] - xlim[0]) / max(width, 1), (ylim[1] - ylim[0]) / max(height, 1))
+        level = 0
+        while ratio >= 2 and self.getLevel(level + 1) is not None:
+            level += 1
+            ratio /= 2
+        data = self.levels[level]
+        scale = 2 ** level
+        x0, y0 = self.origin
+        c0 = max(int(np.floor((xlim[0] - x0) / scale)) - 1, 0)
+        c1 = min(int(np.ceil((xlim[1] - x0) / scale)) + 1, data.shape[1])
+        r0 = max(int(np.floor((ylim[0] - y0) / scale)) - 1, 0)
+        r1 = min(int(np.ceil((ylim[1] - y0) / scale)) + 1, data.shape[0])
+        if c1 <= c0 or r1 <= r0:
+            # the image is not visible
+            c0, c1, r0, r1 = 0, 1, 0, 1
+        self.cropping = True
+        try:
+            self.image.set_data(data[r0:r1, c0:c1])
+            self.image.set_extent(self.getExtent(r0, r1, c0, c1, scale))
+            full = self.getExtent()
+            self.image.sticky_edges.x[:] = [full[0], full[1]]
+            self.image.sticky_edges.y[:] = [full[2], full[3]]
+        finally:
+            self.cropping = False
+
+    def clearOverlays(self):
+        """
+        Remove everything drawn on the axes except the image (replaces ax.cla() before redrawing the overlays)
+        :return: -
+        """
+        ax = self.ax
+        for artists in (ax.lines, ax.patches, ax.texts, ax.collections, ax.artists, ax.images):
+            for artist in list(artists):
+                if artist is not self.image:
+                    artist.remove()
+        if ax.get_legend() is not None:
+            ax.get_legend().remove()
+
+    def onDraw(self, event):
+        """
+        Keep the rendered axes to blit the temporary overlays on it
+        """
+        canvas = self.ax.figure.canvas
+        if hasattr(canvas, 'copy_from_bbox'):
+            self.background = canvas.copy_from_bbox(self.ax.bbox)
+
+    def blit(self, artists):
+        """
+        Draw temporary overlays (added after the last full draw) over the rendered axes, without redrawing the image
+        :param artists: artists to draw
+        :return: -
+        """
+        canvas = self.ax.figure.canvas
+        if self.background is None or not getattr(canvas, 'supports_blit', False):
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        for artist in artists:
+            self.ax.draw_artist(artist)
+        canvas.blit(self.ax.bbox)
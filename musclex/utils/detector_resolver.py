@@ -0,0 +1,162 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import threading
+from pyFAI.detectors import Detector
+from pyFAI import detector_factory
+
+DEFAULT_DETECTOR = 'agilent_titan'
+
+class DetectorResolver:
+    """
+    Resolve the pyFAI detector corresponding to an image.
+    The MAX_SHAPE -> detector name index is built once from the pyFAI registry and the detector
+    objects are instantiated once per name (mask and pixel corners included), so every image of a run
+    gets the same detector object and a lookup only costs a dictionary access.
+    """
+    def __init__(self):
+        self._shape_index = None
+        self._detectors = {}
+        self._lock = threading.Lock()
+
+    def shapeIndex(self):
+        """
+        Give the MAX_SHAPE -> detector name index. When several detectors share a shape,
+        the first one in the registry is kept (same order as the previous registry scan).
+        :return: index (dict)
+        """
+        if self._shape_index is None:
+            index = {}
+            for name, det_class in Detector.registry.items():
+                shape = getattr(det_class, 'MAX_SHAPE', None)
+                if shape is not None and tuple(shape) not in index:
+                    index[tuple(shape)] = name
+            self._shape_index = index
+        return self._shape_index
+
+    def getDetectorName(self, shape, man_det=None):
+        """
+        Give the name of the detector used for an image shape
+        :param shape: image shape (tuple)
+        :param man_det: detector name chosen by the user (str or None)
+        :return: detector name (str)
+        """
+        shape = tuple(shape)
+        if man_det is None:
+            name = self.shapeIndex().get(shape)
+        elif man_det in Detector.registry and getattr(Detector.registry[man_det], 'MAX_SHAPE', None) == shape:
+            name = man_det
+        else:
+            print('The detector specified does not correspond to the image being processed')
+            name = None
+        if name is None:
+            print("No corresponding detector found, using " + DEFAULT_DETECTOR + " by default...")
+            name = DEFAULT_DETECTOR
+        return name
+
+    def getDetector(self, shape, man_det=None):
+        """
+        Give the detector object used for an image shape. The object is created only once per name.
+        :param shape: image shape (tuple)
+        :param man_det: detector name chosen by the user (str or None)
+        :return: pyFAI detector
+        """
+        name = self.getDetectorName(shape, man_det)
+        detector = self._detectors.get(name)
+        if detector is None:
+            with self._lock:
+                detector = self._detectors.get(name)
+                if detector is None:
+                    detector = detector_factory(name)
+                    # Compute mask and pixel corners now, they are reused by all the integrators of the run
+                    _ = detector.mask
+                    detector.get_pixel_corners()
+                    print("Detector used: " + detector.get_name())
+                    self._detectors[name] = detector
+        return detector
+
+    def getBinnedDetector(self, shape, binning, man_det=None):
+        """
+        Give a detector for an image binned by a factor (i.e. a pyramid level of an image of the given shape).
+        Its pixels are the detector pixels scaled by the binning factor, it is created only once per name and binning.
+        :param shape: shape of the native image (tuple)
+        :param binning: binning factor (int)
+        :param man_det: detector name chosen by the user (str or None)
+        :return: pyFAI detector
+        """
+        if binning == 1:
+            return self.getDetector(shape, man_det)
+        base = self.getDetector(shape, man_det)
+        key = (base.get_name(), tuple(shape), binning)
+        detector = self._detectors.get(key)
+        if detector is None:
+            with self._lock:
+                detector = self._detectors.get(key)
+                if detector is None:
+                    detector = Detector(pixel1=base.pixel1 * binning, pixel2=base.pixel2 * binning,
+                                        max_shape=(shape[0] // binning, shape[1] // binning))
+                    self._detectors[key] = detector
+        return detector
+
+    def clear(self):
+        """
+        Forget the cached detectors and the shape index (i.e. after a pyFAI registry change)
+        :return: -
+        """
+        with self._lock:
+            self._shape_index = None
+            self._detectors = {}
+
+_resolver = DetectorResolver()
+
+def getDetectorResolver():
+    """
+    Give the resolver shared by all the modules of the current process
+    :return: DetectorResolver
+    """
+    return _resolver
+
+def resolveDetector(img, man_det=None):
+    """
+    Give the detector used for an image, the same object is returned for every image of a run
+    :param img: input image or image shape
+    :param man_det: detector name chosen by the user (str or None)
+    :return: pyFAI detector
+    """
+    shape = img.shape if hasattr(img, 'shape') else img
+    return _resolver.getDetector(shape, man_det)
+
+def resolveBinnedDetector(shape, binning, man_det=None):
+    """
+    Give the detector used for an image of the given shape binned by a factor
+    :param shape: shape of the native image
+    :param binning: binning factor (int)
+    :param man_det: detector name chosen by the user (str or None)
+    :return: pyFAI detector
+    """
+    return _resolver.getBinnedDetector(shape, binning, man_det)
@@ -0,0 +1,245 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import threading
+import multiprocessing
+from contextlib import contextmanager
+import cv2
+
+# Default threads of stages which should not use the budget of the worker.
+# cv2.warpAffine is kept single threaded as it may crash with several threads in forked processes
+DEFAULT_STAGE_THREADS = {'warp': 1}
+
+# Resources of the current process : number of workers of its pool, threads of the worker (None if not configured), stage overrides
+# and whether a thread pool of the process shares the threads (see workerThreads)
+_resources = {'workers': 1, 'threads': None, 'stages': {}, 'pool': False}
+# Threads currently set in each library of the process (see applyThreads) and the threadpoolctl controller of the loaded libraries
+_limits = {'opencv': None, 'threadpool': None, 'controller': None}
+# Threads of numba, which are set for each thread of the process
+_numbaLimit = threading.local()
+
+def getCpuCount():
+    """
+    Give the number of cpus the process may run on
+    :return: number of cpus
+    """
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    return max(1, multiprocessing.cpu_count())
+
+def getEnvInt(name):
+    """
+    Give the positive integer value of an environment variable
+    :param name: name of the variable
+    :return: value, or None if the variable is not set or is not a positive integer
+    """
+    value = os.environ.get(name, '')
+    if value.isdigit() and int(value) > 0:
+        return int(value)
+    return None
+
+def getWorkerCount(nWorkers=None):
+    """
+    Give the number of worker processes to use : nWorkers if given, else MUSCLEX_WORKERS, else the number of cpus
+    :param nWorkers: number of workers requested (int or None)
+    :return: number of workers
+    """
+    if nWorkers is not None and nWorkers > 0:
+        return int(nWorkers)
+    env = getEnvInt('MUSCLEX_WORKERS')
+    return env if env is not None else getCpuCount()
+
+def getThreadBudget(nWorkers=1, nThreads=None):
+    """
+    Give the number of threads of each worker : nThreads if given, else MUSCLEX_THREADS, else the cpus shared between the workers
+    :param nWorkers: number of worker processes running together
+    :param nThreads: number of threads requested (int or None)
+    :return: number of threads of a worker
+    """
+    if nThreads is not None and nThreads > 0:
+        return int(nThreads)
+    env = getEnvInt('MUSCLEX_THREADS')
+    return env if env is not None else max(1, getCpuCount() // max(1, nWorkers))
+
+def setExecutionBudget(nWorkers=None, nThreads=None):
+    """
+    Set the number of workers and threads of each worker for the workers started from now on by this process.
+    The values are kept in the environment (MUSCLEX_WORKERS, MUSCLEX_THREADS) so that spawned workers use them too.
+    The threads of the current process are not changed, a serial run keeps all the cpus.
+    :param nWorkers: number of worker processes (None to keep the default)
+    :param nThreads: threads of each worker (None to share the cpus between the workers)
+    :return: number of workers, threads of each worker
+    """
+    nWorkers = getWorkerCount(nWorkers)
+    nThreads = getThreadBudget(nWorkers, nThreads)
+    os.environ['MUSCLEX_WORKERS'] = str(nWorkers)
+    os.environ['MUSCLEX_THREADS'] = str(nThreads)
+    return nWorkers, nThreads
+
+def applyThreads(nThreads, refresh=False):
+    """
+    Set the number of threads used by OpenCV, numba, OpenMP (pyFAI) and BLAS in the current process.
+    The libraries already using this number are not set again, and the OpenMP and BLAS libraries are looked up
+    once (threadpoolctl), so that switching the threads around a stage is cheap.
+    :param nThreads: number of threads
+    :param refresh: look up the OpenMP and BLAS libraries again, e.g. after a module loading new ones has been imported
+    :return: -
+    """
+    nThreads = max(1, int(nThreads))
+    if _limits['opencv'] != nThreads:
+        cv2.setNumThreads(nThreads)
+        _limits['opencv'] = nThreads
+    if getattr(_numbaLimit, 'threads', None) != nThreads:
+        try:
+            import numba
+            numba.set_num_threads(min(nThreads, numba.config.NUMBA_NUM_THREADS))
+        except ImportError:
+            pass
+        _numbaLimit.threads = nThreads
+    if refresh or _limits['threadpool'] != nThreads:
+        try:
+            from threadpoolctl import ThreadpoolController
+            if refresh or _limits['controller'] is None:
+                _limits['controller'] = ThreadpoolController()
+            _limits['controller'].limit(limits=nThreads)
+        except ImportError:
+            pass
+        _limits['threadpool'] = nThreads
+
+def configureThreads(nThreads):
+    """
+    Set the number of threads of the current process (see applyThreads), used by its stages which have no threads of their own
+    :param nThreads: number of threads
+    :return: -
+    """
+    nThreads = max(1, int(nThreads))
+    applyThreads(nThreads, refresh=True)
+    _resources['threads'] = nThreads
+
+def initWorker(nWorkers=1, nThreads=None):
+    """
+    Configure the current process as a worker of a pool of nWorkers processes (pool initializer)
+    :param nWorkers: number of worker processes running together
+    :param nThreads: threads of the worker (None to share the cpus between the workers)
+    :return: -
+    """
+    _resources['workers'] = max(1, nWorkers)
+    configureThreads(getThreadBudget(nWorkers, nThreads))
+
+def runWorker(nWorkers, nThreads, target, *args):
+    """
+    Run target(*args) in a worker process configured by initWorker (target of multiprocessing.Process)
+    :param nWorkers: number of worker processes running together
+    :param nThreads: threads of the worker (None to share the cpus between the workers)
+    :param target: function or class to run
+    :param args: arguments of target
+    :return: -
+    """
+    initWorker(nWorkers, nThreads)
+    target(*args)
+
+@contextmanager
+def workerThreads(nWorkers, nThreads=None):
+    """
+    Share the threads of the process between the nWorkers threads of a thread pool started with
+    initializer=initWorkerThread. OpenCV, OpenMP and BLAS are set for the whole process, so the stages run by the
+    threads of the pool keep the threads of a worker instead of setting their own (see stageThreads)
+    :param nWorkers: number of threads of the pool
+    :param nThreads: threads of each worker thread (None to share the cpus between the workers)
+    :return: threads of each worker thread
+    """
+    previous = _resources['threads']
+    nThreads = getThreadBudget(nWorkers, nThreads)
+    configureThreads(nThreads)
+    _resources['pool'] = True
+    try:
+        yield nThreads
+    finally:
+        _resources['pool'] = False
+        configureThreads(previous if previous is not None else getCpuCount())
+        _resources['threads'] = previous
+
+def initWorkerThread():
+    """
+    Set the threads of numba, which are kept for each thread, in a thread of a pool (initializer of the pool, see workerThreads)
+    :return: -
+    """
+    applyThreads(_resources['threads'])
+
+def setStageThreads(stage, nThreads):
+    """
+    Override the threads used by a stage in this process
+    :param stage: name of the stage (e.g. 'warp', 'bgsub', 'integration')
+    :param nThreads: number of threads, None to remove the override
+    :return: -
+    """
+    if nThreads is None:
+        _resources['stages'].pop(stage, None)
+    else:
+        _resources['stages'][stage] = max(1, int(nThreads))
+
+def getStageThreads(stage):
+    """
+    Give the threads of a stage : the override set by setStageThreads or MUSCLEX_THREADS_<STAGE>, else the default
+    of the stage, else the threads of the worker. A process which is not a worker (GUI, serial run) has all the cpus.
+    :param stage: name of the stage
+    :return: number of threads
+    """
+    if stage in _resources['stages']:
+        return _resources['stages'][stage]
+    env = getEnvInt('MUSCLEX_THREADS_' + stage.upper())
+    if env is not None:
+        return env
+    if stage in DEFAULT_STAGE_THREADS:
+        return DEFAULT_STAGE_THREADS[stage]
+    if _resources['threads'] is not None:
+        return _resources['threads']
+    return getCpuCount()
+
+@contextmanager
+def stageThreads(stage):
+    """
+    Run a stage with its own threads (see getStageThreads), the threads of the worker are set back after the stage.
+    In a thread pool sharing the threads of the process (see workerThreads), the stage keeps the threads of a worker.
+    :param stage: name of the stage
+    :return: number of threads of the stage
+    """
+    if _resources['pool']:
+        yield _resources['threads']
+        return
+    nThreads = getStageThreads(stage)
+    previous = _resources['threads'] if _resources['threads'] is not None else getCpuCount()
+    if nThreads == previous:
+        yield nThreads
+        return
+    applyThreads(nThreads)
+    try:
+        yield nThreads
+    finally:
+        applyThreads(previous)
@@ -27,6 +27,7 @@ authorization from Illinois Institute of Technology.
 """
 
 import os
+import sys
 from os.path import split, exists, join
 import numpy as np
 import fabio
@@ -199,11 +200,26 @@ def ifHdfReadConvertless(fileName, img):
         img[img==4294967295] = -1
     return img
 
+def getUserCacheFolder():
+    """
+    Give the folder of the files kept by musclex for the user between runs (e.g. the integration profile) :
+    %LOCALAPPDATA%\\musclex on Windows, ~/Library/Caches/musclex on macOS, $XDG_CACHE_HOME/musclex (~/.cache/musclex) otherwise.
+    The folder is not created
+    :return: path
+    """
+    if os.name == 'nt':
+        base = os.environ.get('LOCALAPPDATA', os.path.join(os.path.expanduser('~'), 'AppData', 'Local'))
+    elif sys.platform == 'darwin':
+        base = os.path.join(os.path.expanduser('~'), 'Library', 'Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'musclex')
+
 def createFolder(path):
     """
     Create a folder if it doesn't exist
     :param path: full path of creating directory
     :return:
     """
-    if not exists(path):
-        os.makedirs(path)
+    # the workers of a batch may create the same folder at the same time
+    os.makedirs(path, exist_ok=True)
@@ -0,0 +1,183 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import sys
+import struct
+import numpy as np
+import fabio
+from fabio.edfimage import DATA_TYPES as EDF_DATA_TYPES
+
+# TIFF tags used to locate the pixels of the first page
+TIFF_TAGS = {256: 'width', 257: 'height', 258: 'bits', 259: 'compression', 273: 'offsets',
+             277: 'samples', 279: 'counts', 284: 'planar', 322: 'tile_width', 339: 'format'}
+# TIFF field types : (struct format, size)
+TIFF_TYPES = {1: ('B', 1), 3: ('H', 2), 4: ('I', 4), 8: ('h', 2), 9: ('i', 4), 16: ('Q', 8)}
+# TIFF SampleFormat -> numpy kind
+TIFF_FORMATS = {1: 'u', 2: 'i', 3: 'f'}
+EDF_BLOCK_SIZE = 512
+
+def isMappingEnabled():
+    """
+    Check if uncompressed frames are memory-mapped (MUSCLEX_MMAP_FRAMES=0 to always decode them with fabio)
+    :return: bool
+    """
+    return os.environ.get('MUSCLEX_MMAP_FRAMES', '1') != '0'
+
+def readTiffLayout(path):
+    """
+    Read the pixel layout of the first page of a TIFF file
+    :param path: full path of the file
+    :return: (dtype, shape, offset) if the page is one uncompressed contiguous block in native byte order, else None
+    """
+    with open(path, 'rb') as f:
+        head = f.read(16)
+        if len(head) < 8 or head[:2] not in (b'II', b'MM'):
+            return None
+        order = '<' if head[:2] == b'II' else '>'
+        if (order == '<') != (sys.byteorder == 'little'):
+            return None
+        version = struct.unpack(order + 'H', head[2:4])[0]
+        if version == 42:
+            ifd = struct.unpack(order + 'I', head[4:8])[0]
+            countFormat, entryFormat, entrySize, valueSize = 'H', 'HHI4s', 12, 4
+        elif version == 43 and len(head) == 16:
+            ifd = struct.unpack(order + 'Q', head[8:16])[0]
+            countFormat, entryFormat, entrySize, valueSize = 'Q', 'HHQ8s', 20, 8
+        else:
+            return None
+        f.seek(ifd)
+        countSize = struct.calcsize(countFormat)
+        nEntries = struct.unpack(order + countFormat, f.read(countSize))[0]
+        entries = f.read(nEntries * entrySize)
+        tags = {}
+        for i in range(nEntries):
+            tag, typ, count, value = struct.unpack(order + entryFormat, entries[i * entrySize:(i + 1) * entrySize])
+            if tag not in TIFF_TAGS:
+                continue
+            if typ not in TIFF_TYPES:
+                return None
+            fmt, size = TIFF_TYPES[typ]
+            if count * size > valueSize:
+                f.seek(struct.unpack(order + ('I' if valueSize == 4 else 'Q'), value)[0])
+                data = f.read(count * size)
+            else:
+                data = value[:count * size]
+            tags[TIFF_TAGS[tag]] = struct.unpack(order + fmt * count, data)
+    if 'tile_width' in tags or tags.get('compression', (1,))[0] != 1 or tags.get('samples', (1,))[0] != 1:
+        return None
+    if any(k not in tags for k in ('width', 'height', 'bits', 'offsets', 'counts')):
+        return None
+    kind = TIFF_FORMATS.get(tags.get('format', (1,))[0])
+    bits = tags['bits'][0]
+    if kind is None or bits not in (8, 16, 32, 64) or (kind == 'f' and bits < 32):
+        return None
+    dtype = np.dtype(order + kind + str(bits // 8))
+    shape = (tags['height'][0], tags['width'][0])
+    offsets, counts = tags['offsets'], tags['counts']
+    for i in range(1, len(offsets)):
+        if offsets[i] != offsets[i - 1] + counts[i - 1]:
+            return None
+    if sum(counts) < shape[0] * shape[1] * dtype.itemsize:
+        return None
+    return dtype, shape, offsets[0]
+
+def readEdfLayout(path):
+    """
+    Read the pixel layout of a single frame EDF file
+    :param path: full path of the file
+    :return: (dtype, shape, offset) if the frame is uncompressed in native byte order, else None
+    """
+    with open(path, 'rb') as f:
+        block = f.read(EDF_BLOCK_SIZE)
+        if not block.lstrip().startswith(b'{'):
+            return None
+        header = block
+        while b'}' not in header:
+            block = f.read(EDF_BLOCK_SIZE)
+            if len(block) == 0:
+                return None
+            header += block
+    end = header.index(b'}') + 1
+    if header[end:end + 1] == b'\n':
+        end += 1
+    keys = {}
+    for line in header[:end].decode('ascii', 'replace').split(';'):
+        if '=' in line:
+            key, value = line.split('=', 1)
+            keys[key.strip(' {\n\r\t')] = value.strip()
+    if keys.get('Compression', 'None').lower() not in ('none', 'no', '') or 'Dim_3' in keys:
+        return None
+    if keys.get('DataType') not in EDF_DATA_TYPES or 'Dim_1' not in keys or 'Dim_2' not in keys:
+        return None
+    byteOrder = '<' if keys.get('ByteOrder', 'LowByteFirst') == 'LowByteFirst' else '>'
+    if (byteOrder == '<') != (sys.byteorder == 'little'):
+        return None
+    dtype = np.dtype(EDF_DATA_TYPES[keys['DataType']])
+    shape = (int(keys['Dim_2']), int(keys['Dim_1']))
+    size = shape[0] * shape[1] * dtype.itemsize
+    if int(keys.get('Size', size)) != size or os.path.getsize(path) != end + size:
+        return None
+    return dtype, shape, end
+
+def mapFrame(path):
+    """
+    Memory-map the pixels of an uncompressed TIFF or EDF file. The pixels are read from the disk only
+    when they are used, without being decoded into an intermediate buffer.
+    :param path: full path of the file
+    :return: read-only image (ndarray backed by the file), or None if the file can not be mapped
+    """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext in ('.tif', '.tiff'):
+            layout = readTiffLayout(path)
+        elif ext == '.edf':
+            layout = readEdfLayout(path)
+        else:
+            return None
+        if layout is None:
+            return None
+        dtype, shape, offset = layout
+        if offset + shape[0] * shape[1] * dtype.itemsize > os.path.getsize(path):
+            return None
+        return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape).view(np.ndarray)
+    except (OSError, ValueError, struct.error):
+        return None
+
+def readFrame(path):
+    """
+    Read the image of a file, memory-mapped if it is uncompressed (see mapFrame), else decoded by fabio
+    (compressed TIFF, CBF with byte offset compression, ...)
+    :param path: full path of the file
+    :return: image (ndarray), read-only if it is mapped
+    """
+    if isMappingEnabled():
+        img = mapFrame(path)
+        if img is not None:
+            return img
+    return fabio.open(path).data
@@ -0,0 +1,90 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .image_prefetcher import readImageData
+
+class GroupAverager:
+    """
+    Incremental mean of a group of images. Images are added one by one to a float64 sum updated in place,
+    so averaging N images needs one image and the sum in memory instead of the N images.
+    The mean is the same as np.mean() of the stacked images for integer images.
+    """
+    def __init__(self):
+        self.sum = None
+        self.count = 0
+        self.dtype = None
+
+    def add(self, img):
+        """
+        Add an image to the group
+        :param img: image (ndarray)
+        :return: -
+        """
+        img = np.asarray(img)
+        if self.sum is None:
+            self.sum = img.astype(np.float64)
+            self.dtype = img.dtype
+        else:
+            self.sum += img
+            self.dtype = np.result_type(self.dtype, img.dtype)
+        self.count += 1
+
+    def mean(self):
+        """
+        Give the mean of the images added so far, with the type np.mean() gives (float64 for integer images)
+        :return: mean image (ndarray), or None if no image was added
+        """
+        if self.count == 0:
+            return None
+        avg = self.sum / self.count
+        if np.issubdtype(self.dtype, np.inexact):
+            return avg.astype(self.dtype, copy=False)
+        return avg
+
+def averageImages(paths, read=readImageData, nWorkers=4):
+    """
+    Average images, decoded in parallel threads and added in order as they are read.
+    At most nWorkers + 1 decoded images are waiting to be added at any time
+    :param paths: full paths of the images
+    :param read: function reading an image from its path
+    :param nWorkers: number of decoding threads
+    :return: mean image (ndarray), or None if paths is empty
+    """
+    averager = GroupAverager()
+    with ThreadPoolExecutor(max_workers=nWorkers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(read, path))
+            if len(pending) > nWorkers:
+                averager.add(pending.popleft().result())
+        while pending:
+            averager.add(pending.popleft().result())
+    return averager.mean()
@@ -31,6 +31,10 @@ import os
 import glob
 import fabio
 import numpy as np
+try:
+    from .result_writer import getResultWriter, writeAtomically
+except ImportError: # run as a script
+    from musclex.utils.result_writer import getResultWriter, writeAtomically
 
 def log_progress(progress, total):
     """
@@ -59,6 +63,8 @@ def generate_tiff_files(fn, path, prefix, compress):
                 # create_tiff(fabio_img.data, metadata, path, prefix, i)
                 create_tiff(fabio_img, path, prefix, i, compress)
                 log_progress(i, fabio_img.nframes)
+    # the files are written in the background while the next frames are read
+    getResultWriter().flush()
     print('Completed')
 
 def create_tiff(img_data, path, prefix, serial, compress):
@@ -73,13 +79,30 @@ def create_tiff(img_data, path, prefix, serial, compress):
     # tifffile.imsave(tif_file_name, img_data, extratags=extra_tags)
     data = img_data.data.astype(np.int32)
     data[data==4294967295] = -1
+    header = img_data.getheader()
     if compress:
-        from PIL import Image
-        tif_img = Image.fromarray(data)
-        tif_img.save(cmp_tif_file_name, compression='tiff_lzw', exif=img_data.getheader())
+        getResultWriter().submit(write_compressed_tiff, cmp_tif_file_name, data, header)
     else:
-        tif_img = fabio.pilatusimage.pilatusimage(data=data, header=img_data.getheader())
-        tif_img.write(tif_file_name)
+        getResultWriter().submit(write_tiff, tif_file_name, data, header)
+
+def write_compressed_tiff(file_name, data, header):
+    """
+    Write a LZW compressed tiff file with the header in exif (run by the result writer)
+    :param file_name, data, header:
+    :return: -
+    """
+    from PIL import Image
+    tif_img = Image.fromarray(data)
+    writeAtomically(file_name, lambda p: tif_img.save(p, format='TIFF', compression='tiff_lzw', exif=header))
+
+def write_tiff(file_name, data, header):
+    """
+    Write a pilatus tiff file with its header (run by the result writer)
+    :param file_name, data, header:
+    :return: -
+    """
+    tif_img = fabio.pilatusimage.pilatusimage(data=data, header=header)
+    writeAtomically(file_name, tif_img.write)
 
 def read_meta_data(meta_fn):
     """
@@ -27,6 +27,8 @@ authorization from Illinois Institute of Technology.
 """
 
 import numpy as np
+from numba import jit
+from .peak_detection import getDerivatives, getPeakCandidates, mergeAdjacentPeaks
 
 def convexHull(hist, start_p = 0, end_p = 99999999, ignore = None):
     """
@@ -37,11 +39,25 @@ def convexHull(hist, start_p = 0, end_p = 99999999, ignore = None):
     :param ignore: specify ignore indexes in case the histogram has valleys from pilatus lines (list of boolean)
     :return: a histogram after convex hull is applied (list)
     """
+    ret = convexHullArray(hist, start_p, end_p, ignore)
+    if ret is None:
+        return np.array(hist)
+    return list(ret)
+
+def convexHullArray(hist, start_p = 0, end_p = 99999999, ignore = None):
+    """
+    Apply 1D Convex hull to a histogram from left to right, same as convexHull() but the result is a numpy array
+    :param hist: input histogram (list or numpy array)
+    :param start_p: start position of applying. The value of indexes before start_p will be 0 (int)
+    :param end_p: end position of applying (int)
+    :param ignore: specify ignore indexes in case the histogram has valleys from pilatus lines (list of boolean)
+    :return: a histogram after convex hull is applied (float64 numpy array), or None if the range is too small to apply it
+    """
     start_p = int(round(start_p))
     end_p = int(round(end_p))
 
     if end_p - start_p < 5 and (start_p !=0 or end_p != 99999999):
-        return np.array(hist)
+        return None
 
     hist = np.array(hist)
 
@@ -52,33 +68,72 @@ def convexHull(hist, start_p = 0, end_p = 99999999, ignore = None):
     hist_y = np.array(hist[hist_x], dtype=np.float32)
 
     if len(hist_x) < 5:
-        return np.array(hist)
+        return None
 
     hist_y2 = hist_y.copy()
     if ignore is not None:
         ignore2 = ignore[hist_x]
         hist_y2[ignore2] = int(max(hist_y2)*1.5)
 
-    # hull_x, hull_y = getHull(hist_x, hist_y2)
-    # hull = getSubtractedHist(hist_x, hist_y, hull_x, hull_y)
-
     if ignore is not None:
         hull_x, hull_y = getHull(hist_x, hist_y2, ignored = ignore2)
     else:
         hull_x, hull_y = getHull(hist_x, hist_y2)
-    hull = getSubtractedHist(hist_x, hist_y, hull_x, hull_y)
 
-    ret = list(np.zeros(start_p))
-    ret.extend(hull)
-    ret.extend(np.zeros(len(hist)-end_p))
+    ret = np.zeros(len(hist))
+    ret[start_p:end_p] = getSubtractedHistArray(hist_x, hist_y, hull_x, hull_y)
 
     if ignore is not None:
-        sub = np.array(ret)
-        sub[ignore] = 0
-        ret = list(sub)
+        ret[ignore] = 0
 
     return ret
 
+def convexHullBatch(hists, start_p = 0, end_p = 99999999, ignore = None):
+    """
+    Apply 1D Convex hull to each histogram of a 2D stack of histograms (e.g. the rows of a 2D integration)
+    :param hists: input histograms (2D numpy array, one histogram per row)
+    :param start_p: start position of applying. The value of indexes before start_p will be 0 (int)
+    :param end_p: end position of applying (int)
+    :param ignore: specify ignore indexes, same for all histograms (list of boolean)
+    :return: histograms after convex hull is applied (2D float64 numpy array), same as convexHull() on each row
+    """
+    hists = np.asarray(hists)
+    result = np.zeros(hists.shape)
+    for i in range(hists.shape[0]):
+        ret = convexHullArray(hists[i], start_p, end_p, ignore)
+        result[i] = hists[i] if ret is None else ret
+    return result
+
+@jit(nopython=True)
+def getHullIndices(x_data, y_data):
+    """
+    Get the indexes of the hull points of a histogram, compiled version of getHullScan() giving the same points.
+    The differences of y values are computed in the type of y_data (float32 or float64) and the slopes
+    and extrapolations in float64, as numpy does in getHullScan() with python int x values
+    :param x_data: x values of the histogram, strictly increasing (float64 numpy array)
+    :param y_data: y values of the histogram (float32 or float64 numpy array)
+    :return: indexes of hull points (numpy array)
+    """
+    n = len(y_data)
+    hull = np.empty(n, dtype=np.int64)
+    hull[0] = 0
+    k = 1
+    lasthullindex = 0
+    while lasthullindex < n - 1:
+        lasthully = y_data[lasthullindex]
+        lasthullx = x_data[lasthullindex]
+        currenthullindex = lasthullindex + 1
+        slope = np.float64(y_data[currenthullindex] - lasthully) / (x_data[currenthullindex] - lasthullx)
+        for i in range(currenthullindex + 1, n):
+            extrapolation = np.float64(lasthully) + slope * (x_data[i] - lasthullx)
+            if np.float64(y_data[i]) < extrapolation:
+                slope = np.float64(y_data[i] - lasthully) / (x_data[i] - lasthullx)
+                currenthullindex = i
+        hull[k] = currenthullindex
+        k += 1
+        lasthullindex = currenthullindex
+    return hull[:k]
+
 def getHull(x_data, y_data, ignored = None):
     """
     Get Hull from histogram
@@ -86,6 +141,28 @@ def getHull(x_data, y_data, ignored = None):
     :param y_data: y values of the histogram (list)
     :return: x and y values of hull (list)
     """
+    if len(x_data) == 0 or len(y_data) == 0:
+        return [], []
+
+    x = np.asarray(x_data)
+    y = np.asarray(y_data)
+    if y.dtype not in (np.float32, np.float64) or (x.dtype.kind not in 'iu' and x.dtype != np.float64):
+        # the arithmetic of other types (e.g. integer overflows) is only reproduced by the scan itself
+        return getHullScan(x_data, y_data)
+
+    indexes = getHullIndices(x.astype(np.float64), y)
+    xhull = [x_data[i] for i in indexes]
+    yhull = [y_data[i] for i in indexes]
+    return xhull, yhull
+
+def getHullScan(x_data, y_data):
+    """
+    Get Hull from histogram by scanning the slopes from each hull point (reference implementation of getHullIndices(),
+    used for the types it does not handle)
+    :param x_data: x values of the histogram (list)
+    :param y_data: y values of the histogram (list)
+    :return: x and y values of hull (list)
+    """
     xhull = []
     yhull = []
     
@@ -114,52 +191,6 @@ def getHull(x_data, y_data, ignored = None):
         yhull.append(y_data[currenthullindex])
         lasthullindex = currenthullindex
 
-    # xhull = []
-    # yhull = []
-    # if len(x_data) == 0 or len(y_data) == 0:
-    #     return xhull, yhull
-    # xhull.append(x_data[0])
-    # yhull.append(y_data[0])
-    
-    # lasthullindex = 0
-
-    # points = len(y_data)
-    # while lasthullindex < points - 1:
-    #     slope = (y_data[lasthullindex + 1] - y_data[lasthullindex]) / (
-    #         x_data[lasthullindex + 1] - x_data[lasthullindex])
-    #     currenthullindex = lasthullindex + 1
-    #     currenthully = y_data[lasthullindex]
-
-    #     for i in range(currenthullindex + 1, points):
-    #         extrapolation = currenthully + slope * (x_data[i] - x_data[lasthullindex])
-    #         if ignored is not None:
-    #             if y_data[i] < extrapolation:
-    #                 slope = ((y_data[i] - y_data[lasthullindex]) / (x_data[i] - x_data[lasthullindex]))
-    #                 currenthullindex = i
-
-    #             elif y_data[i] >= extrapolation: 
-    #                 if ignored[i] == True:
-    #                     currenthullindex = i
-                    
-    #         else : 
-    #             if y_data[i] < extrapolation:
-    #                 slope = ((y_data[i] - y_data[lasthullindex]) / (x_data[i] - x_data[lasthullindex]))
-    #                 currenthullindex = i
-    #     # Store the hull points to be used for a spline fit
-    #     xhull.append(x_data[currenthullindex])
-    #     #yhull.append(y_data[currenthullindex])
-    #     if ignored is not None:
-    #         if ignored[currenthullindex] == True:
-    #             yhull.append(0)
-    #         else:
-    #             yhull.append(y_data[currenthullindex]) 
-    #     else:
-    #         yhull.append(y_data[currenthullindex])
-
-    #     lasthullindex = currenthullindex
-    
-    # print("done with hull")
-    
     return xhull, yhull
 
 def getSubtractedHist(xdata, ydata, xhull, yhull):
@@ -173,6 +204,19 @@ def getSubtractedHist(xdata, ydata, xhull, yhull):
     """
     if len(xdata) < 2 or len(ydata) < 2 or len(xhull) < 2 or len(yhull) < 2:
         return ydata
+    return list(getSubtractedHistArray(xdata, ydata, xhull, yhull))
+
+def getSubtractedHistArray(xdata, ydata, xhull, yhull):
+    """
+    Apply Subtraction to original histogram by using a pchip line created from hull, same as getSubtractedHist() but the result is a numpy array
+    :param xdata: x values of original histogram (list)
+    :param ydata: y values of original histogram (list)
+    :param xhull: x values of hull (list)
+    :param yhull: y values of hull (list)
+    :return: Backgound subtracted histogram (float64 numpy array)
+    """
+    if len(xdata) < 2 or len(ydata) < 2 or len(xhull) < 2 or len(yhull) < 2:
+        return np.array(ydata, dtype=np.float64)
 
     if len(xhull) < 3 or len(yhull) < 3:
         segmentlx = xhull[0]
@@ -182,65 +226,127 @@ def getSubtractedHist(xdata, ydata, xhull, yhull):
         segmently = ydata[leftindex]
         segmentry = ydata[rightindex]
         slope = (float(segmently) - float(segmentry)) / (float(leftindex) - float(rightindex))
-        y_pchip = [segmently]
-        for i in range(1, len(xdata)):
-            val = segmently + slope * (i - leftindex)
-            y_pchip.append(val)
+        y_pchip = segmently + slope * (np.arange(len(xdata)) - leftindex)
+        y_pchip[0] = segmently
     else:
-        y_pchip = pchip(xhull, yhull, xdata) # Create a pchip line (curve) from hull
-
-    suby = []
-    for i in range(len(xdata)):
-        val = ydata[i] - y_pchip[i]
-        if val > 0:
-            suby.append(ydata[i] - y_pchip[i])
-        else:
-            suby.append(0)
+        y_pchip = np.array(pchip(xhull, yhull, xdata), dtype=np.float64) # Create a pchip line (curve) from hull
+
+    suby = np.asarray(ydata, dtype=np.float64) - y_pchip
+    suby[~(suby > 0)] = 0
     return suby
 
 def pchip(x, y, u):
     """
     Calculate the first derivative at each section
     there will be len(x)-1
+    :param x: x values of the hull, their values must be in u (list)
+    :param y: y values of the hull (list)
+    :param u: x values to evaluate the pchip line at, sorted (list)
+    :return: pchip line from x[0] to x[-1] (list)
+    """
+    return list(pchipArray(x, y, u))
+
+def pchipArray(x, y, u):
+    """
+    Evaluate the pchip line of a hull at u, same as pchip() but the result is a numpy array
+    :param x: x values of the hull, their values must be in u (list or numpy array)
+    :param y: y values of the hull (list or numpy array)
+    :param u: x values to evaluate the pchip line at, sorted (list or numpy array)
+    :return: pchip line from x[0] to x[-1] (float64 numpy array)
     """
-    h = []
-    h0 = x[0]
-    for h1 in x[1:]:
-        h.append(h1 - h0)
-        h0 = h1
-
-    delta = []
-    for (j, f) in enumerate(h):
-        delta.append((y[j + 1] - y[j]) / f)
-
-    d = []
-    d.append(pchipend(h[0], h[1], delta[0], delta[1]))
-    for k in range(1, len(x) - 1):
-        d.append(pchipslopes(h[k - 1], h[k], delta[k - 1], delta[k]))
-
-    d.append(pchipend(h[-1], h[-2], delta[-1], delta[-2]))
-
-    # evaluate function
-    pchipy = []
-    segmentlx = x[0]
-    segmently = y[0]
-    for (i, e) in enumerate(delta):
-        segmentrx = x[i + 1]
-        segmentry = y[i + 1]
-        leftindex = u.index(segmentlx)
-        rightindex = u.index(segmentrx)
-        c = (3 * e - 2 * d[i] - d[i + 1]) / h[i]
-        b = (d[i] - 2 * e + d[i + 1]) / (h[i] ** 2)
-        dfloat = d[i]
-        for j in u[leftindex:rightindex]:
-            j = j - u[leftindex]
-            pchipy.append(segmently + j * (dfloat + j * (c + j * b)))
-        segmentlx = segmentrx
-        segmently = segmentry
+    return pchipBatch([x], [y], u)[0]
 
+def pchipBatch(xs, ys, u):
+    """
+    Evaluate the pchip lines of many hulls sharing the same x values u (e.g. one hull per theta bin)
+    All hulls must start and end at the same values of u
+    :param xs: x values of each hull, their values must be in u (list of lists or numpy arrays)
+    :param ys: y values of each hull (list of lists or numpy arrays)
+    :param u: x values to evaluate the pchip lines at, sorted (list or numpy array)
+    :return: pchip lines, one per row (2D float64 numpy array), same as pchip() on each hull
+    """
+    u = np.asarray(u)
+    xs = [np.asarray(x) for x in xs]
+    lengths = np.array([len(x) for x in xs])
+    nseg = lengths - 1
+    # index of the first segment of each hull in the concatenated segments
+    segstart = np.concatenate(([0], np.cumsum(nseg)[:-1]))
+
+    # differences are taken in the input types so float32 histograms are rounded as they were by the scalar code
+    h = np.concatenate([np.diff(x) for x in xs]).astype(np.float64)
+    dy = np.concatenate([np.diff(np.asarray(y)) for y in ys]).astype(np.float64)
+    y0 = np.concatenate([np.asarray(y)[:-1] for y in ys]).astype(np.float64)
+    ylast = np.array([np.asarray(y)[-1] for y in ys], dtype=np.float64)
+    delta = dy / h
+
+    d = pchipSlopesArray(h, delta, segstart, nseg)
+    # slopes at the left and right end of each segment
+    dl = np.delete(d, np.cumsum(lengths) - 1)
+    dr = np.delete(d, segstart + np.arange(len(xs)))
+    c = (3 * delta - 2 * dl - dr) / h
+    b = (dl - 2 * delta + dr) / (h ** 2)
+
+    # segment of each point of u, for each hull
+    first = np.searchsorted(u, xs[0][0])
+    last = np.searchsorted(u, xs[0][-1])
+    knots = [np.searchsorted(u, x) for x in xs]
+    if any(k[0] != first or k[-1] != last for k in knots):
+        raise ValueError("All hulls must start and end at the same x values")
+    nPoints = last - first
+    seg = np.zeros((len(xs), nPoints), dtype=np.int64)
+    for i, k in enumerate(knots):
+        seg[i, k[1:-1] - first] = 1
+    seg = np.cumsum(seg, axis=1) + segstart[:, None]
+
+    knotpos = np.concatenate([k[:-1] for k in knots])
+    j = (u[first:last] - u[knotpos[seg]]).astype(np.float64)
+    result = np.empty((len(xs), nPoints + 1), dtype=np.float64)
+    result[:, :-1] = y0[seg] + j * (dl[seg] + j * (c[seg] + j * b[seg]))
     # append the last point
-    pchipy.append(y[-1])
-    return pchipy
+    result[:, -1] = ylast
+    return result
+
+def pchipSlopesArray(h, delta, segstart, nseg):
+    """
+    Slopes of shape-preserving Hermite cubics at every hull point, vectorized form of pchipslopes() and pchipend()
+    :param h: x differences of the concatenated hulls (float64 numpy array)
+    :param delta: slopes of the segments of the concatenated hulls (float64 numpy array)
+    :param segstart: index of the first segment of each hull (numpy array)
+    :param nseg: number of segments of each hull, at least 2 (numpy array)
+    :return: slopes at each point of the concatenated hulls (float64 numpy array)
+    """
+    nHulls = len(segstart)
+    segend = segstart + nseg - 1
+    # interior points : segment k-1 and segment k in the same hull
+    right = np.ones(len(h), dtype=bool)
+    right[segstart] = False
+    right = np.nonzero(right)[0]
+    hm, hk = h[right - 1], h[right]
+    deltam, deltak = delta[right - 1], delta[right]
+    w1 = 2 * hk + hm
+    w2 = hk + 2 * hm
+    same = np.sign(deltam) * np.sign(deltak) > 0
+    interior = np.zeros(len(right), dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        interior[same] = ((w1 + w2) / (w1 / deltam + w2 / deltak))[same]
+
+    d = np.empty(len(h) + nHulls, dtype=np.float64)
+    # points of hull i are at segment index + i
+    d[right + np.searchsorted(segstart, right, side='right') - 1] = interior
+    d[segstart + np.arange(nHulls)] = pchipEndArray(h[segstart], h[segstart + 1], delta[segstart], delta[segstart + 1])
+    d[segend + 1 + np.arange(nHulls)] = pchipEndArray(h[segend], h[segend - 1], delta[segend], delta[segend - 1])
+    return d
+
+def pchipEndArray(h1, h2, del1, del2):
+    """
+    Noncentered, shape-preserving, three-point formula, vectorized form of pchipend()
+    """
+    d = ((2 * h1 + h2) * del1 - h1 * del2) / (h1 + h2)
+    opposite = np.sign(d) != np.sign(del1)
+    limit = ~opposite & (np.sign(del1) != np.sign(del2)) & (np.abs(d) > np.abs(3 * del1))
+    d[opposite] = 0
+    d[limit] = 3 * del1[limit]
+    return d
 
 def pchipslopes(hm, h, deltam, delta):
     """
@@ -294,57 +400,37 @@ def getPeaksFromHist(orig_hist, width_thres=0, height_thres=0):
     :param height_thres: Height threshold (default = mean value of histogram)
     :return: sorted peak list
     """
-    if len(orig_hist) < 10:
-        return []
+    return getPeaksFromHistBatch([orig_hist], width_thres, height_thres)[0]
+
+def getPeaksFromHistBatch(orig_hists, width_thres=0, height_thres=0):
+    """
+    Find peaks from each histogram of a list, same as getPeaksFromHist() on each histogram.
+    Histograms of the same length are searched together
+    :param orig_hists: input histograms (list of histograms or 2D numpy array)
+    :param width_thres: Width threshold (default = 5)
+    :param height_thres: Height threshold (default = mean value of each histogram)
+    :return: sorted peak list of each histogram (list of lists)
+    """
     if width_thres == 0:
         width_thres = 5
-    if height_thres == 0:
-        height_thres = np.mean(orig_hist)
-
-    hist = smooth(np.array(orig_hist), 20)
-    hist[hist < height_thres] = height_thres
-    hist = hist - min(hist)
-
-    peak_hist1 = np.zeros((len(hist), 1))
-    peak_list = []
-    for i in range(4, len(hist) - 4):
-        peak_hist1[i] = hist[i + 1] - hist[i - 1]
-
-    for i in range(width_thres, len(peak_hist1) - width_thres):
-
-
-        if all(peak_hist1[i - width_thres:i] > 0) and all(peak_hist1[i + 1:i + width_thres] < 0):
-            peak_list.append(i)
-
-    if len(peak_list) != 0:
-        new_list = []
-        derivate = np.zeros((len(peak_list), 1))
-        for i in range(1, len(peak_list)):
-            derivate[i] = peak_list[i] - peak_list[i - 1]
-        i = 0
-        while i < len(derivate) - 1:
-            s = peak_list[i]
-            c = 0
-            if derivate[i + 1] == 1 and not i + 1 == len(derivate) - 1:
-                j = i + 1
-                while j <= len(derivate):
-                    if derivate[j] == 1 and not j + 1 == len(derivate):
-                        s += peak_list[j]
-                        c += 1
-                        j += 1
-                    else:
-                        s /= (c + 1)
-                        i = j
-                        break
-            else:
-                i += 1
-            new_list.append(s)
-        if i != len(derivate) - 1:
-            new_list.append(peak_list[i])
-        peak_list = new_list
 
-    peak_list.sort()
-    return peak_list
+    results = [[] for _ in range(len(orig_hists))]
+    groups = {}
+    for (i, orig_hist) in enumerate(orig_hists):
+        if len(orig_hist) < 10:
+            continue
+        threshold = np.mean(orig_hist) if height_thres == 0 else height_thres
+        hist = smooth(np.array(orig_hist), 20)
+        hist[hist < threshold] = threshold
+        hist = hist - min(hist)
+        groups.setdefault(len(hist), []).append((i, hist))
+
+    for group in groups.values():
+        hists = np.array([hist for _, hist in group])
+        candidates = getPeakCandidates(getDerivatives(hists), width_thres)
+        for ((i, _), row) in zip(group, candidates):
+            results[i] = sorted(mergeAdjacentPeaks(np.flatnonzero(row)))
+    return results
 
 def movePeaks(hist, peaks, dist=20):
     """
@@ -374,7 +460,7 @@ def movePeaks(hist, peaks, dist=20):
                 right = max(p, new_peak)
 
                 # Check if between initial peak and local maximum has valley
-                if all(smooth_hist[left + 1:right] > smooth_hist[p]):
+                if np.all(smooth_hist[left + 1:right] > smooth_hist[p]):
                     break
             dist = dist / 2
         peakList.append(new_peak)
@@ -459,25 +545,84 @@ def getPeakInformations(hist, peaks, baselines):
     :param baselines: baselines of peaks (list)
     :return: result with infomations (dict)
     """
-    centroids = []
-    widths = []
-    intersectionsList = []
-    areas = []
-
-    for (i, p) in enumerate(peaks):
-        baseline = baselines[i]
-        width, intersections = getWidth(hist, p, baseline)
-        cent = getCentroid(hist, p, intersections)
-        areas.append(hist[p] * width / (2.35 * 0.3989))
-        centroids.append(cent)
-        widths.append(width)
-        intersectionsList.append(intersections)
-    results = {}
-    results["centroids"] = centroids
-    results["widths"] = widths
-    results["intersections"] = intersectionsList
-    results["areas"] = areas
-    return results
+    return getPeakInformationsBatch([hist], [peaks], [baselines])[0]
+
+def getPeakInformationsBatch(hists, peaksList, baselinesList):
+    """
+    Get peak informations of several histograms in one pass. The baseline intersections of all peaks are found
+    with one masked search and the centroids are evaluated from cumulative sums of the histograms.
+    Widths and intersections are the same as getWidth(), centroids match getCentroid() up to rounding
+    :param hists: input histograms (list of list)
+    :param peaksList: peak locations of each histogram (list of list)
+    :param baselinesList: baselines of peaks of each histogram (list of list)
+    :return: result with infomations for each histogram, as getPeakInformations() (list of dict)
+    """
+    counts = [len(peaks) for peaks in peaksList]
+    allResults = []
+    if sum(counts) == 0:
+        for _ in hists:
+            allResults.append({"centroids": [], "widths": [], "intersections": [], "areas": []})
+        return allResults
+
+    lens = np.array([len(hist) for hist in hists])
+    n = lens.max()
+    H = np.zeros((len(hists), n))
+    for i, hist in enumerate(hists):
+        H[i, :lens[i]] = hist
+    idx = np.arange(n)
+
+    rows = np.repeat(np.arange(len(hists)), counts)
+    peaks = np.concatenate([np.asarray(p, dtype=int) for p in peaksList if len(p) > 0])
+    baselines = np.concatenate([np.asarray(b, dtype=np.float64) for b in baselinesList if len(b) > 0])
+    k = np.arange(len(peaks))
+    peak_hists = H[rows]
+    stops = ~(peak_hists > baselines[:, None])
+
+    # Left intersection is the last point before the peak which is not above baseline (or the first point)
+    left_stops = (stops | (idx == 0)) & (idx < peaks[:, None])
+    left = n - 1 - np.argmax(left_stops[:, ::-1], axis=1)
+    left = np.where(left_stops.any(axis=1), left, peaks - 1)
+    # Right intersection is the first point after the peak which is not above baseline (or the last point)
+    right_stops = (stops | (idx >= lens[rows][:, None] - 1)) & (idx > peaks[:, None])
+    right = np.argmax(right_stops, axis=1)
+    right = np.where(right_stops.any(axis=1), right, peaks + 1)
+
+    # Intersection of baseline and hist (considered a line between 2 points)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        left_slope = peak_hists[k, left + 1] - peak_hists[k, left]
+        left_b = peak_hists[k, left] - left_slope * left
+        left_x = np.where(left_slope != 0, (baselines - left_b) / left_slope, baselines - left_b)
+        right_slope = peak_hists[k, right] - peak_hists[k, right - 1]
+        right_b = peak_hists[k, right] - right_slope * right
+        right_x = np.where(right_slope != 0, (baselines - right_b) / right_slope, right_b - baselines)
+    widths = right_x - left_x
+    # In the case the slope method fails, we use the int value
+    int_widths = right - left
+    fallback = (widths < 0) | (np.abs(widths - int_widths) > 2)
+    widths = np.where(fallback, int_widths, widths)
+
+    # Centroids from cumulative sums of hist and x*hist between intersections
+    sums = np.zeros((len(hists), n + 1))
+    np.cumsum(H, axis=1, out=sums[:, 1:])
+    moments = np.zeros((len(hists), n + 1))
+    np.cumsum(H * idx, axis=1, out=moments[:, 1:])
+    start = np.clip(left, 0, n)
+    denominators = sums[rows, right + 1] - sums[rows, start]
+    numerators = moments[rows, right + 1] - moments[rows, start]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        centroids = np.where(denominators != 0, numerators / denominators, peaks)
+    areas = peak_hists[k, peaks] * widths / (2.35 * 0.3989)
+
+    splits = np.cumsum(counts)[:-1]
+    for c, w, f, l, r, a in zip(np.split(centroids, splits), np.split(widths, splits), np.split(fallback, splits),
+                                np.split(left, splits), np.split(right, splits), np.split(areas, splits)):
+        results = {}
+        results["centroids"] = c.tolist()
+        results["widths"] = [int(width) if fb else width for width, fb in zip(w.tolist(), f)]
+        results["intersections"] = list(zip(l.tolist(), r.tolist()))
+        results["areas"] = a.tolist()
+        allResults.append(results)
+    return allResults
 
 def smooth(x, window_len=10, window='hanning'): # From http://scipy-cookbook.readthedocs.io/items/SignalSmooth.html
     """
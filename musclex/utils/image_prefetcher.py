@@ -0,0 +1,253 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import pickle
+import threading
+import weakref
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .frame_source import readFrame
+from .run_container import isRunContainerEnabled, readContainerCache
+
+class ImagePrefetcher:
+    """
+    Read-ahead of the images (and of their cache files) around the current image of a GUI.
+    The images following the current one in the navigation direction are read by a thread pool
+    and kept in a bounded LRU, so that going to the next or previous image does not wait for the disk.
+    An entry is only used if its file has not been modified since it has been read.
+    Images given by the prefetcher are read-only, and a cache is given only once (the next read
+    of the same cache file is done again from the disk).
+    """
+    def __init__(self, maxSize=8, readAhead=2, nWorkers=2):
+        """
+        :param maxSize: maximum number of images kept in memory
+        :param readAhead: number of images read in advance in the navigation direction
+        :param nWorkers: number of reading threads
+        """
+        self.maxSize = max(maxSize, readAhead + 2)
+        self.readAhead = readAhead
+        self.nWorkers = nWorkers
+        self.images = OrderedDict() # path -> (file stamp, image)
+        self.caches = {} # path -> (file stamp, info)
+        self.pending = {} # path -> future
+        self.lock = threading.Lock()
+        self.executor = None
+        self.lastIndex = None
+        self.direction = 1
+        _prefetchers.add(self)
+
+    def prefetch(self, dir_path, imgList, index, cache_dir=None, ext=''):
+        """
+        Read in advance the images following the current one in the navigation direction.
+        The direction is given by the previous current image.
+        :param dir_path: directory of the images
+        :param imgList: image file names
+        :param index: index of the current image in imgList
+        :param cache_dir: name of the cache folder of the program (e.g. 'qf_cache'), None to only read images
+        :param ext: extension of the opened file, nothing is read for h5 files (frames are already loaded)
+        :return: -
+        """
+        n = len(imgList)
+        if n == 0 or ext in ('.hdf5', '.h5'):
+            return
+        if self.lastIndex is not None and n > 2:
+            if index == (self.lastIndex + 1) % n:
+                self.direction = 1
+            elif index == (self.lastIndex - 1) % n:
+                self.direction = -1
+        self.lastIndex = index
+        for k in range(1, min(self.readAhead, n - 1) + 1):
+            name = imgList[(index + self.direction * k) % n]
+            self.submit(os.path.join(dir_path, name), self.readImage)
+            if cache_dir is not None:
+                self.submit(os.path.join(dir_path, cache_dir, name + '.info'), self.readCache)
+
+    def prefetchFiles(self, paths):
+        """
+        Read in advance a list of image files (e.g. the images of the next group to add)
+        :param paths: full paths of the image files
+        :return: -
+        """
+        for path in paths[:self.maxSize]:
+            self.submit(path, self.readImage)
+
+    def submit(self, path, read):
+        """
+        Read a file in a reading thread if it is not already in memory or being read
+        """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.nWorkers)
+            if path in self.pending or path in self.images or path in self.caches:
+                return
+            self.pending[path] = self.executor.submit(read, path)
+
+    def readImage(self, path):
+        """
+        Read an image file (in a reading thread)
+        """
+        try:
+            stamp = getFileStamp(path)
+            img = np.array(readFrame(path))
+            img.flags.writeable = False
+            with self.lock:
+                self.images[path] = (stamp, img)
+                self.images.move_to_end(path)
+                while len(self.images) > self.maxSize:
+                    self.images.popitem(last=False)
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.pending.pop(path, None)
+
+    def readCache(self, path):
+        """
+        Read a cache file (in a reading thread)
+        """
+        try:
+            if os.path.isfile(path):
+                stamp = getFileStamp(path)
+                with open(path, 'rb') as c:
+                    info = pickle.load(c)
+                with self.lock:
+                    self.caches[path] = (stamp, info)
+                    while len(self.caches) > self.maxSize:
+                        del self.caches[next(iter(self.caches))]
+        except Exception:
+            pass
+        finally:
+            with self.lock:
+                self.pending.pop(path, None)
+
+    def getImage(self, path):
+        """
+        Give an image read in advance
+        :param path: full path of the image file
+        :return: image (read-only ndarray), or None if the image has not been read or has been modified
+        """
+        self.waitFor(path)
+        with self.lock:
+            entry = self.images.get(path)
+            if entry is None:
+                return None
+            self.images.move_to_end(path)
+        if entry[0] != getFileStamp(path):
+            with self.lock:
+                self.images.pop(path, None)
+            return None
+        return entry[1]
+
+    def getCache(self, path):
+        """
+        Give a cache read in advance, and forget it
+        :param path: full path of the cache file
+        :return: cached info, or None if the cache has not been read or has been modified
+        """
+        self.waitFor(path)
+        with self.lock:
+            entry = self.caches.pop(path, None)
+        if entry is None or entry[0] != getFileStamp(path):
+            return None
+        return entry[1]
+
+    def waitFor(self, path):
+        """
+        Wait for the file to be read if it is being read
+        """
+        with self.lock:
+            future = self.pending.get(path)
+        if future is not None:
+            future.result()
+
+    def invalidate(self):
+        """
+        Forget all the images and caches read in advance (e.g. when the folder or the settings change)
+        :return: -
+        """
+        with self.lock:
+            self.images.clear()
+            self.caches.clear()
+        self.lastIndex = None
+        self.direction = 1
+
+    def shutdown(self):
+        """
+        Stop the reading threads and forget all the images
+        :return: -
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+        with self.lock:
+            self.pending.clear()
+        self.invalidate()
+
+_prefetchers = weakref.WeakSet()
+
+def getFileStamp(path):
+    """
+    Give the modification stamp of a file
+    :param path: full path of the file
+    :return: (modification time, size), or None if the file does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def readImageData(path):
+    """
+    Read the data of an image file, from the images read in advance by the GUIs if available,
+    else memory-mapped if the file is uncompressed (see frame_source.readFrame)
+    :param path: full path of the image file
+    :return: image (ndarray), it may be read-only
+    """
+    for prefetcher in list(_prefetchers):
+        img = prefetcher.getImage(path)
+        if img is not None:
+            return img
+    return readFrame(path)
+
+def readCacheFile(path):
+    """
+    Read a pickled cache file, from the caches read in advance by the GUIs if available
+    :param path: full path of the cache file
+    :return: cached info
+    """
+    if isRunContainerEnabled():
+        return readContainerCache(path)
+    for prefetcher in list(_prefetchers):
+        info = prefetcher.getCache(path)
+        if info is not None:
+            return info
+    with open(path, 'rb') as c:
+        return pickle.load(c)
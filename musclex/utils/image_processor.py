@@ -37,6 +37,8 @@ from pyFAI.detectors import Detector
 from pyFAI import detector_factory, load
 from pyFAI.goniometer import SingleGeometry
 from pyFAI.calibrant import get_calibrant
+from .detector_resolver import resolveDetector, resolveBinnedDetector
+from .integration_backend import getIntegrationMethod
 
 def distance(pt1, pt2):
     """
@@ -172,23 +174,92 @@ def getContours(img, n1=1, n2=2):
         return ret[0]
     return None
 
+def preprocessForGeometry(img, decimate=1):
+    """
+    Compute once the preprocessing shared by the center and rotation angle estimations:
+    the blurred 8-bit image and the ellipse fitted to the biggest contour of the thresholded image.
+    With decimate > 1, the contour is searched on a decimated image and the ellipse is then refined
+    at full resolution in the region of the coarse contour only.
+    :param img: input image
+    :param decimate: decimation factor for the coarse contour search (None = automatic from the image size)
+    :return: dict with 'img8' (blurred 8-bit image), 'decimate' and 'ellipse' (None if not found)
+    """
+    img8 = get8bitImage(img)
+    img8 = cv2.GaussianBlur(img8, (5, 5), 0)
+    if decimate is None:
+        decimate = max(1, max(img8.shape) // 2048)
+
+    if decimate <= 1:
+        cnt = getBiggestContour(bkImg(copy.copy(img8), 0.005, 50))
+        ellipse = cv2.fitEllipse(cnt) if cnt is not None and len(cnt) > 5 else None
+        return {'img8': img8, 'decimate': 1, 'ellipse': ellipse}
+
+    # Coarse search on the decimated image using the full resolution threshold
+    th = max(0, getThreshold(img8, percent=0.005)-1)
+    coarse = cv2.resize(img8, (img8.shape[1] // decimate, img8.shape[0] // decimate), interpolation=cv2.INTER_AREA)
+    cnt = getBiggestContour(bkImgWithThreshold(coarse, th, max(3, int(round(50. / decimate)))))
+    ellipse = None
+    if cnt is not None and len(cnt) > 5:
+        # Refine at full resolution around the coarse contour
+        x, y, w, h = cv2.boundingRect(cnt)
+        margin = 50
+        x1, y1 = max(0, x * decimate - margin), max(0, y * decimate - margin)
+        x2, y2 = min(img8.shape[1], (x + w) * decimate + margin), min(img8.shape[0], (y + h) * decimate + margin)
+        fine_cnt = getBiggestContour(bkImgWithThreshold(img8[y1:y2, x1:x2].copy(), th, 50))
+        if fine_cnt is not None and len(fine_cnt) > 5:
+            ellipse = cv2.fitEllipse(fine_cnt)
+            ellipse = ((ellipse[0][0] + x1, ellipse[0][1] + y1), ellipse[1], ellipse[2])
+        else:
+            ellipse = cv2.fitEllipse(cnt)
+            ellipse = (((ellipse[0][0] + .5) * decimate - .5, (ellipse[0][1] + .5) * decimate - .5),
+                       (ellipse[1][0] * decimate, ellipse[1][1] * decimate), ellipse[2])
+    return {'img8': img8, 'decimate': decimate, 'ellipse': ellipse}
+
+def bkImgWithThreshold(img, th, morph=25):
+    """
+    Same as bkImg() but with a given threshold value instead of a percentage
+    :param img: input image (uint8)
+    :param th: threshold value
+    :param morph: morphology size
+    :return: image
+    """
+    _, img = cv2.threshold(img, th, 255, cv2.THRESH_BINARY_INV, dst=img)
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (morph, morph))
+    img = cv2.morphologyEx(img, cv2.MORPH_OPEN, kernel)
+    return inverte(img)
+
+def getBiggestContour(img):
+    """
+    Give the contour which has the maximum size in the image
+    :param img: binary image
+    :return: contour (None if there's no contour)
+    """
+    contours = getContours(img)
+    if contours is None or len(contours) == 0:
+        return None
+    return max(contours, key=len)
+
 def getCenter(img):
     """
     Find center of the diffraction.
     :param img: input image
     :return: center
     """
-    img = get8bitImage(copy.copy(img))
-    img = cv2.GaussianBlur(img, (5, 5), 0)
+    return getCenterFromPreprocessed(preprocessForGeometry(img))
+
+def getCenterFromPreprocessed(prep):
+    """
+    Find center of the diffraction from the preprocessing given by preprocessForGeometry().
+    The initial center from the coarse ellipse is refined at full resolution with the reflections.
+    :param prep: preprocessed image (dict)
+    :return: center
+    """
+    img = prep['img8']
     init_center = None
 
     ##  Find init center by apply thresholding and fit ellipse to the contour which has the maximum size
-    cimg = bkImg(copy.copy(img), 0.005, 50)
-
-    contours = getContours(cimg)
-    cnt = max(contours, key=len)
-    if len(cnt) > 5:
-        ellipse = cv2.fitEllipse(cnt)
+    if prep['ellipse'] is not None:
+        ellipse = prep['ellipse']
         init_center = (ellipse[0][0], ellipse[0][1])
 
     ## Find center by apply thresholding and fit ellipse to the contour of reflections and find the average center of reflections
@@ -360,27 +431,42 @@ def getRadOfMaxHoF(HoFs, mode, ratio=0.05):
     opt_idx = np.mean(opt_grp) % len(HoFs)
     return 2 * np.pi * opt_idx / nHoFs
 
-def getRotationAngle(img, center, method=0, man_det=None):
+def getRotationAngle(img, center, method=0, man_det=None, prep=None, detector=None):
     """
     Find rotation angle of the diffraction.
     :param img: input image
     :param center: center of the diffraction
+    :param method: orientation model (0 = max intensity, 1 = GMM, 2 = HoF full, 3 = HoF half)
+    :param man_det: detector name chosen by the user
+    :param prep: preprocessing given by preprocessForGeometry() if it is already computed
+    :param detector: detector to use instead of the one resolved from the image (i.e. binned detector for a pyramid level)
+    :return: rotation angle in degree
+    """
+    if prep is None:
+        prep = preprocessForGeometry(img)
+    return getRotationAngleFromPreprocessed(img, center, prep, method=method, man_det=man_det, detector=detector)
+
+def getRotationAngleFromPreprocessed(img, center, prep, method=0, man_det=None, detector=None):
+    """
+    Find rotation angle of the diffraction from the preprocessing given by preprocessForGeometry().
+    The angle is searched on a 1 degree azimuthal histogram and refined on 0.1 degree bins, both taken
+    from the same 2D integration (cake).
+    :param img: input image
+    :param center: center of the diffraction
+    :param prep: preprocessed image (dict)
+    :param method: orientation model (0 = max intensity, 1 = GMM, 2 = HoF full, 3 = HoF half)
+    :param man_det: detector name chosen by the user
+    :param detector: detector to use instead of the one resolved from the image
     :return: rotation angle in degree
     """
-    ## Find init angle by apply thresholding and fit ellipse to the contour which has the maximum size
-    cimg = get8bitImage(copy.copy(img))
-    cimg = cv2.GaussianBlur(cimg, (5, 5), 0)
-    cimg = bkImg(copy.copy(cimg), 0.005, 50)
+    ## Find init angle from the ellipse fitted to the contour which has the maximum size
     init_angle = None
-    contours = getContours(cimg)
-    cnt = max(contours, key=len)
-    if len(cnt) > 5:
-        ellipse = cv2.fitEllipse(cnt)
-        init_angle = (ellipse[2]+90.) % 180
+    if prep['ellipse'] is not None:
+        init_angle = (prep['ellipse'][2]+90.) % 180
         init_angle = init_angle if init_angle <= 90. else 180. - init_angle
 
     # Find angle with maximum intensity from Azimuthal integration
-    det = find_detector(img, man_det=man_det)
+    det = detector if detector is not None else find_detector(img, man_det=man_det)
 
     corners = [(0, 0), (0, img.shape[1]), (img.shape[0], 0), (img.shape[0], img.shape[1])]
     npt_rad = int(round(min([distance(center, c) for c in corners])))
@@ -388,10 +474,17 @@ def getRotationAngle(img, center, method=0, man_det=None):
     mask[img<0] = 1
     ai = AzimuthalIntegrator(detector=det)
     ai.setFit2D(200, center[0], center[1])
-    integration_method = IntegrationMethod.select_one_available("csr", dim=2, default="csr", degradable=True)
-    I2D, tth, _ = ai.integrate2d(img, npt_rad, 360, unit="r_mm", method=integration_method, mask=mask)
-    I2D = I2D[:, :int(len(tth)/3.)]
-    hist = np.sum(I2D, axis=1)  # Find a histogram from 2D Azimuthal integrated histogram, the x-axis is degree and y-axis is intensity
+    integration_method = getIntegrationMethod(ai, img, 2, (npt_rad, 360*10), unit="r_mm", mask=mask)
+    # Cake with 10 bins per degree, 1 degree bins are rebuilt from its signal and normalization sums
+    res = ai.integrate2d(img, npt_rad, 360*10, unit="r_mm", method=integration_method, mask=mask)
+    nrad = int(len(res.radial)/3.)
+    signal = res.sum_signal[:, :nrad]
+    norm = res.sum_normalization[:, :nrad]
+    hist = np.sum(_cakeIntensity(signal.reshape(360, 10, nrad).sum(axis=1), norm.reshape(360, 10, nrad).sum(axis=1)), axis=1)  # Find a histogram from 2D Azimuthal integrated histogram, the x-axis is degree and y-axis is intensity
+    fine_hist = np.sum(_cakeIntensity(signal, norm), axis=1)
+    # Lower edge of the chi range of the cake, the fine bins of an angle are found from it (-180 with the default discontinuity at pi)
+    step = (res.azimuthal[-1] - res.azimuthal[0]) / (len(res.azimuthal) - 1)
+    chi_min = res.azimuthal[0] - step / 2
     sum_range = 0
 
     # Find degree which has maximum intensity
@@ -405,16 +498,15 @@ def getRotationAngle(img, center, method=0, man_det=None):
     else:  # Find the best degree by its intensity
         max_degree = max(np.arange(180), key=lambda d: np.sum(hist[d - sum_range:d + sum_range + 1]) + np.sum(
             hist[d + 180 - sum_range:d + 181 + sum_range]))
+        # Refine with the 0.1 degree bins of the cake around the max degree and its opposite
         hist = 0
         if -175 <= max_degree < 175:
-            I2D, tth, _ = ai.integrate2d(img, npt_rad, 100, azimuth_range=(max_degree-5, max_degree+5), unit="r_mm", method=integration_method, mask=mask)
-            I2D = I2D[:, :int(len(tth)/3.)]
-            hist += np.sum(I2D, axis=1)
+            start = int(round((max_degree - 5 - chi_min) / step))
+            hist += np.take(fine_hist, np.arange(start, start+100), mode='wrap')
         op_max_degree = max_degree-180 if max_degree > 0 else max_degree+180
         if -175 <= op_max_degree < 175:
-            I2D2, tth2, _ = ai.integrate2d(img, npt_rad, 100, azimuth_range=(op_max_degree-5, op_max_degree+5), unit="r_mm", method=integration_method, mask=mask)
-            I2D2 = I2D2[:, :int(len(tth2)/3.)]
-            hist += np.sum(I2D2, axis=1) # Find a histogram from 2D Azimuthal integrated histogram, the x-axis is degree and y-axis is intensity
+            start = int(round((op_max_degree - 5 - chi_min) / step))
+            hist += np.take(fine_hist, np.arange(start, start+100), mode='wrap')
         delta_degree = max(np.arange(100), key=lambda d: np.sum(hist[d - sum_range:d + sum_range + 1]))
         if delta_degree < 50:
             max_degree -= (50-delta_degree)/10
@@ -433,6 +525,30 @@ def getRotationAngle(img, center, method=0, man_det=None):
     # otherwise, return max degree
     return max_degree
 
+def _cakeIntensity(signal, norm):
+    """
+    Give the intensity of cake bins from their signal and normalization sums (empty bins are 0)
+    """
+    result = np.zeros(signal.shape, dtype=np.float64)
+    np.divide(signal, norm, out=result, where=norm != 0)
+    return result
+
+def getCenterAndRotationAngle(img, method=0, man_det=None, decimate=None):
+    """
+    Find center and rotation angle of the diffraction in a single pass. The 8-bit blurred image and the contours
+    are computed once (the contour search runs on a decimated image for large detectors) and are shared by both
+    estimations, the angle is then refined on a single cake at full resolution.
+    :param img: input image
+    :param method: orientation model (see getRotationAngle)
+    :param man_det: detector name chosen by the user
+    :param decimate: decimation factor for the coarse search (None = automatic from the image size)
+    :return: center, rotation angle in degree
+    """
+    prep = preprocessForGeometry(img, decimate=decimate)
+    center = getCenterFromPreprocessed(prep)
+    angle = getRotationAngleFromPreprocessed(img, center, prep, method=method, man_det=man_det)
+    return center, angle
+
 def getCenterRemovedImage(img, center, rmin):
     """
     Remove center location in the image (replace by 0 (black value))
@@ -536,7 +652,7 @@ def rotateImageAboutPoint(img, point, angle):
         return img
 
     M = cv2.getRotationMatrix2D(tuple(point), angle, 1)
-    img = img.astype('float32')
+    img = np.asarray(img, dtype=np.float32)
     # if img_type == "PILATUS":
     #     if mask_thres == -999:
     #         mask_thres = getMaskThreshold(img, img_type)
@@ -562,6 +678,49 @@ def rotatePoint(origin, point, angle):
     qy = oy + np.sin(angle) * (px - ox) + np.cos(angle) * (py - oy)
     return qx, qy
 
+def buildImagePyramid(img, levels=2):
+    """
+    Build a multiresolution pyramid of the image, each level is downsampled by 2 from the previous one
+    (pixel averaging). A pixel of a level is negative (masked) if one of the pixels it comes from was.
+    :param img: input image
+    :param levels: number of downsampled levels
+    :return: list of images [img, img/2, img/4, ...]
+    """
+    pyramid = [img]
+    for _ in range(levels):
+        prev = pyramid[-1]
+        h, w = prev.shape[0] // 2, prev.shape[1] // 2
+        if h < 2 or w < 2:
+            break
+        prev = np.asarray(prev, dtype=np.float32)
+        level = cv2.resize(prev, (w, h), interpolation=cv2.INTER_AREA)
+        masked = cv2.resize((prev < 0).astype(np.float32), (w, h), interpolation=cv2.INTER_AREA)
+        level[masked > 0] = -1
+        pyramid.append(level)
+    return pyramid
+
+def pyramidToNative(point, scale):
+    """
+    Convert a point from the coordinates of a pyramid level to the native resolution coordinates
+    :param point: point in the pyramid level (x, y)
+    :param scale: downsampling factor of the level
+    :return: point in the native image (x, y)
+    """
+    if scale == 1:
+        return point
+    return ((point[0] + .5) * scale - .5, (point[1] + .5) * scale - .5)
+
+def nativeToPyramid(point, scale):
+    """
+    Convert a point from the native resolution coordinates to the coordinates of a pyramid level
+    :param point: point in the native image (x, y)
+    :param scale: downsampling factor of the level
+    :return: point in the pyramid level (x, y)
+    """
+    if scale == 1:
+        return point
+    return ((point[0] + .5) / scale - .5, (point[1] + .5) / scale - .5)
+
 def getMaskThreshold(img):
     """
     Compute the mask threshold for the image given
@@ -637,7 +796,7 @@ def averageImages(file_list, rotate=False, preprocessed=False, man_det=None):
     all_imgs = []
     dims_match, max_dim, max_img_center = checkDimensionsMatch(file_list, preprocessed=preprocessed)
     if not dims_match:
-        return expandAndAverageImages(file_list, max_dim, max_img_center, rotate, preprocessed=preprocessed)
+        return expandAndAverageImages(file_list, max_dim, max_img_center, rotate, preprocessed=preprocessed, man_det=man_det)
     for f in file_list:
         if preprocessed:
             img = f
@@ -645,14 +804,13 @@ def averageImages(file_list, rotate=False, preprocessed=False, man_det=None):
             img = fabio.open(f).data
         if rotate:
             print(f'Rotating and centering {f}')
-            center = getCenter(img)
-            angle = getRotationAngle(img, center, method=0, man_det=man_det)
+            center, angle = getCenterAndRotationAngle(img, method=0, man_det=man_det, decimate=None)
             img, center, _ = rotateImage(img, center, angle)
         all_imgs.append(img)
 
     return np.mean(all_imgs, axis=0)
 
-def expandAndAverageImages(file_list, max_dim, max_img_center, rotate, preprocessed=False):
+def expandAndAverageImages(file_list, max_dim, max_img_center, rotate, preprocessed=False, man_det=None):
     """
     open images, expand to largest size and average them all
     :param file_list: list of image path (str)
@@ -668,7 +826,9 @@ def expandAndAverageImages(file_list, max_dim, max_img_center, rotate, preproces
             img = fabio.open(f).data
 
         # Expand Image to max size by padding the surrounding by zeros and center of all image coincides
-        center = getCenter(img)
+        # The preprocessing is kept for the rotation angle (the ellipse angle does not change with the translation)
+        prep = preprocessForGeometry(img, decimate=None)
+        center = getCenterFromPreprocessed(prep)
         expanded_img = np.zeros(max_dim)
         b, l = img.shape
         expanded_img[0:b, 0:l] = img
@@ -679,7 +839,7 @@ def expandAndAverageImages(file_list, max_dim, max_img_center, rotate, preproces
 
         if rotate:
             print(f'Rotating and centering {f}')
-            angle = getRotationAngle(img, max_img_center, method=0)
+            angle = getRotationAngle(img, max_img_center, method=0, man_det=man_det, prep=prep)
             img, center, _ = rotateImage(img, max_img_center, angle)
         all_imgs.append(img)
 
@@ -742,8 +902,22 @@ def rotateNonSquareImage(img, angle, center1):
     :param file_list: original non square image, angle of rotation and center
     :return: rotated image and center with respect to new coordinate system
     """
-    img = img.astype('float32')
-    height, width = img.shape
+    img = np.asarray(img, dtype=np.float32)
+    rotation_mat, maxB, center2 = getNonSquareRotation(img.shape, angle, center1)
+
+    # rotate image with the new bounds and translated rotation matrix
+    rotated_img = cv2.warpAffine(img, rotation_mat, (maxB, maxB))
+    return rotated_img, center2, rotation_mat
+
+def getNonSquareRotation(shape, angle, center1):
+    """
+    Get the transformation used by rotateNonSquareImage() without rotating the image.
+    :param shape: shape of the image (height, width)
+    :param angle: angle of rotation
+    :param center1: center in the image
+    :return: rotation matrix, size of the square rotated image, center with respect to new coordinate system
+    """
+    height, width = shape
     center = (width/2, height/2)
 
     rotation_mat = cv2.getRotationMatrix2D(center, angle, 1.)
@@ -765,10 +939,45 @@ def rotateNonSquareImage(img, angle, center1):
     center1 = [center1[0], center1[1], 1]
     center1 = np.dot(rotation_mat, center1)
     center2 = (int(center1[0]), int(center1[1]))
+    return rotation_mat, maxB, center2
 
-    # rotate image with the new bounds and translated rotation matrix
-    rotated_img = cv2.warpAffine(img, rotation_mat, (maxB, maxB))
-    return rotated_img, center2, rotation_mat
+def rotateTranslatedImage(img, translation, shape, center, angle):
+    """
+    Get the image translated by an integer translation inside an image of the given shape, then rotated as
+    rotateImage() does and cropped back around the center of the rotated image. The translation, rotation and crop
+    are composed in one affine transformation, so the image is warped once and neither the translated image
+    nor the square rotated image is created.
+    :param img: input image
+    :param translation: integer translation (x, y) of the image inside the translated image
+    :param shape: shape of the translated image (height, width)
+    :param center: center of rotation in the translated image
+    :param angle: rotation angle
+    :return: rotated image, center in the rotated image, rotation matrix of the translated image (None if angle is 0),
+    cropped off size (left, bottom)
+    """
+    height, width = shape
+    tx, ty = int(translation[0]), int(translation[1])
+    # pixels outside of the translated image are lost as if the image was translated first
+    x0, y0 = max(0, -tx), max(0, -ty)
+    img = np.asarray(img, dtype=np.float32)[y0:max(y0, min(height, height - ty)), x0:max(x0, min(width, width - tx))]
+    tx, ty = tx + x0, ty + y0
+
+    if angle == 0:
+        M = np.array([[1., 0., tx], [0., 1., ty]])
+        rotation_mat, new_center, dl, db = None, center, 0, 0
+        size = (width, height)
+    else:
+        rotation_mat, maxB, new_center = getNonSquareRotation(shape, angle, center)
+        db, dl = (maxB - height)//2, (maxB - width)//2
+        M = rotation_mat.copy()
+        M[:, 2] += np.dot(rotation_mat[:, :2], [tx, ty]) - [dl, db]
+        size = (maxB - 2*dl, maxB - 2*db)
+
+    if img.size == 0:
+        rotated_img = np.zeros((size[1], size[0]), dtype=np.float32)
+    else:
+        rotated_img = cv2.warpAffine(img, M, size)
+    return rotated_img, (new_center[0] - dl, new_center[1] - db), rotation_mat, (dl, db)
 
 def mean_square_error(y_predict, y):
     """
@@ -822,30 +1031,11 @@ def inpaint_img(img, center=None, mask=None):
 
 def find_detector(img, man_det=None):
     """
-    Finds the detector used based on the size on the image used. 
-    If not found, use the default agilent_titan
+    Finds the detector used based on the size on the image used.
+    If not found, use the default agilent_titan.
+    The detector is resolved from a shape index and instantiated once per process (see detector_resolver)
     """
-    # if img.shape == (1043, 981):
-    #     det = "pilatus1m"
-    # else:
-    #     det = "agilent_titan"
-    print("Finding detector...")
-    detector = None
-    if man_det is None:
-        for detect in Detector.registry:
-            if hasattr(Detector.registry[detect], 'MAX_SHAPE') and Detector.registry[detect].MAX_SHAPE == img.shape:
-                detector = detector_factory(detect)
-                print(detector.get_name())
-                break
-    else:
-        if man_det in Detector.registry and hasattr(Detector.registry[man_det], 'MAX_SHAPE') and Detector.registry[man_det].MAX_SHAPE == img.shape:
-            detector = detector_factory(man_det)
-        else:
-            print('The detector specified does not correspond to the image being processed')
-    if detector is None:
-        print("No corresponding detector found, using agilent_titan by default...")
-        detector = detector_factory('agilent_titan')
-    return detector
+    return resolveDetector(img, man_det=man_det)
 
 def getMisSettingAngles(img, detector, center, wavelength=1e-10, calibrant="AgBh"):
     """
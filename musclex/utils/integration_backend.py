@@ -0,0 +1,289 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import copy
+import json
+import time
+import threading
+from contextlib import contextmanager
+import numpy as np
+from pyFAI.method_registry import IntegrationMethod
+from .result_writer import writeAtomically
+from .file_manager import getUserCacheFolder
+
+# Method used before the integration backends were benchmarked, it is the reference of the results
+REFERENCE_METHOD = ("bbox", "csr", "cython")
+# Maximum relative difference with the reference result for a method to be used
+RESULT_TOLERANCE = 1e-4
+# Number of timings of each method, the fastest one is kept
+BENCHMARK_REPEAT = 3
+
+_profile = {'path': None, 'methods': None}
+_lock = threading.Lock()
+
+def getProfilePath():
+    """
+    Give the path of the profile file keeping the fastest integration method of each geometry
+    (MUSCLEX_INTEGRATION_PROFILE, else integration_profile.json in the musclex cache folder of the user)
+    :return: path
+    """
+    return os.environ.get('MUSCLEX_INTEGRATION_PROFILE', os.path.join(getUserCacheFolder(), 'integration_profile.json'))
+
+def loadProfile(reload=False):
+    """
+    Load the profile file (once per process)
+    :param reload: read the file again, e.g. to get the entries saved by the other processes
+    :return: profile (dict geometry key -> {'method': [split, algo, impl, target], 'timings': {...}})
+    """
+    path = getProfilePath()
+    if reload or _profile['methods'] is None or _profile['path'] != path:
+        methods = {}
+        if os.path.isfile(path):
+            try:
+                with open(path) as f:
+                    methods = json.load(f)
+            except (OSError, ValueError):
+                print("Integration profile " + path + " can not be read, the integration methods will be benchmarked again")
+        _profile['path'] = path
+        _profile['methods'] = methods
+    return _profile['methods']
+
+def saveProfileEntry(key, entry):
+    """
+    Add the method of a geometry to the profile file. The file is read again before it is written,
+    so that the entries saved by the other processes are kept.
+    :param key: geometry key
+    :param entry: method and timings of the geometry
+    :return: -
+    """
+    path = getProfilePath()
+    methods = {}
+    if os.path.isfile(path):
+        try:
+            with open(path) as f:
+                methods = json.load(f)
+        except (OSError, ValueError):
+            pass
+    methods[key] = entry
+    def write(tmp):
+        with open(tmp, 'w') as f:
+            json.dump(methods, f, indent=2)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        writeAtomically(path, write)
+    except OSError:
+        print("Integration profile " + path + " can not be written")
+    loadProfile().update(methods)
+
+@contextmanager
+def profileLock():
+    """
+    Lock shared by all the processes using the profile file (a lock file next to it), so that only one of them
+    benchmarks the methods at a time. The processes start without the lock if the lock file can not be created.
+    """
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(getProfilePath())), exist_ok=True)
+        f = open(getProfilePath() + '.lock', 'a+')
+    except OSError:
+        yield
+        return
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: # not locked after 10 s
+                    pass
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+    finally:
+        f.close() # releases the lock
+
+def getNptBucket(n):
+    """
+    Give the number of points of the geometry key : the power of 2 above a number of points
+    :param n: number of points
+    :return: int
+    """
+    return 1 << max(0, int(np.ceil(np.log2(max(1, int(n))))))
+
+def getGeometryKey(ai, img, dim, npt, reuse, kwargs):
+    """
+    Give the key of the profile for an integration. The exact center is not part of it, and the numbers of points
+    (derived from the center by the callers) are rounded up to a power of 2, so that all the images of an experiment
+    share the same benchmark.
+    :param ai: AzimuthalIntegrator
+    :param img: image
+    :param dim: 1 or 2
+    :param npt: number of points (radial) or (radial, azimuthal)
+    :param reuse: number of integrations done with the same arguments
+    :param kwargs: arguments of the integration
+    :return: key (str)
+    """
+    detector = ai.detector.name if ai.detector is not None else 'None'
+    key = str(dim) + 'd ' + 'x'.join(str(s) for s in img.shape) + ' ' + detector
+    key += ' npt' + 'x'.join(str(getNptBucket(n)) for n in npt)
+    key += ' ' + str(kwargs['unit']) if kwargs.get('unit') is not None else ''
+    key += ' mask' if kwargs.get('mask') is not None else ''
+    key += ' azimuth_range' if kwargs.get('azimuth_range') is not None else ''
+    key += ' radial_range' if kwargs.get('radial_range') is not None else ''
+    key += ' reuse' + str(reuse) if reuse > 1 else ''
+    return key
+
+def getCandidateMethods(dim):
+    """
+    Give the cpu integration methods available with the pixel splitting of the reference : cython methods with all
+    the algorithms, and OpenCL methods on a cpu device (e.g. pocl) if OpenCL is available and not disabled (PYFAI_OPENCL=0).
+    The other pixel splittings give different results.
+    :param dim: 1 or 2
+    :return: list of IntegrationMethod, the reference method first
+    """
+    split = REFERENCE_METHOD[0]
+    methods = IntegrationMethod.select_method(dim=dim, split=split, impl="cython", degradable=False)
+    if os.environ.get('PYFAI_OPENCL', '') != '0':
+        try:
+            methods += IntegrationMethod.select_method(dim=dim, split=split, impl="opencl", target_type="cpu", degradable=False)
+        except Exception:
+            pass
+    reference = [m for m in methods if (m.split_lower, m.algo_lower, m.impl_lower) == REFERENCE_METHOD]
+    return reference + [m for m in methods if m not in reference]
+
+def methodToList(method):
+    """
+    Give the description of a method saved in the profile
+    :param method: IntegrationMethod
+    :return: [split, algo, impl, target]
+    """
+    return [method.split_lower, method.algo_lower, method.impl_lower, list(method.target) if method.target is not None else None]
+
+def methodFromList(dim, desc):
+    """
+    Give the method of a description saved in the profile
+    :param dim: 1 or 2
+    :param desc: [split, algo, impl, target]
+    :return: IntegrationMethod, or None if it is not available anymore
+    """
+    target = tuple(desc[3]) if desc[3] is not None else None
+    methods = IntegrationMethod.select_method(dim=dim, split=desc[0], algo=desc[1], impl=desc[2], target=target, degradable=False)
+    return methods[0] if len(methods) > 0 else None
+
+def runIntegration(ai, img, dim, npt, method, kwargs):
+    """
+    Run an integration with a method
+    :return: intensity of the result
+    """
+    if dim == 1:
+        return ai.integrate1d(img, npt[0], method=method, **kwargs).intensity
+    return ai.integrate2d(img, npt[0], npt[1], method=method, **kwargs).intensity
+
+def benchmarkMethods(ai, img, dim, npt, reuse, kwargs):
+    """
+    Time the candidate methods on an integration, each one with a new integrator so that the time of the
+    setup of its engine (e.g. the CSR matrix) is counted. Each method is timed BENCHMARK_REPEAT times and its
+    fastest time is kept. The methods giving a result different from the result of the reference method are not used.
+    :param ai: AzimuthalIntegrator
+    :param img: image
+    :param dim: 1 or 2
+    :param npt: number of points (radial) or (radial, azimuthal)
+    :param reuse: number of integrations done with the same arguments (the engine is set up once)
+    :param kwargs: arguments of the integration
+    :return: fastest method, timings (dict method name -> seconds or None if the result is different)
+    """
+    reference = None
+    best, bestTime = None, None
+    timings = {}
+    for method in getCandidateMethods(dim):
+        name = '_'.join(str(v) for v in methodToList(method)[:3])
+        try:
+            first, again = None, None
+            for _ in range(BENCHMARK_REPEAT):
+                fresh = copy.deepcopy(ai)
+                fresh.reset()
+                start = time.perf_counter()
+                result = runIntegration(fresh, img, dim, npt, method, kwargs)
+                elapsed = time.perf_counter() - start
+                first = elapsed if first is None else min(first, elapsed)
+                if reuse > 1:
+                    start = time.perf_counter()
+                    runIntegration(fresh, img, dim, npt, method, kwargs)
+                    elapsed = time.perf_counter() - start
+                    again = elapsed if again is None else min(again, elapsed)
+            elapsed = first + (reuse - 1) * again if reuse > 1 else first
+        except Exception:
+            timings[name] = None
+            continue
+        result = np.asarray(result, dtype=np.float64)
+        if reference is None:
+            reference = result
+        scale = np.nanmax(np.abs(reference)) if np.any(np.isfinite(reference)) else 1.
+        if result.shape != reference.shape or not np.allclose(result, reference, rtol=RESULT_TOLERANCE, atol=RESULT_TOLERANCE * scale, equal_nan=True):
+            timings[name] = None
+            continue
+        timings[name] = elapsed
+        if bestTime is None or elapsed < bestTime:
+            best, bestTime = method, elapsed
+    return best, timings
+
+def getIntegrationMethod(ai, img, dim, npt, reuse=1, **kwargs):
+    """
+    Give the integration method to use. MUSCLEX_INTEGRATION_METHOD forces a method (e.g. 'csr'), else the fastest
+    method of the geometry is taken from the profile, or benchmarked on this integration at its first use.
+    :param ai: AzimuthalIntegrator
+    :param img: image
+    :param dim: 1 or 2
+    :param npt: number of points (radial) or (radial, azimuthal)
+    :param reuse: number of integrations done with the same arguments
+    :param kwargs: arguments of the integration
+    :return: IntegrationMethod
+    """
+    forced = os.environ.get('MUSCLEX_INTEGRATION_METHOD', 'auto')
+    if forced != 'auto':
+        return IntegrationMethod.select_one_available(forced, dim=dim, default="csr", degradable=True)
+    key = getGeometryKey(ai, img, dim, npt, reuse, kwargs)
+    with _lock:
+        entry = loadProfile().get(key)
+        method = methodFromList(dim, entry['method']) if entry is not None else None
+        if method is None:
+            # the workers started together wait for the first one to benchmark the geometry, instead of
+            # benchmarking it at the same time (the timings would be wrong and the work done several times)
+            with profileLock():
+                entry = loadProfile(reload=True).get(key)
+                method = methodFromList(dim, entry['method']) if entry is not None else None
+                if method is None:
+                    method, timings = benchmarkMethods(ai, img, dim, npt, reuse, kwargs)
+                    if method is None:
+                        return IntegrationMethod.select_one_available("csr", dim=dim, default="csr", degradable=True)
+                    print("Integration method for " + key + " : " + str(method))
+                    saveProfileEntry(key, {'method': methodToList(method), 'timings': timings})
+    return method
@@ -0,0 +1,302 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import numpy as np
+
+SQRT_2PI = np.sqrt(2. * np.pi)
+TINY = np.finfo(float).eps
+
+# (sigma, amplitude) of the gaussians centered on centerX in layerlineModelBackground
+BACKGROUND_GAUSSIANS = (('bg_sigma', 'bg_amplitude'),
+                        ('center_sigma1', 'center_amplitude1'),
+                        ('center_sigma2', 'center_amplitude2'))
+
+def getConfigurationKey(params, fixed):
+    """
+    Give the key of the box configuration of a fit setup. Setups with the same key share the same LayerLineModel
+    :param params: parameters as (name, value, min, max, vary)
+    :param fixed: fixed values (dict)
+    :return: key (tuple)
+    """
+    return tuple((p[0], p[4]) for p in params), tuple(fixed.keys())
+
+def toInternal(values, lower, upper):
+    """
+    Convert bounded values to the unbounded values seen by the solver (same transformations as lmfit)
+    :param values: values (array)
+    :param lower: lower bounds, -inf if none (array)
+    :param upper: upper bounds, inf if none (array)
+    :return: internal values
+    """
+    values = np.clip(values, lower, upper)
+    has_lower, has_upper = np.isfinite(lower), np.isfinite(upper)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        both = np.arcsin(2. * (values - lower) / (upper - lower) - 1.)
+        low = np.sqrt((values - lower + 1.) ** 2 - 1.)
+        up = np.sqrt((upper - values + 1.) ** 2 - 1.)
+    return np.where(has_lower & has_upper, both, np.where(has_lower, low, np.where(has_upper, up, values)))
+
+def fromInternal(internal, lower, upper):
+    """
+    Convert the internal values of the solver to bounded values
+    :param internal: internal values (array)
+    :param lower: lower bounds, -inf if none (array)
+    :param upper: upper bounds, inf if none (array)
+    :return: values and their derivatives with respect to the internal values
+    """
+    has_lower, has_upper = np.isfinite(lower), np.isfinite(upper)
+    root = np.sqrt(internal ** 2 + 1.)
+    with np.errstate(invalid='ignore'):
+        both = lower + (np.sin(internal) + 1.) * (upper - lower) / 2.
+        dboth = np.cos(internal) * (upper - lower) / 2.
+    values = np.where(has_lower & has_upper, both,
+                      np.where(has_lower, lower - 1. + root, np.where(has_upper, upper + 1. - root, internal)))
+    derivatives = np.where(has_lower & has_upper, dboth,
+                           np.where(has_lower, internal / root, np.where(has_upper, -internal / root, 1.)))
+    return values, derivatives
+
+class LayerLineModel:
+    """
+    Layer line model of ProjectionProcessor (layerlineModel with gaussian peaks) compiled for one box configuration.
+    All the gaussians are evaluated as one array, with their analytic derivatives, for a stack of frames at once.
+    """
+    def __init__(self, params, fixed):
+        """
+        :param params: parameters of the fit setup as (name, value, min, max, vary)
+        :param fixed: fixed values of the fit setup (dict)
+        """
+        self.names = [p[0] for p in params] + list(fixed.keys())
+        self.free = np.array([i for i, p in enumerate(params) if p[4]], dtype=int)
+        index = {n: i for i, n in enumerate(self.names)}
+        free_index = {i: k for k, i in enumerate(self.free)}
+
+        # (center offset, sigma, amplitude) of each gaussian, the center of a peak being centerX + p_j
+        gaussians = [(None, sigma, amplitude) for sigma, amplitude in BACKGROUND_GAUSSIANS]
+        j = 0
+        while 'p_' + str(j) in index:
+            gaussians.append(('p_' + str(j), 'sigma' + str(j), 'amplitude' + str(j)))
+            j += 1
+
+        nparams, nfree = len(self.names), len(self.free)
+        self.centerMatrix = np.zeros((len(gaussians), nparams))
+        self.centerJac = np.zeros((len(gaussians), nfree))
+        self.sigmaJac = np.zeros((len(gaussians), nfree))
+        self.amplitudeJac = np.zeros((len(gaussians), nfree))
+        self.sigmaIndex = np.array([index[g[1]] for g in gaussians], dtype=int)
+        self.amplitudeIndex = np.array([index[g[2]] for g in gaussians], dtype=int)
+        for k, (offset, sigma, amplitude) in enumerate(gaussians):
+            for name in ('centerX', offset):
+                if name is not None:
+                    self.centerMatrix[k, index[name]] = 1.
+                    if index[name] in free_index:
+                        self.centerJac[k, free_index[index[name]]] = 1.
+            if index[sigma] in free_index:
+                self.sigmaJac[k, free_index[index[sigma]]] = 1.
+            if index[amplitude] in free_index:
+                self.amplitudeJac[k, free_index[index[amplitude]]] = 1.
+        self.lineIndex = index['bg_line']
+        self.lineJac = np.zeros(nfree)
+        if self.lineIndex in free_index:
+            self.lineJac[free_index[self.lineIndex]] = 1.
+
+    def evaluate(self, x, values, jacobian=False):
+        """
+        Evaluate the model for a stack of frames
+        :param x: x axis
+        :param values: values of all the parameters, one row per frame (in the order of self.names)
+        :param jacobian: also give the derivatives with respect to the free parameters
+        :return: model (frames, len(x)) and, if jacobian is True, its derivatives (frames, len(x), free parameters)
+        """
+        centers = values @ self.centerMatrix.T
+        sigmas = values[:, self.sigmaIndex][:, :, None]
+        amplitudes = values[:, self.amplitudeIndex][:, :, None]
+        dist = x[None, None, :] - centers[:, :, None]
+        gauss = np.exp(-dist ** 2 / np.maximum(TINY, 2. * sigmas ** 2)) / np.maximum(TINY, SQRT_2PI * sigmas)
+        peaks = amplitudes * gauss
+        model = peaks.sum(axis=1) + values[:, self.lineIndex][:, None]
+        if not jacobian:
+            return model
+        dcenter = peaks * dist / sigmas ** 2
+        dsigma = peaks * (dist ** 2 / sigmas ** 3 - 1. / sigmas)
+        jac = gauss.transpose(0, 2, 1) @ self.amplitudeJac + dcenter.transpose(0, 2, 1) @ self.centerJac + \
+              dsigma.transpose(0, 2, 1) @ self.sigmaJac + self.lineJac
+        return model, jac
+
+    def getResiduals(self, x, hists, values, internal, lower, upper):
+        """
+        Residuals and their derivatives with respect to the internal values of the free parameters
+        :return: values, residuals and jacobian
+        """
+        values = values.copy()
+        values[:, self.free], derivatives = fromInternal(internal, lower, upper)
+        model, jac = self.evaluate(x, values, jacobian=True)
+        return values, model - hists, jac * derivatives[:, None, :]
+
+    def fit(self, x, hists, values, lower, upper, max_nfev=None, ftol=1.5e-8, xtol=1.5e-8, init_damping=1e-1):
+        """
+        Fit the model to a stack of histograms in one solver call. This is a Levenberg-Marquardt in which every frame
+        keeps its own damping and stops on its own convergence, while the model and the jacobian of all the frames
+        still running are evaluated together
+        :param x: x axis
+        :param hists: histograms of the frames (frames, len(x))
+        :param values: initial values of all the parameters, one row per frame (in the order of self.names)
+        :param lower: lower bounds of the free parameters, one row per frame (-inf if none)
+        :param upper: upper bounds of the free parameters, one row per frame (inf if none)
+        :param max_nfev: maximum number of evaluations of a frame (default as lmfit leastsq: 2000 * (free parameters + 1))
+        :param ftol: relative tolerance on the sum of squares
+        :param xtol: relative tolerance on the parameters
+        :param init_damping: initial damping, relative to the scale of each parameter
+        :return: fitted values (frames, parameters), sum of squares and number of evaluations of each frame
+        """
+        x = np.asarray(x, dtype=float)
+        hists = np.asarray(hists, dtype=float)
+        lower = np.asarray(lower, dtype=float)
+        upper = np.asarray(upper, dtype=float)
+        nframes, nfree = len(hists), len(self.free)
+        if max_nfev is None:
+            max_nfev = 2000 * (nfree + 1)
+        diag = np.arange(nfree)
+
+        internal = toInternal(np.asarray(values, dtype=float)[:, self.free], lower, upper)
+        values, residuals, jac = self.getResiduals(x, hists, np.array(values, dtype=float), internal, lower, upper)
+        cost = (residuals ** 2).sum(axis=1)
+        damping = np.full(nframes, float(init_damping))
+        factor = np.full(nframes, 2.)
+        scale = np.zeros((nframes, nfree))
+        nfev = np.ones(nframes, dtype=int)
+        running = np.isfinite(cost) & (cost > 0)
+
+        while running.any():
+            idx = np.flatnonzero(running)
+            jt = jac[idx].transpose(0, 2, 1)
+            hess = jt @ jac[idx]
+            grad = (jt @ residuals[idx][:, :, None])[:, :, 0]
+            scale[idx] = np.maximum(scale[idx], hess[:, diag, diag])
+            damped = damping[idx, None] * np.maximum(scale[idx], TINY)
+            hess[:, diag, diag] += damped
+            try:
+                step = np.linalg.solve(hess, -grad[:, :, None])[:, :, 0]
+            except np.linalg.LinAlgError:
+                step = (np.linalg.pinv(hess) @ -grad[:, :, None])[:, :, 0]
+
+            new_internal = internal[idx] + step
+            new_values, new_residuals, new_jac = self.getResiduals(x, hists[idx], values[idx], new_internal,
+                                                                   lower[idx], upper[idx])
+            new_cost = (new_residuals ** 2).sum(axis=1)
+            nfev[idx] += 1
+
+            # Ratio between the actual and the predicted decrease of the sum of squares
+            predicted = (step * (damped * step - grad)).sum(axis=1)
+            gain = (cost[idx] - new_cost) / np.maximum(predicted, TINY)
+            better = np.isfinite(new_cost) & (new_cost < cost[idx])
+            small_step = np.all(np.abs(step) <= xtol * (np.abs(new_internal) + xtol), axis=1)
+            small_gain = cost[idx] - new_cost <= ftol * cost[idx]
+            accepted = idx[better]
+            internal[accepted] = new_internal[better]
+            values[accepted] = new_values[better]
+            residuals[accepted] = new_residuals[better]
+            jac[accepted] = new_jac[better]
+            cost[accepted] = new_cost[better]
+            damping[accepted] *= np.maximum(1. / 3., 1. - (2. * np.minimum(gain[better], 1.) - 1.) ** 3)
+            factor[accepted] = 2.
+            rejected = idx[~better]
+            damping[rejected] *= factor[rejected]
+            factor[rejected] *= 2.
+
+            done = (better & (small_gain | small_step)) | (cost[idx] == 0) | (damping[idx] > 1e15) | \
+                   (nfev[idx] >= max_nfev)
+            running[idx[done]] = False
+        return values, cost, nfev
+
+class LayerLineSeriesFitter:
+    """
+    Fit the boxes of a series of images in chunks: each box is fitted on all the frames of a chunk in one solver call,
+    with the model compiled once per box configuration. The frames of a chunk are fitted together, so they can not start
+    from each other: all the frames of a chunk start from the result of the last frame of the previous chunk (and from
+    the default values, the best fit is kept). The frames of the first chunk start from the default values only
+    """
+    def __init__(self, warm_start=True):
+        """
+        :param warm_start: also start the fits of a chunk from the result of the last frame of the previous chunk
+        """
+        self.warm_start = warm_start
+        self.models = {}
+        self.previous = {}
+
+    def getModel(self, params, fixed):
+        """
+        Give the compiled model of a box configuration
+        :param params: parameters as (name, value, min, max, vary)
+        :param fixed: fixed values (dict)
+        :return: LayerLineModel
+        """
+        key = getConfigurationKey(params, fixed)
+        if key not in self.models:
+            self.models[key] = LayerLineModel(params, fixed)
+        return self.models[key]
+
+    def fitChunk(self, processors):
+        """
+        Fit the boxes of the frames of a chunk and keep the results in their info (see ProjectionProcessor.setFitResult)
+        :param processors: ProjectionProcessor objects of the frames in the order of the series, after processHistograms()
+        :return: -
+        """
+        groups = {}
+        for proc in processors:
+            for name, (hist, params, fixed) in proc.getFitSetups().items():
+                key = (name, len(hist), getConfigurationKey(params, fixed))
+                groups.setdefault(key, []).append((proc, hist, params, fixed))
+
+        for key, frames in groups.items():
+            name = key[0]
+            model = self.getModel(frames[0][2], frames[0][3])
+            hists = np.array([f[1] for f in frames], dtype=float)
+            values = np.array([[p[1] for p in f[2]] + list(f[3].values()) for f in frames], dtype=float)
+            lower = np.array([[p[2] for p in f[2] if p[4]] for f in frames], dtype=float)
+            upper = np.array([[p[3] for p in f[2] if p[4]] for f in frames], dtype=float)
+            nframes = len(frames)
+            if self.warm_start and name in self.previous and self.previous[name][0] == key:
+                # The frames are fitted from the last result (only its values inside the bounds of the frame) and from
+                # the default values in the same call, the best of both is kept so a bad start can not be propagated
+                last = self.previous[name][1][model.free]
+                inside = (last > lower) & (last < upper)
+                warm = values.copy()
+                warm[:, model.free] = np.where(inside, last, values[:, model.free])
+                values = np.concatenate((warm, values))
+                hists, lower, upper = np.tile(hists, (2, 1)), np.tile(lower, (2, 1)), np.tile(upper, (2, 1))
+
+            fitted, cost, _ = model.fit(np.arange(hists.shape[1]), hists, values, lower, upper)
+            if len(fitted) > nframes:
+                use_warm = ~(cost[nframes:] < cost[:nframes])
+                fitted = np.where(use_warm[:, None], fitted[:nframes], fitted[nframes:])
+            for (proc, _, params, fixed), vals in zip(frames, fitted):
+                result_dict = {p[0]: v for p, v in zip(params, vals)}
+                result_dict.update(fixed)
+                proc.setFitResult(name, result_dict)
+            if np.all(np.isfinite(fitted[-1])):
+                self.previous[name] = (key, fitted[-1])
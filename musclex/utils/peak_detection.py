@@ -0,0 +1,80 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import numpy as np
+
+def getDerivatives(hists):
+    """
+    Get the central differences used to find peaks, for each histogram of a stack.
+    The first and last 4 values of each row are 0
+    :param hists: smoothed histograms, one per row (2D numpy array)
+    :return: derivatives (2D float64 numpy array)
+    """
+    hists = np.atleast_2d(hists)
+    derivatives = np.zeros(hists.shape, dtype=np.float64)
+    n = hists.shape[1]
+    if n > 8:
+        derivatives[:, 4:n - 4] = hists[:, 5:n - 3] - hists[:, 3:n - 5]
+    return derivatives
+
+def getPeakCandidates(derivatives, width):
+    """
+    Find the indexes where the derivative is positive on the width values before and negative on the width-1 values after,
+    for each row of a stack. Windows are counted with cumulative sums, so the cost does not depend on the width
+    :param derivatives: derivatives, one per row (2D numpy array)
+    :param width: width of the window on each side of a peak (int)
+    :return: mask of the peak candidates (2D boolean numpy array)
+    """
+    derivatives = np.atleast_2d(derivatives)
+    rows, n = derivatives.shape
+    zeros = np.zeros((rows, 1), dtype=np.int64)
+    pos = np.concatenate((zeros, np.cumsum(derivatives > 0, axis=1)), axis=1)
+    neg = np.concatenate((zeros, np.cumsum(derivatives < 0, axis=1)), axis=1)
+
+    candidates = np.zeros((rows, n), dtype=bool)
+    if n - width > width:
+        i = np.arange(width, n - width)
+        candidates[:, width:n - width] = (pos[:, i] - pos[:, i - width] == width) & \
+                                         (neg[:, i + width] - neg[:, i + 1] == width - 1)
+    return candidates
+
+def mergeAdjacentPeaks(peaks):
+    """
+    Merge runs of adjacent peak candidates into their average location, the way getPeaksFromHist() always did :
+    the last candidate only closes the previous run and is not kept
+    :param peaks: sorted peak candidates (list or numpy array of int)
+    :return: merged peaks, int for single candidates and float for merged runs (list)
+    """
+    peaks = np.asarray(peaks, dtype=np.int64)[:-1]
+    if len(peaks) == 0:
+        return []
+    # a run starts at each peak which is not next to the previous one
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(peaks) != 1)))
+    sums = np.add.reduceat(peaks, starts).tolist()
+    sizes = np.diff(np.append(starts, len(peaks))).tolist()
+    return [s if c == 1 else s / c for s, c in zip(sums, sizes)]
@@ -0,0 +1,236 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import queue
+import threading
+import traceback
+from multiprocessing import util
+import fabio
+from PIL import Image
+from .execution_resources import getStageThreads
+
+# Codecs of the result images : 'none' (uncompressed tif written by fabio), 'lzw' (PIL),
+# 'deflate' and 'zstd' (tifffile, strips compressed by several threads)
+CODECS = ['none', 'lzw', 'deflate', 'zstd']
+TIFFFILE_COMPRESSIONS = {'deflate': 'zlib', 'zstd': 'zstd'}
+
+def getAvailableCodecs():
+    """
+    Give the codecs which can be used in this environment (zstd needs imagecodecs)
+    :return: list of codec names
+    """
+    codecs = ['none', 'lzw']
+    try:
+        import tifffile
+        codecs.append('deflate')
+        import imagecodecs
+        if imagecodecs.ZSTD.available:
+            codecs.append('zstd')
+    except (ImportError, AttributeError):
+        pass
+    return codecs
+
+def getResultCodec(settings):
+    """
+    Give the codec of a result image from the settings : 'codec' if it is set, else lzw,
+    or no compression if 'compressed' is False
+    :param settings: settings or info (dict)
+    :return: codec name
+    """
+    if settings.get('codec') in CODECS:
+        return settings['codec']
+    if 'compressed' in settings and not settings['compressed']:
+        return 'none'
+    return 'lzw'
+
+def getTempPath(path):
+    """
+    Give the temporary name of a file being written. It is in the same folder so that the rename is atomic.
+    :param path: final path of the file
+    :return: temporary path
+    """
+    folder, name = os.path.split(path)
+    return os.path.join(folder, '.' + name + '.' + str(os.getpid()) + '_' + str(threading.get_ident()) + '.part')
+
+def writeAtomically(path, write):
+    """
+    Write a file under a temporary name then rename it, so that a reader never sees a partially written file
+    :param path: path of the file
+    :param write: function writing the file at the path given as argument
+    :return: -
+    """
+    tmp = getTempPath(path)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def writeImage(path, img, codec='none', nThreads=None):
+    """
+    Write an image in a tif file with the given codec (see CODECS)
+    :param path: path of the file
+    :param img: image (ndarray)
+    :param codec: codec of the file, a codec which is not available falls back to lzw
+    :param nThreads: threads used to compress the strips (deflate, zstd), None to use the 'write' stage threads
+    :return: -
+    """
+    if codec in TIFFFILE_COMPRESSIONS and codec not in getAvailableCodecs():
+        codec = 'lzw'
+    if codec == 'none':
+        writeAtomically(path, lambda p: fabio.tifimage.tifimage(data=img).write(p))
+    elif codec == 'lzw':
+        writeAtomically(path, lambda p: Image.fromarray(img).save(p, format='TIFF', compression='tiff_lzw'))
+    elif codec in TIFFFILE_COMPRESSIONS:
+        import tifffile
+        if nThreads is None:
+            nThreads = getStageThreads('write')
+        # several strips so that they can be compressed in parallel
+        rowsPerStrip = max(16, img.shape[0] // (4 * nThreads))
+        writeAtomically(path, lambda p: tifffile.imwrite(p, img, compression=TIFFFILE_COMPRESSIONS[codec],
+                                                         rowsperstrip=rowsPerStrip, maxworkers=nThreads))
+    else:
+        raise ValueError('Unknown codec ' + str(codec) + ', codecs are ' + ', '.join(CODECS))
+
+class ResultWriter:
+    """
+    Writer of the results (images, csv files) in a background thread, so that the computation never waits for the disk.
+    The jobs are kept in a bounded queue : when the disk is slower than the computation, submit() waits
+    for a free place instead of keeping an unbounded number of images in memory.
+    Jobs are run in the order they are submitted. The errors are printed and kept until the next flush().
+    """
+    def __init__(self, maxQueue=8):
+        """
+        :param maxQueue: maximum number of jobs waiting to be written
+        """
+        self.queue = queue.Queue(maxsize=maxQueue)
+        self.errors = []
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the writing thread if it is not running
+        :return: -
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='ResultWriter', daemon=True)
+                self.thread.start()
+
+    def submit(self, write, *args, **kwargs):
+        """
+        Run write(*args, **kwargs) in the writing thread. The arguments must not be modified by the caller afterwards.
+        :param write: writing function
+        :return: -
+        """
+        self.start()
+        self.queue.put((write, args, kwargs))
+
+    def submitImage(self, path, img, codec='none'):
+        """
+        Write an image in the writing thread (see writeImage)
+        :param path: path of the file
+        :param img: image (ndarray), must not be modified by the caller afterwards
+        :param codec: codec of the file
+        :return: -
+        """
+        self.submit(writeImage, path, img, codec)
+
+    def run(self):
+        """
+        Run the jobs of the queue until close() is called
+        :return: -
+        """
+        while True:
+            job = self.queue.get()
+            if job is None:
+                self.queue.task_done()
+                break
+            write, args, kwargs = job
+            try:
+                write(*args, **kwargs)
+            except Exception:
+                msg = traceback.format_exc()
+                self.errors.append(msg)
+                print('Error while writing results :\n' + msg)
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        """
+        Wait until all the submitted jobs are done
+        :return: errors of the jobs done since the last flush (list of str)
+        """
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.join()
+        errors, self.errors = self.errors, []
+        return errors
+
+    def close(self):
+        """
+        Write the remaining jobs and stop the writing thread
+        :return: -
+        """
+        with self.lock:
+            thread = self.thread
+            self.thread = None
+        if thread is not None and thread.is_alive():
+            self.queue.put(None)
+            thread.join()
+
+_writer = None
+_writerLock = threading.Lock()
+
+def getResultWriter():
+    """
+    Give the result writer of the current process. The remaining jobs are written when the process exits,
+    this includes the worker processes of multiprocessing and concurrent.futures.
+    :return: ResultWriter
+    """
+    global _writer
+    with _writerLock:
+        if _writer is None:
+            _writer = ResultWriter()
+            # run by multiprocessing at exit of the main process and of its child processes (atexit is not run in children)
+            util.Finalize(_writer, _writer.close, exitpriority=10)
+        return _writer
+
+def _resetWriter():
+    """
+    Forget the writer of the parent in a forked process : its thread is not running in the child
+    """
+    global _writer, _writerLock
+    _writer = None
+    _writerLock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetWriter)
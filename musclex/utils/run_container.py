@@ -0,0 +1,361 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import os
+import time
+import errno
+import pickle
+import threading
+import numpy as np
+import pandas as pd
+from contextlib import contextmanager
+
+# Name of the run container, created in the folder of the images next to the cache and result folders.
+# It keeps the caches of the images and the per-frame scalars exported to csv files at the end of the run,
+# the result images are still written as tif files so that they can be opened by the GUIs and other programs.
+# The container is opened and closed around each access by every process of the run, without SWMR: HDF5 writes
+# in place, so a process killed while it writes can leave the whole file unreadable, with the caches and results
+# of all the images of the run. The container should be used for runs whose results can be computed again.
+RUN_CONTAINER_FILE = 'musclex_run.h5'
+# csv files exported from the per-frame scalars of the run container (group -> csv file in the folder of the group)
+SCALAR_EXPORTS = {'qf_results/bg': 'background_sum.csv'}
+# Only one access at a time to the container in a process (writer thread and computation)
+_lock = threading.RLock()
+# Frame indices of the groups of the containers, (container, group) -> ({frame name -> index}, frame names) (see getFrameIndices)
+_indices = {}
+
+def isRunContainerEnabled():
+    """
+    Tell if the caches and results are kept in the run container instead of one file per image (MUSCLEX_RUN_CONTAINER=1)
+    :return: bool
+    """
+    return os.environ.get('MUSCLEX_RUN_CONTAINER', '') == '1'
+
+def setRunContainer(enabled):
+    """
+    Enable or disable the run container for this process and the workers it starts
+    :param enabled: bool
+    :return: -
+    """
+    os.environ['MUSCLEX_RUN_CONTAINER'] = '1' if enabled else '0'
+
+def splitRunPath(path):
+    """
+    Give the place in the run container of a cache or result file.
+    The nearest folder named *_cache or *_results becomes a group of the container, e.g.
+    <dir>/qf_results/bg/img.bg.tif is the frame 'img.bg.tif' of the group 'qf_results/bg' of <dir>/musclex_run.h5
+    :param path: path of the file
+    :return: container path, group, frame name, or None if the file is not in a cache or result folder
+    """
+    folder, name = os.path.split(os.path.abspath(path))
+    groups = []
+    while True:
+        parent, base = os.path.split(folder)
+        if base == '':
+            return None
+        groups.insert(0, base)
+        if base.endswith('_cache') or base.endswith('_results'):
+            return os.path.join(parent, RUN_CONTAINER_FILE), '/'.join(groups), name
+        folder = parent
+
+def isFileLockedError(error):
+    """
+    Tell if an error of h5py is the failure to lock a file opened by another process (EAGAIN).
+    The other failures to lock (e.g. ENOSYS on file systems without locks) are not solved by waiting.
+    :param error: OSError raised by h5py.File
+    :return: bool
+    """
+    return error.errno == errno.EAGAIN or ('errno = ' + str(errno.EAGAIN) + ',') in str(error)
+
+@contextmanager
+def containerLock(container, exclusive):
+    """
+    Lock of the run container shared by the processes of the run (a lock file next to it), taken around each opening :
+    the writes are serialised even when HDF5 does not lock the file (HDF5_USE_FILE_LOCKING=FALSE, file systems without
+    locks). The container is used without this lock if the lock file can not be created.
+    :param container: path of the container
+    :param exclusive: lock for writing, else the readers share the lock (only exclusive on Windows)
+    """
+    try:
+        f = open(container + '.lock', 'a+')
+    except OSError:
+        yield
+        return
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError: # not locked after 10 s
+                    pass
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        f.close() # releases the lock
+
+@contextmanager
+def openContainer(container, mode='r', timeout=300):
+    """
+    Open the run container under the lock of the run (see containerLock), e.g. with openContainer(path, 'a') as f:
+    HDF5 also locks the file while it is open, the opening is tried again until the other programs have closed it.
+    Other errors (e.g. a corrupted container) are raised at once.
+    :param container: path of the container
+    :param mode: h5py mode ('r' or 'a')
+    :param timeout: maximum waiting time in seconds
+    :return: h5py File
+    """
+    import h5py
+    with containerLock(container, mode != 'r'):
+        start = time.time()
+        while True:
+            try:
+                f = h5py.File(container, mode)
+                break
+            except OSError as e:
+                if not isFileLockedError(e) or time.time() - start > timeout:
+                    raise
+                time.sleep(0.05)
+        with f:
+            yield f
+
+def getFrameIndices(group):
+    """
+    Give the indices of the frames of a group by name. The names of a group are only appended, so the indices are
+    kept from one opening of the container to the next and only the names added since then (by any process) are read
+    :param group: h5py group
+    :return: indices (dict frame name -> index), names in the order of the indices (list)
+    """
+    key = (os.path.abspath(group.file.filename), group.name)
+    indices, names = _indices.get(key, ({}, []))
+    n = group['names'].shape[0] if 'names' in group else 0
+    if n < len(names) or (len(names) > 0 and group['names'].asstr()[len(names) - 1] != names[-1]):
+        # the container was replaced
+        indices, names = {}, []
+    if n > len(names):
+        for i, name in enumerate(group['names'].asstr()[len(names):n], len(names)):
+            indices.setdefault(name, i)
+            names.append(name)
+    _indices[key] = (indices, names)
+    return indices, names
+
+def getFrameIndex(group, name, create=False):
+    """
+    Give the index of a frame in a group of the container. The frames of a group are indexed by their
+    order of insertion, all the per-frame datasets of the group (entries, scalars) are aligned on it.
+    :param group: h5py group
+    :param name: frame name
+    :param create: add the frame if it is not in the group
+    :return: index, or None if the frame is not in the group and create is False
+    """
+    import h5py
+    with _lock:
+        indices, names = getFrameIndices(group)
+        if name in indices:
+            return indices[name]
+        if not create:
+            return None
+        if 'names' not in group:
+            group.create_dataset('names', shape=(0,), maxshape=(None,), chunks=(1024,), dtype=h5py.string_dtype())
+        dset = group['names']
+        n = dset.shape[0]
+        dset.resize((n + 1,))
+        dset[n] = name
+        indices[name] = n
+        names.append(name)
+        return n
+
+def getFrameDataset(group, name, n, dtype, fillvalue=None):
+    """
+    Give an extendable per-frame dataset, resized to the number of frames
+    :param group: h5py group of the dataset
+    :param name: name of the dataset
+    :param n: number of frames
+    :param dtype: data type
+    :param fillvalue: value of the frames which have not been written
+    :return: h5py dataset
+    """
+    if name not in group:
+        group.create_dataset(name, shape=(n,), maxshape=(None,), chunks=(1024,), dtype=dtype, fillvalue=fillvalue)
+    dset = group[name]
+    if dset.shape[0] < n:
+        dset.resize((n,))
+    return dset
+
+def writeContainerEntry(path, data):
+    """
+    Write the content of a small file (e.g. a pickled cache) in the run container
+    :param path: path the file would have
+    :param data: content (bytes)
+    :return: -
+    """
+    import h5py
+    container, group, name = splitRunPath(path)
+    with _lock, openContainer(container, 'a') as f:
+        grp = f.require_group(group)
+        index = getFrameIndex(grp, name, create=True)
+        getFrameDataset(grp, 'entries', grp['names'].shape[0], h5py.vlen_dtype(np.uint8))[index] = np.frombuffer(data, dtype=np.uint8)
+
+def readContainerEntry(path):
+    """
+    Read the content of a small file from the run container
+    :param path: path the file would have
+    :return: content (bytes), or None if it is not in the container
+    """
+    container, group, name = splitRunPath(path)
+    if not os.path.exists(container):
+        return None
+    with _lock, openContainer(container, 'r') as f:
+        if group not in f or 'entries' not in f[group]:
+            return None
+        index = getFrameIndex(f[group], name)
+        if index is None or index >= f[group]['entries'].shape[0]:
+            return None
+        data = f[group]['entries'][index]
+    return data.tobytes() if len(data) > 0 else None
+
+def removeContainerEntry(path):
+    """
+    Remove the content of a small file from the run container
+    :param path: path the file would have
+    :return: -
+    """
+    container, group, name = splitRunPath(path)
+    if readContainerEntry(path) is not None:
+        with _lock, openContainer(container, 'a') as f:
+            index = getFrameIndex(f[group], name)
+            f[group]['entries'][index] = np.zeros(0, dtype=np.uint8)
+
+def writeContainerScalars(path, values):
+    """
+    Write per-frame scalars in the run container, e.g. writeContainerScalars('<dir>/qf_results/bg/img.tif', {'Sum': 12.})
+    :param path: path of a file of the frame in a cache or result folder
+    :param values: scalars of the frame (dict name -> float)
+    :return: -
+    """
+    container, group, name = splitRunPath(path)
+    with _lock, openContainer(container, 'a') as f:
+        grp = f.require_group(group)
+        index = getFrameIndex(grp, name, create=True)
+        scalars = grp.require_group('scalars')
+        for key, value in values.items():
+            getFrameDataset(scalars, key, grp['names'].shape[0], np.float64, np.nan)[index] = value
+
+def readContainerScalars(folder):
+    """
+    Read the per-frame scalars of a cache or result folder from the run container
+    :param folder: cache or result folder, e.g. '<dir>/qf_results/bg'
+    :return: DataFrame indexed by frame name (empty if there is nothing in the container)
+    """
+    container, group, _ = splitRunPath(os.path.join(folder, 'frame'))
+    df = pd.DataFrame()
+    df.index.name = 'Name'
+    if not os.path.exists(container):
+        return df
+    with _lock, openContainer(container, 'r') as f:
+        if group not in f or 'scalars' not in f[group]:
+            return df
+        names = f[group]['names'].asstr()[:]
+        columns = {}
+        for key, dset in f[group]['scalars'].items():
+            column = np.full(len(names), np.nan)
+            column[:dset.shape[0]] = dset[()]
+            columns[key] = column
+    df = pd.DataFrame(columns, index=pd.Index(names, name='Name'))
+    return df.dropna(how='all')
+
+def exportContainerScalars(folder, csv_path):
+    """
+    Write the per-frame scalars of a folder kept in the run container to a csv file
+    :param folder: cache or result folder, e.g. '<dir>/qf_results/bg'
+    :param csv_path: path of the csv file
+    :return: -
+    """
+    df = readContainerScalars(folder)
+    if len(df) > 0:
+        df.to_csv(csv_path)
+
+def exportRunCsvs(dir_path):
+    """
+    Write the csv files of the per-frame scalars kept in the run container of a folder (see SCALAR_EXPORTS)
+    :param dir_path: folder of the images
+    :return: -
+    """
+    if not isRunContainerEnabled() or not os.path.exists(os.path.join(dir_path, RUN_CONTAINER_FILE)):
+        return
+    for group, csv_name in SCALAR_EXPORTS.items():
+        folder = os.path.join(dir_path, group)
+        if os.path.isdir(folder):
+            exportContainerScalars(folder, os.path.join(folder, csv_name))
+
+def cacheExists(path):
+    """
+    Tell if a cache exists, in the run container if it is enabled or as a file
+    :param path: path of the cache file
+    :return: bool
+    """
+    if isRunContainerEnabled():
+        return readContainerEntry(path) is not None
+    return os.path.isfile(path)
+
+def writeCacheFile(path, info):
+    """
+    Save a cache (pickled), in the run container if it is enabled or as a file
+    :param path: path of the cache file
+    :param info: cached object
+    :return: -
+    """
+    if isRunContainerEnabled():
+        writeContainerEntry(path, pickle.dumps(info))
+    else:
+        with open(path, 'wb') as c:
+            pickle.dump(info, c)
+
+def readContainerCache(path):
+    """
+    Read a cache from the run container
+    :param path: path of the cache file
+    :return: cached object, or None if the cache is not in the container
+    """
+    data = readContainerEntry(path)
+    return pickle.loads(data) if data is not None else None
+
+def removeCacheFile(path):
+    """
+    Delete a cache, in the run container if it is enabled or as a file
+    :param path: path of the cache file
+    :return: -
+    """
+    if isRunContainerEnabled():
+        removeContainerEntry(path)
+    elif os.path.isfile(path):
+        os.remove(path)
@@ -0,0 +1,173 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import numpy as np
+import pandas as pd
+
+def toNumeric(column):
+    """
+    Convert a csv column to floats
+    :param column: pandas Series
+    :return: values (float ndarray, NaN if missing), and which values are set but are not numbers (bool ndarray)
+    """
+    values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64)
+    invalid = np.isnan(values) & column.notna().to_numpy()
+    return values, invalid
+
+def getFrameIndexes(filenames):
+    """
+    Give the scan index of the frames from their file names (number between the last '_' and the last '.')
+    :param filenames: file names
+    :return: indexes (int ndarray)
+    """
+    return np.array([int(f[f.rfind('_') + 1:f.rfind('.')]) for f in filenames], dtype=np.int64)
+
+class ScanMapAssembler:
+    """
+    Assemble the maps of a scanning diffraction batch from summary.csv and rings.csv.
+    The rings are grouped by frame once, the selection of the ring of each frame (best fit or closest to a distance)
+    is then done on arrays, so that changing the options of the maps does not read the csv files again.
+    """
+    def __init__(self, df_sum, df_rings):
+        """
+        :param df_sum: summary of the frames (DataFrame of summary.csv)
+        :param df_rings: rings of the frames (DataFrame of rings.csv)
+        """
+        # a frame processed several times : its last results are used
+        df_sum = df_sum.sort_values(['filename'], ascending=True).drop_duplicates('filename', keep='last')
+        self.filenames = df_sum['filename'].astype(str).to_numpy()
+        self.indexes = getFrameIndexes(self.filenames)
+        self.total_intensity = toNumeric(df_sum['total intensity'])[0]
+        if 'total intensity (hull)' in df_sum:
+            hull = toNumeric(df_sum['total intensity (hull)'])[0]
+            self.intensity = np.where(np.isnan(hull), self.total_intensity, hull)
+        else:
+            self.intensity = self.total_intensity.copy()
+
+        # rings of each frame, in the order of rings.csv : frame f has the rings self.ring_order[self.starts[f]:self.ends[f]]
+        frames = pd.Index(self.filenames).get_indexer(df_rings['filename'].astype(str))
+        kept = np.flatnonzero(frames >= 0)
+        order = kept[np.argsort(frames[kept], kind='stable')]
+        self.ring_order = order
+        self.ring_frames = frames[order]
+        self.starts = np.searchsorted(self.ring_frames, np.arange(len(self.filenames)), side='left')
+        self.ends = np.searchsorted(self.ring_frames, np.arange(len(self.filenames)), side='right')
+        self.has_rings = self.ends > self.starts
+
+        columns = {}
+        for col in ('S', 'd', 'peak intensity', 'angle', 'angle sigma', 'angle fitting error'):
+            if col in df_rings:
+                columns[col] = toNumeric(df_rings[col].iloc[order])
+            else:
+                columns[col] = (np.full(len(order), np.nan), np.zeros(len(order), dtype=bool))
+        self.rings = columns
+
+    def firstOfFrames(self, key):
+        """
+        Give the position of the ring with the smallest key in each frame having rings (the first one if there are several)
+        :param key: key of each ring (float ndarray aligned with the grouped rings)
+        :return: positions in the grouped rings (int ndarray, one per frame with rings)
+        """
+        order = np.lexsort((np.arange(len(key)), key, self.ring_frames))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = self.ring_frames[order[1:]] != self.ring_frames[order[:-1]]
+        return order[first]
+
+    def selectRings(self, best=True, distance=0., col='S', bandwidth=0., angle_sigma=1.):
+        """
+        Select the ring of each frame and give its values
+        :param best: select the ring with the smallest angle fitting error, else the ring closest to distance
+        :param distance: distance of the ring (in col unit)
+        :param col: 'S' (pixel) or 'd' (nm)
+        :param bandwidth: maximum difference between the distance of the closest ring and distance
+        :param angle_sigma: maximum angle sigma of a good ring model
+        :return: dict of arrays aligned with the frames : 'peak intensity' (-1 without good ring), 'angle', 'angle sigma', 'd-spacing'
+        """
+        nFrames = len(self.filenames)
+        withRings = np.flatnonzero(self.has_rings)
+        error = self.rings['angle fitting error'][0]
+        distance_ok = np.ones(len(withRings), dtype=bool)
+        if best:
+            # sorted by angle fitting error, the rings without error last
+            selected = self.firstOfFrames(np.where(np.isnan(error), np.inf, error))
+        else:
+            values, invalid = self.rings[col]
+            diff = np.abs(values - distance)
+            selected = self.firstOfFrames(np.where(np.isnan(diff), np.inf, diff))
+            first = self.starts[withRings]
+            # the first ring is kept when its distance is missing, as it can not be compared with the others
+            selected = np.where(np.isnan(diff[first]), first, selected)
+            distance_ok = ~(diff[selected] > bandwidth)
+            # a distance which is not a number : the first ring is used but it is not a good model
+            frameInvalid = np.add.reduceat(invalid.astype(np.int64), first) > 0 if len(first) > 0 else np.zeros(0, dtype=bool)
+            if np.any(frameInvalid):
+                names = self.filenames[withRings[frameInvalid]]
+                print("WARNING : Unable to find the closest ring to the specified d-spacing for " + str(len(names)) + " images (" + ', '.join(names[:5]) + (', ...)' if len(names) > 5 else ')'))
+            selected = np.where(frameInvalid, first, selected)
+            distance_ok &= ~frameInvalid
+
+        sigma = self.rings['angle sigma'][0][selected]
+        good = (error[selected] < 1.) & (sigma < angle_sigma) & distance_ok
+        peak = self.rings['peak intensity'][0][selected]
+        angle = self.rings['angle'][0][selected]
+        d, dInvalid = self.rings['d']
+        S = self.rings['S'][0][selected]
+        d = d[selected]
+        d_ok = ~np.isnan(d)
+        d_spacing = np.where(d_ok, d, np.where(np.isnan(S), 0., S))
+
+        result = {'peak intensity': np.full(nFrames, -1.), 'angle': np.zeros(nFrames),
+                  'angle sigma': np.zeros(nFrames), 'd-spacing': np.zeros(nFrames)}
+        result['peak intensity'][withRings] = np.where(good, np.nan_to_num(peak, nan=0.), -1.)
+        result['angle'][withRings] = np.where(good, np.nan_to_num(angle, nan=0.), 0.)
+        result['angle sigma'][withRings] = np.where(good, np.nan_to_num(sigma, nan=0.), 0.)
+        result['d-spacing'][withRings] = np.where(good, d_spacing, 0.)
+        return result
+
+    def toGrid(self, values, nPositions, init_number, fill=-1.):
+        """
+        Place the values of the frames at their scan position
+        :param values: values aligned with the frames
+        :param nPositions: number of scan positions
+        :param init_number: index of the first scan position
+        :param fill: value of the positions without frame
+        :return: values of the scan positions (float ndarray)
+        """
+        grid = np.full(nPositions, fill, dtype=np.float64)
+        pos = self.indexes - init_number
+        ok = (pos >= 0) & (pos < nPositions)
+        grid[pos[ok]] = values[ok]
+        return grid
+
+    def toDict(self, values):
+        """
+        Give the values of the frames by scan index
+        :param values: values aligned with the frames
+        :return: dict index -> value
+        """
+        return dict(zip(self.indexes.tolist(), values.tolist()))
@@ -0,0 +1,78 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import threading
+import numpy as np
+
+class ScratchArena:
+    """
+    Scratch buffers reused from one image to the next by the same worker (process or thread),
+    so that the full-size intermediate arrays of a pipeline are not reallocated for every image.
+    A buffer given by the arena is only valid until the next request with the same name:
+    it must never be kept in a result (info dict, cache, image cache).
+    """
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.float32):
+        """
+        Give a scratch buffer (content is undefined)
+        :param name: name of the buffer
+        :param shape: shape of the buffer
+        :param dtype: data type of the buffer
+        :return: buffer (ndarray)
+        """
+        shape = tuple(int(s) for s in shape)
+        dtype = np.dtype(dtype)
+        buf = self.buffers.get(name)
+        if buf is None or buf.dtype != dtype or buf.size < int(np.prod(shape)):
+            buf = np.empty(int(np.prod(shape)), dtype=dtype)
+            self.buffers[name] = buf
+        return buf[:int(np.prod(shape))].reshape(shape)
+
+    def release(self, name=None):
+        """
+        Release a buffer, or all the buffers if name is None
+        :param name: name of the buffer
+        :return: -
+        """
+        if name is None:
+            self.buffers = {}
+        elif name in self.buffers:
+            del self.buffers[name]
+
+_local = threading.local()
+
+def getScratchArena():
+    """
+    Give the scratch arena of the current worker (one per thread, and so one per process for process workers)
+    :return: ScratchArena
+    """
+    if not hasattr(_local, 'arena'):
+        _local.arena = ScratchArena()
+    return _local.arena
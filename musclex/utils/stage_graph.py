@@ -0,0 +1,195 @@
+"""
+Copyright 1999 Illinois Institute of Technology
+
+Permission is hereby granted, free of charge, to any person obtaining
+a copy of this software and associated documentation files (the
+"Software"), to deal in the Software without restriction, including
+without limitation the rights to use, copy, modify, merge, publish,
+distribute, sublicense, and/or sell copies of the Software, and to
+permit persons to whom the Software is furnished to do so, subject to
+the following conditions:
+
+The above copyright notice and this permission notice shall be
+included in all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND,
+EXPRESS OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF
+MERCHANTABILITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT.
+IN NO EVENT SHALL ILLINOIS INSTITUTE OF TECHNOLOGY BE LIABLE FOR ANY
+CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER IN AN ACTION OF CONTRACT,
+TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN CONNECTION WITH THE
+SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+Except as contained in this notice, the name of Illinois Institute
+of Technology shall not be used in advertising or otherwise to promote
+the sale, use or other dealings in this Software without prior written
+authorization from Illinois Institute of Technology.
+"""
+
+import copy
+import numpy as np
+
+class Stage:
+    """
+    A processing stage of a pipeline : the results it produces, the stages it uses the results of,
+    and the parameters (keys of the info dict) it depends on
+    """
+    def __init__(self, name, outputs, inputs=(), params=(), store='info'):
+        """
+        :param name: name of the stage
+        :param outputs: keys of the results of the stage
+        :param inputs: names of the stages whose results are used by this stage
+        :param params: keys of the info dict used by the stage, or function giving them from the info dict
+        :param store: dict keeping the results, 'info' (saved in the cache) or 'imgCache' (kept in memory only)
+        """
+        self.name = name
+        self.outputs = list(outputs)
+        self.inputs = list(inputs)
+        self.params = params
+        self.store = store
+
+    def getParamKeys(self, info):
+        """
+        Give the keys of the parameters of the stage for the current info dict
+        """
+        return list(self.params(info)) if callable(self.params) else list(self.params)
+
+class StageGraph:
+    """
+    Dependency graph of the stages of a pipeline. A stage is run only if one of its results is missing
+    or one of its parameters changed since its results were produced. Running a stage removes the results
+    of all the stages depending on it, so they are produced again from the new results.
+    The parameters used to produce the results of each stage are kept in info['stage_params'],
+    so that they are saved in the cache with the results. Results without recorded parameters are produced again,
+    the results set from outside of the graph (e.g. a manual value) must be recorded with seed().
+    """
+    def __init__(self, stages):
+        """
+        :param stages: list of Stage, a stage must be after the stages it uses
+        """
+        self.stages = {}
+        self.order = []
+        for stage in stages:
+            for name in stage.inputs:
+                if name not in self.stages:
+                    raise ValueError("Stage " + stage.name + " uses unknown stage " + name)
+            self.stages[stage.name] = stage
+            self.order.append(stage.name)
+        self.ran = []
+        self.skipped = []
+
+    def getDependents(self, name):
+        """
+        Give the stages using the results of a stage, directly or not
+        :param name: name of the stage
+        :return: names of the stages, in pipeline order
+        """
+        dependents = set([name])
+        for n in self.order:
+            if any(i in dependents for i in self.stages[n].inputs):
+                dependents.add(n)
+        dependents.remove(name)
+        return [n for n in self.order if n in dependents]
+
+    def getParamValues(self, stage, info):
+        """
+        Give a copy of the values of the parameters of a stage (a missing parameter is not in the dict)
+        """
+        return {k: copy.deepcopy(info[k]) for k in stage.getParamKeys(info) if k in info}
+
+    def isUpToDate(self, name, stores):
+        """
+        Check if the results of a stage are available and were produced with the current parameters.
+        Results without recorded parameters (set from outside of the graph and not seeded) are not up to date.
+        :param name: name of the stage
+        :param stores: dicts keeping the results {'info': info, 'imgCache': imgCache}
+        :return: bool
+        """
+        stage = self.stages[name]
+        store = stores[stage.store]
+        if any(k not in store for k in stage.outputs):
+            return False
+        recorded = stores['info'].get('stage_params', {}).get(name)
+        return recorded is not None and sameValues(recorded, self.getParamValues(stage, stores['info']))
+
+    def invalidate(self, stores, name, dependentsOnly=False):
+        """
+        Remove the results of a stage and of all the stages depending on it
+        :param stores: dicts keeping the results {'info': info, 'imgCache': imgCache}
+        :param name: name of the stage
+        :param dependentsOnly: keep the results of the stage itself
+        :return: -
+        """
+        names = self.getDependents(name) if dependentsOnly else [name] + self.getDependents(name)
+        records = stores['info'].get('stage_params', {})
+        for n in names:
+            stage = self.stages[n]
+            for k in stage.outputs:
+                stores[stage.store].pop(k, None)
+            records.pop(n, None)
+
+    def seed(self, stores, name):
+        """
+        Mark the results of a stage set by the caller (e.g. a manual value) as produced with the current parameters,
+        so that they are kept by run(). The stages depending on it are invalidated.
+        :param stores: dicts keeping the results {'info': info, 'imgCache': imgCache}
+        :param name: name of the stage
+        :return: -
+        """
+        stage = self.stages[name]
+        missing = [k for k in stage.outputs if k not in stores[stage.store]]
+        if len(missing) > 0:
+            raise ValueError("Stage " + name + " is seeded without " + ", ".join(missing))
+        self.invalidate(stores, name, dependentsOnly=True)
+        stores['info'].setdefault('stage_params', {})[name] = self.getParamValues(stage, stores['info'])
+
+    def run(self, stores, name, compute):
+        """
+        Run a stage if its results are not up to date. The stages depending on it are invalidated when it runs.
+        :param stores: dicts keeping the results {'info': info, 'imgCache': imgCache}
+        :param name: name of the stage
+        :param compute: function producing the results of the stage in the stores
+        :return: True if the stage ran, False if it was skipped
+        """
+        if self.isUpToDate(name, stores):
+            self.skipped.append(name)
+            return False
+        self.invalidate(stores, name, dependentsOnly=True)
+        compute()
+        stage = self.stages[name]
+        if all(k in stores[stage.store] for k in stage.outputs):
+            stores['info'].setdefault('stage_params', {})[name] = self.getParamValues(stage, stores['info'])
+        self.ran.append(name)
+        return True
+
+    def resetReport(self):
+        """
+        Clear the lists of the stages run and skipped
+        """
+        self.ran = []
+        self.skipped = []
+
+    def getReport(self):
+        """
+        Give the stages run and skipped since the last resetReport()
+        :return: text report
+        """
+        return "Stages run : " + (", ".join(self.ran) if self.ran else "none") + \
+            ", skipped : " + (", ".join(self.skipped) if self.skipped else "none")
+
+def sameValues(a, b):
+    """
+    Compare parameter values which may contain arrays
+    :param a, b: values
+    :return: bool
+    """
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(sameValues(a[k], b[k]) for k in a)
+    if isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        return len(a) == len(b) and all(sameValues(x, y) for x, y in zip(a, b))
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(np.asarray(a), np.asarray(b))
+    try:
+        return bool(a == b)
+    except (ValueError, TypeError):
+        return False